@@ -724,6 +724,13 @@ class TileAcqPlugin(Plugin):
         return px
 
     MEMPP = 22  # bytes per pixel, found empirically
+    # bytes per pixel, when the stitched image is directly written tile by tile
+    # into a pyramidal file: only the tiles (and the registration) use memory.
+    # Found empirically, by measuring the peak RSS while registering, weaving
+    # and exporting 6x6 and 8x8 tiles of 1024x1024 px at 16 bits: 2.5 to 3 B/px,
+    # of which 2 B/px are the tiles themselves. Rounded up to twice the memory
+    # of the (16-bit) input tiles.
+    MEMPP_TILED = 4
     @call_in_wx_main
     def _memory_check(self, _=None):
         """
@@ -740,7 +747,11 @@ class TileAcqPlugin(Plugin):
             pxs *= self.nx.value * self.ny.value
 
             # Memory calculation
-            mem_est = pxs * self.MEMPP
+            exporter = dataio.find_fittest_converter(self.filename.value)
+            if exporter.CAN_SAVE_PYRAMID:
+                mem_est = pxs * self.MEMPP_TILED
+            else:
+                mem_est = pxs * self.MEMPP
             mem_computer = psutil.virtual_memory().total
             logging.debug("Estimating %g GB needed, while %g GB available",
                           mem_est / 1024 ** 3, mem_computer / 1024 ** 3)
@@ -855,21 +866,26 @@ class TileAcqPlugin(Plugin):
                     weaving_method = WEAVER_MEAN
                     logging.info("Using weaving method WEAVER_MEAN.")
 
+                # If the file is pyramidal, the stitched images are only
+                # computed tile by tile, while they are being saved, so that
+                # they are never entirely in memory.
+                exporter = dataio.find_fittest_converter(fn)
+                tiled = exporter.CAN_SAVE_PYRAMID
+
                 # Weave every stream
                 if isinstance(das_registered[0], tuple):
                     for s in range(len(das_registered[0])):
                         streams = []
                         for da in das_registered:
                             streams.append(da[s])
-                        da = stitching.weave(streams, weaving_method)
+                        da = stitching.weave(streams, weaving_method, tiled)
                         da.metadata[model.MD_DIMS] = "YX"  # TODO: do it in the weaver
                         st_data.append(da)
                 else:
-                    da = stitching.weave(das_registered, weaving_method)
+                    da = stitching.weave(das_registered, weaving_method, tiled)
                     st_data.append(da)
 
                 # Save
-                exporter = dataio.find_fittest_converter(fn)
                 if exporter.CAN_SAVE_PYRAMID:
                     exporter.export(fn, st_data, pyramid=True)
                 else:
@@ -0,0 +1,886 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+
+# This script measures the performance of some parts of Odemis, to compare them
+# before and after a change. Each benchmark is a sub-command, which uses
+# synthetic data (or simulated hardware) by default:
+# * export: speed and compression ratio of the export to TIFF and HDF5, for
+#   each compression codec available. It's also possible to pass files, whose
+#   data will be used instead of the synthetic data.
+# * camera: frame rate and latency of the simulated cameras (FakeAndorCam2 and
+#   simcam), at full resolution. The cameras are instantiated directly in the
+#   process, so no back-end is needed. The latency is the time between the end
+#   of the exposure and the reception of the frame by the subscriber. The
+#   receiver can hold the last frames, to simulate a slow consumer (eg, the
+#   GUI), which prevents the buffers from being recycled immediately. The CPU
+#   time used per frame (by the whole process) is also reported, as it shows
+#   the cost of the memory management.
+# * stitching: time needed by the GlobalShiftRegistrar to register grids of
+#   tiles, of increasing size. The tiles are cropped from a random (smoothed)
+#   image, and acquired in "zigzag" order. Their MD_POS is the actual position
+#   plus a random error, to simulate the imprecision of the stage. The time to
+#   add all the tiles (which starts the computation of the shifts) and the time
+#   to get the positions (which waits for the shifts and does the global
+#   optimisation) are reported separately, as well as the error of the
+#   registered positions.
+# * shift: time needed to estimate the shift of a series of frames compared to
+#   a reference frame, as done for drift correction. It compares calling
+#   MeasureShift() for each frame, to using a ShiftEstimator on each frame, and
+#   to using a ShiftEstimator on the whole stack of frames at once. The frames
+#   are a random (smoothed) image, shifted by a random sub-pixel amount.
+# * img: time needed to compute the histogram of an image and to convert it to
+#   RGB, as done by the streams for every new image. For each type of data, it
+#   compares numpy (as used by odemis.util.img when the optimised version is not
+#   available) with img_fast, and with the combined kernel of img_fast, which
+#   computes the histogram, the minimum/maximum and the RGB image in a single
+#   pass.
+# * scanpattern: comparison of the scan patterns of the semcomedi driver. For
+#   each pattern, it measures the time to generate the waveform and to convert
+#   the data back to an image, and reports the number of points written (which
+#   is proportional to the acquisition time) compared to a raster scan. If a
+#   comedi device is given (a real one, or one using the comedi_test driver),
+#   it also measures the time to acquire an image with each pattern, with the
+#   waveforms already cached.
+# * semcomedi-pixel: time needed by the semcomedi driver to acquire an image
+#   pixel per pixel, as done for long dwell times. It compares one command per
+#   pixel (as used when the newPosition event has listeners) with grouping as
+#   many pixels as fit in the device buffer in each command. It needs a comedi
+#   device. Without hardware, the comedi_test driver can be used:
+#   sudo modprobe comedi comedi_num_legacy_minors=4
+#   sudo modprobe comedi_test
+#   sudo chmod a+rw /dev/comedi0
+#   sudo comedi_config /dev/comedi0 comedi_test 1000000,1000000
+# * fitmap: time needed to fit the peak of every spectrum of a spectrum cube
+#   with FitMap(), for different numbers of processes. It compares it to
+#   fitting each spectrum with PeakFitter.Fit(), measured on a subset of the
+#   spectra and extrapolated to the whole cube. The cube is synthetic: each
+#   pixel has one peak, whose position changes smoothly over the map, plus
+#   noise.
+# * mdcodec: time needed to encode and decode the metadata of the frames sent
+#   by a DataFlow, and the size of the messages, compared to pickling the whole
+#   metadata at every frame.
+# Use "--help" after the sub-command to see its options.
+# Example:
+# ./scripts/perf_bench.py export
+# ./scripts/perf_bench.py export --input acq-spec.h5 mosaic.ome.tiff
+# ./scripts/perf_bench.py camera --duration 10 --hold 2
+# ./scripts/perf_bench.py stitching --grids 10 20 30 --tile 128
+# ./scripts/perf_bench.py shift --sizes 256 512 --frames 20 --precision 10
+# ./scripts/perf_bench.py img --sizes 512 2048 --dtypes uint16 float32
+# ./scripts/perf_bench.py scanpattern --sizes 512 2048 --margin 10 --device /dev/comedi0
+# ./scripts/perf_bench.py semcomedi-pixel --sizes 10 50 --dwell-time 1e-3
+# ./scripts/perf_bench.py fitmap --size 100 100 --wavelengths 1024 --workers 1 4
+# ./scripts/perf_bench.py mdcodec --frames 100000
+
+from __future__ import division, print_function
+
+import argparse
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import logging
+import multiprocessing
+import numpy
+from numpy import fft
+from odemis import model, dataio
+from odemis.acq.align.shift import MeasureShift, ShiftEstimator
+from odemis.acq.stitching import GlobalShiftRegistrar
+from odemis.dataio import tiff, hdf5
+import odemis.driver
+from odemis.driver import andorcam2, simcam
+from odemis.driver.scanpattern import RasterPattern, SerpentinePattern, \
+    InterlacedPattern, RandomPattern
+from odemis.model import _mdcodec
+from odemis.util import peak
+import os
+import scipy.ndimage
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# The optimised functions are only available once compiled
+try:
+    from odemis.util import img_fast
+except ImportError:
+    img_fast = None
+
+
+def _gen_image(shape, depth=4096):
+    """
+    return (numpy.array of uint16): a noisy image, with some smooth features,
+      looking a little bit like a microscope image
+    """
+    y, x = numpy.ogrid[:shape[-2], :shape[-1]]
+    signal = (numpy.sin(x / 37) * numpy.cos(y / 23) + 1) * (depth / 4)
+    noise = numpy.random.poisson(depth / 16, shape)
+    return (signal + noise).clip(0, depth - 1).astype(numpy.uint16)
+
+
+# Export
+
+EXPORT_CODECS = {tiff: (False, "lzw", "deflate:1", "deflate", "deflate:9"),
+                 hdf5: (False, "gzip:1", "gzip", "gzip:9", "lzf"),
+                }
+
+
+def gen_acquisitions(ntiles=20):
+    """
+    return (list of (str, list of DataArray)): name and data of each acquisition
+    """
+    acqs = []
+
+    md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (0, 0)}
+    tiles = [model.DataArray(_gen_image((2048, 2048)), md) for i in range(ntiles)]
+    acqs.append(("mosaic %d tiles" % (ntiles,), tiles))
+
+    md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (0, 0),
+          model.MD_WL_LIST: [400e-9 + i * 0.5e-9 for i in range(1024)]}
+    spec = _gen_image((1024, 1, 1, 128, 128))
+    acqs.append(("spectrum cube", [model.DataArray(spec, md)]))
+
+    md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (0, 0),
+          model.MD_WL_LIST: [400e-9 + i * 1e-9 for i in range(256)],
+          model.MD_TIME_LIST: [i * 1e-12 for i in range(256)]}
+    tspec = _gen_image((256, 256, 1, 24, 24))
+    acqs.append(("temporal spectrum", [model.DataArray(tspec, md)]))
+
+    return acqs
+
+
+def bench_export(name, data, tmpdir):
+    """
+    Export the data with every format and codec, and print the results
+    """
+    raw_size = sum(d.nbytes for d in data)
+    print("%s: %d MB" % (name, raw_size / 2 ** 20))
+    print("%-6s %-10s %10s %10s %8s" % ("format", "codec", "time (s)", "MB/s", "ratio"))
+    for conv, codecs in EXPORT_CODECS.items():
+        fn = os.path.join(tmpdir, u"bench" + conv.EXTENSIONS[0])
+        for codec in codecs:
+            tstart = time.time()
+            conv.export(fn, data, compressed=codec)
+            dur = time.time() - tstart
+            fsize = os.path.getsize(fn)
+            print("%-6s %-10s %10.3f %10.1f %8.2f" % (conv.FORMAT, codec or "none", dur,
+                                                     raw_size / dur / 2 ** 20, raw_size / fsize))
+            os.remove(fn)
+    print("")
+
+
+def run_export(options):
+    if options.input:
+        acqs = []
+        for fn in options.input:
+            conv = dataio.find_fittest_converter(fn, mode=os.O_RDONLY)
+            acqs.append((os.path.basename(fn), conv.read_data(fn)))
+    else:
+        acqs = gen_acquisitions(options.tiles)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, data in acqs:
+            bench_export(name, data, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+# Camera
+
+SIMCAM_IMAGE = os.path.join(os.path.dirname(odemis.driver.__file__), "simcam-fake-overview.h5")
+
+
+class FrameRecorder(object):
+    """
+    Receives the frames, and records the time of reception
+    """
+
+    def __init__(self, hold=0):
+        """
+        hold (0<=int): number of frames to keep referenced
+        """
+        self._hold = hold
+        self._held = []
+        self.latencies = []  # s
+        self.arrivals = []  # s
+        self._lock = threading.Lock()
+
+    def on_data(self, df, data):
+        now = time.time()
+        md = data.metadata
+        end_exp = md.get(model.MD_ACQ_DATE, now) + md.get(model.MD_EXP_TIME, 0)
+        with self._lock:
+            self.arrivals.append(now)
+            self.latencies.append(now - end_exp)
+            if self._hold:
+                self._held.append(data)
+                del self._held[:-self._hold]
+
+    def clear(self):
+        with self._lock:
+            self._held = []
+
+
+def bench_camera(name, cam, exp, duration, hold):
+    """
+    Acquire frames for the given duration, and print the statistics
+    """
+    cam.exposureTime.value = exp
+    cam.resolution.value = cam.resolution.range[1]
+    res = cam.resolution.value
+
+    recorder = FrameRecorder(hold)
+    tstart = os.times()
+    cam.data.subscribe(recorder.on_data)
+    try:
+        time.sleep(duration)
+    finally:
+        cam.data.unsubscribe(recorder.on_data)
+        tend = os.times()
+        recorder.clear()
+    cpu = (tend[0] + tend[1]) - (tstart[0] + tstart[1])
+
+    # Skip the first frame, as it contains the start-up time
+    arrivals = numpy.array(recorder.arrivals[1:])
+    latencies = numpy.array(recorder.latencies[1:]) * 1e3  # ms
+    if len(arrivals) < 2:
+        print("%s: not enough frames received (%d)" % (name, len(recorder.arrivals)))
+        return
+
+    intervals = numpy.diff(arrivals) * 1e3  # ms
+    print("%s: %dx%d px, exposure %g s, %d frames" % (name, res[0], res[1], exp, len(arrivals)))
+    print("  frame rate: %.2f fps" % (1e3 / intervals.mean(),))
+    print("  interval: mean %.2f ms, std %.2f ms, max %.2f ms" %
+          (intervals.mean(), intervals.std(), intervals.max()))
+    print("  latency: mean %.2f ms, median %.2f ms, max %.2f ms" %
+          (latencies.mean(), numpy.median(latencies), latencies.max()))
+    print("  CPU: %.2f ms/frame" % (cpu * 1e3 / len(recorder.arrivals),))
+    pool = getattr(cam, "_buffer_pool", None)
+    if pool is not None:
+        print("  buffers: %d allocated, %d reused" % (pool.allocated, pool.reused))
+    print("")
+
+
+def run_camera(options):
+    cam = andorcam2.FakeAndorCam2("camera", "ccd", device=0)
+    try:
+        bench_camera("FakeAndorCam2", cam, options.exp, options.duration, options.hold)
+    finally:
+        cam.terminate()
+
+    cam = simcam.Camera("camera", "ccd", image=SIMCAM_IMAGE)
+    try:
+        bench_camera("SimCam", cam, options.exp, options.duration, options.hold)
+    finally:
+        cam.terminate()
+
+
+# Stitching
+
+STITCHING_PIXEL_SIZE = (1e-6, 1e-6)  # m/px
+
+
+def generate_tiles(num, tile_size, overlap, pos_error):
+    """
+    Creates a grid of tiles from a random image
+    num (int): number of tiles on each axis
+    tile_size (int): width and height of a tile (px)
+    overlap (0<float<1): overlap ratio between two neighbouring tiles
+    pos_error (int): maximum error on the position of each tile (px)
+    return:
+      tiles (list of DataArray): the tiles, in acquisition order
+      positions (list of (float, float)): the actual position of each tile (m)
+    """
+    step = int(tile_size * (1 - overlap))
+    shape = (step * (num - 1) + tile_size,) * 2
+    img = numpy.random.random_sample(shape)
+    img = scipy.ndimage.gaussian_filter(img, 2)
+    img -= img.min()
+    img = (img * (2 ** 16 - 1) / img.max()).astype(numpy.uint16)
+
+    tiles = []
+    positions = []
+    for row in range(num):
+        cols = range(num) if row % 2 == 0 else reversed(range(num))
+        for col in cols:
+            t, l = row * step, col * step
+            # Y is going up in the physical coordinates
+            pos = (l * STITCHING_PIXEL_SIZE[0], -t * STITCHING_PIXEL_SIZE[1])
+            err = numpy.random.randint(-pos_error, pos_error + 1, 2)
+            md = {model.MD_PIXEL_SIZE: STITCHING_PIXEL_SIZE,
+                  model.MD_POS: (pos[0] + err[0] * STITCHING_PIXEL_SIZE[0],
+                                 pos[1] + err[1] * STITCHING_PIXEL_SIZE[1]),
+                  }
+            tiles.append(model.DataArray(img[t:t + tile_size, l:l + tile_size], md))
+            positions.append(pos)
+
+    return tiles, positions
+
+
+def bench_registrar(num, tile_size, overlap, pos_error):
+    """
+    Register a grid of tiles, and print the statistics
+    """
+    tiles, positions = generate_tiles(num, tile_size, overlap, pos_error)
+
+    registrar = GlobalShiftRegistrar()
+    tstart = time.time()
+    for t in tiles:
+        registrar.addTile(t)
+    tadded = time.time()
+    reg_pos, _ = registrar.getPositions()
+    tend = time.time()
+
+    # The registration is relative to the first tile => compare the relative positions
+    diff = numpy.subtract(reg_pos, reg_pos[0]) - numpy.subtract(positions, positions[0])
+    err = numpy.hypot(diff[:, 0], diff[:, 1]) / STITCHING_PIXEL_SIZE[0]
+    print("%dx%d tiles of %d px: add %.2f s, positions %.2f s, total %.2f s (%.1f ms/tile), "
+          "error mean %.2f px, max %.2f px" %
+          (num, num, tile_size, tadded - tstart, tend - tadded, tend - tstart,
+           (tend - tstart) * 1e3 / len(tiles), err.mean(), err.max()))
+
+
+def run_stitching(options):
+    for num in options.grids:
+        bench_registrar(num, options.tile, options.overlap, options.pos_error)
+
+
+# Shift
+
+def generate_frames(size, num):
+    """
+    Creates a reference image, and shifted copies of it
+    size (int): width and height of the images (px)
+    num (int): number of shifted frames
+    return:
+      ref (numpy.array): the reference image
+      frames (numpy.array of shape N, size, size): the shifted frames
+      shifts (numpy.array of shape N, 2): the actual shift (X, Y) of each frame (px)
+    """
+    ref = numpy.random.random_sample((size, size))
+    ref = scipy.ndimage.gaussian_filter(ref, 2)
+
+    shifts = numpy.random.uniform(-10, 10, (num, 2))
+    freq = fft.fftfreq(size)
+    ref_fft = fft.fft2(ref)
+    frames = numpy.empty((num, size, size))
+    for f, (dx, dy) in zip(frames, shifts):
+        phase = numpy.exp(2j * numpy.pi * (dy * freq[:, None] + dx * freq[None, :]))
+        f[...] = fft.ifft2(ref_fft * phase).real
+
+    return ref, frames, shifts
+
+
+def bench_shift(size, num, precision):
+    """
+    Estimate the shifts with the different methods, and print the statistics
+    """
+    ref, frames, shifts = generate_frames(size, num)
+
+    tstart = time.time()
+    res_func = [MeasureShift(ref, f, precision) for f in frames]
+    tfunc = time.time() - tstart
+
+    tstart = time.time()
+    estimator = ShiftEstimator(ref, precision)
+    res_est = [estimator.estimate(f) for f in frames]
+    test = time.time() - tstart
+
+    tstart = time.time()
+    estimator = ShiftEstimator(ref, precision)
+    res_stack = estimator.estimate(frames)
+    tstack = time.time() - tstart
+
+    if not numpy.allclose(res_func, res_est) or not numpy.allclose(res_func, res_stack):
+        logging.warning("Estimated shifts differ between methods")
+    err = numpy.abs(numpy.subtract(res_stack, shifts)).max()
+
+    print("%d² px x %d frames, precision %d: MeasureShift %.1f ms/frame, "
+          "ShiftEstimator %.1f ms/frame, stack %.1f ms/frame (x%.2f), max error %.3f px" %
+          (size, num, precision, tfunc * 1e3 / num, test * 1e3 / num,
+           tstack * 1e3 / num, tfunc / tstack, err))
+
+
+def run_shift(options):
+    for size in options.sizes:
+        bench_shift(size, options.frames, options.precision)
+
+
+# Image conversion
+
+IMG_HIST_LENGTH = 256
+IMG_TINT = (0, 73, 255)
+
+
+def generate_image(size, dtype):
+    """
+    Creates a random image
+    size (int): width and height of the image
+    dtype (numpy.dtype): type of the data
+    return (numpy.array of shape (size, size)): the image
+    """
+    if dtype.kind == "f":
+        return numpy.random.normal(0, 1000, (size, size)).astype(dtype)
+    else:
+        idt = numpy.iinfo(dtype)
+        return numpy.random.randint(idt.min, min(idt.max, 2 ** 24) + 1, (size, size)).astype(dtype)
+
+
+def numpy_rgb(data, irange, tint):
+    """
+    Converts to RGB, the same way as odemis.util.img does without the optimised
+    version
+    """
+    data = data.clip(*irange)
+    b = 255 / (irange[1] - irange[0])
+    drescaled = ((data - irange[0]) * b + 0.5).astype(numpy.uint8)
+    return numpy.outer(drescaled, numpy.asarray(tint, dtype=numpy.float64) / 255).astype(numpy.uint8).reshape(data.shape + (3,))
+
+
+def time_func(func, repeat):
+    """
+    return (float): the best time to run the function (in s)
+    """
+    durations = []
+    for i in range(repeat):
+        tstart = time.time()
+        func()
+        durations.append(time.time() - tstart)
+    return min(durations)
+
+
+def bench_image(size, dtype, repeat):
+    """
+    Compute the histogram and RGB image with each method, and print the timings
+    """
+    data = generate_image(size, dtype)
+    vmin, vmax = float(data.min()), float(data.max())
+    hrange = (vmin, vmax)
+    irange = (vmin + (vmax - vmin) / 4, vmax - (vmax - vmin) / 4)
+
+    t_np_hist = time_func(lambda: numpy.histogram(data, bins=IMG_HIST_LENGTH, range=hrange), repeat)
+    t_np_rgb = time_func(lambda: numpy_rgb(data, irange, IMG_TINT), repeat)
+    t_np_mm = time_func(lambda: (data.min(), data.max()), repeat)
+    t_fast_hist = time_func(lambda: img_fast.histogram(data, hrange, IMG_HIST_LENGTH), repeat)
+    t_fast_rgb = time_func(lambda: img_fast.DataArray2RGB(data, irange, IMG_TINT), repeat)
+    t_fast_all = time_func(lambda: img_fast.DataArray2RGBHistogram(data, irange, hrange, IMG_HIST_LENGTH, IMG_TINT), repeat)
+
+    t_np = t_np_hist + t_np_rgb + t_np_mm
+    print("%4d² %-7s: histogram numpy %.1f ms / fast %.1f ms, RGB numpy %.1f ms / fast %.1f ms, "
+          "all numpy %.1f ms / separate %.1f ms / combined %.1f ms (x%.1f)" %
+          (size, dtype.name, t_np_hist * 1e3, t_fast_hist * 1e3, t_np_rgb * 1e3, t_fast_rgb * 1e3,
+           t_np * 1e3, (t_fast_hist + t_fast_rgb) * 1e3, t_fast_all * 1e3, t_np / t_fast_all))
+
+
+def run_img(options):
+    if img_fast is None:
+        raise ImportError("img_fast is not available, it needs to be compiled first")
+    dtypes = options.dtypes or img_fast.SUPPORTED_DTYPES
+    print("Using %d threads" % (img_fast._NTHREADS,))
+    for size in options.sizes:
+        for dtype in dtypes:
+            bench_image(size, numpy.dtype(dtype), options.repeat)
+
+
+# SEM scanning
+
+SCAN_PATTERNS = (RasterPattern(), SerpentinePattern(), InterlacedPattern(2),
+                 RandomPattern(0.1))
+
+# minY, maxY, minX, maxX, as raw values
+SCAN_LIMITS = numpy.array([[30320, 35215], [40943, 24592]], dtype=numpy.uint16)
+
+
+def open_semcomedi(device):
+    """
+    Instantiate the semcomedi driver, with one scanner and one detector
+    device (str): the comedi device
+    return (SEMComedi, Scanner, Detector): the SEM and its children. The SEM
+      should be terminated after use.
+    """
+    # Only imported when needed, as it requires comedi
+    from odemis.driver import semcomedi
+    config = {"name": "sem", "role": "sem", "device": device,
+              "children": {
+                  "detector0": {"name": "sed", "role": "sed", "channel": 5, "limits": [-3, 3]},
+                  "scanner": {"name": "scanner", "role": "ebeam", "limits": [[-5, 5], [3, -3]],
+                              "channels": [0, 1], "settle_time": 10e-6, "hfw_nomag": 10e-3},
+              }
+             }
+    sem = semcomedi.SEMComedi(**config)
+    for child in sem.children.value:
+        if child.role == "sed":
+            sed = child
+        elif child.role == "ebeam":
+            scanner = child
+    return sem, scanner, sed
+
+
+def bench_waveform(size, margin):
+    """
+    Generate the waveform of each pattern, and print the statistics
+    """
+    shape = (size, size)
+    npoints_raster = size * (size + margin)
+    for p in SCAN_PATTERNS:
+        tstart = time.time()
+        scan, m = p.generate(shape, SCAN_LIMITS, margin)
+        tgen = time.time() - tstart
+
+        data = numpy.zeros(scan.shape[:2], dtype=numpy.uint16)[:, m:]
+        tstart = time.time()
+        p.toImage(shape, data)
+        timg = time.time() - tstart
+
+        npoints = scan.shape[0] * scan.shape[1]
+        print("%4d² %-40s: generate %.1f ms, to image %.1f ms, %d points (x%.2f)" %
+              (size, p, tgen * 1e3, timg * 1e3, npoints, npoints / npoints_raster))
+
+
+def bench_acquisition(device, size, dwell_time):
+    """
+    Acquire an image with each pattern, and print the duration
+    """
+    sem, scanner, sed = open_semcomedi(device)
+    try:
+        scanner.scale.value = (scanner.shape[0] / size, scanner.shape[1] / size)
+        scanner.resolution.value = (size, size)
+        scanner.dwellTime.value = dwell_time
+        for p in SCAN_PATTERNS:
+            scanner.scanPattern.value = p
+            sed.data.get()  # To fill the cache
+            tstart = time.time()
+            sed.data.get()
+            dur = time.time() - tstart
+            print("%4d² %-40s: acquisition %.3f s" % (size, p, dur))
+    finally:
+        sem.terminate()
+
+
+def run_scanpattern(options):
+    for size in options.sizes:
+        bench_waveform(size, options.margin)
+    if options.device:
+        for size in options.sizes:
+            bench_acquisition(options.device, size, options.dwell_time)
+
+
+def bench_pixel(sem, scanner, sed, size, dwell_time):
+    """
+    Acquire an image pixel per pixel, with and without grouping, and print the
+    durations
+    """
+    scanner.scale.value = (scanner.shape[0] / size, scanner.shape[1] / size)
+    scanner.resolution.value = (size, size)
+    scanner.dwellTime.value = dwell_time
+    (scan, period, shape, margin,
+     wchannels, wranges, osr, dpr, pattern) = scanner.get_scan_data(1)
+    rchannels, rranges = (sed.channel,), (sed._range,)
+    expected = scan.shape[0] * scan.shape[1] * period
+
+    def on_new_position():
+        pass
+
+    for grouped in (False, True):
+        if not grouped:
+            # Forces one command per pixel
+            scanner.newPosition.subscribe(on_new_position)
+        try:
+            tstart = time.time()
+            sem._write_read_2d_pixel(wchannels, wranges, rchannels, rranges,
+                                     period, margin, osr, dpr, scan)
+            dur = time.time() - tstart
+        finally:
+            if not grouped:
+                scanner.newPosition.unsubscribe(on_new_position)
+
+        print("%3d² px, dwell time %g s (osr=%d, dpr=%d), %s: %.2f s, overhead %.3f ms/px" %
+              (size, period, osr, dpr, "grouped" if grouped else "per pixel",
+               dur, (dur - expected) * 1e3 / (scan.shape[0] * scan.shape[1])))
+
+
+def run_semcomedi_pixel(options):
+    sem, scanner, sed = open_semcomedi(options.device)
+    try:
+        for size in options.sizes:
+            bench_pixel(sem, scanner, sed, size, options.dwell_time)
+    finally:
+        sem.terminate()
+
+
+# Peak fitting
+
+def generate_cube(shape, nwl, type, noise):
+    """
+    Creates a spectrum cube with one peak per pixel
+    shape (int, int): number of pixels in Y and X
+    nwl (int): number of wavelengths
+    type (str): type of peak ('gaussian' or 'lorentzian')
+    noise (float): standard deviation of the noise added
+    return:
+      cube (DataArray of shape CYX): the spectra, with MD_WL_LIST
+      pos (ndarray of shape YX): the actual position of the peak (m)
+    """
+    wl = numpy.linspace(400e-9, 800e-9, nwl)
+    ys, xs = numpy.mgrid[0:shape[0], 0:shape[1]]
+    pos = 550e-9 + 50e-9 * numpy.sin(xs / 15) * numpy.cos(ys / 20)
+    FitFunction = peak.PEAK_MODELS[type][0]
+
+    cube = numpy.empty((nwl,) + tuple(shape))
+    for y in range(shape[0]):
+        for x in range(shape[1]):
+            cube[:, y, x] = FitFunction([pos[y, x], 0.04, 1000, 50], wl)
+    cube += numpy.random.normal(0, noise, cube.shape)
+    return model.DataArray(cube, {model.MD_WL_LIST: list(wl)}), pos
+
+
+def bench_fitmap(cube, pos, type, workers):
+    """
+    Fit the whole cube with FitMap(), and print the statistics
+    """
+    tstart = time.time()
+    f = peak.FitMap(cube, type=type, max_workers=workers)
+    ppos, width, amplitude, offset = f.result()
+    dur = time.time() - tstart
+
+    npix = ppos.size
+    failed = numpy.isnan(ppos)
+    err = numpy.abs(ppos - pos)[~failed] * 1e9
+    print("FitMap with %d processes: %.2f s (%.0f spectra/s), %d failed, "
+          "position error mean %.3f nm, max %.3f nm" %
+          (workers, dur, npix / dur, numpy.count_nonzero(failed), err.mean(), err.max()))
+
+
+def bench_fitter(cube, type, num):
+    """
+    Fit some spectra with PeakFitter.Fit(), and print the statistics,
+    extrapolated to the whole cube
+    """
+    wl = numpy.array(cube.metadata[model.MD_WL_LIST])
+    spectra = cube.reshape(cube.shape[0], -1).T
+    idx = numpy.random.choice(len(spectra), min(num, len(spectra)), replace=False)
+
+    fitter = peak.PeakFitter()
+    tstart = time.time()
+    for i in idx:
+        try:
+            fitter.Fit(spectra[i], wl, type=type).result()
+        except ValueError:
+            pass
+    dur = time.time() - tstart
+    print("PeakFitter.Fit on %d spectra: %.2f s (%.0f spectra/s), %.1f s extrapolated to %d spectra" %
+          (len(idx), dur, len(idx) / dur, dur * len(spectra) / len(idx), len(spectra)))
+
+
+def run_fitmap(options):
+    cube, pos = generate_cube(options.size, options.wavelengths, options.type, options.noise)
+    for w in options.workers:
+        bench_fitmap(cube, pos, options.type, w)
+    if options.fitter:
+        bench_fitter(cube, options.type, options.fitter)
+
+
+# Metadata encoding
+
+def gen_metadata(i):
+    """
+    Creates a typical metadata of a camera, which changes a little bit at every
+    frame
+    i (int): frame number
+    return (dict str -> value): the metadata
+    """
+    return {model.MD_ACQ_DATE: time.time(),
+            model.MD_EXP_TIME: 0.01,
+            model.MD_POS: (1e-3, -2e-3 + i * 1e-9),
+            model.MD_PIXEL_SIZE: (1e-7, 1e-7),
+            model.MD_SENSOR_PIXEL_SIZE: (6.5e-6, 6.5e-6),
+            model.MD_BINNING: (1, 1),
+            model.MD_BPP: 16,
+            model.MD_GAIN: 1.0,
+            model.MD_READOUT_TIME: 1e-8,
+            model.MD_SENSOR_TEMP: -60.0,
+            model.MD_HW_NAME: "Andor Clara (s/n: 1234)",
+            model.MD_HW_VERSION: "Andor SDK v2.100",
+            model.MD_SW_VERSION: "2.9.0",
+            model.MD_DESCRIPTION: "Camera",
+            model.MD_ROTATION: 0.0,
+            model.MD_SHEAR: 0.0,
+            model.MD_LENS_MAG: 40.0,
+            model.MD_LENS_NA: 0.95,
+            model.MD_IN_WL: (500e-9, 520e-9),
+            model.MD_OUT_WL: (600e-9, 650e-9),
+            model.MD_LIGHT_POWER: 0.1,
+            model.MD_DWELL_TIME: 1e-6,
+            model.MD_EBEAM_VOLTAGE: 10000.0,
+            model.MD_EBEAM_CURRENT: 1e-9,
+            model.MD_WL_POLYNOMIAL: [500e-9, 1e-10, 1e-15],
+            model.MD_BASELINE: 100,
+            model.MD_INTEGRATION_COUNT: 1,
+            model.MD_FLIP: 0,
+            model.MD_DIMS: "YX",
+            model.MD_SENSOR_SIZE: (2048, 2048),
+            }
+
+
+def run_mdcodec(options):
+    n = options.frames
+    mds = [gen_metadata(i) for i in range(n)]
+
+    size_full = 0
+    tstart = time.time()
+    for md in mds:
+        buf = pickle.dumps(md, pickle.HIGHEST_PROTOCOL)
+        pickle.loads(buf)
+        size_full += len(buf)
+    dur_full = time.time() - tstart
+
+    enc = _mdcodec.MetadataEncoder()
+    dec = _mdcodec.MetadataDecoder()
+    size_delta = 0
+    tstart = time.time()
+    for md in mds:
+        buf = enc.encode(md)
+        dec.decode(buf)
+        size_delta += len(buf)
+    dur_delta = time.time() - tstart
+
+    print("Metadata of %d frames: full pickle %g µs/frame (%d B/frame), "
+          "delta encoding %g µs/frame (%d B/frame)" %
+          (n, dur_full / n * 1e6, size_full // n, dur_delta / n * 1e6, size_delta // n))
+
+
+def main(args):
+    """
+    Handles the command line arguments
+    args is the list of arguments passed
+    return (int): value to return to the OS as program exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure the performance of parts of Odemis")
+    parser.add_argument("--log-level", dest="loglev", metavar="<level>", type=int,
+                        default=0, help="set verbosity level (0-2, default = 0)")
+    subparsers = parser.add_subparsers(title="Benchmarks")
+
+    sp = subparsers.add_parser("export", help="Measure export speed for each codec")
+    sp.add_argument("--input", dest="input", nargs="+",
+                    help="Files to use as data, instead of synthetic data")
+    sp.add_argument("--tiles", dest="tiles", type=int, default=20,
+                    help="Number of tiles of the synthetic mosaic")
+    sp.set_defaults(func=run_export)
+
+    sp = subparsers.add_parser("camera", help="Measure frame rate and latency of simulated cameras")
+    sp.add_argument("--duration", dest="duration", type=float, default=5,
+                    help="Acquisition time for each camera (s)")
+    sp.add_argument("--exp", dest="exp", type=float, default=0.001,
+                    help="Exposure time (s)")
+    sp.add_argument("--hold", dest="hold", type=int, default=1,
+                    help="Number of frames kept by the receiver")
+    sp.set_defaults(func=run_camera)
+
+    sp = subparsers.add_parser("stitching", help="Measure the registration time of the GlobalShiftRegistrar")
+    sp.add_argument("--grids", dest="grids", type=int, nargs="+", default=[10, 20, 30, 40, 50],
+                    help="Number of tiles on each axis of the grids to register")
+    sp.add_argument("--tile", dest="tile", type=int, default=128,
+                    help="Width and height of each tile (px)")
+    sp.add_argument("--overlap", dest="overlap", type=float, default=0.2,
+                    help="Overlap ratio between tiles")
+    sp.add_argument("--pos-error", dest="pos_error", type=int, default=5,
+                    help="Maximum error on the position of the tiles (px)")
+    sp.set_defaults(func=run_stitching)
+
+    sp = subparsers.add_parser("shift", help="Measure the time to estimate the shift between frames")
+    sp.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=[256, 512, 1024, 2048],
+                    help="Width and height of the frames (px)")
+    sp.add_argument("--frames", dest="frames", type=int, default=10,
+                    help="Number of frames to compare to the reference")
+    sp.add_argument("--precision", dest="precision", type=int, default=10,
+                    help="Precision of the shift estimation (1/px)")
+    sp.set_defaults(func=run_shift)
+
+    sp = subparsers.add_parser("img", help="Measure the time to compute the histogram and RGB image")
+    sp.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=[512, 1024, 2048, 4096],
+                    help="Width and height of the images (px)")
+    sp.add_argument("--dtypes", dest="dtypes", nargs="+",
+                    help="Types of the data (default: all the types supported by img_fast)")
+    sp.add_argument("--repeat", dest="repeat", type=int, default=5,
+                    help="Number of times each computation is run")
+    sp.set_defaults(func=run_img)
+
+    sp = subparsers.add_parser("scanpattern", help="Compare the scan patterns of the semcomedi driver")
+    sp.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=[256, 512, 1024, 2048],
+                    help="Width and height of the scanned area (px)")
+    sp.add_argument("--margin", dest="margin", type=int, default=10,
+                    help="Number of points needed to settle after a fly-back")
+    sp.add_argument("--device", dest="device",
+                    help="Comedi device to acquire with (eg, /dev/comedi0)")
+    sp.add_argument("--dwell-time", dest="dwell_time", type=float, default=1e-6,
+                    help="Dwell time for the acquisition (s)")
+    sp.set_defaults(func=run_scanpattern)
+
+    sp = subparsers.add_parser("semcomedi-pixel", help="Measure the time to acquire pixel per pixel with semcomedi")
+    sp.add_argument("--device", dest="device", default="/dev/comedi0",
+                    help="Comedi device to acquire with")
+    sp.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=[10, 30, 100],
+                    help="Width and height of the scanned area (px)")
+    sp.add_argument("--dwell-time", dest="dwell_time", type=float, default=1e-3,
+                    help="Dwell time (s)")
+    sp.set_defaults(func=run_semcomedi_pixel)
+
+    sp = subparsers.add_parser("fitmap", help="Measure the peak fitting time of a spectrum cube")
+    sp.add_argument("--size", dest="size", type=int, nargs=2, default=[100, 100],
+                    help="Number of pixels in Y and X")
+    sp.add_argument("--wavelengths", dest="wavelengths", type=int, default=1024,
+                    help="Number of wavelengths of each spectrum")
+    sp.add_argument("--type", dest="type", default="gaussian",
+                    choices=sorted(peak.PEAK_MODELS.keys()),
+                    help="Type of peak")
+    sp.add_argument("--noise", dest="noise", type=float, default=10,
+                    help="Standard deviation of the noise (the peak amplitude is 1000)")
+    sp.add_argument("--workers", dest="workers", type=int, nargs="+",
+                    default=sorted({1, multiprocessing.cpu_count()}),
+                    help="Numbers of processes to use with FitMap")
+    sp.add_argument("--fitter", dest="fitter", type=int, default=100,
+                    help="Number of spectra to fit with PeakFitter (0 to skip)")
+    sp.set_defaults(func=run_fitmap)
+
+    sp = subparsers.add_parser("mdcodec", help="Measure the time to encode and decode the metadata")
+    sp.add_argument("--frames", dest="frames", type=int, default=10000,
+                    help="Number of frames whose metadata is encoded")
+    sp.set_defaults(func=run_mdcodec)
+
+    options = parser.parse_args(args[1:])
+
+    loglev_names = [logging.WARNING, logging.INFO, logging.DEBUG]
+    loglev = loglev_names[min(len(loglev_names) - 1, options.loglev)]
+    logging.getLogger().setLevel(loglev)
+
+    try:
+        # Always the same synthetic data, to compare the runs
+        numpy.random.seed(0)
+        options.func(options)
+    except Exception:
+        logging.exception("Failed to run the benchmark")
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    exit(ret)
@@ -29,6 +29,12 @@ import math
 from numpy import arange
 from numpy import fft
 
+
+# Maximum memory used by the intermediary arrays, when estimating the shift of
+# a stack of images. The images are processed by chunks of this size.
+BATCH_MAX_BYTES = 64 * 2 ** 20  # bytes
+
+
 def MeasureShift(previous_img, current_img, precision=1):
     """
     Given two images, it calculates the shift in x and y axis. It first computes
@@ -38,6 +44,7 @@ def MeasureShift(previous_img, current_img, precision=1):
     cross-correlation" by Manuel Guizar, for the corresponding matlab code see
     http://www.mathworks.com/matlabcentral/fileexchange/
     18401-efficient-subpixel-image-registration-by-cross-correlation.
+    To compare many images to the same reference image, use a ShiftEstimator.
 
     previous_img (numpy.array): 2d array with the previous frame
     current_img (numpy.array): 2d array with the last frame, must be of same
@@ -45,143 +52,238 @@ def MeasureShift(previous_img, current_img, precision=1):
     precision (1<=int): Calculate drift within 1/precision of a pixel
     returns (tuple of floats): Drift in pixels
     """
-    if precision < 1:
-        raise ValueError("Precision cannot be less than 1, got %s." % (precision,))
     assert previous_img.shape == current_img.shape, "Prev shape %s != new shape %s" % (previous_img.shape, current_img.shape)
+    return ShiftEstimator(previous_img, precision).estimate(current_img)
 
-    previous_fft = fft.fft2(previous_img)
-    current_fft = fft.fft2(current_img)
-    m, n = previous_fft.shape
-
-    if precision == 1:
-        # Cross-correlation computation
-        CC = fft.ifft2(previous_fft * current_fft.conj())
-
-        # Locate the peak
-        ACC = abs(CC)
-        loc1 = ACC.argmax(0)
-        max1 = ACC[(loc1, range(ACC.shape[1]))]
-        loc2 = max1.argmax(0)
-
-        rloc = loc1[loc2]
-        cloc = loc2
 
-        # Calculate shift from the peak
-        md2 = m // 2
-        nd2 = n // 2
-        if rloc > md2:
-            row_shift = rloc - m
-        else:
-            row_shift = rloc
+class ShiftEstimator(object):
+    """
+    Measures the shift between a reference image and other images, as
+    MeasureShift() does. The spectrum of the reference image is only computed
+    once, and a whole stack of images can be compared at once. This is faster
+    when comparing many images to the same reference, for instance in drift
+    correction.
+    """
 
-        if cloc > nd2:
-            col_shift = cloc - n
+    def __init__(self, reference, precision=1, window=None, roi=None):
+        """
+        reference (numpy.array): 2d array with the reference (previous) frame
+        precision (1<=int): Calculate drift within 1/precision of a pixel
+        window (None or "hanning"): window applied to the images before
+          computing the cross-correlation. It reduces the effect of the borders
+          of the images, at the cost of ignoring more the data on the borders.
+        roi (None or 4 ints): part of the images to compare, as left, top,
+          right, bottom (in px). If None, the whole images are compared.
+        raise ValueError: if an argument is incorrect
+        """
+        if precision < 1:
+            raise ValueError("Precision cannot be less than 1, got %s." % (precision,))
+        self._precision = precision
+
+        if reference.ndim != 2:
+            raise ValueError("Reference image must be 2D, but got shape %s" % (reference.shape,))
+        self._img_shape = reference.shape
+
+        if roi is not None:
+            l, t, r, b = roi
+            if not (0 <= l < r <= reference.shape[1] and 0 <= t < b <= reference.shape[0]):
+                raise ValueError("ROI %s is not within the image of shape %s" %
+                                 (roi, reference.shape))
+            self._roi = (slice(t, b), slice(l, r))
         else:
-            col_shift = cloc
-
-    else:
-        mlarge, nlarge = m * 2, n * 2
-
-        # Upsample by factor of 2 to obtain initial estimation and
-        # embed Fourier data in a 2x larger array
-        CC = numpy.zeros((mlarge, nlarge), dtype=numpy.complex)
-        CC[m - m // 2:m + 1 + (m - 1) // 2,
-           n - n // 2:n + 1 + (n - 1) // 2] = (fft.fftshift(previous_fft) *
-                                               fft.fftshift(current_fft).conj()
-                                              )
-
-        # Cross-correlation computation
-        CC = fft.ifft2(fft.ifftshift(CC))
-
-        # Locate the peak
-        ACC = abs(CC)
-        loc1 = ACC.argmax(0)
-        max1 = ACC[(loc1, range(ACC.shape[1]))]
-        loc2 = max1.argmax(0)
-
-        rloc = loc1[loc2]
-        cloc = loc2
-
-        # Calculate shift in previous pixel grid from the position of the peak
-        (m, n) = CC.shape
-        md2 = m // 2
-        nd2 = n // 2
-
-        if rloc > md2:
-            row_shift = rloc - m
+            self._roi = (slice(None), slice(None))
+        self._shape = reference[self._roi].shape
+
+        if window is None:
+            self._window = None
+        elif window == "hanning":
+            m, n = self._shape
+            self._window = numpy.outer(numpy.hanning(m), numpy.hanning(n))
         else:
-            row_shift = rloc
+            raise ValueError("Unknown window %s" % (window,))
+
+        self._ref_fft = self._computeSpectrum(reference[numpy.newaxis])[0]
+
+    def _computeSpectrum(self, images):
+        """
+        images (numpy.array of shape NYX): the images, of the original shape
+        return (numpy.array of complex of shape NYX): the 2D DFT of each image
+        """
+        images = images[(slice(None),) + self._roi]
+        if self._window is not None:
+            # Remove the mean first, otherwise the window itself is the main
+            # feature of the images, which always correlates at shift 0
+            images = images - images.mean(axis=(1, 2), keepdims=True)
+            images *= self._window
+        return fft.fft2(images)
+
+    def estimate(self, images):
+        """
+        Measures the shift of one or several images, compared to the reference.
+        images (numpy.array of shape YX or NYX): the image(s) to compare. Each
+          image must have the same shape as the reference.
+        returns (tuple of floats, or numpy.array of shape N2): Drift in pixels
+          (X, Y), for each image if a stack of images was passed.
+        """
+        images = numpy.asarray(images)
+        single = (images.ndim == 2)
+        if single:
+            images = images[numpy.newaxis]
+        if images.shape[1:] != self._img_shape:
+            raise ValueError("Images of shape %s, while reference has shape %s" %
+                             (images.shape[1:], self._img_shape))
+
+        # The up-sampled cross-correlation (complex) is the largest array
+        m, n = self._shape
+        chunk = max(1, BATCH_MAX_BYTES // (2 * m * 2 * n * 16))
+        shifts = numpy.empty((images.shape[0], 2))
+        for i in range(0, images.shape[0], chunk):
+            shifts[i:i + chunk] = self._estimateChunk(images[i:i + chunk])
+
+        if single:
+            if self._precision == 1:
+                return int(shifts[0, 0]), int(shifts[0, 1])
+            return tuple(shifts[0])
+        return shifts
+
+    def _estimateChunk(self, images):
+        """
+        images (numpy.array of shape NYX): the images to compare
+        returns (numpy.array of shape N2): Drift in pixels (X, Y) for each image
+        """
+        current_fft = self._computeSpectrum(images)
+        m, n = self._shape
+        precision = self._precision
+
+        # Cross-power spectrum
+        cps = self._ref_fft * current_fft.conj()
+
+        if precision == 1:
+            # Cross-correlation computation
+            CC = fft.ifft2(cps)
+
+            # Locate the peak, and calculate shift from it
+            rloc, cloc = _FindPeak(abs(CC))
+            row_shift = numpy.where(rloc > m // 2, rloc - m, rloc)
+            col_shift = numpy.where(cloc > n // 2, cloc - n, cloc)
 
-        if cloc > nd2:
-            col_shift = cloc - n
         else:
-            col_shift = cloc
-
-        row_shift /= 2
-        col_shift /= 2
-
-        # DFT computation
-        # Initial shift estimation in upsampled grid
-        row_shift = round(row_shift * precision) / precision
-        col_shift = round(col_shift * precision) / precision
-        dft_shift = math.ceil(precision * 1.5) // 2  # Center of output at dft_shift+1
-
-        # Matrix multiply DFT around the current shift estimation
-        CC = (_UpsampledDFT(current_fft * previous_fft.conj(),
-                            math.ceil(precision * 1.5),
-                            math.ceil(precision * 1.5),
-                            precision,
-                            dft_shift - row_shift * precision,
-                            dft_shift - col_shift * precision)
-              ) / (md2 * nd2 * (precision ** 2))
-        # was .conj(), but as we just need the abs(), it's not needed
-
-        # Locate maximum and map back to original pixel grid
-        ACC = abs(CC)
-        loc1 = ACC.argmax(0)
-        max1 = ACC[(loc1, range(ACC.shape[1]))]
-        loc2 = max1.argmax(0)
-
-        rloc = loc1[loc2]
-        cloc = loc2
-
-        rloc -= dft_shift
-        cloc -= dft_shift
-
-        row_shift += rloc / precision
-        col_shift += cloc / precision
+            mlarge, nlarge = m * 2, n * 2
+
+            # Upsample by factor of 2 to obtain initial estimation and
+            # embed Fourier data in a 2x larger array. The data is directly
+            # placed in the (inverse) fft-shifted positions: the negative
+            # frequencies are at the end.
+            # The 2D inverse DFT is done as 1D on the last axis, but only on the
+            # rows containing data, and then 1D on the first axis.
+            pr, pc = m - m // 2, n - n // 2  # number of positive frequencies
+            CCr = numpy.zeros((images.shape[0], m, nlarge), dtype=numpy.complex)
+            CCr[:, :, :pc] = cps[:, :, :pc]
+            CCr[:, :, n + pc:] = cps[:, :, pc:]
+            CCr = fft.ifft(CCr, axis=-1)
+            CC = numpy.zeros((images.shape[0], mlarge, nlarge), dtype=numpy.complex)
+            CC[:, :pr] = CCr[:, :pr]
+            CC[:, m + pr:] = CCr[:, pr:]
+            del CCr
+
+            # Cross-correlation computation
+            CC = fft.ifft(CC, axis=-2)
+
+            # Locate the peak, and calculate shift in previous pixel grid from it
+            rloc, cloc = _FindPeak(abs(CC))
+            del CC
+            row_shift = numpy.where(rloc > m, rloc - mlarge, rloc) / 2
+            col_shift = numpy.where(cloc > n, cloc - nlarge, cloc) / 2
+
+            # DFT computation
+            # Initial shift estimation in upsampled grid
+            row_shift = _RoundHalfAway(row_shift * precision) / precision
+            col_shift = _RoundHalfAway(col_shift * precision) / precision
+            upsampled = int(math.ceil(precision * 1.5))
+            dft_shift = upsampled // 2  # Center of output at dft_shift+1
+
+            # Matrix multiply DFT around the current shift estimation
+            CC = (_UpsampledDFT(cps.conj(),
+                                upsampled, upsampled, precision,
+                                dft_shift - row_shift * precision,
+                                dft_shift - col_shift * precision)
+                  ) / (m * n * (precision ** 2))
+            # was .conj(), but as we just need the abs(), it's not needed
+
+            # Locate maximum and map back to original pixel grid
+            rloc, cloc = _FindPeak(abs(CC))
+            row_shift = row_shift + (rloc - dft_shift) / precision
+            col_shift = col_shift + (cloc - dft_shift) / precision
+
+            if m == 1:
+                row_shift[:] = 0
+            if n == 1:
+                col_shift[:] = 0
+
+        return numpy.stack([col_shift, row_shift], axis=1)
+
+
+def _FindPeak(data):
+    """
+    Locates the maximum of each image. In case of equality, the first one in
+    column order is picked.
+    data (numpy.array of shape NYX): the images
+    returns (numpy.array of ints of shape N, numpy.array of ints of shape N):
+      row and column of the maximum for each image
+    """
+    n = data.shape[0]
+    loc1 = data.argmax(axis=1)  # row of the maximum of each column
+    # Maximum of each column, for each image
+    max1 = data[numpy.arange(n)[:, None], loc1, numpy.arange(data.shape[2])]
+    loc2 = max1.argmax(axis=1)
+    return loc1[numpy.arange(n), loc2], loc2
 
-        if md2 == 1:
-            row_shift = 0
-        if nd2 == 1:
-            col_shift = 0
 
-    return col_shift, row_shift
+def _RoundHalfAway(x):
+    """
+    Rounds to the closest integer, with halves rounded away from zero (as
+    round() on a float does)
+    x (numpy.array): values to round
+    returns (numpy.array of floats): the rounded values
+    """
+    return numpy.copysign(numpy.floor(numpy.abs(x) + 0.5), x)
 
 
 def _UpsampledDFT(data, nor, noc, precision=1, roff=0, coff=0):
     """
     Upsampled DFT by matrix multiplies.
-    data (numpy.array): 2d array
+    data (numpy.array): 2d array, or 3d array (stack of 2d arrays)
     nor, noc (ints): Number of pixels in the output upsampled DFT, in units
     of upsampled pixels
     precision (int): Calculate drift within 1/precision of a pixel
-    roff, coff (ints): Row and column offsets, allow to shift the output array
-                    to a region of interest on the DFT
-    returns (tuple of floats): Drift in pixels
+    roff, coff (ints or numpy.arrays): Row and column offsets, allow to shift the output array
+                    to a region of interest on the DFT. If data is a stack, it can be
+                    one value per array.
+    returns (numpy.array of complex): upsampled DFT, of shape nor x noc
+      (for each array if data is a stack)
     """
     z = 1j  # imaginary unit
-    nr, nc = data.shape
+    nr, nc = data.shape[-2:]
+    single = (data.ndim == 2)
+    if single:
+        data = data[numpy.newaxis]
+    roff = numpy.broadcast_to(roff, data.shape[:1])
+    coff = numpy.broadcast_to(coff, data.shape[:1])
+
+    # The kernels are the product of a part independent of the offsets, and
+    # a "phase" dependent on the offsets (of each array).
+    freqc = fft.ifftshift(arange(0, nc)) - nc // 2
+    freqr = fft.ifftshift(arange(0, nr)) - nr // 2
+    fc = (-z * 2 * math.pi / (nc * precision)) * freqc
+    fr = (-z * 2 * math.pi / (nr * precision)) * freqr
 
     # Compute kernels and obtain DFT by matrix products
-    kernc = numpy.power(math.e, (-z * 2 * math.pi / (nc * precision)) *
-                                ((fft.ifftshift(arange(0, nc))[:, None]).T - nc // 2) *
-                                (arange(0, noc) - coff)[:, None]
-                       )
-
-    kernr = numpy.power(math.e, (-z * 2 * math.pi / (nr * precision)) *
-                                (fft.ifftshift(arange(0, nr))[:, None] - nr // 2) *
-                                ((arange(0, nor)[:, None]).T - roff)
-                       )
-
-    return numpy.dot(numpy.dot((kernr.transpose()), data), kernc.transpose())
+    kernc = (numpy.exp(-coff[:, None] * fc)[:, :, None] *
+             numpy.exp(fc[:, None] * arange(0, noc)))  # N x nc x noc
+    kernr = (numpy.exp(-roff[:, None] * fr)[:, None, :] *
+             numpy.exp(arange(0, nor)[:, None] * fr))  # N x nor x nr
+
+    dft = numpy.matmul(numpy.matmul(kernr, data), kernc)
+    if single:
+        return dft[0]
+    return dft
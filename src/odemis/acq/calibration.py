@@ -23,6 +23,7 @@ import logging
 import numpy
 from odemis import model
 from odemis.util import spectrum, img, find_closest, almost_equal
+from odemis.util.cache import LRUCache
 
 
 # AR calibration data is a background image. The file format expected is a
@@ -179,18 +180,20 @@ def get_spectrum_efficiency(das):
     return ret
 
 
-def compensate_spectrum_efficiency(data, bckg=None, coef=None):
+def _get_spectrum_compensation(data, bckg=None, coef=None):
     """
-    Apply the efficiency compensation factors to the given data.
-    If the wavelength of the calibration doesn't cover the whole data wavelength,
-    the missing wavelength is filled by the same value as the border. Wavelength
-    in-between points is linearly interpolated.
+    Check the calibration data, and convert it to the factors to apply for each
+    wavelength of the data.
     data (DataArray of at least 5 dims): the original data. Need MD_WL_* metadata
     bckg (None or DataArray of at least 5 dims): the background data, with TZXY = 1111
       Need MD_WL_* metadata.
     coef (None or DataArray of at least 5 dims): the coeficient data, with TZXY = 1111
       Need MD_WL_* metadata.
-    returns (DataArray): same shape as original data. Can have dtype=float
+    returns:
+      bckg (None or DataArray of shape C1111): the background to subtract
+      calib_fitted (None or ndarray of float of shape C1111): the coefficient
+        to multiply, for each wavelength of the data
+    raise ValueError: if the data and calibration data are not compatible
     """
     # Need to get the calibration data for each wavelength of the data
     wl_data = spectrum.get_wavelength_per_pixel(data)
@@ -213,10 +216,9 @@ def compensate_spectrum_efficiency(data, bckg=None, coef=None):
                             wl_bckg[0] * 1e9, wl_bckg[-1] * 1e9,
                             wl_data[0] * 1e9, wl_data[-1] * 1e9)
 
-        data = img.Subtract(data, bckg)
-
     # We could be more clever if calib has a MD_WL_POLYNOMIAL, but it's very
     # unlikely the calibration is in this form anyway.
+    calib_fitted = None
     if coef is not None:
         if coef.shape[1:] != (1, 1, 1, 1):
             raise ValueError("coef should have shape C1111")
@@ -233,12 +235,155 @@ def compensate_spectrum_efficiency(data, bckg=None, coef=None):
         calib_fitted = numpy.interp(wl_data, wl_coef, coef[:, 0, 0, 0, 0])
         calib_fitted.shape += (1, 1, 1, 1) # put TZYX dims
 
+    return bckg, calib_fitted
+
+
+def compensate_spectrum_efficiency(data, bckg=None, coef=None):
+    """
+    Apply the efficiency compensation factors to the given data.
+    If the wavelength of the calibration doesn't cover the whole data wavelength,
+    the missing wavelength is filled by the same value as the border. Wavelength
+    in-between points is linearly interpolated.
+    data (DataArray of at least 5 dims): the original data. Need MD_WL_* metadata
+    bckg (None or DataArray of at least 5 dims): the background data, with TZXY = 1111
+      Need MD_WL_* metadata.
+    coef (None or DataArray of at least 5 dims): the coeficient data, with TZXY = 1111
+      Need MD_WL_* metadata.
+    returns (DataArray): same shape as original data. Can have dtype=float
+    """
+    bckg, calib_fitted = _get_spectrum_compensation(data, bckg, coef)
+
+    if bckg is not None:
+        data = img.Subtract(data, bckg)
+
+    if calib_fitted is not None:
         # Compensate the data
         data = data * calib_fitted # will keep metadata from data
 
     return data
 
 
+def _hashable_key(key):
+    """
+    Convert an index (as passed to the [] operator) to a hashable value
+    key (index): basic index (int, slice, None, Ellipsis, or tuple of them)
+    return (tuple or None): the hashable version, or None if the index is
+      not a basic index (eg, an array)
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    hkey = []
+    for k in key:
+        if isinstance(k, slice):
+            hkey.append(("slice", k.start, k.stop, k.step))
+        elif k is None or k is Ellipsis:
+            hkey.append(k)
+        elif isinstance(k, (int, long, numpy.integer)):
+            hkey.append(int(k))
+        else:
+            return None
+    return tuple(hkey)
+
+
+class CompensatedSpectrum(object):
+    """
+    Lazy version of compensate_spectrum_efficiency(). It behaves as the
+    compensated DataArray when accessing it with the [] operator, but the
+    background subtraction and the efficiency compensation are only applied on
+    the part of the data requested. The parts computed are cached, up to a
+    given memory size.
+    It is immutable, so the parts returned are read-only.
+    """
+
+    def __init__(self, data, bckg=None, coef=None, dtype=None, cache_size=0):
+        """
+        data (DataArray or DataArrayShadow of at least 5 dims): the original
+          data. Need MD_WL_* metadata. A DataArrayShadow must support indexing,
+          and then only the basic indices (ie, ints and slices) can be used.
+        bckg (None or DataArray of at least 5 dims): the background data, with TZXY = 1111
+          Need MD_WL_* metadata.
+        coef (None or DataArray of at least 5 dims): the coeficient data, with TZXY = 1111
+          Need MD_WL_* metadata.
+        dtype (None or numpy.float32 or numpy.float64): type of the compensated
+          data, when it's a float. None will use the same type as
+          compensate_spectrum_efficiency(). numpy.float32 allows to use half
+          the memory, at the cost of precision.
+        cache_size (0<=int): maximum memory used to keep the parts computed (in bytes)
+        raise ValueError: if the data and calibration data are not compatible
+        """
+        bckg, calib_fitted = _get_spectrum_compensation(data, bckg, coef)
+
+        self._data = data
+        self.metadata = data.metadata
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.size = int(numpy.prod(data.shape))
+
+        # Same type as compensate_spectrum_efficiency(), or the float type requested
+        if calib_fitted is not None:
+            rdtype = numpy.result_type(data.dtype, calib_fitted.dtype)
+        elif bckg is not None:
+            rdtype = numpy.result_type(data.dtype, bckg.dtype)
+        else:
+            rdtype = data.dtype
+        if dtype is not None and rdtype.kind == "f":
+            rdtype = numpy.dtype(dtype)
+        self.dtype = rdtype
+
+        # The calibration data is "extended" (without copy) to the shape of the
+        # data, so that any index on the data can directly be applied to it.
+        self._bckg = None
+        if bckg is not None:
+            self._bckg = numpy.broadcast_to(bckg, data.shape)
+        self._coef = None
+        if calib_fitted is not None:
+            self._coef = numpy.broadcast_to(calib_fitted, data.shape)
+
+        self._cache = LRUCache(cache_size)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """
+        key (index): any index accepted by numpy
+        return (DataArray or scalar): the compensated data at the given index
+        """
+        hkey = _hashable_key(key)
+        if hkey is not None:
+            d = self._cache.get(hkey)
+            if d is not None:
+                return d
+
+        d = self._data[key]
+        if self._bckg is not None:
+            d = img.Subtract(d, self._bckg[key])
+        if self._coef is not None:
+            d = numpy.multiply(d, self._coef[key], dtype=self.dtype)
+        elif d.dtype != self.dtype:
+            d = d.astype(self.dtype)
+
+        if not isinstance(d, numpy.ndarray):  # scalar
+            return d
+
+        d = model.DataArray(d, self.metadata)
+        d.flags.writeable = False
+        if hkey is not None:
+            self._cache.put(hkey, d)
+        return d
+
+    def getData(self):
+        """
+        Compute the whole compensated data
+        return (DataArray): same as compensate_spectrum_efficiency(), read-only
+        """
+        return self[...]
+
+    def __array__(self, dtype=None):
+        return numpy.asarray(self.getData(), dtype)
+
+
 def get_time_range_to_trigger_delay(data, timeRange_choices, triggerDelay_range):
     """
     Reads the time range and trigger delay values from a csv object.
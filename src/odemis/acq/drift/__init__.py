@@ -30,7 +30,7 @@ from scipy import misc
 import threading
 import cv2
 
-from odemis.acq.align.shift import MeasureShift
+from odemis.acq.align.shift import MeasureShift, ShiftEstimator
 
 MIN_RESOLUTION = (20, 20) # seems 10x10 sometimes work, but let's not tent it
 MAX_PIXELS = 128 ** 2  # px
@@ -65,6 +65,8 @@ class AnchoredEstimator(object):
         self.max_drift = (0, 0) # in sem px
 
         self.raw = []  # first 2 and last 2 anchor areas acquired (in order)
+        # To compare the images to the first one (raw[0]), which never changes
+        self._orig_estimator = None
         self._acq_sem_complete = threading.Event()
 
         # Calculate initial translation for anchor region acquisition
@@ -172,7 +174,9 @@ class AnchoredEstimator(object):
             prev_drift = (prev_drift[0] * self._scale[0] + self.drift[0],
                           prev_drift[1] * self._scale[1] + self.drift[1])
 
-            orig_drift = MeasureShift(self.raw[0], self.raw[-1], 10)
+            if self._orig_estimator is None:
+                self._orig_estimator = ShiftEstimator(self.raw[0], 10)
+            orig_drift = self._orig_estimator.estimate(self.raw[-1])
             self.drift = (orig_drift[0] * self._scale[0],
                           orig_drift[1] * self._scale[1])
 
@@ -26,7 +26,7 @@ import math
 from numpy import fft
 from numpy import random
 import numpy
-from odemis.acq.align.shift import MeasureShift
+from odemis.acq.align.shift import MeasureShift, ShiftEstimator
 from odemis.dataio import hdf5
 import os
 import unittest
@@ -207,5 +207,40 @@ class TestShiftCalculation(unittest.TestCase):
         drift = MeasureShift(self.small_data, self.small_data_random_drifted_noisy, 10)
         numpy.testing.assert_almost_equal(drift, (self.small_deltac, self.small_deltar), 0)
 
+    def test_estimator_stack(self):
+        """
+        Tests the ShiftEstimator on a stack of images, compared to MeasureShift.
+        """
+        images = numpy.array([self.data[0], self.data_drifted[0], self.data_random_drifted.real,
+                              self.data_random_drifted_noisy.real])
+        for precision in (1, 10, 100):
+            estimator = ShiftEstimator(self.data[0], precision)
+            drifts = estimator.estimate(images)
+            self.assertEqual(drifts.shape, (4, 2))
+            for im, drift in zip(images, drifts):
+                numpy.testing.assert_almost_equal(drift, MeasureShift(self.data[0], im, precision))
+
+            # Also works one image at a time
+            numpy.testing.assert_almost_equal(estimator.estimate(images[2]), drifts[2])
+
+        numpy.testing.assert_almost_equal(drifts[1], (-3, 5), 0)
+        numpy.testing.assert_almost_equal(drifts[2], (self.deltac, self.deltar), 2)
+
+        with self.assertRaises(ValueError):
+            estimator.estimate(self.small_data)
+
+    def test_estimator_roi_window(self):
+        """
+        Tests the ShiftEstimator with a ROI and a window
+        """
+        estimator = ShiftEstimator(self.data[0], 10, window="hanning", roi=(100, 50, 400, 350))
+        drift = estimator.estimate(self.data_drifted[0])
+        numpy.testing.assert_almost_equal(drift, (-3, 5), 0)
+
+        with self.assertRaises(ValueError):
+            ShiftEstimator(self.data[0], 10, roi=(100, 50, 4000, 350))
+        with self.assertRaises(ValueError):
+            ShiftEstimator(self.data[0], 10, window="foo")
+
 if __name__ == '__main__':
     unittest.main()
@@ -63,6 +63,7 @@ def register(tiles, method=REGISTER_GLOBAL_SHIFT):
         registrar.addTile(tile, dep_tiles)
 
     # Update positions
+    tile_positions, dep_tile_positions = registrar.getPositions()
     for i, ts in enumerate(tiles):
         # Return tuple of positions if dependent tiles are present
         if isinstance(ts, tuple):
@@ -71,20 +72,20 @@ def register(tiles, method=REGISTER_GLOBAL_SHIFT):
 
             # Update main tile
             md = copy.deepcopy(tile.metadata)
-            md[model.MD_POS] = registrar.getPositions()[0][i]
+            md[model.MD_POS] = tile_positions[i]
             tileUpd = model.DataArray(tile, md)
 
             # Update dependent tiles
             tilesNew = [tileUpd]
             for j, dt in enumerate(dep_tiles):
                 md = copy.deepcopy(dt.metadata)
-                md[model.MD_POS] = registrar.getPositions()[1][i][j]
+                md[model.MD_POS] = dep_tile_positions[i][j]
                 tilesNew.append(model.DataArray(dt, md))
             tileUpd = tuple(tilesNew)
 
         else:
             md = copy.deepcopy(ts.metadata)
-            md[model.MD_POS] = registrar.getPositions()[0][i]
+            md[model.MD_POS] = tile_positions[i]
             tileUpd = model.DataArray(ts, md)
 
         updatedTiles.append(tileUpd)
@@ -92,13 +93,17 @@ def register(tiles, method=REGISTER_GLOBAL_SHIFT):
     return updatedTiles
 
 
-def weave(tiles, method=WEAVER_MEAN):
+def weave(tiles, method=WEAVER_MEAN, tiled=False):
     """
     tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles to compute the registration. 
     If it's tuples, the first tile of each tuple is the “main tile”, and the following ones are dependent tiles.
     method (WEAVER_*): WEAVER_MEAN → MeanWeaver, WEAVER_COLLAGE → CollageWeaver
+    tiled (bool): if True, the stitched image is only computed tile by tile,
+      when it's read (typically, by the TIFF exporter with pyramid=True). This
+      avoids holding the whole stitched image in memory.
     return:
-        tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles as passed, but with updated MD_POS metadata
+        stitched_image (DataArray or DataArrayShadow of shape YX): The stitched image.
+          It's a DataArrayShadow if tiled is True.
     """
 
     if method == WEAVER_MEAN:
@@ -112,7 +117,11 @@ def weave(tiles, method=WEAVER_MEAN):
 
     for t in tiles:
         weaver.addTile(t)
-    stitched_image = weaver.getFullImage()
+
+    if tiled:
+        stitched_image = weaver.getFullImageShadow()
+    else:
+        stitched_image = weaver.getFullImage()
 
     return stitched_image
 
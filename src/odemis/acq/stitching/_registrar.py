@@ -29,14 +29,15 @@ content, in other words performing "image registration".
 """
 
 from __future__ import division
+from concurrent import futures
 from odemis.acq.drift import MeasureShift
 import numpy
 import math
+import multiprocessing
 from odemis import model
 import logging
 from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import minimum_spanning_tree
-from collections import deque
+from scipy.sparse.csgraph import minimum_spanning_tree, breadth_first_order
 
 GOOD_MATCH = 0.9  # consider all registrations with match > GOOD_MATCH
 LEFT_TO_RIGHT = 1
@@ -450,22 +451,30 @@ class GlobalShiftRegistrar(object):
         # Store all the tiles. Each cell contains either None or a DataArray
         self.tiles = [[None]]
 
-        # Store the shifts in a data structure with shape num_rows x (num_cols - 1) x 2 for the
-        # horizontal shifts and (num_cols - 1) x num_rows x 2 for the vertical shifts. The data
-        # structure contains the shift on all edges in the tile grid from top left to bottom right.
-        # Each cell contains a tuple (x, y shift) and a float (error value).
-        # The main advantage of using this data structure over an adjacency matrix is
-        # that it can be extended in the same way as the self.tiles attribute is extended
-        # when a new tile is added.
-        self.shifts_hor = [[None]]
-        self.shifts_ver = [[None]]
+        # Store the shifts on the edges of the tile grid (ie, between two neighbouring tiles).
+        # Only the edges between two tiles which have been added are present, so it
+        # stays small even for large grids. As the grid positions don't change
+        # when the grid is extended, the edges are not affected by the extension.
+        # (int, int), (int, int) -> Future returning ((float, float), float):
+        # row/col of the left (or top) tile, row/col of the right (or bottom) tile ->
+        # x/y shift between the two tiles, and the normalized cross-correlation.
+        self.shifts = {}
+
+        # The shifts are computed in parallel, while the next tiles are added.
+        # Created on the first tile, and stopped once all the shifts are used.
+        self._executor = None
 
         # List of 2D indices for grid positions in order of acquisition
         self.acq_order = []
+        # MD_POS of each tile, in order of acquisition
+        self._md_pos = []
 
         # Shift between main tile and dependent tiles, shape: number of tiles x number of dep_tiles.
         self.offsets_dep_tiles = []
 
+        # Result of getPositions(), computed only once all the tiles have been added
+        self._positions = None
+
     def addTile(self, tile, dependent_tiles=None):
         """
         Extends grid by one tile. The first tile is added at the top left position. Any following
@@ -478,6 +487,7 @@ class GlobalShiftRegistrar(object):
         """
         row, col = self._insert_tile_to_grid(tile)
         self._compute_registration(row, col)
+        self._positions = None
 
         if dependent_tiles is not None:
             offsets = []
@@ -494,12 +504,21 @@ class GlobalShiftRegistrar(object):
         :returns dep_tile_positions: (list of N tuples of K tuples of 2 floats) for each tile, it returns
         the adjusted position of all dependent tile (in the order they were passed)
         """
+        if self._positions is not None:
+            return self._positions
+
         px_size = self.tiles[0][0].metadata[model.MD_PIXEL_SIZE]
         firstPosition = numpy.divide(self.tiles[0][0].metadata[model.MD_POS], px_size)
         tile_positions = []
         dep_tile_positions = []
 
         registered_positions = self._assemble_mosaic()
+        # All the shifts are computed => the threads are not needed anymore
+        # (a new executor is created if more tiles are added)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
         for ti in self.acq_order:
             shift = registered_positions[ti[0]][ti[1]]
             tile_positions.append(((shift[0] + firstPosition[0]) * px_size[0],
@@ -512,7 +531,8 @@ class GlobalShiftRegistrar(object):
                 dts.append((t[0] + sdt[0], t[1] + sdt[1]))
             dep_tile_positions.append(dts)
 
-        return tile_positions, dep_tile_positions
+        self._positions = tile_positions, dep_tile_positions
+        return self._positions
 
     def _insert_tile_to_grid(self, tile):
         """
@@ -521,11 +541,12 @@ class GlobalShiftRegistrar(object):
 
         :param tile: (DataArray) tile to be inserted
         :returns: (int, int) row, col grid position of the tile
-        :updates self.tiles, self.shifts, self.acq_order:
+        :updates self.tiles, self.acq_order:
         """
         if self.tiles[0][0] is None:
             self.tiles[0][0] = tile
             self.acq_order.append([0, 0])
+            self._md_pos.append(tile.metadata[model.MD_POS])
             return 0, 0
 
         if tile.shape != self.tiles[0][0].shape:
@@ -535,20 +556,17 @@ class GlobalShiftRegistrar(object):
         num_cols = len(self.tiles[0])
         num_rows = len(self.tiles)
 
-        # Find the registered tile that is closest to the new tile.
-        minDist = float("inf")
-        for i in range(num_rows):
-            for j in range(num_cols):
-                if self.tiles[i][j] is not None:
-                    dist = math.hypot(*numpy.subtract(tile.metadata[model.MD_POS],
-                                                     self.tiles[i][j].metadata[model.MD_POS]))
-                    if dist < minDist:
-                        minDist = dist
-                        prev_row, prev_col = (i, j)
+        # Find the registered tile that is closest to the new tile. In case of
+        # equality, pick the first one in the grid (row by row).
+        pos = tile.metadata[model.MD_POS]
+        diff = numpy.subtract(pos, self._md_pos)
+        dists = numpy.hypot(diff[:, 0], diff[:, 1])
+        closest = numpy.flatnonzero(dists == dists.min())
+        prev_row, prev_col = min(self.acq_order[i] for i in closest)
 
         # Insert new tile either to the right or to the bottom of the closest tile.
-        ver_diff = tile.metadata[model.MD_POS][1] - self.tiles[prev_row][prev_col].metadata[model.MD_POS][1]
-        hor_diff = tile.metadata[model.MD_POS][0] - self.tiles[prev_row][prev_col].metadata[model.MD_POS][0]
+        ver_diff = pos[1] - self.tiles[prev_row][prev_col].metadata[model.MD_POS][1]
+        hor_diff = pos[0] - self.tiles[prev_row][prev_col].metadata[model.MD_POS][0]
         if abs(ver_diff) > abs(hor_diff) and ver_diff < 0:
             # new tile below previous tile
             row = prev_row + 1
@@ -556,8 +574,6 @@ class GlobalShiftRegistrar(object):
             # extend grid in y direction if necessary
             if num_rows <= row:
                 self.tiles.append([None] * num_cols)
-                self.shifts_hor.append([None] * (num_cols - 1))
-                self.shifts_ver.append([None] * num_cols)
         elif abs(ver_diff) > abs(hor_diff) and ver_diff > 0:
             # new tile on top of previous tile
             row = prev_row - 1
@@ -574,13 +590,12 @@ class GlobalShiftRegistrar(object):
             if num_cols <= col:
                 for i in range(len(self.tiles)):
                     self.tiles[i].append(None)
-                    self.shifts_hor[i].append(None)
-                    self.shifts_ver[i].append(None)
         else:
             raise ValueError("Cannot insert multiple tiles at the same position.")
 
         self.tiles[row][col] = tile
         self.acq_order.append([row, col])
+        self._md_pos.append(pos)
         return row, col
 
     def _get_shift(self, prev_tile, tile):
@@ -643,9 +658,9 @@ class GlobalShiftRegistrar(object):
 
     def _compute_registration(self, row, col):
         """
-        Performs registration of the tile at grid position row, col with respect to every
-        available neighbour. The computed shifts and the respective cross-correlation values
-        are stored in self.shifts.
+        Starts the registration of the tile at grid position row, col with respect to every
+        available neighbour. The shifts and the respective cross-correlation values
+        are computed asynchronously, and stored in self.shifts.
 
         :param row: (int) row index
         :param col: (int) col index
@@ -655,95 +670,67 @@ class GlobalShiftRegistrar(object):
         num_cols = len(self.tiles[0])
         num_rows = len(self.tiles)
 
-        # Neighbouring tiles and shifts
-        nbr_left = self.tiles[row][col - 1] if col > 0 else None
-        nbr_right = self.tiles[row][col + 1] if col < num_cols - 2 else None
-        nbr_top = self.tiles[row - 1][col] if row > 0 else None
-        nbr_bottom = self.tiles[row + 1][col] if row < num_rows - 2 else None
-
-        shift_left = self.shifts_hor[row][col - 1] if col > 0 else None
-        shift_right = self.shifts_hor[row][col] if col < num_cols - 2 else None
-        shift_top = self.shifts_ver[row - 1][col] if row > 0 else None
-        shift_bottom = self.shifts_ver[row][col] if row < num_rows - 2 else None
-
         # Calculate the shifts to all adjacent tiles that have not been calculated yet
-        if nbr_left is not None and not shift_left:
-            self.shifts_hor[row][col - 1] = self._get_shift(nbr_left, tile)
-        if nbr_right is not None and not shift_right:
-            self.shifts_hor[row][col] = self._get_shift(tile, nbr_right)
-        if nbr_top is not None and not shift_top:
-            self.shifts_ver[row - 1][col] = self._get_shift(nbr_top, tile)
-        if nbr_bottom is not None and not shift_bottom:
-            self.shifts_ver[row][col] = self._get_shift(tile, nbr_bottom)
-            
+        # The edges always go from the left (or top) tile to the right (or bottom) tile.
+        edges = []
+        if col > 0:
+            edges.append(((row, col - 1), (row, col)))
+        if col < num_cols - 1:
+            edges.append(((row, col), (row, col + 1)))
+        if row > 0:
+            edges.append(((row - 1, col), (row, col)))
+        if row < num_rows - 1:
+            edges.append(((row, col), (row + 1, col)))
+
+        for (r1, c1), (r2, c2) in edges:
+            prev_tile, next_tile = self.tiles[r1][c1], self.tiles[r2][c2]
+            if prev_tile is None or next_tile is None or ((r1, c1), (r2, c2)) in self.shifts:
+                continue
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+            self.shifts[(r1, c1), (r2, c2)] = self._executor.submit(self._get_shift, prev_tile, next_tile)
+
     def _assemble_mosaic(self):
         """
         Performs a global optimization to find the best path through the tile grid using 
         a minimum spanning tree.
 
-        :returns: (DataArray with shape num_rows x num_cols x 2) registered positions
+        :returns: (ndarray with shape num_rows x num_cols x 2) registered positions.
+          The grid positions without tile (or which are not connected to the first tile) are NaN.
         """
-        # Transform shifts and errors to adjacency matrices
+        # Transform shifts and errors to a (sparse) adjacency matrix
         # The normalized cross correlation value needs to be transformed, so it can be
         # used in the minimum spanning tree. Lower values are better and the value should
         # never be 0 --> convert to error between [100, 200]
         num_cols = len(self.tiles[0])
         num_rows = len(self.tiles)
-        errors = numpy.zeros((num_rows * num_cols, num_rows * num_cols))
-        shifts = numpy.zeros((num_rows * num_cols, num_rows * num_cols, 2))
-        for row in range(num_rows):
-            for col in range(num_cols - 1):
-                idx = row * num_cols + col
-                if self.shifts_hor[row][col]:
-                    ncc = self.shifts_hor[row][col][1]
-                    errors[idx, idx + 1] = 200 - (ncc + 1) * 50
-                    shifts[idx, idx + 1] = self.shifts_hor[row][col][0]
-
-        for row in range(num_rows - 1):
-            for col in range(num_cols):
-                idx = row * num_cols + col
-                if self.shifts_ver[row][col]:
-                    ncc = self.shifts_ver[row][col][1]
-                    errors[idx, idx + num_cols] = 200 - (ncc + 1) * 50
-                    shifts[idx, idx + num_cols] = self.shifts_ver[row][col][0]
+        num_nodes = num_rows * num_cols
+        starts, ends, errors = [], [], []
+        shifts = {}  # (int, int) -> (float, float): index of start and end tile -> shift
+        for ((r1, c1), (r2, c2)), f in self.shifts.items():
+            shift, ncc = f.result()
+            idx1, idx2 = r1 * num_cols + c1, r2 * num_cols + c2
+            starts.append(idx1)
+            ends.append(idx2)
+            errors.append(200 - (ncc + 1) * 50)
+            shifts[idx1, idx2] = shift
 
         # Build the minimum spanning tree
-        tree = minimum_spanning_tree(csr_matrix(errors))
-        tree = tree.toarray().astype(int)
-
-        # Follow the path through the tree and update positions with the corresponding shifts.
-        # The minimum spanning tree is converted to an adjacency list that contains for every
-        # tile a list of all tiles that should be updated based on the current tile.
-        # The children of the newly updated tile will be placed in a queue waiting to be
-        # updated themselves.
-        adj_list = {}
-        for i in range(len(tree)):
-            adj = []
-            for j in range(len(tree[0])):
-                if tree[i][j] != 0:
-                    adj.append([j, shifts[i][j]])
-                if tree[j][i] != 0:
-                    adj.append([j, shifts[j][i]])
-            adj_list[i] = adj
-
-        positions = {0: (0, 0)}
-        idx_queue = deque([0])  # start with index 0
-        while idx_queue:
-            key = idx_queue.popleft()
-            for next_idx, shift in adj_list[key]:
-                if not next_idx in positions.keys():
-                    if next_idx > key:
-                        positions[next_idx] = numpy.add(positions[key], shift)
-                    else:
-                        positions[next_idx] = numpy.subtract(positions[key], shift)
-
-                    if next_idx not in idx_queue:
-                        idx_queue.append(next_idx)
-
-        # If there are any tiles missing in the grid, add position None, so we can still
-        # reshape the array and get an output
-        for i in range(num_rows * num_cols):
-            if i not in positions:
-                positions[i] = [None, None]
-
-        return numpy.array(list(positions.values())).reshape([num_rows, num_cols, 2])
+        error_graph = csr_matrix((errors, (starts, ends)), shape=(num_nodes, num_nodes))
+        error_graph.sort_indices()  # Same order as the dense version, for reproducibility
+        tree = minimum_spanning_tree(error_graph)
+
+        # Follow the path through the tree, starting from the first tile, and
+        # update positions with the corresponding shifts. Each tile is reached
+        # from its predecessor, which has always been updated before.
+        order, predecessors = breadth_first_order(tree, 0, directed=False, return_predecessors=True)
+        positions = numpy.full((num_nodes, 2), numpy.nan)
+        positions[0] = (0, 0)
+        for idx in order[1:]:
+            prev_idx = predecessors[idx]
+            if prev_idx < idx:
+                positions[idx] = positions[prev_idx] + shifts[prev_idx, idx]
+            else:
+                positions[idx] = positions[prev_idx] - shifts[idx, prev_idx]
+
+        return positions.reshape([num_rows, num_cols, 2])
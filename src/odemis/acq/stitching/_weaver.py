@@ -16,10 +16,13 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+import copy
 import logging
 import numpy
 from odemis import model, util
 from odemis.util import img
+from odemis.util.cache import LRUCache
+from odemis.util.conversion import get_tile_md_pos
 
 
 # This is a series of classes which use different methods to generate a large
@@ -30,17 +33,96 @@ from odemis.util import img
 # directly copy the image already transformed.
 # TODO: handle higher dimensions by just copying them as-is
 
-class CollageWeaver(object):
+# Shape (X, Y) of the tiles of the global image, when it is computed tile by
+# tile. Same as the tiles of the pyramidal TIFF files.
+OUTPUT_TILE_SHAPE = (256, 256)  # px
+
+# Maximum memory used to keep the input tiles, when they are DataArrayShadows,
+# and the global image is computed tile by tile
+INPUT_TILES_CACHE_SIZE = 256 * 2 ** 20  # bytes
+
+
+def _getTileData(tile):
     """
-    Very straight-forward version, which just paste the images where their center
-    position is. It expects that the pixel size for all the images are identical.
-    It doesn't take into account the rotation and skew metadata.
-    tiles (iterable of 2D DataArray): each image must have at least MD_POS and
-      MD_PIXEL_SIZE metadata. They should all have the same dtype.
-    border (None or value): if there is a value, it's used around each image, to
-     highlight the position
-    return (2D DataArray): same dtype as the tiles, with shape corresponding to
-      the bounding box.
+    tile (DataArray or DataArrayShadow): a tile
+    return (DataArray): the data of the tile
+    """
+    if isinstance(tile, model.DataArrayShadow):
+        return tile.getData()
+    return tile
+
+
+def _computeTilesLayout(tiles):
+    """
+    Compute the bounding box of each tile and the global bounding box.
+    It expects that the pixel size for all the images are identical.
+    tiles (list of DataArray or DataArrayShadow of shape YX): each image must
+      have at least MD_POS and MD_PIXEL_SIZE metadata. Their data is not used.
+    return:
+      tbbx_px (list of 4 ints): bounding box (ltrb) of each tile in the global image (px)
+      gbbx_px (4 ints): bounding box (ltrb) of the global image (px). The left
+        and top are always 0.
+      md (dict): metadata of the global image
+    """
+    # Get a fixed pixel size by using the first one
+    # TODO: use the mean, in case they are all slightly different due to
+    # correction?
+    pxs = tiles[0].metadata[model.MD_PIXEL_SIZE]
+
+    tbbx_phy = []  # tuples of ltrb in physical coordinates
+    for t in tiles:
+        c = t.metadata[model.MD_POS]
+        w = t.shape[-1], t.shape[-2]
+        if not util.almost_equal(pxs[0], t.metadata[model.MD_PIXEL_SIZE][0], rtol=0.01):
+            logging.warning("Tile @ %s has a unexpected pixel size (%g vs %g)",
+                            c, t.metadata[model.MD_PIXEL_SIZE][0], pxs[0])
+        bbx = (c[0] - (w[0] * pxs[0] / 2), c[1] - (w[1] * pxs[1] / 2),
+               c[0] + (w[0] * pxs[0] / 2), c[1] + (w[1] * pxs[1] / 2))
+
+        tbbx_phy.append(bbx)
+
+    gbbx_phy = (min(b[0] for b in tbbx_phy), min(b[1] for b in tbbx_phy),
+                max(b[2] for b in tbbx_phy), max(b[3] for b in tbbx_phy))
+
+    # Compute the bounding-boxes in pixel coordinates
+    tbbx_px = []
+
+    # that's the origin (Y is max as Y is inverted)
+    glt = gbbx_phy[0], gbbx_phy[3]
+    for bp, t in zip(tbbx_phy, tiles):
+        lt = (int(round((bp[0] - glt[0]) / pxs[0])),
+              int(round(-(bp[3] - glt[1]) / pxs[1])))
+        w = t.shape[-1], t.shape[-2]
+        bbx = (lt[0], lt[1],
+               lt[0] + w[0], lt[1] + w[1])
+        tbbx_px.append(bbx)
+
+    gbbx_px = (min(b[0] for b in tbbx_px), min(b[1] for b in tbbx_px),
+               max(b[2] for b in tbbx_px), max(b[3] for b in tbbx_px))
+
+    assert gbbx_px[0] == gbbx_px[1] == 0
+
+    if numpy.greater(gbbx_px[-2:], 4 * numpy.sum(tbbx_px[-2:])).any():
+        # Overlap > 50% or missing tiles
+        logging.warning("Global area much bigger than sum of tile areas")
+
+    # Update metadata
+    # TODO: check this is also correct based on lt + half shape * pxs
+    c_phy = ((gbbx_phy[0] + gbbx_phy[2]) / 2,
+             (gbbx_phy[1] + gbbx_phy[3]) / 2)
+    md = tiles[0].metadata.copy()
+    md[model.MD_POS] = c_phy
+
+    return tbbx_px, gbbx_px, md
+
+
+class _TileWeaver(object):
+    """
+    Base class for the weavers. They paste each tile, in the order they were
+    added, into the global image. The subclasses define how a tile is pasted
+    over the previous ones.
+    The global image can be either computed entirely (getFullImage()), or
+    tile by tile, when it's read (getFullImageShadow()).
     """
 
     def __init__(self):
@@ -48,12 +130,17 @@ class CollageWeaver(object):
 
     def addTile(self, tile):
         """
-        tile (2D DataArray): the image must have at least MD_POS and
+        tile (2D DataArray or DataArrayShadow): the image must have at least MD_POS and
         MD_PIXEL_SIZE metadata. All provided tiles should have the same dtype.
+        If it's a DataArrayShadow, its data is only read when it's needed.
         """
         # Merge the correction metadata inside each image (to keep the rest of the
         # code simple)
-        tile = model.DataArray(tile, tile.metadata.copy())
+        if isinstance(tile, model.DataArrayShadow):
+            tile = copy.copy(tile)
+            tile.metadata = tile.metadata.copy()
+        else:
+            tile = model.DataArray(tile, tile.metadata.copy())
         img.mergeMetadata(tile.metadata)
         self.tiles.append(tile)
 
@@ -61,311 +148,264 @@ class CollageWeaver(object):
         """
         return (2D DataArray): same dtype as the tiles, with shape corresponding to the bounding box. 
         """
+        tiles = [_getTileData(t) for t in self.tiles]
+        tbbx_px, gbbx_px, md = _computeTilesLayout(tiles)
 
-        tiles = self.tiles
-
-        # Compute the bounding box of each tile and the global bounding box
-
-        # Get a fixed pixel size by using the first one
-        # TODO: use the mean, in case they are all slightly different due to
-        # correction?
-        pxs = tiles[0].metadata[model.MD_PIXEL_SIZE]
-
-        tbbx_phy = []  # tuples of ltrb in physical coordinates
-        for t in tiles:
-            c = t.metadata[model.MD_POS]
-            w = t.shape[-1], t.shape[-2]
-            if not util.almost_equal(pxs[0], t.metadata[model.MD_PIXEL_SIZE][0], rtol=0.01):
-                logging.warning("Tile @ %s has a unexpected pixel size (%g vs %g)",
-                                c, t.metadata[model.MD_PIXEL_SIZE][0], pxs[0])
-            bbx = (c[0] - (w[0] * pxs[0] / 2), c[1] - (w[1] * pxs[1] / 2),
-                   c[0] + (w[0] * pxs[0] / 2), c[1] + (w[1] * pxs[1] / 2))
-
-            tbbx_phy.append(bbx)
-
-        gbbx_phy = (min(b[0] for b in tbbx_phy), min(b[1] for b in tbbx_phy),
-                    max(b[2] for b in tbbx_phy), max(b[3] for b in tbbx_phy))
-
-        # Compute the bounding-boxes in pixel coordinates
-        tbbx_px = []
-
-        # that's the origin (Y is max as Y is inverted)
-        glt = gbbx_phy[0], gbbx_phy[3]
-        for bp, t in zip(tbbx_phy, tiles):
-            lt = (int(round((bp[0] - glt[0]) / pxs[0])),
-                  int(round(-(bp[3] - glt[1]) / pxs[1])))
-            w = t.shape[-1], t.shape[-2]
-            bbx = (lt[0], lt[1],
-                   lt[0] + w[0], lt[1] + w[1])
-            tbbx_px.append(bbx)
-
-        gbbx_px = (min(b[0] for b in tbbx_px), min(b[1] for b in tbbx_px),
-                   max(b[2] for b in tbbx_px), max(b[3] for b in tbbx_px))
-
-        assert gbbx_px[0] == gbbx_px[1] == 0
-
-        if numpy.greater(gbbx_px[-2:], 4 * numpy.sum(tbbx_px[-2:])).any():
-            # Overlap > 50% or missing tiles
-            logging.warning("Global area much bigger than sum of tile areas")
-
-        # Paste each tile
         logging.debug("Generating global image of size %dx%d px",
                       gbbx_px[-2], gbbx_px[-1])
-        im = numpy.empty((gbbx_px[-1], gbbx_px[-2]), dtype=tiles[0].dtype)
         # Use minimum of the values in the tiles for background
-        im[:] = numpy.amin(tiles)
-        for b, t in zip(tbbx_px, tiles):
-            im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = t
-            # TODO: border
-
-        # Update metadata
-        # TODO: check this is also correct based on lt + half shape * pxs
-        c_phy = ((gbbx_phy[0] + gbbx_phy[2]) / 2,
-                 (gbbx_phy[1] + gbbx_phy[3]) / 2)
-        md = tiles[0].metadata.copy()
-        md[model.MD_POS] = c_phy
+        im = self._weaveRegion(gbbx_px, zip(tbbx_px, tiles), tiles[0].dtype, numpy.amin(tiles))
 
         return model.DataArray(im, md)
 
+    def getFullImageShadow(self, tile_shape=OUTPUT_TILE_SHAPE):
+        """
+        Same as getFullImage(), but the global image is only computed when it's
+        read, tile by tile. Only the tiles overlapping the requested part are
+        used, so the whole global image is never in memory. Pass it to the TIFF
+        exporter, with pyramid=True, to save it to a file.
+        Note: the tiles should not be modified until the global image is read.
+        tile_shape (int, int): shape (X, Y) of the tiles of the global image (px)
+        return (WovenImageShadow): the global image, with getTile() support
+        """
+        return WovenImageShadow(self, tile_shape)
 
-class CollageWeaverReverse(object):
-    """
-    Similar to CollageWeaver, but only fills parts of the global image with the new tile that
-    are still empty. This is desirable if the quality of the overlap regions is much better the first
-    time a region is imaged due to bleaching effects. The result is equivalent to a collage that starts 
-    with the last tile and pastes the older tiles in reverse order of acquisition.
-    """
+    def _weaveRegion(self, region, tiles, dtype, bg):
+        """
+        Computes a part of the global image, by pasting each tile in order.
+        region (4 ints): bounding box (ltrb) of the part of the global image (px)
+        tiles (iterable of (4 ints, DataArray)): the bounding box (ltrb) of each
+          tile in the global image, and its data, in the order to paste them.
+          The tiles which don't overlap the region are ignored.
+        dtype (numpy.dtype): type of the global image
+        bg (number): value of the pixels which are not covered by any tile
+        return (numpy.array of shape YX): the part of the global image
+        """
+        l, t, r, b = region
+        im = numpy.empty((b - t, r - l), dtype=dtype)
+        im[:] = bg
+
+        # The mask indicates the parts of the image that already contain image
+        # data (True) and the ones that are still empty (False).
+        mask = numpy.zeros(im.shape, dtype=numpy.bool)
+
+        for bbx, tile in tiles:
+            # Part of the region overlapping with the tile
+            il, it = max(l, bbx[0]), max(t, bbx[1])
+            ir, ib = min(r, bbx[2]), min(b, bbx[3])
+            if il >= ir or it >= ib:
+                continue
+            roi = im[it - t:ib - t, il - l:ir - l]
+            moi = mask[it - t:ib - t, il - l:ir - l]
+            tslice = (slice(it - bbx[1], ib - bbx[1]), slice(il - bbx[0], ir - bbx[0]))
+            self._pasteTile(roi, moi, tile, tslice)
 
-    def __init__(self):
-        self.tiles = []
+            # Update mask
+            moi[...] = True
 
-    def addTile(self, tile):
-        # Merge the correction metadata inside each image (to keep the rest of the
-        # code simple)
-        tile = model.DataArray(tile, tile.metadata.copy())
-        img.mergeMetadata(tile.metadata)
-        self.tiles.append(tile)
+        return im
 
-    def getFullImage(self):
+    def _pasteTile(self, roi, moi, tile, tslice):
         """
-        return (2D DataArray): same dtype as the tiles, with shape corresponding to the bounding box. 
+        Pastes (part of) a tile into the global image.
+        roi (numpy.array): part of the global image overlapping with the tile.
+          It is updated.
+        moi (numpy.array of bool): part of the mask overlapping with the tile.
+          True where the global image already contains data.
+        tile (DataArray): the whole tile
+        tslice (slice, slice): part of the tile corresponding to roi (Y, X)
         """
-        tiles = self.tiles
-
-        # Compute the bounding box of each tile and the global bounding box
-
-        # Get a fixed pixel size by using the first one
-        # TODO: use the mean, in case they are all slightly different due to
-        # correction?
-        pxs = tiles[0].metadata[model.MD_PIXEL_SIZE]
-
-        tbbx_phy = []  # tuples of ltrb in physical coordinates
-        for t in tiles:
-            c = t.metadata[model.MD_POS]
-            w = t.shape[-1], t.shape[-2]
-            if not util.almost_equal(pxs[0], t.metadata[model.MD_PIXEL_SIZE][0], rtol=0.01):
-                logging.warning("Tile @ %s has a unexpected pixel size (%g vs %g)",
-                                c, t.metadata[model.MD_PIXEL_SIZE][0], pxs[0])
-            bbx = (c[0] - (w[0] * pxs[0] / 2), c[1] - (w[1] * pxs[1] / 2),
-                   c[0] + (w[0] * pxs[0] / 2), c[1] + (w[1] * pxs[1] / 2))
-
-            tbbx_phy.append(bbx)
-
-        gbbx_phy = (min(b[0] for b in tbbx_phy), min(b[1] for b in tbbx_phy),
-                    max(b[2] for b in tbbx_phy), max(b[3] for b in tbbx_phy))
-
-        # Compute the bounding-boxes in pixel coordinates
-        tbbx_px = []
-
-        # that's the origin (Y is max as Y is inverted)
-        glt = gbbx_phy[0], gbbx_phy[3]
-        for bp, t in zip(tbbx_phy, tiles):
-            lt = (int(round((bp[0] - glt[0]) / pxs[0])),
-                  int(round(-(bp[3] - glt[1]) / pxs[1])))
-            w = t.shape[-1], t.shape[-2]
-            bbx = (lt[0], lt[1],
-                   lt[0] + w[0], lt[1] + w[1])
-            tbbx_px.append(bbx)
-
-        gbbx_px = (min(b[0] for b in tbbx_px), min(b[1] for b in tbbx_px),
-                   max(b[2] for b in tbbx_px), max(b[3] for b in tbbx_px))
-
-        assert gbbx_px[0] == gbbx_px[1] == 0
-        if numpy.greater(gbbx_px[-2:], 4 * numpy.sum(tbbx_px[-2:])).any():
-            # Overlap > 50% or missing tiles
-            logging.warning("Global area much bigger than sum of tile areas")
-
-        # Paste each tile
-        logging.debug("Generating global image of size %dx%d px",
-                      gbbx_px[-2], gbbx_px[-1])
-        im = numpy.empty((gbbx_px[-1], gbbx_px[-2]), dtype=tiles[0].dtype)
-        # Use minimum of the values in the tiles for background
-        im[:] = numpy.amin(tiles)
+        raise NotImplementedError()
 
-        # The mask is multiplied with the tile, thereby creating a tile with a gradient
-        mask = numpy.zeros((gbbx_px[-1], gbbx_px[-2]), dtype=numpy.bool)
 
-        for b, t in zip(tbbx_px, tiles):
-            # Part of image overlapping with tile
-            roi = im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-            moi = mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
+class CollageWeaver(_TileWeaver):
+    """
+    Very straight-forward version, which just paste the images where their center
+    position is. It expects that the pixel size for all the images are identical.
+    It doesn't take into account the rotation and skew metadata.
+    tiles (iterable of 2D DataArray): each image must have at least MD_POS and
+      MD_PIXEL_SIZE metadata. They should all have the same dtype.
+    border (None or value): if there is a value, it's used around each image, to
+     highlight the position
+    return (2D DataArray): same dtype as the tiles, with shape corresponding to
+      the bounding box.
+    """
 
-            # Insert image at positions that are still empty
-            roi[~moi] = t[~moi]
+    def _pasteTile(self, roi, moi, tile, tslice):
+        roi[...] = tile[tslice]
+        # TODO: border
 
-            # Update mask
-            mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = True
 
-        # Update metadata
-        # TODO: check this is also correct based on lt + half shape * pxs
-        c_phy = ((gbbx_phy[0] + gbbx_phy[2]) / 2,
-                 (gbbx_phy[1] + gbbx_phy[3]) / 2)
-        md = tiles[0].metadata.copy()
-        md[model.MD_POS] = c_phy
+class CollageWeaverReverse(_TileWeaver):
+    """
+    Similar to CollageWeaver, but only fills parts of the global image with the new tile that
+    are still empty. This is desirable if the quality of the overlap regions is much better the first
+    time a region is imaged due to bleaching effects. The result is equivalent to a collage that starts 
+    with the last tile and pastes the older tiles in reverse order of acquisition.
+    """
 
-        return model.DataArray(im, md)
+    def _pasteTile(self, roi, moi, tile, tslice):
+        # Insert image at positions that are still empty
+        roi[~moi] = tile[tslice][~moi]
 
 
-class MeanWeaver(object):
+class MeanWeaver(_TileWeaver):
     """
     Pixels of the final image which are corresponding to several tiles are computed as an 
     average of the pixel of each tile.
     """
 
+    # Weave tiles by using a smooth gradient. The part of the tile that does not overlap
+    # with any previous tiles is inserted into the part of the
+    # ovv image that is still empty. This part is determined by a mask, which indicates
+    # the parts of the image that already contain image data (True) and the ones that are still
+    # empty (False). For the overlapping parts, the tile is multiplied with weights corresponding
+    # to a gradient that has its maximum at the center of the tile and
+    # smoothly decreases toward the edges. The function for creating the weights is
+    # a distance measure resembling the maximum-norm, i.e. equidistant points lie
+    # on a rectangle (instead of a circle like for the euclidean norm). Additionally,
+    # the x and y values generating this norm are raised to the power of 6 to
+    # create a steeper gradient. The value 6 is quite arbitrary and was found to give
+    # good results during experimentation.
+    # The part of the overview image that overlaps with the new tile is multiplied with the
+    # complementary weights (1 -  weights) and the weighted overlapping parts of the new tile and
+    # the ovv image are added, so the resulting image contains a gradient in the overlapping regions
+    # between all the tiles that have been inserted before and the newly inserted tile.
+
     def __init__(self):
-        self.tiles = []
+        super(MeanWeaver, self).__init__()
+        self._weights = {}  # tile shape -> weights
 
-    def addTile(self, tile):
-        # Merge the correction metadata inside each image (to keep the rest of the
-        # code simple)
-        tile = model.DataArray(tile, tile.metadata.copy())
-        img.mergeMetadata(tile.metadata)
-        self.tiles.append(tile)
+    def _getWeights(self, shape):
+        """
+        Create weight matrix with decreasing values from its center that
+        has the same size as the tile.
+        shape (int, int): shape of the tile
+        return (numpy.array of float): the weights (0 at the center, 1 on the borders)
+        """
+        try:
+            return self._weights[shape]
+        except KeyError:
+            pass
+
+        hh, hw = numpy.divide(shape, 2)  # half-height, half-width
+        # Deal with even/odd tile sizes
+        if shape[1] % 2 == 0:
+            x = numpy.arange(-hw, hw, 1)
+        else:
+            x = numpy.arange(-hw, hw + 1, 1)
+
+        if shape[0] % 2 == 0:
+            y = numpy.arange(-hh, hh, 1)
+        else:
+            y = numpy.arange(-hh, hh + 1, 1)
+
+        xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
+        w = numpy.maximum(xx, yy)
+        # Hardcoding a weight function is quite arbitrary and might result in
+        # suboptimal solutions in some cases.
+        # Alternatively, different weights might be used. One option would be to select
+        # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
+        # only apply a (linear) gradient to these parts, while keeping the new tile for the
+        # rest of the region. However, this approach does not solve the hardcoding problem
+        # since the overlap region is still arbitrary. Future solutions might adaptively
+        # select the this region.
+        self._weights[shape] = w
+        return w
+
+    def _pasteTile(self, roi, moi, tile, tslice):
+        t = tile[tslice]
+        # Insert image at positions that are still empty
+        roi[~moi] = t[~moi]
+
+        # Create gradient in overlapping region. Ratio between old image and new tile values determined by
+        # distance to the center of the tile
+        w = self._getWeights(tile.shape)[tslice]
+
+        # Use weights to create gradient in overlapping region
+        roi[moi] = (t * (1 - w))[moi] + (roi * w)[moi]
+
+
+class WovenImageShadow(model.DataArrayShadow):
+    """
+    Global image of a weaver, which is computed tile by tile, only when it is read.
+    For each tile of the global image, only the (input) tiles overlapping it
+    are used. So the memory needed is proportional to the size of a few tiles,
+    whatever the size of the global image.
+    """
 
-    def getFullImage(self):
+    def __init__(self, weaver, tile_shape=OUTPUT_TILE_SHAPE):
         """
-        return (2D DataArray): same dtype as the tiles, with shape corresponding to the bounding box. 
+        weaver (_TileWeaver): the weaver, with all the tiles already added
+        tile_shape (int, int): shape (X, Y) of the tiles of the global image (px)
         """
-        tiles = self.tiles
-
-        # Compute the bounding box of each tile and the global bounding box
-
-        # Get a fixed pixel size by using the first one
-        # TODO: use the mean, in case they are all slightly different due to
-        # correction?
-        pxs = tiles[0].metadata[model.MD_PIXEL_SIZE]
-
-        tbbx_phy = []  # tuples of ltrb in physical coordinates
-        for t in tiles:
-            c = t.metadata[model.MD_POS]
-            w = t.shape[-1], t.shape[-2]
-            if not util.almost_equal(pxs[0], t.metadata[model.MD_PIXEL_SIZE][0], rtol=0.01):
-                logging.warning("Tile @ %s has a unexpected pixel size (%g vs %g)",
-                                c, t.metadata[model.MD_PIXEL_SIZE][0], pxs[0])
-            bbx = (c[0] - (w[0] * pxs[0] / 2), c[1] - (w[1] * pxs[1] / 2),
-                   c[0] + (w[0] * pxs[0] / 2), c[1] + (w[1] * pxs[1] / 2))
-
-            tbbx_phy.append(bbx)
-
-        gbbx_phy = (min(b[0] for b in tbbx_phy), min(b[1] for b in tbbx_phy),
-                    max(b[2] for b in tbbx_phy), max(b[3] for b in tbbx_phy))
-
-        # Compute the bounding-boxes in pixel coordinates
-        tbbx_px = []
-
-        # that's the origin (Y is max as Y is inverted)
-        glt = gbbx_phy[0], gbbx_phy[3]
-        for bp, t in zip(tbbx_phy, tiles):
-            lt = (int(round((bp[0] - glt[0]) / pxs[0])),
-                  int(round(-(bp[3] - glt[1]) / pxs[1])))
-            w = t.shape[-1], t.shape[-2]
-            bbx = (lt[0], lt[1],
-                   lt[0] + w[0], lt[1] + w[1])
-            tbbx_px.append(bbx)
-
-        gbbx_px = (min(b[0] for b in tbbx_px), min(b[1] for b in tbbx_px),
-                   max(b[2] for b in tbbx_px), max(b[3] for b in tbbx_px))
-
-        assert gbbx_px[0] == gbbx_px[1] == 0
-        if numpy.greater(gbbx_px[-2:], 4 * numpy.sum(tbbx_px[-2:])).any():
-            # Overlap > 50% or missing tiles
-            logging.warning("Global area much bigger than sum of tile areas")
-
-        # Weave tiles by using a smooth gradient. The part of the tile that does not overlap
-        # with any previous tiles is inserted into the part of the
-        # ovv image that is still empty. This part is determined by a mask, which indicates
-        # the parts of the image that already contain image data (True) and the ones that are still
-        # empty (False). For the overlapping parts, the tile is multiplied with weights corresponding
-        # to a gradient that has its maximum at the center of the tile and
-        # smoothly decreases toward the edges. The function for creating the weights is
-        # a distance measure resembling the maximum-norm, i.e. equidistant points lie
-        # on a rectangle (instead of a circle like for the euclidean norm). Additionally,
-        # the x and y values generating this norm are raised to the power of 6 to
-        # create a steeper gradient. The value 6 is quite arbitrary and was found to give
-        # good results during experimentation.
-        # The part of the overview image that overlaps with the new tile is multiplied with the
-        # complementary weights (1 -  weights) and the weighted overlapping parts of the new tile and
-        # the ovv image are added, so the resulting image contains a gradient in the overlapping regions
-        # between all the tiles that have been inserted before and the newly inserted tile.
-
-        # Paste each tile
-        logging.debug("Generating global image of size %dx%d px",
-                      gbbx_px[-2], gbbx_px[-1])
-        im = numpy.empty((gbbx_px[-1], gbbx_px[-2]), dtype=tiles[0].dtype)
+        if not weaver.tiles:
+            raise ValueError("No tile to weave")
+        self._weaver = weaver
+        self._tiles = list(weaver.tiles)
+        # Only uses the metadata and shape, so the tiles are not read
+        tbbx_px, gbbx_px, md = _computeTilesLayout(self._tiles)
+        self._tbbx_px = numpy.array(tbbx_px, dtype=numpy.int64).reshape(-1, 4)
+        # Input tiles, when they are DataArrayShadows. As the global image is
+        # typically read row by row, a whole row of input tiles is reused.
+        self._tiles_cache = LRUCache(INPUT_TILES_CACHE_SIZE)
+
         # Use minimum of the values in the tiles for background
-        im[:] = numpy.amin(tiles)
-
-        # The mask is multiplied with the tile, thereby creating a tile with a gradient
-        mask = numpy.zeros((gbbx_px[-1], gbbx_px[-2]), dtype=numpy.bool)
-
-        for b, t in zip(tbbx_px, tiles):
-            # Part of image overlapping with tile
-            roi = im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-            moi = mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-
-            # Insert image at positions that are still empty
-            roi[~moi] = t[~moi]
-
-            # Create gradient in overlapping region. Ratio between old image and new tile values determined by
-            # distance to the center of the tile
-
-            # Create weight matrix with decreasing values from its center that
-            # has the same size as the tile.
-            hh, hw = numpy.divide(roi.shape, 2)  # half-height, half-width
-            # Deal with even/odd tile sizes
-            sz = roi.shape
-            if sz[1] % 2 == 0:
-                x = numpy.arange(-hw, hw, 1)
-            else:
-                x = numpy.arange(-hw, hw + 1, 1)
-
-            if sz[0] % 2 == 0:
-                y = numpy.arange(-hh, hh, 1)
-            else:
-                y = numpy.arange(-hh, hh + 1, 1)
-
-            xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
-            w = numpy.maximum(xx, yy)
-            # Hardcoding a weight function is quite arbitrary and might result in
-            # suboptimal solutions in some cases.
-            # Alternatively, different weights might be used. One option would be to select
-            # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
-            # only apply a (linear) gradient to these parts, while keeping the new tile for the
-            # rest of the region. However, this approach does not solve the hardcoding problem
-            # since the overlap region is still arbitrary. Future solutions might adaptively
-            # select the this region.
-
-            # Use weights to create gradient in overlapping region
-            roi[moi] = (t * (1 - w))[moi] + (roi * w)[moi]
+        self._bg = min(numpy.amin(self._getInputTile(i)) for i in range(len(self._tiles)))
 
-            # Update mask
-            mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = True
+        shape = gbbx_px[3], gbbx_px[2]
+        logging.debug("Global image of size %dx%d px will be generated tile by tile",
+                      shape[1], shape[0])
+        model.DataArrayShadow.__init__(self, shape, self._tiles[0].dtype, md,
+                                       maxzoom=0, tile_shape=tile_shape)
 
-        # Update metadata
-        # TODO: check this is also correct based on lt + half shape * pxs
-        c_phy = ((gbbx_phy[0] + gbbx_phy[2]) / 2,
-                 (gbbx_phy[1] + gbbx_phy[3]) / 2)
-        md = tiles[0].metadata.copy()
-        md[model.MD_POS] = c_phy
+    def _getInputTile(self, i):
+        """
+        i (int): index of the input tile
+        return (DataArray): the data of the input tile
+        """
+        tile = self._tiles[i]
+        if not isinstance(tile, model.DataArrayShadow):
+            return tile
+        data = self._tiles_cache.get(i)
+        if data is None:
+            data = tile.getData()
+            self._tiles_cache.put(i, data)
+        return data
+
+    def getData(self):
+        """
+        return (DataArray): the whole global image
+        """
+        tiles = ((self._tbbx_px[i], self._getInputTile(i)) for i in range(len(self._tiles)))
+        im = self._weaver._weaveRegion((0, 0, self.shape[1], self.shape[0]), tiles,
+                                       self.dtype, self._bg)
+        return model.DataArray(im, self.metadata.copy())
 
-        return model.DataArray(im, md)
+    def getTile(self, x, y, zoom):
+        """
+        Computes one tile of the global image
+        x (0<=int): X index of the tile.
+        y (0<=int): Y index of the tile
+        zoom (0): zoom level to use. Only the full resolution (0) is available.
+        return (DataArray): the tile. On the right and bottom borders, the tile
+          is smaller than tile_shape.
+        """
+        if zoom != 0:
+            raise ValueError("Image does not have zoom levels")
+
+        tw, th = self.tile_shape
+        l, t = x * tw, y * th
+        r, b = min(l + tw, self.shape[1]), min(t + th, self.shape[0])
+        if not (0 <= l < r and 0 <= t < b):
+            raise ValueError("Tile %d,%d is outside of the image" % (x, y))
+
+        bbx = self._tbbx_px
+        overlap = numpy.flatnonzero((bbx[:, 0] < r) & (bbx[:, 2] > l) &
+                                    (bbx[:, 1] < b) & (bbx[:, 3] > t))
+        tiles = ((bbx[i], self._getInputTile(i)) for i in overlap)
+        im = self._weaver._weaveRegion((l, t, r, b), tiles, self.dtype, self._bg)
+
+        tile = model.DataArray(im, self.metadata.copy())
+        tile.metadata[model.MD_POS] = get_tile_md_pos((x, y), self.tile_shape, tile, self)
+        return tile
@@ -29,6 +29,7 @@ import random
 import copy
 import os
 import itertools
+from scipy import ndimage
 
 from odemis.acq.stitching import IdentityRegistrar, ShiftRegistrar, GlobalShiftRegistrar
 from odemis.dataio import find_fittest_converter
@@ -623,6 +624,43 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
                     self.assertLessEqual(diff[0], 1)
                     self.assertLessEqual(diff[1], 1)
 
+    def test_serpentine_grid(self):
+        """
+        Test on a synthetic grid of 3x3 tiles, acquired row by row, alternately
+        from left to right and right to left, with errors on the positions
+        """
+        numpy.random.seed(1)
+        img = ndimage.gaussian_filter(numpy.random.random((700, 1000)) * 1000, 3)
+        img = img.astype(numpy.uint16)
+        th, tw = 250, 350  # px, tile size
+        step = (200, 280)  # px, Y/X distance between tiles
+        px_size = (1e-6, 1e-6)
+
+        order = [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0), (2, 0), (2, 1), (2, 2)]
+        registrar = GlobalShiftRegistrar()
+        exp_pos = []
+        for i, (r, c) in enumerate(order):
+            t, l = r * step[0], c * step[1]
+            tile = img[t:t + th, l:l + tw]
+            # Center of the tile, with the Y axis going up
+            pos = ((l + tw / 2) * px_size[0], -(t + th / 2) * px_size[1])
+            exp_pos.append(pos)
+            if i > 0:  # the first tile is the reference
+                err = numpy.random.randint(-5, 6, 2)
+                pos = (pos[0] + err[0] * px_size[0], pos[1] + err[1] * px_size[1])
+            registrar.addTile(model.DataArray(tile, {model.MD_POS: pos,
+                                                     model.MD_PIXEL_SIZE: px_size}))
+
+        self.assertEqual([tuple(o) for o in registrar.acq_order], order)
+        positions, _ = registrar.getPositions()
+        self.assertEqual(len(positions), len(order))
+        for pos, epos in zip(positions, exp_pos):
+            # one pixel difference allowed
+            numpy.testing.assert_allclose(pos, epos, atol=px_size[0])
+
+        # The threads used to compute the shifts are stopped
+        self.assertIsNone(registrar._executor)
+
     def test_white_image(self):
         """ Position should be left as-is in case of white images """
         tile1 = 255 * numpy.ones((200, 200))
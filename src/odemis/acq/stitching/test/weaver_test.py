@@ -27,10 +27,11 @@ import numpy
 from odemis import model
 import odemis
 from odemis.acq.stitching import CollageWeaver, MeanWeaver, CollageWeaverReverse
-from odemis.dataio import find_fittest_converter
+from odemis.dataio import find_fittest_converter, tiff
 from odemis.util.img import ensure2DImage
 import os
 import random
+import tempfile
 import time
 import unittest
 
@@ -469,5 +470,74 @@ class TestCollageWeaverReverse(unittest.TestCase):
         numpy.testing.assert_equal(o, 256 * numpy.ones((80, 30)))
 
 
+class TestWovenImageShadow(unittest.TestCase):
+    """
+    Test weaving the global image tile by tile
+    """
+
+    def setUp(self):
+        random.seed(1)  # for reproducibility
+        numpy.random.seed(1)
+        img = numpy.random.randint(0, 4096, (700, 700)).astype(numpy.uint16)
+        md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+              model.MD_POS: (0, 0),  # m
+              }
+        self.img = model.DataArray(img, md)
+
+    def test_tiles(self):
+        """
+        Check the tiles of the global image are the same as the full image
+        """
+        tiles, _ = decompose_image(self.img, 0.3, 3, "horizontalZigzag", True)
+        for weaver_class in (CollageWeaver, MeanWeaver, CollageWeaverReverse):
+            weaver = weaver_class()
+            for t in tiles:
+                weaver.addTile(t)
+
+            full = weaver.getFullImage()
+            shadow = weaver.getFullImageShadow(tile_shape=(100, 100))
+            self.assertEqual(shadow.shape, full.shape)
+            self.assertEqual(shadow.dtype, full.dtype)
+            self.assertEqual(shadow.metadata[model.MD_POS], full.metadata[model.MD_POS])
+
+            nx = -(-full.shape[1] // 100)
+            ny = -(-full.shape[0] // 100)
+            for y in range(ny):
+                for x in range(nx):
+                    tile = shadow.getTile(x, y, 0)
+                    numpy.testing.assert_array_equal(tile, full[y * 100:(y + 1) * 100,
+                                                                x * 100:(x + 1) * 100])
+
+            with self.assertRaises(ValueError):
+                shadow.getTile(nx, 0, 0)
+
+            numpy.testing.assert_array_equal(shadow.getData(), full)
+
+    def test_export_pyramid(self):
+        """
+        Check the global image can be saved tile by tile in a pyramidal TIFF file
+        """
+        tiles, _ = decompose_image(self.img, 0.2, 4, "horizontalZigzag", True)
+        weaver = MeanWeaver()
+        for t in tiles:
+            weaver.addTile(t)
+        full = weaver.getFullImage()
+
+        weaver = MeanWeaver()
+        for t in tiles:
+            weaver.addTile(t)
+        shadow = weaver.getFullImageShadow()
+        shadow.metadata[model.MD_DIMS] = "YX"
+
+        f = tempfile.NamedTemporaryFile(suffix=".ome.tiff", delete=False)
+        f.close()
+        try:
+            tiff.export(f.name, [shadow], pyramid=True)
+            rdata = tiff.open_data(f.name)
+            numpy.testing.assert_array_equal(rdata.content[0].getData(), full)
+        finally:
+            os.remove(f.name)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -29,15 +29,50 @@ import logging
 import time
 import math
 import gc
+import itertools
+import multiprocessing
 import numpy
 
 from odemis import model
 from odemis.util import img
+from odemis.util.cache import LRUCache
 from scipy import ndimage
 from odemis.model import MD_PIXEL_SIZE
-from odemis.acq.stream._static import StaticSpectrumStream
+from odemis.acq.stream._static import StaticSpectrumStream, get_spectrum_chunks
 from abc import abstractmethod
 
+# Number of tiles read simultaneously, when the DataArrayShadow supports it
+TILES_BATCH_SIZE = multiprocessing.cpu_count()
+
+# Default maximum memory used to cache the tiles (raw and projected)
+TILE_CACHE_SIZE = 512 * 2 ** 20  # bytes
+
+# Cache of the tiles of the pyramidal images, shared by all the projections.
+# The keys are tuples, starting with the cache ID of the owner of the tile (the
+# DataArrayShadow for the raw tiles, and the projection for the projected tiles).
+# Its .max_size can be changed at runtime.
+TILE_CACHE = LRUCache(TILE_CACHE_SIZE)
+
+_tile_cache_ids = weakref.WeakKeyDictionary()  # object -> int
+_tile_cache_counter = itertools.count()
+_tile_cache_lock = threading.Lock()
+
+
+def _get_tile_cache_id(obj):
+    """
+    Return the ID of an object, to be used in the keys of the TILE_CACHE.
+    Contrarily to id(), it is never reused, even after the object is deleted.
+    obj (object): object which can be weakly referenced
+    return (int): the ID
+    """
+    with _tile_cache_lock:
+        try:
+            return _tile_cache_ids[obj]
+        except KeyError:
+            cid = next(_tile_cache_counter)
+            _tile_cache_ids[obj] = cid
+            return cid
+
 
 class DataProjection(object):
 
@@ -131,6 +166,10 @@ class RGBProjection(DataProjection):
 
         self.image = model.VigilantAttribute(None)
 
+        # Incremented every time the projection settings change, so that the
+        # projected tiles cached can be recognised as out-of-date
+        self._projectedTilesVersion = 0
+
         # Don't call at init, so don't set metadata if default value
         self.stream.tint.subscribe(self._onTint)
         self.stream.intensityRange.subscribe(self._onIntensityRange)
@@ -159,8 +198,8 @@ class RGBProjection(DataProjection):
         Indicate that the .image should be computed _and_ that all the previous
         tiles cached (and visible in the new image) have to be recomputed too
         """
-        # set projected tiles cache as invalid
-        self._projectedTilesInvalid = True
+        # the projected tiles cached are now out-of-date
+        self._projectedTilesVersion += 1
         self._shouldUpdateImage()
 
     def onTint(self, value):
@@ -227,6 +266,11 @@ class RGBSpatialProjection(RGBProjection):
     RGBSpatialProjection might be created (via the use of the __new__ operator).
     That is the recommended way to create a RGBSpatialProjection.
     """
+
+    # If True, after updating the image of a pyramidal image, the tiles likely
+    # to be needed soon are read in advance, and stored in the TILE_CACHE.
+    prefetch_tiles = True
+
     def __new__(cls, stream):
 
         if isinstance(stream, StaticSpectrumStream):
@@ -245,7 +289,9 @@ class RGBSpatialProjection(RGBProjection):
             self.zIndex = stream.zIndex
             self.zIndex.subscribe(self._onZIndex)
 
-        if stream.raw and isinstance(stream.raw[0], model.DataArrayShadow):
+        if (stream.raw and isinstance(stream.raw[0], model.DataArrayShadow) and
+            hasattr(stream.raw[0], "maxzoom")):
+            # Pyramidal data
             # The raw tiles corresponding to the .image, updated whenever .image is updated
             self._raw = (())  # 2D tuple of DataArrays
             raw = stream.raw[0]
@@ -262,15 +308,19 @@ class RGBSpatialProjection(RGBProjection):
             self.rect = model.TupleContinuous(full_rect, rect_range)
             self.mpp.subscribe(self._onMpp)
             self.rect.subscribe(self._onRect)
-            # initialize the projected tiles cache
-            self._projectedTilesCache = {}
-            # initialize the raw tiles cache
-            self._rawTilesCache = {}
-            # When True, the projected tiles cache should be invalidated
-            self._projectedTilesInvalid = True
+            # ID of the projected tiles in the TILE_CACHE
+            self._tileCacheId = _get_tile_cache_id(self)
 
         self._shouldUpdateImage()
 
+    def _shouldUpdateImageEntirely(self):
+        super(RGBSpatialProjection, self)._shouldUpdateImageEntirely()
+        if hasattr(self, "_tileCacheId"):
+            # The tiles projected with the previous settings will not be used anymore
+            cid = self._tileCacheId
+            version = self._projectedTilesVersion
+            TILE_CACHE.discard(lambda k: k[0] == cid and k[-1] != version)
+
     def _onMpp(self, mpp):
         self._shouldUpdateImage()
 
@@ -303,7 +353,8 @@ class RGBSpatialProjection(RGBProjection):
         return model.DataArray(rgbim, md)
 
     def _onZIndex(self, value):
-        self._shouldUpdateImage()
+        # The projected tiles depend on the Z index
+        self._shouldUpdateImageEntirely()
 
     def getBoundingBox(self):
         ''' Get the bounding box of the whole image, whether it`s tiled or not.
@@ -370,43 +421,59 @@ class RGBSpatialProjection(RGBProjection):
             int(round(rect[3] / (-ps[1]) + img_shape[1] / 2)) - 1,
         )
 
-    def _getTile(self, x, y, z, prev_raw_cache, prev_proj_cache):
+    def _getTileRange(self, z):
+        """
+        Compute the tiles which are inside the .rect
+        z (int): zoom level
+        return (int, int, int, int): X and Y indices of the top-left and bottom-right tiles
+        """
+        das = self.stream.raw[0]
+        rect = self._rectWorldToPixel(self.rect.value)
+        # convert the rect coords to tile indexes
+        rect = [l / (2 ** z) for l in rect]
+        rect = [int(math.floor(l / das.tile_shape[0])) for l in rect]
+        return tuple(rect)
+
+    def _getNumTiles(self, z):
+        """
+        z (int): zoom level
+        return (int, int): number of tiles in X and Y at the given zoom level
+        """
+        das = self.stream.raw[0]
+        dims = das.metadata.get(model.MD_DIMS, "CTZYX"[-das.ndim::])
+        shape_z = (das.shape[dims.index('X')] // (2 ** z), das.shape[dims.index('Y')] // (2 ** z))
+        return (int(math.ceil(shape_z[0] / das.tile_shape[0])),
+                int(math.ceil(shape_z[1] / das.tile_shape[1])))
+
+    def _getTile(self, x, y, z, version, fetched):
         """
-        Get a tile from a DataArrayShadow. Uses cache.
-        The cache for projected tiles and the cache for raw tiles has always the same tiles
+        Get a tile from a DataArrayShadow. Uses the TILE_CACHE.
         x (int): X coordinate of the tile
         y (int): Y coordinate of the tile
         z (int): zoom level where the tile is
-        prev_raw_cache (dictionary): raw tiles cache from the
-            last execution of _updateImage
-        prev_proj_cache (dictionary): projected tiles cache from the
-            last execution of _updateImage
+        version (int): version of the projection settings to use
+        fetched (dict (int, int, int) -> DataArray): raw tiles already read,
+          but not yet in the cache
         return (DataArray, DataArray): raw tile and projected tile
         """
-        # the key of the tile on the cache
-        tile_key = "%d-%d-%d" % (x, y, z)
-
-        # if the raw tile has been already cached, read it from the cache
-        if tile_key in prev_raw_cache:
-            raw_tile = prev_raw_cache[tile_key]
-        elif tile_key in self._rawTilesCache:
-            raw_tile = self._rawTilesCache[tile_key]
-        else:
-            # The tile was not cached, so it must be read from the file
-            raw_tile = self.stream.raw[0].getTile(x, y, z)
-
-        # if the projected tile has been already cached, read it from the cache
-        if tile_key in prev_proj_cache:
-            proj_tile = prev_proj_cache[tile_key]
-        elif tile_key in self._projectedTilesCache:
-            proj_tile = self._projectedTilesCache[tile_key]
-        else:
+        das = self.stream.raw[0]
+        raw_key = (_get_tile_cache_id(das), x, y, z)
+        raw_tile = TILE_CACHE.get(raw_key)
+        if raw_tile is None:
+            # The tile was not cached, so it must be read from the file (if not
+            # already done)
+            raw_tile = fetched.get((x, y, z))
+            if raw_tile is None:
+                raw_tile = das.getTile(x, y, z)
+            TILE_CACHE.put(raw_key, raw_tile)
+
+        proj_key = (self._tileCacheId, x, y, z, version)
+        proj_tile = TILE_CACHE.get(proj_key)
+        if proj_tile is None:
             # The tile was not cached, so it must be projected again
             proj_tile = self._projectTile(raw_tile)
+            TILE_CACHE.put(proj_key, proj_tile)
 
-        # cache raw and projected tiles
-        self._rawTilesCache[tile_key] = raw_tile
-        self._projectedTilesCache[tile_key] = proj_tile
         return raw_tile, proj_tile
 
     def _projectTile(self, tile):
@@ -445,42 +512,41 @@ class RGBSpatialProjection(RGBProjection):
             pass
 
         das = self.stream.raw[0]
+        das_id = _get_tile_cache_id(das)
 
-        # store the previous cache to use in this execution
-        prev_raw_cache = self._rawTilesCache
-        prev_proj_cache = self._projectedTilesCache
         # Execute at least once. If mpp and rect changed in
         # the last execution of the loops, execute again
         need_recompute = True
         while need_recompute:
             z = self._zFromMpp()
-            rect = self._rectWorldToPixel(self.rect.value)
-            # convert the rect coords to tile indexes
-            rect = [l / (2 ** z) for l in rect]
-            rect = [int(math.floor(l / das.tile_shape[0])) for l in rect]
-            x1, y1, x2, y2 = rect
-            # the 4 lines below avoids that lots of old tiles
-            # stays in instance caches
-            prev_raw_cache.update(self._rawTilesCache)
-            prev_proj_cache.update(self._projectedTilesCache)
-            # empty current caches
-            self._rawTilesCache = {}
-            self._projectedTilesCache = {}
+            x1, y1, x2, y2 = self._getTileRange(z)
+            version = self._projectedTilesVersion
 
             raw_tiles = []
             projected_tiles = []
             need_recompute = False
             try:
+                # If possible, read the missing tiles several at a time, which
+                # is faster than one by one. They are read by small batches,
+                # to quickly stop if the image changes.
+                fetched = {}
+                if hasattr(das, "getTiles"):
+                    missing = [(x, y, z) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)
+                               if (das_id, x, y, z) not in TILE_CACHE]
+                    for i in range(0, len(missing), TILES_BATCH_SIZE):
+                        if self._im_needs_recompute.is_set():
+                            self._im_needs_recompute.clear()
+                            raise NeedRecomputeException()
+                        batch = missing[i:i + TILES_BATCH_SIZE]
+                        fetched.update(zip(batch, das.getTiles(batch)))
+
                 for x in range(x1, x2 + 1):
                     rt_column = []
                     pt_column = []
 
                     for y in range(y1, y2 + 1):
-                        # the projected tiles cache is invalid
-                        if self._projectedTilesInvalid:
-                            self._projectedTilesCache = {}
-                            prev_proj_cache = {}
-                            self._projectedTilesInvalid = False
+                        # the projection settings changed
+                        if self._projectedTilesVersion != version:
                             raise NeedRecomputeException()
 
                         # check if the image changed in the middle of the process
@@ -490,8 +556,7 @@ class RGBSpatialProjection(RGBProjection):
                             # but using the cache from the last execution
                             raise NeedRecomputeException()
 
-                        raw_tile, proj_tile = \
-                                self._getTile(x, y, z, prev_raw_cache, prev_proj_cache)
+                        raw_tile, proj_tile = self._getTile(x, y, z, version, fetched)
                         rt_column.append(raw_tile)
                         pt_column.append(proj_tile)
 
@@ -504,6 +569,55 @@ class RGBSpatialProjection(RGBProjection):
 
         return tuple(raw_tiles), tuple(projected_tiles)
 
+    def _prefetchTiles(self):
+        """
+        Read in advance the raw tiles likely to be needed soon, and store them
+        in the TILE_CACHE. These are the tiles just around the .rect (for
+        panning), and the tiles of the .rect at the next zoom level (for
+        zooming in). It stops as soon as the image has to be updated.
+        At most half of the cache is used for these tiles.
+        """
+        das = self.stream.raw[0]
+        das_id = _get_tile_cache_id(das)
+        z = self._zFromMpp()
+        x1, y1, x2, y2 = self._getTileRange(z)
+
+        # The ring of tiles around the current ones
+        ntx, nty = self._getNumTiles(z)
+        tiles = []
+        for x in range(max(0, x1 - 1), min(x2 + 1, ntx - 1) + 1):
+            for y in range(max(0, y1 - 1), min(y2 + 1, nty - 1) + 1):
+                if not (x1 <= x <= x2 and y1 <= y <= y2):
+                    tiles.append((x, y, z))
+
+        # The same area, at the next zoom level
+        if z > 0:
+            ntx, nty = self._getNumTiles(z - 1)
+            for x in range(2 * x1, min(2 * x2 + 1, ntx - 1) + 1):
+                for y in range(2 * y1, min(2 * y2 + 1, nty - 1) + 1):
+                    tiles.append((x, y, z - 1))
+
+        tiles = [t for t in tiles if (das_id,) + t not in TILE_CACHE]
+        # Estimate the memory used by a tile, to not fill the cache with them
+        dims = das.metadata.get(model.MD_DIMS, "CTZYX"[-das.ndim::])
+        px_nbytes = (numpy.prod(das.shape) * numpy.dtype(das.dtype).itemsize /
+                     (das.shape[dims.index('X')] * das.shape[dims.index('Y')]))
+        tile_nbytes = px_nbytes * das.tile_shape[0] * das.tile_shape[1]
+        max_tiles = int(TILE_CACHE.max_size / 2 / tile_nbytes)
+        del tiles[max_tiles:]
+
+        for i in range(0, len(tiles), TILES_BATCH_SIZE):
+            if self._im_needs_recompute.is_set():
+                logging.debug("Stopping tile prefetching after %d tiles", i)
+                return
+            batch = tiles[i:i + TILES_BATCH_SIZE]
+            if hasattr(das, "getTiles"):
+                batch_tiles = das.getTiles(batch)
+            else:
+                batch_tiles = [das.getTile(x, y, z) for x, y, z in batch]
+            for (x, y, z), tile in zip(batch, batch_tiles):
+                TILE_CACHE.put((das_id, x, y, z), tile)
+
     def _updateImage(self):
         """ Recomputes the image with all the raw data available
         """
@@ -517,6 +631,8 @@ class RGBSpatialProjection(RGBProjection):
                 # DataArrayShadow => need to get each tile individually
                 self._raw, projected_tiles = self._getTilesFromSelectedArea()
                 self.image.value = projected_tiles
+                if self.prefetch_tiles:
+                    self._prefetchTiles()
             else:
                 self.image.value = self._projectTile(raw[0])
 
@@ -576,20 +692,13 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
                  model.MD_POS: raw_md[model.MD_POS]
                  }
 
-            # Average time values if they exist.
-            if data.shape[1] > 1:
-                t = data.shape[1] - 1
-                data = numpy.mean(data[0:t], axis=1)
-                data = data[:, 0, :, :]
-            else:
-                data = data[:, 0, 0, :, :]
-
             # pick only the data inside the bandwidth
             spec_range = self.stream._get_bandwidth_in_pixel()
 
             logging.debug("Spectrum range picked: %s px", spec_range)
 
-            av_data = numpy.mean(data[spec_range[0]:spec_range[1] + 1], axis=0)
+            # Average over the bandwidth, and over time values if they exist
+            av_data = self.stream._get_band_mean(*spec_range)
             av_data = img.ensure2DImage(av_data).astype(data.dtype)
             return model.DataArray(av_data, md)
 
@@ -616,14 +725,6 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
                  model.MD_POS: raw_md[model.MD_POS]
                  }
 
-            # Average time values if they exist.
-            if data.shape[1] > 1:
-                t = data.shape[1] - 1
-                data = numpy.mean(data[0:t], axis=1)
-                data = data[:, 0, :, :]
-            else:
-                data = data[:, 0, 0, :, :]
-
             # pick only the data inside the bandwidth
             spec_range = self.stream._get_bandwidth_in_pixel()
 
@@ -631,9 +732,12 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
 
             irange = self.stream._getDisplayIRange()  # will update histogram if not yet present
 
+            # The averages over the bandwidth (and over the time values if they
+            # exist) are computed from the cumulative sum of the cube, so each
+            # band only costs one subtraction per pixel.
             if not hasattr(self.stream, "fitToRGB") or not self.stream.fitToRGB.value:
                 # TODO: use better intermediary type if possible?, cf semcomedi
-                av_data = numpy.mean(data[spec_range[0]:spec_range[1] + 1], axis=0)
+                av_data = self.stream._get_band_mean(*spec_range)
                 av_data = img.ensure2DImage(av_data)
                 rgbim = img.DataArray2RGB(av_data, irange)
 
@@ -654,18 +758,15 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
                 grange[1] = max(grange)
                 rrange[1] = max(rrange)
 
-                # FIXME: unoptimized, as each channel is duplicated 3 times, and discarded
-                av_data = numpy.mean(data[rrange[0]:rrange[1] + 1], axis=0)
-                av_data = img.ensure2DImage(av_data)
-                rgbim = img.DataArray2RGB(av_data, irange)
-                av_data = numpy.mean(data[grange[0]:grange[1] + 1], axis=0)
-                av_data = img.ensure2DImage(av_data)
-                gim = img.DataArray2RGB(av_data, irange)
-                rgbim[:, :, 1] = gim[:, :, 0]
-                av_data = numpy.mean(data[brange[0]:brange[1] + 1], axis=0)
-                av_data = img.ensure2DImage(av_data)
-                bim = img.DataArray2RGB(av_data, irange)
-                rgbim[:, :, 2] = bim[:, :, 0]
+                rgbim = None
+                for i, rng in enumerate((rrange, grange, brange)):
+                    av_data = self.stream._get_band_mean(*rng)
+                    av_data = img.ensure2DImage(av_data)
+                    cim = img.DataArray2RGB(av_data, irange)
+                    if rgbim is None:
+                        rgbim = cim
+                    else:
+                        rgbim[:, :, i] = cim[:, :, 0]
 
             rgbim.flags.writeable = False
             raw = model.DataArray(rgbim, md)
@@ -721,7 +822,7 @@ class LineSpectrumProjection(RGBProjection):
         else:
             t = 0
 
-        spec2d = self.stream.calibrated.value[:, t, 0, :, :]  # same data but remove useless dims
+        data = self.stream.calibrated.value
         width = self.stream.selectionWidth.value
 
         # Number of points to return: the length of the line
@@ -739,8 +840,8 @@ class LineSpectrumProjection(RGBProjection):
         # Coordinates of each point: ndim of data (5-2), pos on line (Y), spectrum (X)
         # The line is scanned from the end till the start so that the spectra
         # closest to the origin of the line are at the bottom.
-        coord = numpy.empty((3, width, n, spec2d.shape[0]))
-        coord[0] = numpy.arange(spec2d.shape[0])  # spectra = all
+        coord = numpy.empty((3, width, n, data.shape[0]))
+        coord[0] = numpy.arange(data.shape[0])  # spectra = all
         coord_spc = coord.swapaxes(2, 3)  # just a view to have (line) space as last dim
         coord_spc[-1] = numpy.linspace(end[0], start[0], n)  # X axis
         coord_spc[-2] = numpy.linspace(end[1], start[1], n)  # Y axis
@@ -756,6 +857,17 @@ class LineSpectrumProjection(RGBProjection):
         coord_cw = coord[1:].swapaxes(0, 2).swapaxes(1, 3)  # view with coordinates and width as last dims
         coord_cw += width_coord
 
+        # Only read the area around the line (with a margin of one pixel, for
+        # the interpolation), as the calibrated data might only be computed
+        # when accessed.
+        y0 = max(0, int(math.floor(coord[1].min())) - 1)
+        y1 = min(data.shape[-2], int(math.ceil(coord[1].max())) + 2)
+        x0 = max(0, int(math.floor(coord[2].min())) - 1)
+        x1 = min(data.shape[-1], int(math.ceil(coord[2].max())) + 2)
+        spec2d = data[:, t, 0, y0:y1, x0:x1]  # same data but remove useless dims
+        coord[1] -= y0
+        coord[2] -= x0
+
         # Interpolate the values based on the data
         if width == 1:
             # simple version for the most usual case
@@ -874,7 +986,6 @@ class PixelTemporalSpectrumProjection(RGBProjection):
 
         x, y = self.stream.selected_pixel.value
 
-        spec2d = self.stream.calibrated.value[:, :, 0, :, :]  # same data but remove useless dims
         md = dict(data.metadata)
         md[model.MD_DIMS] = "TC"
 
@@ -882,7 +993,7 @@ class PixelTemporalSpectrumProjection(RGBProjection):
         # of the pixels to be taken into account
         width = self.stream.selectionWidth.value
         if width == 1:  # short-cut for simple case
-            data = spec2d[:, :, y, x]
+            data = data[:, :, 0, y, x]
             data = numpy.swapaxes(data, 0, 1)
             return model.DataArray(data, md)
 
@@ -893,15 +1004,16 @@ class PixelTemporalSpectrumProjection(RGBProjection):
         radius = width / 2
         n = 0
         # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros((spec2d.shape[0], spec2d.shape[1]), dtype=numpy.float64)
+        datasum = numpy.zeros((data.shape[0], data.shape[1]), dtype=numpy.float64)
         # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, spec2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, spec2d.shape[-2])):
+        x0, x1 = max(0, int(x - radius)), min(int(x + radius) + 1, data.shape[-1])
+        y0, y1 = max(0, int(y - radius)), min(int(y + radius) + 1, data.shape[-2])
+        spec2d = data[:, :, 0, y0:y1, x0:x1]  # same data but remove useless dims
+        for px in range(x0, x1):
+            for py in range(y0, y1):
                 if math.hypot(x - px, y - py) <= radius:
                     n += 1
-                    datasum += spec2d[:, :, py, px]
+                    datasum += spec2d[:, :, py - y0, px - x0]
 
         mean = datasum / n
         mean = numpy.swapaxes(mean, 0, 1)
@@ -958,9 +1070,14 @@ class MeanSpectrumProjection(DataProjection):
         md = dict(data.metadata)
         md[model.MD_DIMS] = "C"
 
-        # flatten all but the C dimension, for the average
-        data = data.reshape((data.shape[0], numpy.prod(data.shape[1:])))
-        av_data = numpy.mean(data, axis=1)
+        # The data is read by groups of wavelengths, as the calibrated data
+        # might only be computed when accessed.
+        av_data = numpy.empty(data.shape[0], dtype=numpy.float64)
+        for c, ce in get_spectrum_chunks(data):
+            # flatten all but the C dimension, for the average
+            cdata = data[c:ce]
+            cdata = cdata.reshape((cdata.shape[0], numpy.prod(cdata.shape[1:])))
+            av_data[c:ce] = numpy.mean(cdata, axis=1)
 
         self.image.value = model.DataArray(av_data, md)
 
@@ -1007,8 +1124,6 @@ class SinglePointSpectrumProjection(DataProjection):
             t = self.stream._tl_px_values.index(self.stream.selected_time.value)
         else:
             t = 0
-        spec2d = self.stream.calibrated.value[:, t, 0, :, :]  # same data but remove useless dims
-
         md = dict(data.metadata)
         md[model.MD_DIMS] = "C"
 
@@ -1016,7 +1131,7 @@ class SinglePointSpectrumProjection(DataProjection):
         # of the pixels to be taken into account
         width = self.stream.selectionWidth.value
         if width == 1:  # short-cut for simple case
-            data = spec2d[:, y, x]
+            data = data[:, t, 0, y, x]
             return model.DataArray(data, md)
 
         # There are various ways to do it with numpy. As typically the spectrum
@@ -1026,15 +1141,16 @@ class SinglePointSpectrumProjection(DataProjection):
         radius = width / 2
         n = 0
         # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros(spec2d.shape[0], dtype=numpy.float64)
+        datasum = numpy.zeros(data.shape[0], dtype=numpy.float64)
         # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, spec2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, spec2d.shape[-2])):
+        x0, x1 = max(0, int(x - radius)), min(int(x + radius) + 1, data.shape[-1])
+        y0, y1 = max(0, int(y - radius)), min(int(y + radius) + 1, data.shape[-2])
+        spec2d = data[:, t, 0, y0:y1, x0:x1]  # same data but remove useless dims
+        for px in range(x0, x1):
+            for py in range(y0, y1):
                 if math.hypot(x - px, y - py) <= radius:
                     n += 1
-                    datasum += spec2d[:, py, px]
+                    datasum += spec2d[:, py - y0, px - x0]
 
         mean = datasum / n
 
@@ -1089,17 +1205,17 @@ class SinglePointTemporalProjection(DataProjection):
         
         x, y = self.stream.selected_pixel.value
         c = self.stream._wl_px_values.index(self.stream.selected_wavelength.value)
-        chrono2d = self.stream.calibrated.value[c, :, 0, :, :]  # same data but remove useless dims
+        data = self.stream.calibrated.value
 
         md = {model.MD_DIMS: "T"}
-        if model.MD_TIME_LIST in chrono2d.metadata:
-            md[model.MD_TIME_LIST] = chrono2d.metadata[model.MD_TIME_LIST]
+        if model.MD_TIME_LIST in data.metadata:
+            md[model.MD_TIME_LIST] = data.metadata[model.MD_TIME_LIST]
 
         # We treat width as the diameter of the circle which contains the center
         # of the pixels to be taken into account
         width = self.stream.selectionWidth.value
         if width == 1:  # short-cut for simple case
-            data = chrono2d[:, y, x]
+            data = data[c, :, 0, y, x]
             return model.DataArray(data, md)
 
         # There are various ways to do it with numpy. As typically the spectrum
@@ -1109,15 +1225,16 @@ class SinglePointTemporalProjection(DataProjection):
         radius = width / 2
         n = 0
         # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros(chrono2d.shape[0], dtype=numpy.float64)
+        datasum = numpy.zeros(data.shape[1], dtype=numpy.float64)
         # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, chrono2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, chrono2d.shape[-2])):
+        x0, x1 = max(0, int(x - radius)), min(int(x + radius) + 1, data.shape[-1])
+        y0, y1 = max(0, int(y - radius)), min(int(y + radius) + 1, data.shape[-2])
+        chrono2d = data[c, :, 0, y0:y1, x0:x1]  # same data but remove useless dims
+        for px in range(x0, x1):
+            for py in range(y0, y1):
                 if math.hypot(x - px, y - py) <= radius:
                     n += 1
-                    datasum += chrono2d[:, py, px]
+                    datasum += chrono2d[:, py - y0, px - x0]
 
         mean = datasum / n
         return model.DataArray(mean.astype(chrono2d.dtype), md)
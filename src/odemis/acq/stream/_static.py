@@ -43,6 +43,22 @@ import time
 from ._base import Stream
 
 
+# Maximum memory used to store the cumulative sum of the spectrum cube. Above
+# it, the band means are computed directly from the data.
+SPECTRUM_CUMSUM_MAX_SIZE = 2048 * 2 ** 20  # bytes
+
+# Maximum memory used to keep the parts of the calibrated spectrum cube already
+# computed (the calibration is only applied on the parts needed).
+SPECTRUM_CALIB_CACHE_SIZE = 256 * 2 ** 20  # bytes
+# Type of the calibrated spectrum cube, when it's a float. Can be
+# numpy.float32 to use less memory.
+SPECTRUM_CALIB_DTYPE = numpy.float64
+
+# Maximum size of the parts of the spectrum cube processed at once, when going
+# through the whole cube.
+SPECTRUM_CHUNK_SIZE = 64 * 2 ** 20  # bytes
+
+
 class StaticStream(Stream):
     """
     Stream containing one static image.
@@ -627,6 +643,38 @@ class StaticARStream(StaticStream):
         super(StaticARStream, self)._onBackground(data)
 
 
+def get_spectrum_chunks(data):
+    """
+    Cut a spectrum cube into groups of wavelengths of (at most)
+    SPECTRUM_CHUNK_SIZE bytes, to go through the whole cube without having it
+    completely in memory.
+    data (DataArray, DataArrayShadow or CompensatedSpectrum of shape C...)
+    return (list of (int, int)): the first and last (excluded) index on C of
+      each group
+    """
+    csize = max(1, int(numpy.prod(data.shape[1:]))) * data.dtype.itemsize
+    n = max(1, int(SPECTRUM_CHUNK_SIZE // csize))
+    return [(c, min(c + n, data.shape[0])) for c in range(0, data.shape[0], n)]
+
+
+def _get_cumsum_dtype(data):
+    """
+    Pick the type used to store the cumulative sum along C (summed over T) of
+    a spectrum cube.
+    data (DataArray, DataArrayShadow or CompensatedSpectrum of shape CT1YX)
+    return (numpy.dtype): integers are accumulated exactly (so that the
+      subtraction of two sums is exact too), in the smallest type which cannot
+      overflow.
+    """
+    if data.dtype.kind == "u":
+        max_sum = data.shape[0] * data.shape[1] * numpy.iinfo(data.dtype).max
+        return numpy.dtype(numpy.uint32 if max_sum < 2 ** 32 else numpy.uint64)
+    elif data.dtype.kind in "ib":
+        return numpy.dtype(numpy.int64)
+    else:
+        return numpy.dtype(numpy.float64)
+
+
 class StaticSpectrumStream(StaticStream):
     """
     A Spectrum stream which displays only one static image/data.
@@ -658,11 +706,12 @@ class StaticSpectrumStream(StaticStream):
         #  * coordinates of 1st point (1-point, line)
         #  * coordinates of 2nd point (line)
 
-        # TODO: need to handle DAS properly, in case it's tiled (in XY), to avoid
-        # loading too much data in memory.
-        # Ensure the data is a DataArray, as we don't handle (yet) DAS
+        # A DAS is kept as-is if it supports indexing (eg, HDF5), as the
+        # projections only read the parts of the data they need. Otherwise, or
+        # if it doesn't have already the 5 dimensions, it's read in memory.
         if isinstance(image, model.DataArrayShadow):
-            image = image.getData()
+            if not hasattr(image, "__getitem__") or len(image.shape) != 5:
+                image = image.getData()
 
         if len(image.shape) == 3:
             # force 5D for CYX
@@ -740,9 +789,22 @@ class StaticSpectrumStream(StaticStream):
             self.fitToRGB = model.BooleanVA(False)
             self.fitToRGB.subscribe(self.onFitToRGB)
 
-        # the raw data after calibration
+        # the raw data after calibration: either the raw data itself, or a
+        # CompensatedSpectrum, which only computes the parts accessed (with the
+        # [] operator). So the projections should only index the data needed.
         self.calibrated = model.VigilantAttribute(image)
 
+        # Cumulative sum along C of the calibrated data (summed over T), to
+        # quickly compute the mean over any band: calibrated data -> cube
+        # The cube has an extra first plane of 0's, so that the band low..high
+        # (included) is cube[high + 1] - cube[low].
+        # Note: there is no cumulative sum along T, as the projections always
+        # average over the whole time range, and it'd multiply the size of the
+        # cube by the number of time values.
+        self._spec_cumsum = (None, None)
+        self._spec_cumsum_lock = threading.Lock()
+        self.calibrated.subscribe(self._onCalibrated, init=True)
+
         if "acq_type" not in kwargs:
             if image.shape[0] > 1 and image.shape[1] > 1:
                 kwargs["acq_type"] = model.MD_AT_TEMPSPECTRUM
@@ -789,6 +851,18 @@ class StaticSpectrumStream(StaticStream):
     def _updateDRange(self, data=None):
         if data is None:
             data = self.calibrated.value
+            if not isinstance(data, numpy.ndarray):
+                # CompensatedSpectrum or DataArrayShadow: only the min/max of
+                # the data are needed, so compute them chunk by chunk, instead
+                # of computing (or reading) the whole cube.
+                mn, mx = None, None
+                for c, ce in get_spectrum_chunks(data):
+                    d = data[c:ce].view(numpy.ndarray)
+                    dmn, dmx = d.min(), d.max()
+                    mn = dmn if mn is None else min(mn, dmn)
+                    mx = dmx if mx is None else max(mx, dmx)
+                data = model.DataArray(numpy.array([mn, mx], dtype=data.dtype),
+                                       data.metadata)
         super(StaticSpectrumStream, self)._updateDRange(data)
 
     def _updateHistogram(self, data=None):
@@ -861,6 +935,75 @@ class StaticSpectrumStream(StaticStream):
         assert low_px <= high_px
         return low_px, high_px
 
+    def _onCalibrated(self, data):
+        """
+        Called when the calibrated data is changed, to start computing its
+        cumulative sum in the background
+        """
+        if data is None or data.shape[0] <= 1:  # No band to average
+            return
+
+        dtype = _get_cumsum_dtype(data)
+        nbytes = dtype.itemsize * (data.shape[0] + 1) * data.shape[-2] * data.shape[-1]
+        if nbytes > SPECTRUM_CUMSUM_MAX_SIZE:
+            logging.info("Not computing the cumulative sum of the spectrum, as it would take %d MB",
+                         nbytes // 2 ** 20)
+            return
+
+        t = threading.Thread(target=self._computeSpectrumCumSum,
+                             name="Spectrum cumulative sum",
+                             args=(data,))
+        t.daemon = True
+        t.start()
+
+    def _computeSpectrumCumSum(self, data):
+        """
+        Compute the cumulative sum along C of the data, summed over T, and store
+        it, if the data is still the current calibrated data.
+        data (DataArray of shape CT1YX)
+        """
+        try:
+            tstart = time.time()
+            dtype = _get_cumsum_dtype(data)
+            cumsum = numpy.empty((data.shape[0] + 1,) + data.shape[-2:], dtype=dtype)
+            cumsum[0] = 0
+            # The data is read by groups of wavelengths, as the calibrated data
+            # might only be computed when accessed.
+            for c, ce in get_spectrum_chunks(data):
+                if data.shape[1] > 1:
+                    tsum = numpy.sum(data[c:ce, :, 0], axis=1, dtype=dtype)
+                else:
+                    tsum = data[c:ce, 0, 0]
+                numpy.cumsum(tsum, axis=0, dtype=dtype, out=cumsum[c + 1:ce + 1])
+                cumsum[c + 1:ce + 1] += cumsum[c]
+
+            with self._spec_cumsum_lock:
+                if self.calibrated.value is data:
+                    self._spec_cumsum = (data, cumsum)
+            logging.debug("Computed cumulative sum of spectrum cube %s in %g s",
+                          data.shape, time.time() - tstart)
+        except Exception:
+            logging.exception("Failed to compute the cumulative sum of the spectrum")
+
+    def _get_band_mean(self, low_px, high_px):
+        """
+        Compute the average of the calibrated data over the given band, and over
+         the time.
+        low_px (int): first index of the band on C
+        high_px (int): last index of the band on C (included)
+        return (ndarray of float64 of shape YX): mean intensity of each pixel
+        """
+        data = self.calibrated.value
+        with self._spec_cumsum_lock:
+            cdata, cumsum = self._spec_cumsum
+
+        if cdata is data:
+            band = numpy.subtract(cumsum[high_px + 1], cumsum[low_px])
+            return band / ((high_px - low_px + 1) * data.shape[1])
+        else:
+            # The cumulative sum is not (yet) available => compute directly
+            return numpy.mean(data[low_px:high_px + 1, :, 0], axis=(0, 1))
+
     # We don't have problems of rerunning this when the data is updated,
     # as the data is static.
     def _updateCalibratedData(self, bckg=None, coef=None):
@@ -889,7 +1032,11 @@ class StaticSpectrumStream(StaticStream):
             raise ValueError("Spectrum data contains no wavelength information")
 
         # will raise an exception if incompatible
-        calibrated = calibration.compensate_spectrum_efficiency(data, bckg, coef)
+        # The calibration is only applied on the parts of the data used by the
+        # projections, when they are accessed.
+        calibrated = calibration.CompensatedSpectrum(data, bckg, coef,
+                                                     dtype=SPECTRUM_CALIB_DTYPE,
+                                                     cache_size=SPECTRUM_CALIB_CACHE_SIZE)
         self.calibrated.value = calibrated
 
     def _setBackground(self, bckg):
@@ -759,6 +759,10 @@ class SEMCCDMDStream(MultipleDetectorStream):
     moving the SEM spot and starts a new CCD acquisition at each spot. It brings
     a bit more overhead than linking directly the event of the SEM to the CCD
     detector trigger, but it's very reliable.
+    If the e-beam scanner supports it (ie, it has a .setSpotList() method), the
+    positions of all the spots are passed at once to the scanner, and the SEM
+    detector is synchronised on the same trigger as the CCD, to avoid changing
+    the spot position and restarting the SEM acquisition for every pixel.
     """
 
     def __init__(self, name, streams):
@@ -797,6 +801,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
         self._trigger = self._ccd.softwareTrigger
         self._ccd_idx = len(self._streams) - 1  # optical detector is always last in streams
 
+        # If True, and the e-beam scanner supports it, all the spot positions
+        # are sent to the scanner at once, and it moves to the next one at every
+        # CCD trigger. Otherwise, the spot position is set for every pixel.
+        self.useSpotList = model.BooleanVA(True)
+        self._acq_overheads = []  # s, overhead of each pixel of the last acquisition
+
     def _estimateRawAcquisitionTime(self):
         """
         return (float): time in s for acquiring the whole image, without drift
@@ -1000,6 +1010,18 @@ class SEMCCDMDStream(MultipleDetectorStream):
             # initialize leeches
             leech_np, leech_time_ppx = self._startLeeches(px_time, (len(pos_polarizations), rep[1], rep[0]))
 
+            # With the spot list, the SEM detector is synchronised on the CCD
+            # trigger, and the scanner moves the e-beam to the next spot for
+            # every trigger. So it stays subscribed for the whole acquisition,
+            # and there is no communication with the scanner for each pixel.
+            use_spot_list = self.useSpotList.value and hasattr(self._emitter, "setSpotList")
+            if use_spot_list:
+                logging.debug("Using spot list mode of the scanner")
+                spot_list = spot_pos
+            else:
+                spot_list = None
+            self._acq_overheads = []
+
             n = 0  # number of images acquired so far
 
             for pol_pos in pos_polarizations:
@@ -1010,28 +1032,20 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     f.result()
                     time_move_pol_left -= time_move_pol_once
 
+                if spot_list is not None:
+                    self._startSpotList(spot_list, 0)
+
                 # iterate over pixel positions for scanning
                 for px_idx in numpy.ndindex(*rep[::-1]):  # last dim (X) iterates first
-                    trans = tuple(spot_pos[px_idx])  # spot position
-
-                    # take care of drift
-                    if self._dc_estimator:
-                        trans = (trans[0] - self._dc_estimator.tot_drift[0],
-                                 trans[1] - self._dc_estimator.tot_drift[1])
-                    cptrans = self._emitter.translation.clip(trans)
-                    if cptrans != trans:
-                        if self._dc_estimator:
-                            logging.error("Drift of %s px caused acquisition region out "
-                                          "of bounds: needed to scan spot at %s.",
-                                          self._dc_estimator.tot_drift, trans)
-                        else:
-                            logging.error("Unexpected clipping in the scan spot position %s", trans)
-                    self._emitter.translation.value = cptrans
-                    logging.debug("E-beam spot after drift correction: %s",
-                                  self._emitter.translation.value)
-                    logging.debug("Scanning resolution is %s and scale %s",
-                                  self._emitter.resolution.value,
-                                  self._emitter.scale.value)
+                    px_start = time.time()
+                    if spot_list is None:
+                        trans = self._getSpotTranslations(spot_pos[px_idx])
+                        self._emitter.translation.value = tuple(trans)
+                        logging.debug("E-beam spot after drift correction: %s",
+                                      self._emitter.translation.value)
+                        logging.debug("Scanning resolution is %s and scale %s",
+                                      self._emitter.resolution.value,
+                                      self._emitter.scale.value)
 
                     # time left for leeches
                     leech_time_left = (tot_num - n + 1) * leech_time_ppx
@@ -1040,11 +1054,29 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
                     # acquire
                     self._acquireImage(n, px_idx, px_time, sem_time, sub_pxs,
-                                       tot_num, leech_np, extra_time, future)
+                                       tot_num, extra_time, future, spot_list)
+                    self._acq_overheads.append(time.time() - px_start - px_time)
                     n += 1
 
                     logging.debug("Done acquiring image number %s out of %s." % (n, tot_num))
 
+                    # Check if it's time to run a leech
+                    leeches_due = self._getDueLeeches(leech_np)
+                    if leeches_due:
+                        # The leeches use the e-beam on their own
+                        if spot_list is not None:
+                            self._stopSpotList()
+                        self._runLeeches(leeches_due, leech_np)
+                        next_idx = numpy.ravel_multi_index(px_idx, rep[::-1]) + 1
+                        if spot_list is not None and next_idx < numpy.prod(rep):
+                            # Restart from the next pixel, with the new drift
+                            self._startSpotList(spot_list, next_idx)
+
+                if spot_list is not None:
+                    self._stopSpotList()
+
+            self._logOverheads("spot list" if use_spot_list else "per-pixel")
+
             # acquisition done!
             for s, sub in zip(self._streams, self._subscribers):
                 s._dataflow.unsubscribe(sub)
@@ -1071,6 +1103,11 @@ class SEMCCDMDStream(MultipleDetectorStream):
             for s, sub in zip(self._streams, self._subscribers):
                 s._dataflow.unsubscribe(sub)
             self._ccd_df.synchronizedOn(None)
+            try:
+                if hasattr(self._emitter, "setSpotList"):
+                    self._stopSpotList()
+            except Exception:
+                logging.exception("Failed to stop the spot list acquisition")
 
             self._raw = []
             self._anchor_raw = []
@@ -1088,6 +1125,110 @@ class SEMCCDMDStream(MultipleDetectorStream):
             self._current_future = None
             self._acq_done.set()
 
+    def _getSpotTranslations(self, spot_pos):
+        """
+        Compute the e-beam translation of the spots, taking into account the
+          drift correction.
+        spot_pos (numpy.array of shape (..., 2)): the positions of the spots,
+          as returned by _getSpotPositions()
+        return (numpy.array of shape (..., 2)): the translations, clipped to the
+          range of the scanner .translation
+        """
+        trans = numpy.array(spot_pos, dtype=numpy.float64)
+        if self._dc_estimator:
+            trans -= self._dc_estimator.tot_drift
+
+        rng = self._emitter.translation.range
+        cptrans = numpy.clip(trans, rng[0], rng[1])
+        clipped = (cptrans != trans).reshape(-1, 2).any(axis=1)
+        if clipped.any():
+            out_pos = trans.reshape(-1, 2)[clipped].tolist()
+            if self._dc_estimator:
+                logging.error("Drift of %s px caused acquisition region out "
+                              "of bounds: needed to scan spot at %s.",
+                              self._dc_estimator.tot_drift, out_pos)
+            else:
+                logging.error("Unexpected clipping in the scan spot position %s", out_pos)
+        return cptrans
+
+    def _startSpotList(self, spot_pos, start):
+        """
+        Send the positions of the spots to the scanner, and start the e-beam
+          acquisition, synchronised on the CCD trigger. Each trigger will then
+          acquire at the next spot position.
+        spot_pos (numpy.array of shape (Y, X, 2)): the positions of all the spots,
+          as returned by _getSpotPositions()
+        start (0<=int): index of the first spot to scan (X changing fast)
+        """
+        trans = self._getSpotTranslations(spot_pos.reshape(-1, 2)[start:])
+        logging.debug("Starting spot list acquisition from spot %d, at %s", start, trans[0])
+
+        # Ensure the dataflows don't have any (old) event queued
+        for s in self._streams[:-1]:
+            s._dataflow.synchronizedOn(None)
+        self._emitter.setSpotList(trans)
+        for s, sub in zip(self._streams[:-1], self._subscribers[:-1]):
+            s._dataflow.synchronizedOn(self._trigger)
+            s._dataflow.subscribe(sub)
+
+    def _stopSpotList(self):
+        """
+        Stop the e-beam acquisition started by _startSpotList()
+        """
+        for s, sub in zip(self._streams[:-1], self._subscribers[:-1]):
+            s._dataflow.unsubscribe(sub)
+            s._dataflow.synchronizedOn(None)
+        self._emitter.setSpotList(None)
+
+    def _logOverheads(self, mode):
+        """
+        Report the time spent per pixel, in addition to the expected acquisition
+          time, during the last acquisition.
+        mode (str): name of the acquisition mode, for the log
+        """
+        if not self._acq_overheads:
+            return
+        ovh = numpy.array(self._acq_overheads)
+        logging.info("Acquired %d pixels in %s mode, with overhead per pixel: "
+                     "mean = %g ms, median = %g ms, max = %g ms",
+                     len(ovh), mode, ovh.mean() * 1e3, numpy.median(ovh) * 1e3,
+                     ovh.max() * 1e3)
+
+    def _getDueLeeches(self, leech_np):
+        """
+        Count one more pixel acquired, and find the leeches which should run.
+        leech_np (list of 0<int or None): for each leech, number of pixels before
+          the leech should be executed again. It's updated.
+        return (list of int): the indices of the leeches to run now
+        """
+        due = []
+        for li in range(len(leech_np)):
+            if leech_np[li] is None:
+                continue
+            leech_np[li] -= 1
+            if leech_np[li] == 0:
+                due.append(li)
+        return due
+
+    def _runLeeches(self, leeches_due, leech_np):
+        """
+        Run the leeches, with the data of the last pixel acquired.
+        leeches_due (list of int): the indices of the leeches to run
+        leech_np (list of 0<int or None): for each leech, number of pixels before
+          the leech should be executed again. It's updated.
+        """
+        leeches = self.leeches
+        for li in leeches_due:
+            l = leeches[li]
+            try:
+                np = l.next([d[-1] for d in self._acq_data])
+            except Exception:
+                logging.exception("Leech %s failed, will retry next pixel", l)
+                np = 1  # try again next pixel
+            leech_np[li] = np
+            if self._acq_state == CANCELLED:
+                raise CancelledError()
+
     def _waitForImage(self, px_time):
         """
         Wait for the detector to acquire the image
@@ -1113,7 +1254,7 @@ class SEMCCDMDStream(MultipleDetectorStream):
         return timedout
 
     def _acquireImage(self, n, px_idx, px_time, sem_time, sub_pxs,
-                      tot_num, leech_np, extra_time, future):
+                      tot_num, extra_time, future, spot_list=None):
         """
         acquires image from detector
         :param n (int): number of points (pixel positions) acquired so far
@@ -1123,10 +1264,11 @@ class SEMCCDMDStream(MultipleDetectorStream):
                (=px_time if not fuzzing, and < px_time if fuzzing)
         :param sub_pxs (float, float): sub-pixel size when acquiring in fuzzy-mode
         :param tot_num (int): total number of images
-        :param leech_np (list of 0<int or None): for each leech, number of pixels before the leech should be
-                executed again. It's automatically updated inside the list. (np = next pixels)
         :param extra_time (float): # extra time needed taking leeches into account and moving polarizer HW if present
         :param future: current future running for the whole acquisition
+        :param spot_list (None or numpy.array of shape (Y, X, 2)): if the acquisition
+               is done in spot list mode, the positions of all the spots. The e-beam
+               acquisition is then already running (see _startSpotList()).
         """
 
         failures = 0  # keeps track of acquisition failures
@@ -1139,30 +1281,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
             if self._acq_state == CANCELLED:
                 raise CancelledError()
 
-            # subscribe to _subscribers
-            for s, sub in zip(self._streams[:-1], self._subscribers[:-1]):
-                s._dataflow.subscribe(sub)
-            # TODO: in theory (aka in a perfect world), the ebeam would immediately
-            # be at the requested position after the subscription starts. However,
-            # that's not exactly the case due to:
-            # * physics limits the speed of voltage change in the ebeam column,
-            #   so it takes the "settle time" before the beam is at the right
-            #   place (in the order of 10 µs).
-            # * the (odemis) driver is asynchronous, and between the moment it
-            #   receives the request to start and the actual moment it asks the
-            #   hardware to change voltages, several ms might have passed.
-            # One thing that would help is to not park the e-beam between each
-            # spot. This way, the ebeam would reach the position much quicker,
-            # and if it's not yet at the right place, it's still not that far.
-            # In the meantime, waiting a tiny bit ensures the CCD receives the
-            # right data.
-            time.sleep(5e-3)  # give more chances spot has been already processed
-
-            # send event to detector to acquire one image
-            self._trigger.notify()
-
-            # wait for detector to acquire image
-            timedout = self._waitForImage(px_time)
+            if spot_list is not None:
+                # The e-beam will go to the spot simultaneously with the CCD trigger
+                self._trigger.notify()
+                timedout = self._waitForImage(px_time)
+            else:
+                timedout = self._acquireSpot(px_time)
 
             if self._acq_state == CANCELLED:
                 raise CancelledError()
@@ -1197,6 +1321,8 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     # properly
                     time.sleep(1)
                     self._ccd_df.subscribe(self._subscribers[self._ccd_idx])
+                    if spot_list is not None:
+                        self._startSpotList(spot_list, numpy.ravel_multi_index(px_idx, spot_list.shape[:2]))
                     continue
 
             # Normally, the SEM acquisitions have already completed
@@ -1206,7 +1332,8 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     raise TimeoutError("Acquisition of SEM pixel %s timed out after %g s"
                                        % (px_idx, sem_time * 1.5 + 5))
                 logging.debug("Got synchronisation from %s", s)
-                s._dataflow.unsubscribe(sub)
+                if spot_list is None:
+                    s._dataflow.unsubscribe(sub)
 
             if self._acq_state == CANCELLED:
                 raise CancelledError()
@@ -1225,25 +1352,42 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
             self._updateProgress(future, time.time() - start, n + 1, tot_num, extra_time)
 
-            # Check if it's time to run a leech
-            for li, l in enumerate(self.leeches):
-                if leech_np[li] is None:
-                    continue
-                leech_np[li] -= 1
-                if leech_np[li] == 0:
-                    try:
-                        np = l.next([d[-1] for d in self._acq_data])
-                    except Exception:
-                        logging.exception("Leech %s failed, will retry next pixel", l)
-                        np = 1  # try again next pixel
-                    leech_np[li] = np
-                    if self._acq_state == CANCELLED:
-                        raise CancelledError()
-
             # Since we reached this point means everything went fine, so
             # no need to retry
             break
 
+    def _acquireSpot(self, px_time):
+        """
+        Start the e-beam acquisition at the current spot position, and acquire
+          one CCD image.
+        :param px_time (0<float): expected time spend for one pixel
+        :return (bool): True if acquisition timed out
+        """
+        # subscribe to _subscribers
+        for s, sub in zip(self._streams[:-1], self._subscribers[:-1]):
+            s._dataflow.subscribe(sub)
+        # TODO: in theory (aka in a perfect world), the ebeam would immediately
+        # be at the requested position after the subscription starts. However,
+        # that's not exactly the case due to:
+        # * physics limits the speed of voltage change in the ebeam column,
+        #   so it takes the "settle time" before the beam is at the right
+        #   place (in the order of 10 µs).
+        # * the (odemis) driver is asynchronous, and between the moment it
+        #   receives the request to start and the actual moment it asks the
+        #   hardware to change voltages, several ms might have passed.
+        # One thing that would help is to not park the e-beam between each
+        # spot. This way, the ebeam would reach the position much quicker,
+        # and if it's not yet at the right place, it's still not that far.
+        # In the meantime, waiting a tiny bit ensures the CCD receives the
+        # right data.
+        time.sleep(5e-3)  # give more chances spot has been already processed
+
+        # send event to detector to acquire one image
+        self._trigger.notify()
+
+        # wait for detector to acquire image
+        return self._waitForImage(px_time)
+
     def _adjustHardwareSettingsScanStage(self):
         """
         Read the SEM and CCD stream settings and adapt the SEM scanner
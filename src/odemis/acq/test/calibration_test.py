@@ -343,5 +343,49 @@ class TestSpectrum(unittest.TestCase):
             if wl <= wl_calib[0]:
                 self.assertEqual(vo * dcalib[0], vc)
 
+    def test_compensate_lazy(self):
+        """Test the lazy efficiency compensation gives the same data"""
+        data = numpy.random.randint(0, 200, (51, 3, 1, 20, 30)).astype(numpy.uint16)
+        wld = 433e-9 + numpy.array(range(data.shape[0])) * 0.1e-9
+        spec = model.DataArray(data, metadata={model.MD_WL_LIST: wld})
+
+        dbckg = numpy.random.randint(0, 50, (data.shape[0], 1, 1, 1, 1)).astype(numpy.uint16)
+        bckg = model.DataArray(dbckg, metadata={model.MD_WL_LIST: wld})
+
+        dcalib = numpy.array([1, 1.3, 2, 3.5, 4, 5, 0.1, 6, 9.1], dtype=numpy.float)
+        dcalib.shape = (dcalib.shape[0], 1, 1, 1, 1)
+        wl_calib = 430e-9 + numpy.array(range(dcalib.shape[0])) * 1e-9
+        calib = model.DataArray(dcalib, metadata={model.MD_WL_LIST: wl_calib})
+
+        for b, c in ((bckg, None), (None, calib), (bckg, calib)):
+            compensated = calibration.compensate_spectrum_efficiency(spec, b, c)
+            lazy = calibration.CompensatedSpectrum(spec, b, c, cache_size=100000)
+            self.assertEqual(lazy.shape, compensated.shape)
+            self.assertEqual(lazy.dtype, compensated.dtype)
+            numpy.testing.assert_equal(lazy.metadata, compensated.metadata)
+
+            for key in ((slice(None), 1, 0, 3, 3), (slice(4, 20), slice(None), 0),
+                        (5, 2, 0, 19, 29), (Ellipsis, 2, 3), [1, 4, 5]):
+                d = lazy[key]
+                numpy.testing.assert_array_equal(d, compensated[key])
+                numpy.testing.assert_array_equal(lazy[key], d)  # 2nd time: cached
+            numpy.testing.assert_array_equal(lazy.getData(), compensated)
+            numpy.testing.assert_array_equal(numpy.asarray(lazy), compensated)
+
+            d = lazy[2:4]
+            self.assertIsInstance(d, model.DataArray)
+            numpy.testing.assert_equal(d.metadata[model.MD_WL_LIST], wld)
+            self.assertFalse(d.flags.writeable)
+
+        # float32 only affects float data
+        lazy = calibration.CompensatedSpectrum(spec, bckg, calib, dtype=numpy.float32)
+        self.assertEqual(lazy.dtype, numpy.float32)
+        numpy.testing.assert_allclose(lazy[:, 0], compensated[:, 0], rtol=1e-6)
+        lazy = calibration.CompensatedSpectrum(spec, bckg, dtype=numpy.float32)
+        self.assertEqual(lazy.dtype, numpy.uint16)
+
+        # Wrong background
+        self.assertRaises(ValueError, calibration.CompensatedSpectrum, spec, bckg[:10])
+
 if __name__ == "__main__":
     unittest.main()
@@ -34,7 +34,7 @@ from odemis.acq.stream import POL_POSITIONS
 from odemis.acq.stream import RGBSpatialSpectrumProjection, \
     SinglePointSpectrumProjection, SinglePointTemporalProjection, \
     LineSpectrumProjection, MeanSpectrumProjection
-from odemis.dataio import tiff
+from odemis.dataio import tiff, hdf5
 from odemis.driver import simcam
 from odemis.util import test, conversion, img, spectrum, find_closest
 import os
@@ -1208,6 +1208,40 @@ class SPARCTestCase(unittest.TestCase):
         numpy.testing.assert_allclose(spec_md[model.MD_PIXEL_SIZE], exp_pxs)
 
 
+#     @skip("simple")
+    def test_acq_spec_spot_list(self):
+        """
+        Test acquisition for Spectrometer, with and without the spot list mode
+        of the e-beam scanner, which should give the same data
+        """
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        specs = stream.SpectrumSettingsStream("test spec", self.spec, self.spec.data, self.ebeam)
+        sps = stream.SEMSpectrumMDStream("test sem-spec", [sems, specs])
+
+        specs.roi.value = (0.15, 0.6, 0.8, 0.8)
+        self.spec.exposureTime.value = 0.01  # s
+        specs.repetition.value = (10, 8)
+        exp_pos, exp_pxs, exp_res = self._roiToPhys(specs)
+
+        overheads = {}
+        for use_spot_list in (False, True):
+            sps.useSpotList.value = use_spot_list
+            timeout = 1 + 2.5 * sps.estimateAcquisitionTime()
+            f = sps.acquire()
+            data = f.result(timeout)
+            self.assertEqual(len(data), len(sps.raw))
+            overheads[use_spot_list] = numpy.mean(sps._acq_overheads)
+
+            sem_da = sps.raw[0]
+            self.assertEqual(sem_da.shape, exp_res[::-1])
+            sp_da = sps.raw[1]
+            self.assertEqual(sp_da.shape[-2:], exp_res[::-1])
+            numpy.testing.assert_allclose(sp_da.metadata[model.MD_POS], exp_pos)
+            numpy.testing.assert_allclose(sp_da.metadata[model.MD_PIXEL_SIZE], exp_pxs)
+
+        logging.info("Overhead per pixel: %g ms per-pixel, %g ms with spot list",
+                     overheads[False] * 1e3, overheads[True] * 1e3)
+
 #     @skip("simple")
     def test_acq_fuz(self):
         """
@@ -3167,6 +3201,7 @@ class SettingsStreamsTestCase(unittest.TestCase):
 
 
 FILENAME = u"test" + tiff.EXTENSIONS[0]
+FILENAME_H5 = u"test" + hdf5.EXTENSIONS[0]
 
 
 # @skip("faster")
@@ -3177,10 +3212,11 @@ class StaticStreamsTestCase(unittest.TestCase):
 
     def tearDown(self):
         # clean up
-        try:
-            os.remove(FILENAME)
-        except Exception:
-            pass
+        for fn in (FILENAME, FILENAME_H5):
+            try:
+                os.remove(fn)
+            except Exception:
+                pass
 
     def test_fluo(self):
         """Test StaticFluoStream"""
@@ -3664,6 +3700,41 @@ class StaticStreamsTestCase(unittest.TestCase):
         md2d = im2d.metadata
         self.assertEqual(md2d[model.MD_POS], spec.metadata[model.MD_POS])
 
+    def test_spec_das_lazy(self):
+        """Test StaticSpectrumStream with DataArrayShadow supporting indexing"""
+        spec = self._create_spec_data()
+        hdf5.export(FILENAME_H5, spec)
+        acd = hdf5.open_data(FILENAME_H5)
+
+        # The data is not read in memory, but only the parts needed
+        specs = stream.StaticSpectrumStream("test", acd.content[0])
+        self.assertIsInstance(specs.raw[0], model.DataArrayShadow)
+        proj_spatial = RGBSpatialSpectrumProjection(specs)
+        proj_point = SinglePointSpectrumProjection(specs)
+        specs.selected_pixel.value = (3, 10)
+        time.sleep(0.5)  # wait a bit for the image to update
+
+        im2d = proj_spatial.image.value
+        self.assertEqual(im2d.shape, spec.shape[-2:] + (3,))
+        sp0d = proj_point.image.value
+        numpy.testing.assert_array_equal(sp0d, spec[:, 0, 0, 10, 3])
+        low, high = specs._get_bandwidth_in_pixel()
+        numpy.testing.assert_array_almost_equal(specs._get_band_mean(low, high),
+                                                spec[low:high + 1, 0, 0].mean(axis=0))
+
+        # Same with calibration
+        dcalib = numpy.array([1, 1.3, 2, 3.5, 4, 5, 1.3, 6, 9.1], dtype=numpy.float)
+        dcalib.shape = (dcalib.shape[0], 1, 1, 1, 1)
+        wl_calib = 400e-9 + numpy.array(range(dcalib.shape[0])) * 10e-9
+        calib = model.DataArray(dcalib, metadata={model.MD_WL_LIST: wl_calib})
+        specs.efficiencyCompensation.value = calib
+        time.sleep(0.5)
+
+        self.assertIsInstance(specs.raw[0], model.DataArrayShadow)
+        exp_calib = calibration.compensate_spectrum_efficiency(spec, coef=calib)
+        sp0d = proj_point.image.value
+        numpy.testing.assert_array_almost_equal(sp0d, exp_calib[:, 0, 0, 10, 3], decimal=3)
+
     def test_spec_2d(self):
         """Test StaticSpectrumStream 2D"""
         spec = self._create_spec_data()
@@ -3693,6 +3764,49 @@ class StaticStreamsTestCase(unittest.TestCase):
         im2d = proj_spatial.image.value
         self.assertEqual(im2d.shape, spec.shape[-2:] + (3,))
 
+    def test_spec_band_mean(self):
+        """Test the average over a band, with and without the cumulative sum"""
+        for spec in (self._create_spec_data(), self._create_temporal_spec_data()):
+            specs = stream.StaticSpectrumStream("test", spec)
+            proj_spatial = RGBSpatialSpectrumProjection(specs)
+            time.sleep(0.5)  # wait for the cumulative sum to be computed
+            self.assertIs(specs._spec_cumsum[0], specs.calibrated.value)
+
+            cshape = spec.shape[0]
+            for low, high in ((0, 0), (1, 3), (0, cshape - 1), (cshape - 1, cshape - 1)):
+                exp = numpy.mean(spec[low:high + 1, :, 0], axis=(0, 1))
+                numpy.testing.assert_allclose(specs._get_band_mean(low, high), exp)
+
+            spec_range = specs._get_bandwidth_in_pixel()
+            exp = numpy.mean(spec[spec_range[0]:spec_range[1] + 1, :, 0], axis=(0, 1))
+            raw = proj_spatial.projectAsRaw()
+            self.assertEqual(raw.shape, spec.shape[-2:])
+            numpy.testing.assert_array_equal(raw, exp.astype(spec.dtype))
+
+            # Without the cumulative sum, the result is the same
+            specs._spec_cumsum = (None, None)
+            numpy.testing.assert_allclose(specs._get_band_mean(1, 3),
+                                          numpy.mean(spec[1:4, :, 0], axis=(0, 1)))
+
+    def test_spec_cumsum_size(self):
+        """Test the cumulative sum fits in memory for big spectrum cubes"""
+        from odemis.acq.stream._static import _get_cumsum_dtype, SPECTRUM_CUMSUM_MAX_SIZE
+        shape = (2048, 1, 1, 256, 256)
+        for dtype, exp_dtype in ((numpy.uint16, numpy.uint32),
+                                 (numpy.float64, numpy.float64)):
+            data = numpy.empty((1,) * 5, dtype=dtype)
+            # Only the shape and dtype are used, so no need for a real big cube
+            data = numpy.lib.stride_tricks.as_strided(data, shape, (0,) * 5)
+            cdtype = _get_cumsum_dtype(data)
+            self.assertEqual(cdtype, exp_dtype)
+            nbytes = cdtype.itemsize * (shape[0] + 1) * shape[-2] * shape[-1]
+            self.assertLessEqual(nbytes, SPECTRUM_CUMSUM_MAX_SIZE)
+
+        # Sum over a long T: uint32 could overflow
+        data = numpy.empty((1,) * 5, dtype=numpy.uint16)
+        data = numpy.lib.stride_tricks.as_strided(data, (2048, 1000, 1, 2, 2), (0,) * 5)
+        self.assertEqual(_get_cumsum_dtype(data), numpy.uint64)
+
     def test_spec_0d(self):
         """Test StaticSpectrumStream 0D"""
         spec = self._create_spec_data()
@@ -3838,6 +3952,14 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(im2d.shape, spec.shape[-2:] + (3,))
         self.assertTrue(numpy.any(im2d != prev_im2d))
 
+        # The data range is computed without computing the whole calibrated cube
+        cdata = specs.calibrated.value
+        self.assertIsInstance(cdata, calibration.CompensatedSpectrum)
+        specs._drange = None
+        specs._updateDRange()
+        full = cdata.getData()
+        self.assertEqual(specs._drange, (full.min(), full.max()))
+
     def _create_temporal_spec_data(self):
         # Temporal Spectrum
         data = numpy.random.randint(1, 100, size=(256, 128, 1, 20, 30), dtype="uint16")
@@ -4056,6 +4178,9 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         tiff.DataArrayShadowPyramidalTIFF._getTileOldSP = tiff.DataArrayShadowPyramidalTIFF.getTile
         tiff.DataArrayShadowPyramidalTIFF.getTile = getTileMock
+        # Only count the tiles read on demand
+        stream.RGBSpatialProjection.prefetch_tiles = False
+        self.addCleanup(setattr, stream.RGBSpatialProjection, "prefetch_tiles", True)
 
         POS = (5.0, 7.0)
         size = (3000, 2000, 3)
@@ -4101,11 +4226,11 @@ class StaticStreamsTestCase(unittest.TestCase):
         self.assertEqual(len(pj.image.value), 3)
         self.assertEqual(len(pj.image.value[0]), 4)
 
-        # half image (right side), only the center tiles will are cached
+        # half image (right side), all tiles are still cached from the full image
         pj.rect.value = (POS[0], POS[1] + 0.001, POS[0] + 0.0015, POS[1] - 0.001)
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
         self.assertEqual(len(pj.image.value), 4)
         self.assertEqual(len(pj.image.value[0]), 4)
 
@@ -4114,7 +4239,7 @@ class StaticStreamsTestCase(unittest.TestCase):
         
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        self.assertEqual(40, len(read_tiles))
+        self.assertEqual(28, len(read_tiles))
         self.assertEqual(len(pj.image.value), 1)
         self.assertEqual(len(pj.image.value[0]), 1)
 
@@ -4136,6 +4261,9 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         tiff.DataArrayShadowPyramidalTIFF._getTileOldSZ = tiff.DataArrayShadowPyramidalTIFF.getTile
         tiff.DataArrayShadowPyramidalTIFF.getTile = getTileMock
+        # Only count the tiles read on demand
+        stream.RGBSpatialProjection.prefetch_tiles = False
+        self.addCleanup(setattr, stream.RGBSpatialProjection, "prefetch_tiles", True)
 
         POS = (5.0, 7.0)
         dtype = numpy.uint8
@@ -4190,11 +4318,11 @@ class StaticStreamsTestCase(unittest.TestCase):
         # top-left pixel of the left tile
         numpy.testing.assert_array_equal([0, 0, 0], pj.image.value[0][0][0, 0, :])
         # top-right pixel of the left tile
-        numpy.testing.assert_array_equal([173, 0, 0], pj.image.value[0][0][0, 255, :])
+        numpy.testing.assert_array_equal([174, 0, 0], pj.image.value[0][0][0, 255, :])
         # bottom-left pixel of the left tile
-        numpy.testing.assert_array_equal([0, 254, 0], pj.image.value[0][0][249, 0, :])
+        numpy.testing.assert_array_equal([0, 255, 0], pj.image.value[0][0][249, 0, :])
         # bottom-right pixel of the right tile
-        numpy.testing.assert_array_equal([254, 254, 0], pj.image.value[1][0][249, 117, :])
+        numpy.testing.assert_array_equal([254, 255, 0], pj.image.value[1][0][249, 117, :])
 
         # really small rect on the center, the tile is in the cache
         pj.rect.value = (POS[0], POS[1], POS[0] + 0.00001, POS[1] + 0.00001)
@@ -4208,9 +4336,9 @@ class StaticStreamsTestCase(unittest.TestCase):
         # top-left pixel of the only tile
         numpy.testing.assert_array_equal([0, 0, 0], pj.image.value[0][0][0, 0, :])
         # top-right pixel of the only tile
-        numpy.testing.assert_array_equal([173, 0, 0],pj.image.value[0][0][0, 255, :])
+        numpy.testing.assert_array_equal([174, 0, 0], pj.image.value[0][0][0, 255, :])
         # bottom-left pixel of the only tile
-        numpy.testing.assert_array_equal([0, 254, 0], pj.image.value[0][0][249, 0, :])
+        numpy.testing.assert_array_equal([0, 255, 0], pj.image.value[0][0][249, 0, :])
 
         # Now, just the tiny rect again, but at the minimum mpp (= fully zoomed in)
         # => should just need one new tile
@@ -4243,23 +4371,24 @@ class StaticStreamsTestCase(unittest.TestCase):
 
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
-        # Only 2 tiles read from disk. It means that the loop inside _updateImage,
-        # triggered by the change on .rect was immediately stopped when .mpp changed
-        if len(read_tiles) == 8:
+        # Only 1 tile read from disk (the tiles at max mpp are still in the cache).
+        # It means that the loop inside _updateImage, triggered by the change
+        # on .rect was immediately stopped when .mpp changed
+        if len(read_tiles) == 7:
             logging.warning("Two tiles read while expected to have just one, but "
                             "this is acceptable as updateImage thread might have "
                             "gone very fast.")
         else:
-            self.assertEqual(7, len(read_tiles))
+            self.assertEqual(6, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 1)
 
         # top-left pixel of the left tile
         numpy.testing.assert_array_equal([0, 0, 0], pj.image.value[0][0][0, 0, :])
         # bottom-right pixel of the left tile
-        numpy.testing.assert_array_equal([173, 0, 0], pj.image.value[0][0][0, 255, :])
+        numpy.testing.assert_array_equal([174, 0, 0], pj.image.value[0][0][0, 255, :])
         # bottom-right pixel of right right
-        numpy.testing.assert_array_equal([254, 254, 0], pj.image.value[1][0][249, 117, :])
+        numpy.testing.assert_array_equal([254, 255, 0], pj.image.value[1][0][249, 117, :])
 
         read_tiles = []  # reset, to keep the numbers simple
 
@@ -4281,11 +4410,11 @@ class StaticStreamsTestCase(unittest.TestCase):
         # top-left pixel of a center tile
         numpy.testing.assert_array_equal([87, 0, 0], pj.image.value[1][0][0, 0, :])
         # top-right pixel of a center tile
-        numpy.testing.assert_array_equal([173, 0, 0], pj.image.value[1][0][0, 255, :])
+        numpy.testing.assert_array_equal([174, 0, 0], pj.image.value[1][0][0, 255, :])
         # bottom-left pixel of a center tile
         numpy.testing.assert_array_equal([87, 130, 0], pj.image.value[1][0][255, 0, :])
         # bottom pixel of a center tile
-        numpy.testing.assert_array_equal([173, 130, 0], pj.image.value[1][0][255, 255, :])
+        numpy.testing.assert_array_equal([174, 130, 0], pj.image.value[1][0][255, 255, :])
 
         delta = [d / 8 for d in dfr]
         # this rect is 1/8 the size of the full image, in the center of the image
@@ -4298,8 +4427,9 @@ class StaticStreamsTestCase(unittest.TestCase):
         # Wait a little bit to make sure the image has been generated
         time.sleep(0.5)
 
-        # reads 4 tiles from the disk, no tile is cached becase the zoom changed
-        self.assertEqual(10, len(read_tiles))
+        # reads 3 tiles from the disk, the 4th one is still cached from when
+        # the tiny rect was displayed at the min mpp
+        self.assertEqual(9, len(read_tiles))
         self.assertEqual(len(pj.image.value), 2)
         self.assertEqual(len(pj.image.value[0]), 2)
         # top-left pixel of the top-left tile
@@ -4314,6 +4444,75 @@ class StaticStreamsTestCase(unittest.TestCase):
         # get the old function back to the class
         tiff.DataArrayShadowPyramidalTIFF.getTile = tiff.DataArrayShadowPyramidalTIFF._getTileOldSZ
 
+    def test_tiled_stream_cache(self):
+        """
+        Check the tiles are read in advance, and kept in the cache
+        """
+        read_tiles = []
+        def getTileMock(self, x, y, zoom):
+            read_tiles.append((x, y, zoom))
+            return tiff.DataArrayShadowPyramidalTIFF._getTileOldPF(self, x, y, zoom)
+
+        tiff.DataArrayShadowPyramidalTIFF._getTileOldPF = tiff.DataArrayShadowPyramidalTIFF.getTile
+        tiff.DataArrayShadowPyramidalTIFF.getTile = getTileMock
+        self.addCleanup(setattr, tiff.DataArrayShadowPyramidalTIFF, "getTile",
+                        tiff.DataArrayShadowPyramidalTIFF._getTileOldPF)
+        self.addCleanup(setattr, stream.TILE_CACHE, "max_size", stream.TILE_CACHE.max_size)
+
+        def count_reads(zoom):
+            return len([t for t in read_tiles if t[2] == zoom])
+
+        POS = (5.0, 7.0)
+        md = {
+            model.MD_DIMS: 'YX',
+            model.MD_POS: POS,
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        arr = numpy.arange(3000 * 2000, dtype=numpy.uint16).reshape(2000, 3000)
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        acd = tiff.open_data(FILENAME)
+        ss = stream.StaticSEMStream("test", acd.content[0])
+        pj = stream.RGBSpatialProjection(ss)
+        time.sleep(0.5)
+
+        # The whole image is displayed at the max zoom level (z=3), so the
+        # whole image at the next zoom level (z=2, 3x2 tiles) is read in advance
+        self.assertEqual(len(pj.image.value), 2)
+        self.assertEqual(count_reads(2), 6)
+        self.assertEqual(count_reads(1), 0)
+
+        # Zooming in => no tile to read for the display, but the next zoom level
+        # (z=1, 6x4 tiles) is read in advance
+        pj.mpp.value = 4e-6
+        time.sleep(0.5)
+        self.assertEqual(len(pj.image.value), 3)
+        self.assertEqual(count_reads(2), 6)
+        self.assertEqual(count_reads(1), 24)
+
+        # Changing the tint => all the projected tiles are recomputed, and the
+        # previous ones dropped from the cache
+        ss.tint.value = (255, 0, 0)
+        time.sleep(0.5)
+        pj_keys = [k for k in stream.TILE_CACHE._entries if k[0] == pj._tileCacheId]
+        self.assertEqual(len(pj_keys), 3 * 2)
+        for k in pj_keys:
+            self.assertEqual(k[-1], pj._projectedTilesVersion)
+        tile = pj.image.value[0][0]
+        self.assertTrue(tile[..., 0].any())
+        self.assertFalse(tile[..., 1:].any())
+        self.assertEqual(count_reads(2), 6)
+
+        # The cache stays within its limits, even if the image needs more tiles
+        # than can fit (raw tile = 128 KB, projected tile = 192 KB)
+        stream.TILE_CACHE.max_size = 2 * 2 ** 20
+        pj.mpp.value = 1e-6
+        time.sleep(1)
+        self.assertEqual(len(pj.image.value), 12)
+        self.assertEqual(len(pj.image.value[0]), 8)
+        self.assertLessEqual(stream.TILE_CACHE.size, 2 * 2 ** 20)
+
     def test_rgb_updatable_stream(self):
         """Test RGBUpdatableStream """
 
@@ -212,11 +212,13 @@ def add_acq_type_md(das):
     return das
 
 
-def stitch(infns, registration_method, weaving_method):
+def stitch(infns, registration_method, weaving_method, tiled=False):
     """
     Stitches a set of tiles.
     infns: file names of tiles
     method: weaving method (WEAVER_MEAN or WEAVER_COLLAGE)
+    tiled (bool): if True, the stitched images are DataArrayShadows, only
+      computed tile by tile when they are read (ie, when exported to a pyramidal file).
     returns list of data arrays containing the stitched images for every stream
     """
 
@@ -264,7 +266,7 @@ def stitch(infns, registration_method, weaving_method):
         streams = []
         for da in das_registered:
             streams.append(da[s])
-        da = stitching.weave(streams, weaving_method)
+        da = stitching.weave(streams, weaving_method, tiled)
         da.metadata[model.MD_DIMS] = "YX"
         st_data.append(da)
 
@@ -347,7 +349,11 @@ def main(args):
                                "global_shift": REGISTER_GLOBAL_SHIFT}[options.registrar]
         weaving_method = {"collage": WEAVER_COLLAGE, "mean": WEAVER_MEAN,
                   "collage_reverse": WEAVER_COLLAGE_REVERSE}[options.weaver]
-        data = stitch(tifns, registration_method, weaving_method)
+        # When saving to a pyramidal file, the stitched image can be directly
+        # written tile by tile, without ever being entirely in memory. The
+        # subtraction needs the whole image, so it's not possible then.
+        tiled = options.pyramid and not options.minus
+        data = stitch(tifns, registration_method, weaving_method, tiled)
         thumbs = []
         logging.info("File contains %d %s",
                      len(data), ngettext("stream", "streams", len(data)))
@@ -40,6 +40,7 @@ from odemis.util.driver import BACKEND_RUNNING, \
     BACKEND_DEAD, BACKEND_STOPPED, get_backend_status, BACKEND_STARTING
 import sys
 import threading
+import time
 
 
 status_to_xtcode = {BACKEND_RUNNING: 0,
@@ -48,6 +49,9 @@ status_to_xtcode = {BACKEND_RUNNING: 0,
                     BACKEND_STARTING: 3,
                     }
 
+# Time (in s) during which the data is received to compute the dataflow statistics
+DF_STATS_DURATION = 5
+
 # Special VigilantAttributes
 VAS_COMPS = {"alive", "dependencies"}
 VAS_HIDDEN = {"children", "affects"}
@@ -277,7 +281,32 @@ def print_events(component, pretty):
         print_event(name, value, pretty)
 
 
-def print_vattribute(name, va, pretty):
+def get_vattribute_info(va):
+    """
+    Read the value, and the range and choices of a VA, one by one.
+    return (dict str -> value): same as one entry of HwComponent.getVAInfo()
+    """
+    info = {"value": va.value}
+    # we cannot discover if it continuous or enumerated, just try and see if it fails
+    for p in ("range", "choices"):
+        try:
+            info[p] = getattr(va, p)
+        except (AttributeError, model.NotApplicableError):
+            pass
+    return info
+
+
+def print_vattribute(name, va, pretty, info=None):
+    """
+    name (str): name of the VA
+    va (VigilantAttribute): the VA
+    pretty (bool)
+    info (None or dict str -> value): the value, range and choices of the VA,
+      as returned by getVAInfo(). If None, they are read from the VA.
+    """
+    if info is None:
+        info = get_vattribute_info(va)
+
     if va.unit:
         if pretty:
             unit = u" (unit: %s)" % va.unit
@@ -294,31 +323,30 @@ def print_vattribute(name, va, pretty):
     else:
         readonly = u""
 
-    # we cannot discover if it continuous or enumerated, just try and see if it fails
-    try:
-        varange = va.range
+    if "range" in info:
+        varange = info["range"]
         if pretty:
             str_range = u" (range: %s → %s)" % (varange[0], varange[1])
         else:
             str_range = u"\trange:%s" % unicode(varange)
-    except (AttributeError, model.NotApplicableError):
+    else:
         str_range = u""
 
-    try:
-        vachoices = va.choices # set or dict
+    if "choices" in info:
+        vachoices = info["choices"]  # set or dict
         if pretty:
-            if isinstance(va.choices, dict):
+            if isinstance(vachoices, dict):
                 str_choices = u" (choices: %s)" % u", ".join(
                                 u"%s: '%s'" % i for i in vachoices.items())
             else:
                 str_choices = u" (choices: %s)" % u", ".join([str(c) for c in vachoices])
         else:
             str_choices = u"\tchoices:%s" % unicode(vachoices)
-    except (AttributeError, model.NotApplicableError):
+    else:
         str_choices = ""
 
+    val = info["value"]
     if pretty:
-        val = va.value
         if name in VAS_COMPS:
             try:
                 val = {c.name for c in val}
@@ -338,14 +366,20 @@ def print_vattribute(name, va, pretty):
               (readonly, sval, unit, str_range, str_choices))
     else:
         print(u"%s\ttype:%sva\tvalue:%s%s%s%s" %
-              (name, readonly, str(va.value), unit, str_range, str_choices))
+              (name, readonly, str(val), unit, str_range, str_choices))
 
 
 def print_vattributes(component, pretty):
-    for name, value in model.getVAs(component).items():
-        if name in VAS_HIDDEN:
-            continue
-        print_vattribute(name, value, pretty)
+    vas = {n: va for n, va in model.getVAs(component).items() if n not in VAS_HIDDEN}
+    # Read everything in one go, as it's much faster than VA per VA
+    try:
+        infos = component.getVAInfo(list(vas.keys()))
+    except AttributeError:  # Not a HwComponent
+        logging.debug("Reading VAs of %s one by one", component.name)
+        infos = {}
+
+    for name, va in vas.items():
+        print_vattribute(name, va, pretty, infos.get(name))
 
 def print_metadata(component, pretty):
     md = component.getMetadata()
@@ -425,6 +459,23 @@ def list_properties(comp_name, pretty=True):
         component = get_component(comp_name)
         print_attributes(component, pretty)
 
+def list_start_times(pretty=True):
+    """
+    print the time each component took to be instantiated by the back-end
+    pretty (bool): if True, display with pretty-printing
+    """
+    microscope = model.getMicroscope()
+    start_times = microscope.startTimes.value
+    if not start_times:
+        return
+    tfirst = min(t for t, d in start_times.values())
+    # Show them in the order they started
+    for name, (t, d) in sorted(start_times.items(), key=lambda i: i[1][0]):
+        if pretty:
+            print(u"%s\tstarted at +%.3f s\ttook %.3f s" % (name, t - tfirst, d))
+        else:
+            print(u"%s\tstart:%f\tduration:%f" % (name, t, d))
+
 def set_attr(comp_name, attr_val_str):
     """
     set the value of vigilant attribute of the given component.
@@ -818,6 +869,64 @@ def live_display(comp_name, df_name):
     finally:
         df.unsubscribe(new_image_wrapper)
 
+def print_dataflow_stats(stats, duration, pretty=True):
+    """
+    stats (dict): as returned by DataFlow.getStatistics()
+    duration (float): time during which the statistics were accumulated
+    """
+    received = stats["received"]
+    discarded = stats.get("discarded", 0)
+    if pretty:
+        print(u"Received %d data (%g fps), discarded %d" %
+              (received, received / duration, discarded))
+    else:
+        print(u"received:%d\tfps:%g\tdiscarded:%d" % (received, received / duration, discarded))
+
+    bins_names = [u"<%s" % units.readable_str(b, "s", sig=1) for b in model.LATENCY_BINS[:-1]]
+    bins_names.append(u">=%s" % units.readable_str(model.LATENCY_BINS[-2], "s", sig=1))
+    for name, ls in sorted(stats["listeners"].items()):
+        latency = u", ".join(u"%s: %d" % (bn, c) for bn, c in zip(bins_names, ls["latency"]))
+        if pretty:
+            print(u"\t%s (policy: %s)\tdelivered: %d, dropped: %d, queue: %d" %
+                  (name, ls["policy"], ls["delivered"], ls["dropped"], ls["queue"]))
+            print(u"\t\tlatency: %s" % (latency,))
+        else:
+            print(u"%s\tpolicy:%s\tdelivered:%d\tdropped:%d\tqueue:%d\tlatency:%s" %
+                  (name, ls["policy"], ls["delivered"], ls["dropped"], ls["queue"], latency))
+
+
+def measure_dataflow(comp_name, df_name, pretty=True):
+    """
+    Receive the data of a dataflow during a few seconds, and print the
+    statistics of the delivery
+    comp_name (string): name of the detector to find
+    df_name (string): name of the dataflow to access
+    pretty (bool): if True, display with pretty-printing
+    """
+    component = get_detector(comp_name)
+
+    # check the dataflow exists
+    try:
+        df = getattr(component, df_name)
+    except AttributeError:
+        raise ValueError("Failed to find data-flow '%s' on component %s" % (df_name, comp_name))
+
+    if not isinstance(df, model.DataFlowBase):
+        raise ValueError("%s.%s is not a data-flow" % (comp_name, df_name))
+
+    def on_data(dflow, da):
+        pass
+
+    df.subscribe(on_data)
+    try:
+        time.sleep(DF_STATS_DURATION)
+        stats = df.getStatistics()
+    finally:
+        df.unsubscribe(on_data)
+
+    print_dataflow_stats(stats, DF_STATS_DURATION, pretty)
+
+
 def ensure_output_encoding():
     """
     Make sure the output encoding supports unicode
@@ -867,6 +976,8 @@ def main(args):
                          help="list the components of the microscope")
     dm_grpe.add_argument("--list-prop", "-L", dest="listprop", metavar="<component>",
                          help="list the properties of a component. Use '*' to list all the components.")
+    dm_grpe.add_argument("--start-times", dest="starttimes", action="store_true", default=False,
+                         help="list the time each component took to start")
     dm_grpe.add_argument("--set-attr", "-s", dest="setattr", nargs="+", action='append',
                          metavar=("<component>", "<attribute>"),
                          help="set the attribute of a component. First the component name, "
@@ -900,6 +1011,10 @@ def main(args):
     dm_grpe.add_argument("--live", dest="live", nargs="+",
                          metavar=("<component>", "data-flow"),
                          help="display and update an image on the screen (default data-flow is \"data\")")
+    dm_grpe.add_argument("--dataflow-stats", dest="dfstats", nargs="+",
+                         metavar=("<component>", "data-flow"),
+                         help="receive data during %d s, and display the statistics of "
+                         "the delivery (default data-flow is \"data\")" % (DF_STATS_DURATION,))
 
     options = parser.parse_args(args[1:])
 
@@ -935,10 +1050,10 @@ def main(args):
 
     # anything to do?
     if not any((options.check, options.kill, options.scan,
-        options.list, options.stop, options.move,
+        options.list, options.starttimes, options.stop, options.move,
         options.position, options.reference,
         options.listprop, options.setattr, options.upmd,
-        options.acquire, options.live)):
+        options.acquire, options.live, options.dfstats)):
         logging.error("No action specified.")
         return 127
     if options.acquire is not None and options.output is None:
@@ -984,6 +1099,8 @@ def main(args):
             list_components(pretty=not options.machine)
         elif options.listprop is not None:
             list_properties(options.listprop, pretty=not options.machine)
+        elif options.starttimes:
+            list_start_times(pretty=not options.machine)
         elif options.setattr is not None:
             for l in options.setattr:
                 # C A B E F => C, {A: B, E: F}
@@ -1026,6 +1143,15 @@ def main(args):
             else:
                 raise ValueError("Live command accepts only one data-flow")
             live_display(component, dataflow)
+        elif options.dfstats is not None:
+            component = options.dfstats[0]
+            if len(options.dfstats) == 1:
+                dataflow = "data"
+            elif len(options.dfstats) == 2:
+                dataflow = options.dfstats[1]
+            else:
+                raise ValueError("Data-flow statistics accepts only one data-flow")
+            measure_dataflow(component, dataflow, pretty=not options.machine)
     except KeyboardInterrupt:
         logging.info("Interrupted before the end of the execution")
         return 1
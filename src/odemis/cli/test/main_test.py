@@ -47,6 +47,7 @@ logging.getLogger().setLevel(logging.DEBUG)
 ODEMISCLI_CMD = ["python2", "-m", "odemis.cli.main"]
 CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/"
 SECOM_CONFIG = CONFIG_PATH + "sim/secom-sim.odm.yaml"
+SPARC_CONFIG = CONFIG_PATH + "sim/sparc-sim.odm.yaml"
 
 class TestWithoutBackend(unittest.TestCase):
     # all the test cases which don't need a backend running
@@ -190,6 +191,22 @@ class TestWithBackend(unittest.TestCase):
         self.assertTrue("swVersion" in output)
         self.assertTrue("power" in output)
 
+    def test_start_times(self):
+        try:
+            # change the stdout
+            out = StringIO.StringIO()
+            sys.stdout = out
+
+            cmdline = "cli --start-times"
+            ret = main.main(cmdline.split())
+        except SystemExit as exc:
+            ret = exc.code
+        self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+
+        output = out.getvalue()
+        self.assertTrue("Light Engine" in output)
+        self.assertTrue("took" in output)
+
     def test_encoding(self):
         """Check no problem happens due to unicode encoding to ascii"""
         f = open("test.txt", "w")
@@ -340,5 +357,77 @@ class TestWithBackend(unittest.TestCase):
         self.assertEqual(im.format, "TIFF")
         self.assertEqual(im.size, size)
     
+
+class TestListPropSpeed(unittest.TestCase):
+    """
+    Benchmark of reading all the properties of a microscope with many components
+    """
+    backend_was_running = False
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            test.start_backend(SPARC_CONFIG)
+        except LookupError:
+            logging.info("A running backend is already found, skipping tests")
+            cls.backend_was_running = True
+            return
+        except IOError as exp:
+            logging.error(str(exp))
+            raise
+
+    def setUp(self):
+        if self.backend_was_running:
+            self.skipTest("Running backend found")
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.backend_was_running:
+            return
+        test.stop_backend()
+
+    def tearDown(self):
+        model._core._microscope = None  # force reset of the microscope for next connection
+        time.sleep(1)  # time to stop
+
+    def test_list_prop_all(self):
+        comps = model.getComponents()
+        stdout = sys.stdout
+        try:
+            sys.stdout = StringIO.StringIO()
+
+            # Each VA read one by one (as before the batch API)
+            tstart = time.time()
+            for c in comps:
+                for n, va in model.getVAs(c).items():
+                    if n not in main.VAS_HIDDEN:
+                        main.print_vattribute(n, va, True)
+            dur_single = time.time() - tstart
+
+            # All the VAs of each component read at once
+            tstart = time.time()
+            for c in comps:
+                main.print_vattributes(c, True)
+            dur_batch = time.time() - tstart
+
+            # Full command
+            tstart = time.time()
+            try:
+                ret = main.main(["cli", "--list-prop", "*"])
+            except SystemExit as exc:
+                ret = exc.code
+            dur_cmd = time.time() - tstart
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(ret, 0)
+        self.assertIn("Vigilant Attribute", output)
+        nvas = sum(len(model.getVAs(c)) for c in comps)
+        print("Reading %d VAs of %d components took %g s one by one, %g s in batch. "
+              "--list-prop * took %g s" % (nvas, len(comps), dur_single, dur_batch, dur_cmd))
+        self.assertLess(dur_batch, dur_single)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Helpers shared by the converters to compress the data in parallel. The data
+# is split into independent blocks (strips, tiles, chunks), which are compressed
+# by a pool of threads (zlib releases the GIL), and written in order by the
+# caller.
+
+from __future__ import division
+
+from concurrent import futures
+import collections
+import multiprocessing
+import threading
+import zlib
+
+
+# Names which refer to the same codec. For instance, deflate is called "deflate"
+# in TIFF, and "gzip" in HDF5. Each converter accepts all the names of a codec
+# it supports.
+CODEC_SYNONYMS = (("deflate", "gzip"),)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    return (ThreadPoolExecutor): the executor shared by all the converters, with
+      one thread per CPU.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+        return _executor
+
+
+def parse_compression(compressed, codecs, default):
+    """
+    Convert the "compressed" argument of the export functions into a codec and
+     a level.
+    compressed (bool or str): False (or None) for no compression, True for the
+      default codec, or the name of the codec, optionally followed by ":" and
+      the compression level (eg, "deflate:9"). The name can also be any
+      synonym of a supported codec (see CODEC_SYNONYMS).
+    codecs (collection of str): the codecs supported
+    default (str): the codec to use when compressed is True
+    return (None or str, None or int): the codec (None if no compression),
+      and the level (None if not specified)
+    raise ValueError: if the codec is not supported or the level is not a number
+    """
+    if not compressed:
+        return None, None
+    if compressed is True:
+        return default, None
+
+    codec, _, level = compressed.partition(":")
+    codec = codec.lower()
+    if codec not in codecs:
+        # Maybe the name of the codec in another format?
+        for names in CODEC_SYNONYMS:
+            if codec in names:
+                for n in names:
+                    if n in codecs:
+                        codec = n
+                        break
+                break
+
+    if codec not in codecs:
+        raise ValueError("Compression %s not supported, should be one of %s" %
+                         (codec, ", ".join(codecs)))
+    if level:
+        try:
+            level = int(level)
+        except ValueError:
+            raise ValueError("Compression level '%s' is not a number" % (level,))
+    else:
+        level = None
+    return codec, level
+
+
+def compress_deflate(block, level=None):
+    """
+    Compress a block of data with the deflate algorithm, in the zlib format
+     (as used by the TIFF "Adobe deflate" and the HDF5 "gzip" filters).
+    block (numpy.ndarray): the data (C-contiguous)
+    level (None or 0<=int<=9): compression level, None for the default one (6)
+    return (bytes): the compressed data
+    """
+    if level is None:
+        level = zlib.Z_DEFAULT_COMPRESSION
+    return zlib.compress(block.tobytes(), level)
+
+
+def imap_ordered(func, blocks, max_pending=None):
+    """
+    Apply a function on each block, in parallel, and yield the results in order.
+    The number of blocks being processed (or waiting to be consumed) is
+    limited, so that the memory usage stays small even if there are many blocks.
+    func (callable): function taking one block as argument
+    blocks (iterable): the blocks to process
+    max_pending (None or int): maximum number of blocks processed in advance.
+      If None, it's 4 times the number of CPUs.
+    yields (values): the result of func() on each block, in the same order
+    """
+    executor = get_executor()
+    if max_pending is None:
+        max_pending = 4 * multiprocessing.cpu_count()
+
+    pending = collections.deque()
+    try:
+        for b in blocks:
+            pending.append(executor.submit(func, b))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # In case of error, don't process the rest
+        for f in pending:
+            f.cancel()
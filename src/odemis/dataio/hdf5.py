@@ -25,8 +25,11 @@ from past.builtins import basestring, unicode
 import collections
 import h5py
 import logging
+import math
 import numpy
 from odemis import model
+from odemis.dataio import _compress
+from odemis.model import DataArrayShadow, AcquisitionData
 from odemis.util import spectrum, img, fluo
 import os
 import time
@@ -39,6 +42,16 @@ EXTENSIONS = [u".h5", u".hdf5"]
 LOSSY = False
 CAN_SAVE_PYRAMID = False
 
+# Compression codecs which can be passed to export(). gzip is the most widely
+# supported and is compressed in parallel, lzf is faster but has a lower
+# compression ratio, and is only supported by h5py.
+# (szip is not free for commercial usage)
+COMPRESSIONS = ("gzip", "lzf")
+
+# Maximum size of a chunk (in bytes). HDF5 keeps by default a cache of 1 MiB of
+# chunks per dataset, so bigger chunks would be (de)compressed at every access.
+CHUNK_SIZE = 1024 * 1024
+
 # We are trying to follow the same format as SVI, as defined here:
 # http://www.svi.nl/HDF5
 # A file follows this structure:
@@ -135,17 +148,71 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     returns the new dataset
     """
     assert(len(image.shape) >= 2)
-    image_dataset = group.create_dataset(dataset_name, data=image, **kwargs)
+    if kwargs.get("compression") == "gzip" and kwargs.get("chunks"):
+        # Compress the chunks in parallel
+        image_dataset = group.create_dataset(dataset_name, shape=image.shape,
+                                             dtype=image.dtype, **kwargs)
+        _write_chunks_gzip(image_dataset, image, kwargs.get("compression_opts"))
+    else:
+        image_dataset = group.create_dataset(dataset_name, data=image, **kwargs)
+    _add_image_attrs(image_dataset)
+    if image_dataset.attrs["IMAGE_SUBCLASS"] == b"IMAGE_GRAYSCALE":
+        image_dataset.attrs["IMAGE_MINMAXRANGE"] = [image.min(), image.max()]
+
+    return image_dataset
+
 
+def _write_chunks_gzip(dataset, data, level=None):
+    """
+    Write the data into a chunked dataset with the gzip filter, by compressing
+     all the chunks in parallel.
+    dataset (HDF Dataset): dataset with only the gzip filter
+    data (numpy.ndarray): data of the same shape and dtype as the dataset
+    level (None or 0<=int<=9): compression level (None for the default)
+    """
+    if not hasattr(dataset.id, "write_direct_chunk"):  # h5py < 2.3
+        dataset[...] = data
+        return
+
+    if level is None:
+        level = 4  # Same default as h5py
+    chunks = dataset.chunks
+    nchunks = [int(math.ceil(s / c)) for s, c in zip(data.shape, chunks)]
+
+    def get_blocks():
+        for ci in numpy.ndindex(*nchunks):
+            offset = tuple(i * c for i, c in zip(ci, chunks))
+            block = data[tuple(slice(o, o + c) for o, c in zip(offset, chunks))]
+            yield offset, block
+
+    def compress(ob):
+        offset, block = ob
+        if block.shape != chunks:
+            # Chunks on the border are always full size, filled with 0's
+            fblock = numpy.zeros(chunks, dtype=block.dtype)
+            fblock[tuple(slice(0, s) for s in block.shape)] = block
+            block = fblock
+        return offset, _compress.compress_deflate(numpy.ascontiguousarray(block), level)
+
+    for offset, cdata in _compress.imap_ordered(compress, get_blocks()):
+        dataset.id.write_direct_chunk(offset, cdata)
+
+
+def _add_image_attrs(image_dataset):
+    """
+    Set the attributes of a dataset to respect the HDF5 image specification.
+    Note: for greyscale images, IMAGE_MINMAXRANGE should also be set.
+    image_dataset (HDF Dataset): the dataset, with at least 2 dimensions
+    """
     # numpy.string_ is to force fixed-length string (necessary for compatibility)
     # FIXME: needs to be NULLTERM, not NULLPAD... but h5py doesn't allow to distinguish
     image_dataset.attrs["CLASS"] = numpy.string_("IMAGE")
     # Colour image?
-    if image.ndim == 3 and (image.shape[-3] == 3 or image.shape[-1] == 3):
+    if len(image_dataset.shape) == 3 and (image_dataset.shape[-3] == 3 or image_dataset.shape[-1] == 3):
         # TODO: check dtype is int?
         image_dataset.attrs["IMAGE_SUBCLASS"] = numpy.string_("IMAGE_TRUECOLOR")
         image_dataset.attrs["IMAGE_COLORMODEL"] = numpy.string_("RGB")
-        if image.shape[-3] == 3:
+        if image_dataset.shape[-3] == 3:
             # Stored as [pixel components][height][width]
             image_dataset.attrs["INTERLACE_MODE"] = numpy.string_("INTERLACE_PLANE")
         else: # This is the numpy standard
@@ -154,19 +221,45 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     else:
         image_dataset.attrs["IMAGE_SUBCLASS"] = numpy.string_("IMAGE_GRAYSCALE")
         image_dataset.attrs["IMAGE_WHITE_IS_ZERO"] = numpy.array(0, dtype="uint8")
-        image_dataset.attrs["IMAGE_MINMAXRANGE"] = [image.min(), image.max()]
 
     image_dataset.attrs["DISPLAY_ORIGIN"] = numpy.string_("UL") # not rotated
     image_dataset.attrs["IMAGE_VERSION"] = numpy.string_("1.2")
 
-    return image_dataset
 
+def _guess_chunk_shape(shape, itemsize, max_lines=None):
+    """
+    Compute a chunk shape fitting the way the data is typically accessed: a
+    chunk contains the whole spectrum (C and T) of a few pixels, so that the
+    data of one pixel is in one chunk, and as many pixels of a line as possible.
+    shape (5 ints): shape of the data, in the order CTZYX
+    itemsize (int): number of bytes of one element
+    max_lines (None or int): if not None, maximum size of the chunk along Y.
+      Pass 1 when the data is written line by line, so that every line
+      completes its chunks.
+    return (5 ints): shape of the chunk, of size <= CHUNK_SIZE (if possible)
+    """
+    assert len(shape) == 5
+    chunk = [1] * 5
+    size = itemsize
+    # Fill up the dimensions in order C, T, X, Y, Z, until the maximum size
+    for d in (0, 1, 4, 3, 2):
+        maxl = shape[d]
+        if d == 3 and max_lines is not None:
+            maxl = min(maxl, max_lines)
+        chunk[d] = int(max(1, min(maxl, CHUNK_SIZE // size)))
+        size *= chunk[d]
+        if chunk[d] < shape[d]:
+            break
+
+    return tuple(chunk)
 
-def _read_image_dataset(dataset):
+
+def _read_image_layout(dataset):
     """
-    Get a numpy array from a dataset respecting the HDF5 image specification.
-    returns (numpy.ndimage): it has at least 2 dimensions and if RGB, it has
-     a 3 dimensions and the metadata MD_DIMS indicates the order.
+    Check a dataset respects the HDF5 image specification, without reading the
+    data.
+    returns (dict): the metadata deduced from the layout of the image. If RGB,
+     it contains MD_DIMS, which indicates the order of the dimensions.
     raises
      IOError: if it doesn't conform to the standard
      NotImplementedError: if the image uses so fancy standard features
@@ -181,7 +274,7 @@ def _read_image_dataset(dataset):
     # conversion is almost entirely different depending on subclass
     subclass = dataset.attrs.get("IMAGE_SUBCLASS", b"IMAGE_GRAYSCALE")
 
-    image = model.DataArray(dataset[...])
+    md = {}
     if subclass == b"IMAGE_GRAYSCALE":
         pass
     elif subclass == b"IMAGE_TRUECOLOR":
@@ -200,9 +293,9 @@ def _read_image_dataset(dataset):
 
         if il_mode == b"INTERLACE_PLANE":
             # colour is first dim
-            image.metadata[model.MD_DIMS] = "CYX"
+            md[model.MD_DIMS] = "CYX"
         elif il_mode == b"INTERLACE_PIXEL":
-            image.metadata[model.MD_DIMS] = "YXC"
+            md[model.MD_DIMS] = "YXC"
         else:
             raise NotImplementedError("Unable to handle images of subclass '%s'" % subclass)
 
@@ -214,7 +307,7 @@ def _read_image_dataset(dataset):
     if dorig != b"UL":
         logging.warning("Image rotation %s not handled", dorig)
 
-    return image
+    return md
 
 
 def _add_image_info(group, dataset, image):
@@ -614,13 +707,16 @@ def _read_image_info(group):
     return md
 
 
-def _parse_physical_data(pdgroup, da):
+def _parse_physical_metadata(pdgroup, md, nc):
     """
-    Parse the metadata found in PhysicalData, and cut the DataArray if necessary.
+    Parse the metadata found in PhysicalData, without reading the image data.
     pdgroup (HDF Group): the group "PhysicalData" associated to an image
-    da (DataArray): the DataArray that was obtained by reading the ImageData
-    returns (list of DataArrays): The same data, but broken into smaller 
-      DataArrays if necessary, and with additional metadata.
+    md (dict): the metadata already known about the image
+    nc (int): the length of the first dimension (C) of the image
+    returns (list of dict): the metadata for each channel, if the image has to
+      be broken into one DataArray per channel, or just one metadata, if the
+      image is kept as-is. The metadata are copies of md, with additional
+      metadata.
     """
     # The information in PhysicalData might be different for each channel (e.g.
     # fluorescence image). In this case, the DA must be separated into smaller
@@ -636,18 +732,16 @@ def _parse_physical_data(pdgroup, da):
 
     if n > 1:
         # need to separate it
-        if n != da.shape[0]:
+        if n != nc:
             logging.warning("Image has %d channels and %d metadata, failed to map",
-                            da.shape[0], n)
-            das = [da]
+                            nc, n)
+            mds = [md.copy()]
         else:
-            # list(da) does almost what we need, but metadata is shared
-            das = [model.DataArray(c, da.metadata.copy()) for c in da]
+            mds = [md.copy() for i in range(n)]
     else:
-        das = [da]
+        mds = [md.copy()]
 
-    for i, d in enumerate(das):
-        md = d.metadata
+    for i, md in enumerate(mds):
         try:
             cd = pdgroup["ChannelDescription"][i]
             # For Python 2, where it returns a "str", which are actually UTF-8 encoded bytes
@@ -699,7 +793,7 @@ def _parse_physical_data(pdgroup, da):
         read_metadata(pdgroup, i, md, "TriggerDelay", model.MD_TRIGGER_DELAY, converter=float)
         read_metadata(pdgroup, i, md, "TriggerRate", model.MD_TRIGGER_RATE, converter=float)
 
-    return das
+    return mds
 
 
 def read_metadata(pdgroup, c_index, md, name, md_key, converter, bad_states=(ST_INVALID,)):
@@ -1310,14 +1404,78 @@ def _updateRGBMD(da):
     da.metadata[model.MD_DIMS] = dims
 
 
-def _thumbFromHDF5(filename):
+class DataArrayShadowHDF5(DataArrayShadow):
     """
-    Read thumbnails from an HDF5 file.
-    Expects to find them as IMAGE in Preview/Image.
-    return (list of model.DataArray)
+    Represents an image stored in a dataset of an HDF5 file. The data is only
+    read when requested. It's also possible to read just a part of the data
+    with the standard (basic) indexing, for instance das[:, 0, 0, 10:20, 30]
+    only reads the spectrum of 10 pixels.
     """
-    f = h5py.File(filename, "r")
 
+    def __init__(self, dataset, metadata=None, channel=None):
+        """
+        dataset (h5py.Dataset): the dataset containing the image
+        metadata (dict str->val): The metadata
+        channel (None or int): If not None, the image is only the given index
+          of the first dimension (C) of the dataset.
+        """
+        self._dataset = dataset
+        self._channel = channel
+        if channel is None:
+            shape = dataset.shape
+        else:
+            shape = dataset.shape[1:]
+        DataArrayShadow.__init__(self, shape, dataset.dtype, metadata)
+
+    def getData(self):
+        """
+        Fetches the whole data of the image.
+        return DataArray: the data, with its metadata
+        """
+        return self[...]
+
+    def __getitem__(self, key):
+        """
+        Fetches only a part of the data of the image. Only the corresponding
+        part of the file is read (and decompressed).
+        key (int, slice, Ellipsis, or tuple of them): the part of the data, as
+          with the numpy basic indexing. Slices with negative step and
+          numpy.newaxis are not supported.
+        return DataArray: the data, with its metadata. Same as when indexing a
+          DataArray, the metadata is not updated to the part of the data read.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if self._channel is not None:
+            key = (self._channel,) + key
+        return model.DataArray(self._dataset[key], self.metadata.copy())
+
+
+class AcquisitionDataHDF5(AcquisitionData):
+    """
+    Implements AcquisitionData for HDF5 files. The file is kept open as long as
+    this object (or one of its DataArrayShadows) is used.
+    """
+
+    def __init__(self, filename):
+        """
+        filename (string): The name of the HDF5 file
+        raises:
+            IOError in case the file format is not as expected.
+        """
+        self._file = h5py.File(filename, "r")
+        data = _shadowsFromHDF5(self._file)
+        thumbnails = _thumbShadowsFromHDF5(self._file)
+        AcquisitionData.__init__(self, tuple(data), tuple(thumbnails))
+
+
+def _thumbShadowsFromHDF5(f):
+    """
+    Find thumbnails in an HDF5 file.
+    Expects to find them as IMAGE in Preview/Image.
+    f (h5py.File): the root of the file
+    return (list of DataArrayShadowHDF5)
+    """
     thumbs = []
     # look for the Preview directory
     try:
@@ -1331,29 +1489,29 @@ def _thumbFromHDF5(filename):
         # an image? (== has the attribute CLASS: IMAGE)
         if isinstance(ds, h5py.Dataset) and ds.attrs.get("CLASS") == b"IMAGE":
             try:
-                da = _read_image_dataset(ds)
+                md = _read_image_layout(ds)
             except Exception:
                 logging.info("Skipping image '%s' which couldn't be read.", name)
                 continue
 
             if name == "Image":
                 try:
-                    da.metadata = _read_image_info(grp)
+                    md = _read_image_info(grp)
                 except Exception:
                     logging.debug("Failed to parse metadata of acquisition '%s'", name)
                     continue
 
-            thumbs.append(da)
+            thumbs.append(DataArrayShadowHDF5(ds, md))
 
     return thumbs
 
 
-def _dataFromSVIHDF5(f):
+def _shadowsFromSVIHDF5(f):
     """
-    Read microscopy data from an HDF5 file using the SVI convention.
+    Find microscopy data in an HDF5 file using the SVI convention.
     Expects to find them as IMAGE in XXX/ImageData/Image + XXX/PhysicalData.
     f (h5py.File): the root of the file
-    return (list of model.DataArray)
+    return (list of DataArrayShadowHDF5)
     """
     data = []
 
@@ -1367,37 +1525,39 @@ def _dataFromSVIHDF5(f):
         except KeyError:
             continue  # not conforming => try next object
 
-        # Read the raw data
+        # Check the raw data
         try:
-            da = _read_image_dataset(image)
+            md = _read_image_layout(image)
         except Exception:
             logging.exception("Failed to read data of acquisition '%s'", obj.name)
+            continue
 
         # TODO: read more metadata
         try:
-            da.metadata.update(_read_image_info(imagedata))
+            md.update(_read_image_info(imagedata))
         except Exception:
             logging.exception("Failed to parse metadata of acquisition '%s'", obj.name)
 
-        das = _parse_physical_data(physicaldata, da)
-        data.extend(das)
+        mds = _parse_physical_metadata(physicaldata, md, image.shape[0])
+        if len(mds) > 1:
+            data.extend(DataArrayShadowHDF5(image, cmd, channel=i) for i, cmd in enumerate(mds))
+        else:
+            data.append(DataArrayShadowHDF5(image, mds[0]))
     return data
 
 
-def _dataFromHDF5(filename):
+def _shadowsFromHDF5(f):
     """
-    Read microscopy data from an HDF5 file.
-    filename (string): path of the file to read
-    return (list of model.DataArray)
+    Find microscopy data in an HDF5 file.
+    f (h5py.File): the root of the file
+    return (list of DataArrayShadowHDF5)
     """
-    f = h5py.File(filename, "r")
-
     # if follows SVI convention => use the special function
     # If it has at least one directory like XXX/SVIData => it follows SVI conventions
     for obj in f.values():
         if (isinstance(obj, h5py.Group) and
             isinstance(obj.get("SVIData"), h5py.Group)):
-            return _dataFromSVIHDF5(f)
+            return _shadowsFromSVIHDF5(f)
 
     data = []
     # go rough: return any dataset with numbers (and more than one element)
@@ -1412,10 +1572,11 @@ def _dataFromHDF5(filename):
                 return
             # TODO: if it's an image, open it as an image
             # TODO: try to get some metadata?
-            da = model.DataArray(obj[...])
+            das = DataArrayShadowHDF5(obj)
         except Exception:
             logging.info("Skipping '%s' as it doesn't seem a correct data", name)
-        data.append(da)
+            return
+        data.append(das)
 
     f.visititems(addIfWorthy)
     return data
@@ -1433,6 +1594,20 @@ def _mergeCorrectionMetadata(da):
     return model.DataArray(da, md) # create a view
 
 
+def _add_thumbnail(f, thumbnail, **kwargs):
+    """
+    Save the thumbnail as-is in a special group "Preview"
+    f (h5py.File): the root of the file
+    thumbnail (DataArray): see export
+    kwargs: passed to create_dataset()
+    """
+    thumbnail = _mergeCorrectionMetadata(thumbnail)
+    prevg = f.create_group("Preview")
+    _updateRGBMD(thumbnail) # ensure RGB info is there if needed
+    ids = _create_image_dataset(prevg, "Image", thumbnail, **kwargs)
+    _add_image_info(prevg, ids, thumbnail)
+
+
 def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     """
     Saves a list of DataArray as a HDF5 (SVI) file.
@@ -1440,8 +1615,13 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     ldata (list of DataArray): list of 2D (up to 5D) data of int or float. 
      Should have at least one array.
     thumbnail (None or DataArray): see export
-    compressed (boolean): whether the file is compressed or not.
+    compressed (boolean or str): whether the file is compressed or not, or the
+      compression codec. See export.
     """
+    compression, level = _compress.parse_compression(compressed, COMPRESSIONS, "gzip")
+    if compression == "lzf":
+        level = None  # lzf has no option
+
     # h5py will extend the current file by default, so we want to make sure
     # there is no file at all.
     try:
@@ -1449,20 +1629,9 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     except OSError:
         pass
     f = h5py.File(filename, "w") # w will fail if file exists
-    if compressed:
-        # szip is not free for commercial usage and lzf doesn't seem to be
-        # well supported yet
-        compression = "gzip"
-    else:
-        compression = None
 
     if thumbnail is not None:
-        thumbnail = _mergeCorrectionMetadata(thumbnail)
-        # Save the image as-is in a special group "Preview"
-        prevg = f.create_group("Preview")
-        _updateRGBMD(thumbnail) # ensure RGB info is there if needed
-        ids = _create_image_dataset(prevg, "Image", thumbnail, compression=compression)
-        _add_image_info(prevg, ids, thumbnail)
+        _add_thumbnail(f, thumbnail, compression=compression, compression_opts=level)
 
     # merge correction metadata (as we cannot save them separatly in OME-TIFF)
     ldata = [_mergeCorrectionMetadata(da) for da in ldata]
@@ -1471,14 +1640,204 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     acq, mds = _groupImages(ldata)
     for i, da in enumerate(acq):
         ga = f.create_group("Acquisition%d" % i)
-        _add_acquistion_svi(ga, da, mds[i], compression=compression)
+        if compression and da.ndim == 5:
+            chunks = _guess_chunk_shape(da.shape, da.dtype.itemsize)
+        else:
+            chunks = None  # Let h5py decide
+        _add_acquistion_svi(ga, da, mds[i], compression=compression,
+                            compression_opts=level, chunks=chunks)
 
     f.close()
 
 
-# TODO: allow to append data to a file, or any other way to allow saving large
-# data without having everything in memory simultaneously.
-def export(filename, data, thumbnail=None):
+class FileWriter(object):
+    """
+    Writes an HDF5 (SVI) file incrementally, so that large acquisitions can be
+    saved without having all the data in memory simultaneously.
+    Typical usage:
+      with FileWriter(fn) as fw:
+          aw = fw.add_acquisition((C, 1, 1, Y, X), numpy.uint16, md)
+          for each line or pixel received:
+              aw.append(data)
+    Not thread-safe.
+    """
+
+    def __init__(self, filename, compressed=True):
+        """
+        filename (unicode): filename of the file to create (including path).
+          If it already exists, it is overwritten.
+        compressed (boolean or str): whether the data is compressed or not, or
+          the compression codec. See export.
+        """
+        self._compression, self._level = _compress.parse_compression(compressed, COMPRESSIONS, "gzip")
+        if self._compression == "lzf":
+            self._level = None  # lzf has no option
+
+        # h5py will extend the current file by default, so we want to make sure
+        # there is no file at all.
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        self._file = h5py.File(filename, "w")
+        self._acqs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_thumbnail(self, thumbnail):
+        """
+        thumbnail (DataArray): Image used as thumbnail for the file. See export().
+          There can only be one thumbnail per file.
+        """
+        _add_thumbnail(self._file, thumbnail, compression=self._compression,
+                       compression_opts=self._level)
+
+    def add_acquisition(self, shape, dtype, metadata, mds=None):
+        """
+        Create a new acquisition in the file. The data is initially all 0's,
+        and should be written via the returned AcquisitionWriter.
+        shape (tuple of 2 to 5 ints): shape of the data, with the dimensions in
+          the order CTZYX (the missing first dimensions are considered of length 1).
+        dtype (numpy.dtype): type of the data
+        metadata (dict str->value): the (global) metadata of the acquisition.
+          It can be updated via AcquisitionWriter.metadata until the
+          acquisition is finished.
+        mds (None or list of dict): metadata for each C of the image (if different)
+        return (AcquisitionWriter): the object to write the data
+        raise ValueError: if the dimensions are not in the order CTZYX
+        """
+        dims = metadata.get(model.MD_DIMS, "CTZYX"[-len(shape):])
+        if not "CTZYX".endswith(dims) or len(dims) != len(shape):
+            raise ValueError("Data must have the dimensions ordered CTZYX, but got %s" % (dims,))
+        shape = (1,) * (5 - len(shape)) + tuple(shape)
+
+        ga = self._file.create_group("Acquisition%d" % len(self._acqs))
+        aw = AcquisitionWriter(ga, shape, dtype, metadata, mds, self._compression, self._level)
+        self._acqs.append(aw)
+        return aw
+
+    def close(self):
+        """
+        Finish all the acquisitions, and close the file.
+        """
+        if self._file is None:
+            return
+        try:
+            for aw in self._acqs:
+                aw.finish()
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class AcquisitionWriter(object):
+    """
+    Writes the data of one acquisition, as parts, in an HDF5 file.
+    Created via FileWriter.add_acquisition().
+    The data can be written either by indexing (eg, aw[:, 0, 0, y, x] = spec),
+    or in the scanning order (X first, then Y), pixel by pixel, or line by line,
+    with append().
+    """
+
+    def __init__(self, group, shape, dtype, metadata, mds, compression, level=None):
+        """
+        group (HDF Group): the (empty) group of the acquisition
+        shape (5 ints): shape of the data, in the order CTZYX. It is also
+          accessible as .shape .
+        dtype (numpy.dtype): type of the data
+        metadata (dict str->value): the (global) metadata of the acquisition
+        mds (None or list of dict): metadata for each C of the image
+        compression (None or str): compression filter to use
+        level (None or int): compression level
+        """
+        self._group = group
+        self.shape = shape
+        self.dtype = numpy.dtype(dtype)
+        self.metadata = dict(metadata)
+        self.metadata[model.MD_DIMS] = "CTZYX"
+        self._mds = mds
+        self._npx = 0  # number of pixels appended so far
+        self._minmax = None  # (min, max) of all the data written
+        self._finished = False
+
+        # Create up front all the structure, with the data written line by line
+        self._image_data = group.create_group("ImageData")
+        # FIXME: should be done by _h5svi_set_state (and used)
+        _h5py_enum_commit(group, b"StateEnumeration", _dtstate)
+        chunks = _guess_chunk_shape(shape, self.dtype.itemsize, max_lines=1)
+        self._dataset = self._image_data.create_dataset("Image", shape=shape, dtype=self.dtype,
+                                                        chunks=chunks, compression=compression,
+                                                        compression_opts=level)
+        _add_image_attrs(self._dataset)
+        _add_svi_info(group)
+
+    def __setitem__(self, key, data):
+        """
+        Write a part of the data
+        key (int, slice, Ellipsis, or tuple of them): the part of the data to
+          write, as with the numpy basic indexing, on the 5 dimensions CTZYX.
+        data (numpy.ndarray): the data, of the same shape as the part
+        """
+        if self._finished:
+            raise IOError("Acquisition already finished")
+        data = numpy.asarray(data)
+        self._dataset[key] = data
+        if data.size:
+            mn, mx = data.min(), data.max()
+            if self._minmax is not None:
+                mn, mx = min(mn, self._minmax[0]), max(mx, self._minmax[1])
+            self._minmax = mn, mx
+
+    def append(self, data):
+        """
+        Write the data of the next pixel or line, in the scanning order (X
+        first, then Y).
+        data (numpy.ndarray): the data of one pixel (CTZ) or one line (CTZX).
+          Any shape is accepted, as long as the order of the data is the same.
+        raise IndexError: if all the pixels are already written
+        raise ValueError: if the data doesn't correspond to a pixel or a line
+        """
+        data = numpy.asarray(data)
+        c, t, z, h, w = self.shape
+        y, x = divmod(self._npx, w)
+        if y >= h:
+            raise IndexError("All the %d pixels were already written" % (w * h,))
+
+        if data.size == c * t * z:
+            self[:, :, :, y, x] = data.reshape(c, t, z)
+            self._npx += 1
+        elif data.size == c * t * z * w and x == 0:
+            self[:, :, :, y, :] = data.reshape(c, t, z, w)
+            self._npx += w
+        else:
+            raise ValueError("Data of shape %s is neither a pixel nor a line of %s at pixel %d,%d"
+                             % (data.shape, self.shape, x, y))
+
+    def finish(self):
+        """
+        Write the metadata. Afterwards, no more data can be written.
+        It is automatically called when the file is closed.
+        """
+        if self._finished:
+            return
+        self._finished = True
+
+        if self._minmax is None:
+            self._minmax = 0, 0  # Only the default 0's
+        self._dataset.attrs["IMAGE_MINMAXRANGE"] = numpy.array(self._minmax, dtype=self.dtype)
+
+        md = self.metadata.copy()
+        img.mergeMetadata(md)
+        image = DataArrayShadowHDF5(self._dataset, md)
+        _add_image_info(self._image_data, self._dataset, image)
+        _add_image_metadata(self._group, image, self._mds)
+
+
+def export(filename, data, thumbnail=None, compressed=True):
     '''
     Write an HDF5 file with the given image and metadata
     filename (unicode): filename of the file to create (including path)
@@ -1492,13 +1851,18 @@ def export(filename, data, thumbnail=None):
       (reasonable) size. Must be either 2D array (greyscale) or 3D with last 
       dimension of length 3 (RGB). If the exporter doesn't support it, it will
       be dropped silently.
+    compressed (boolean or str): whether the file is compressed or not. It can
+      also be the name of the compression codec (one of COMPRESSIONS), optionally
+      followed by ":" and the compression level (eg, "gzip:9"). "deflate" is
+      also accepted, as a synonym of "gzip" (as in TIFF). True means gzip.
+    raise ValueError: if the compression is not supported
     '''
     # TODO: add an argument to not do any clever data aggregation?
     if not isinstance(data, (list, tuple)):
         # TODO should probably not enforce it: respect duck typing
         assert(isinstance(data, model.DataArray))
         data = [data]
-    _saveAsHDF5(filename, data, thumbnail)
+    _saveAsHDF5(filename, data, thumbnail, compressed)
 
 
 def read_data(filename):
@@ -1514,11 +1878,8 @@ def read_data(filename):
     raises:
         IOError in case the file format is not as expected.
     """
-    # TODO: support filename to be a File or Stream (but it seems very difficult
-    # to do it without looking at the .filename attribute)
-    # see http://pytables.github.io/cookbook/inmemory_hdf5_files.html
-
-    return _dataFromHDF5(filename)
+    acd = open_data(filename)
+    return [das.getData() for das in acd.content]
 
 
 def read_thumbnail(filename):
@@ -1531,7 +1892,21 @@ def read_thumbnail(filename):
     raises:
         IOError in case the file format is not as expected.
     """
-    # TODO: support filename to be a File or Stream
+    acd = open_data(filename)
+    return [das.getData() for das in acd.thumbnails]
+
 
-    return _thumbFromHDF5(filename)
+def open_data(filename):
+    """
+    Opens an HDF5 file, and return an AcquisitionData instance. The data is
+    only read when requested, via the DataArrayShadows.
+    filename (string): path to the file
+    return (AcquisitionData): an opened file
+    raises:
+        IOError in case the file format is not as expected.
+    """
+    # TODO: support filename to be a File or Stream (but it seems very difficult
+    # to do it without looking at the .filename attribute)
+    # see http://pytables.github.io/cookbook/inmemory_hdf5_files.html
+    return AcquisitionDataHDF5(filename)
 
@@ -49,6 +49,7 @@ def export(filename, data, thumbnail=None, compressed=True, pyramid=False):
       Can be of any (reasonable) size. Must be either 2D array (greyscale) or 3D
       with last dimension of length 3 (RGB). If the exporter doesn't support it,
       it will be dropped silently.
-    compressed (boolean): whether the file is compressed or not.
+    compressed (boolean or str): whether the file is compressed or not, or
+      the compression codec. See tiff.export().
     '''
     tiff.export(filename, data, thumbnail, compressed, multiple_files=True, pyramid=pyramid)
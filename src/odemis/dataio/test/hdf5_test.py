@@ -1257,6 +1257,240 @@ class TestHDF5IO(unittest.TestCase):
         self.assertEqual(im.shape, tshape)
         self.assertEqual(im[0, 0].tolist(), [0, 255, 0])
 
+    def testOpenData(self):
+        """
+        Checks that a spectrum cube can be opened without reading the data,
+        and only a part of it read.
+        """
+        shape = (200, 3, 1, 40, 50)  # CTZYX
+        md = {model.MD_DESCRIPTION: "spectrum",
+              model.MD_ACQ_DATE: time.time(),
+              model.MD_PIXEL_SIZE: (1e-6, 2e-6),  # m/px
+              model.MD_POS: (1e-3, -30e-3),  # m
+              model.MD_WL_LIST: [500e-9 + i * 1e-9 for i in range(shape[0])],
+             }
+        data = model.DataArray(numpy.arange(numpy.prod(shape), dtype=numpy.uint32).reshape(shape), md)
+
+        # thumbnail : small RGB completely green
+        tshape = (40, 50, 3)
+        thumbnail = model.DataArray(numpy.zeros(tshape, numpy.uint8))
+        thumbnail[:, :, 1] += 255  # green
+
+        hdf5.export(FILENAME, data, thumbnail)
+
+        acd = hdf5.open_data(FILENAME)
+        self.assertEqual(len(acd.content), 1)
+        das = acd.content[0]
+        self.assertIsInstance(das, model.DataArrayShadow)
+        self.assertEqual(das.shape, shape)
+        self.assertEqual(das.dtype, data.dtype)
+        self.assertEqual(das.metadata[model.MD_DESCRIPTION], md[model.MD_DESCRIPTION])
+        self.assertEqual(das.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+
+        # Single C plane
+        im = das[10, 1, 0]
+        self.assertIsInstance(im, model.DataArray)
+        numpy.testing.assert_array_equal(im, data[10, 1, 0])
+        self.assertEqual(im.metadata[model.MD_POS], md[model.MD_POS])
+
+        # Single pixel spectrum
+        numpy.testing.assert_array_equal(das[:, 0, 0, 5, 7], data[:, 0, 0, 5, 7])
+
+        # Sub-rectangle
+        numpy.testing.assert_array_equal(das[..., 10:20, 30:45], data[..., 10:20, 30:45])
+        numpy.testing.assert_array_equal(das[:, 2, 0, 3:9:2, -1], data[:, 2, 0, 3:9:2, -1])
+
+        # Whole data
+        rdata = das.getData()
+        numpy.testing.assert_array_equal(rdata, data)
+        self.assertEqual(rdata.metadata[model.MD_WL_LIST], md[model.MD_WL_LIST])
+
+        self.assertEqual(len(acd.thumbnails), 1)
+        im = acd.thumbnails[0].getData()
+        self.assertEqual(im.shape, tshape)
+        self.assertEqual(im[0, 0].tolist(), [0, 255, 0])
+
+    def testOpenDataFluo(self):
+        """
+        Checks that the data merged in one dataset, but with different metadata
+        per channel is opened as separate DataArrayShadows
+        """
+        size = (512, 256)
+        metadata = []
+        ldata = []
+        for i, wl in enumerate((500e-9, 600e-9, 700e-9)):
+            md = {model.MD_DESCRIPTION: "brightfield %d" % (i,),
+                  model.MD_ACQ_DATE: time.time(),
+                  model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                  model.MD_POS: (13.7e-3, -30e-3),  # m
+                  model.MD_IN_WL: (wl - 10e-9, wl + 10e-9),  # m
+                  model.MD_OUT_WL: (wl + 30e-9, wl + 50e-9),  # m
+                 }
+            metadata.append(md)
+            a = model.DataArray(numpy.zeros(size[::-1], numpy.uint16), md)
+            a[i, i + 10] = i + 1
+            ldata.append(a)
+
+        hdf5.export(FILENAME, ldata)
+
+        acd = hdf5.open_data(FILENAME)
+        self.assertEqual(len(acd.content), len(ldata))
+        self.assertEqual(len(acd.thumbnails), 0)
+        for i, das in enumerate(acd.content):
+            self.assertEqual(das.metadata[model.MD_DESCRIPTION], metadata[i][model.MD_DESCRIPTION])
+            # (merged into a 5D array)
+            self.assertEqual(das.shape[-2:], size[::-1])
+            self.assertEqual(das[..., i, i + 10], i + 1)
+            numpy.testing.assert_array_equal(das.getData().reshape(size[::-1]), ldata[i])
+
+
+    def testFileWriterPixels(self):
+        """
+        Checks that a spectrum cube can be written pixel by pixel
+        """
+        shape = (300, 1, 1, 20, 30)  # CTZYX
+        md = {model.MD_DESCRIPTION: "spectrum",
+              model.MD_ACQ_DATE: time.time(),
+              model.MD_PIXEL_SIZE: (1e-6, 2e-6),  # m/px
+              model.MD_POS: (1e-3, -30e-3),  # m
+              model.MD_WL_LIST: [500e-9 + i * 1e-9 for i in range(shape[0])],
+             }
+        data = numpy.random.randint(1, 4000, shape).astype(numpy.uint16)
+
+        with hdf5.FileWriter(FILENAME) as fw:
+            aw = fw.add_acquisition(shape, data.dtype, md)
+            for y, x in numpy.ndindex(shape[-2:]):
+                # Same shape as the data from a spectrometer
+                aw.append(data[:, 0, 0, y, x].reshape(1, shape[0]))
+            self.assertRaises(IndexError, aw.append, data[:, 0, 0, 0, 0])
+            # Metadata known only at the end
+            aw.metadata[model.MD_EXP_TIME] = 0.1
+
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), 1)
+        im = rdata[0]
+        numpy.testing.assert_array_equal(im, data)
+        self.assertEqual(im.metadata[model.MD_DESCRIPTION], md[model.MD_DESCRIPTION])
+        self.assertEqual(im.metadata[model.MD_POS], md[model.MD_POS])
+        self.assertEqual(im.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+        self.assertEqual(im.metadata[model.MD_EXP_TIME], 0.1)
+        numpy.testing.assert_almost_equal(im.metadata[model.MD_WL_LIST], md[model.MD_WL_LIST])
+
+        # The whole spectrum of a pixel should be in a single chunk
+        f = h5py.File(FILENAME, "r")
+        chunks = f["Acquisition0/ImageData/Image"].chunks
+        self.assertEqual(chunks[:3], shape[:3])
+        self.assertEqual(chunks[3], 1)
+        self.assertEqual(f["Acquisition0/ImageData/Image"].attrs["IMAGE_MINMAXRANGE"].tolist(),
+                         [data.min(), data.max()])
+        f.close()
+
+    def testFileWriterLines(self):
+        """
+        Checks that multiple acquisitions can be written line by line, or directly
+        """
+        shape = (16, 32, 1, 10, 8)  # CTZYX
+        md = {model.MD_DESCRIPTION: "temporal spectrum",
+              model.MD_ACQ_DATE: time.time(),
+              model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+              model.MD_POS: (1e-3, -30e-3),  # m
+              model.MD_TIME_LIST: [1e-9 * i for i in range(shape[1])],
+             }
+        data = numpy.random.randint(1, 2 ** 20, shape).astype(numpy.uint32)
+        sem_shape = (10, 8)
+        sem_md = {model.MD_DESCRIPTION: "sem",
+                  model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                  model.MD_POS: (1e-3, -30e-3),  # m
+                 }
+        sem_data = numpy.random.randint(1, 2 ** 12, sem_shape).astype(numpy.uint16)
+        tshape = (40, 50, 3)
+        thumbnail = model.DataArray(numpy.zeros(tshape, numpy.uint8))
+        thumbnail[:, :, 1] += 255  # green
+
+        with hdf5.FileWriter(FILENAME) as fw:
+            semw = fw.add_acquisition(sem_shape, sem_data.dtype, sem_md)
+            aw = fw.add_acquisition(shape, data.dtype, md)
+            for y in range(shape[-2]):
+                aw.append(data[:, :, :, y, :])
+                semw[0, 0, 0, y] = sem_data[y]
+            fw.add_thumbnail(thumbnail)
+
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), 2)
+        numpy.testing.assert_array_equal(rdata[0].reshape(sem_shape), sem_data)
+        self.assertEqual(rdata[0].metadata[model.MD_DESCRIPTION], "sem")
+        numpy.testing.assert_array_equal(rdata[1], data)
+        self.assertEqual(rdata[1].metadata[model.MD_DESCRIPTION], md[model.MD_DESCRIPTION])
+        numpy.testing.assert_almost_equal(rdata[1].metadata[model.MD_TIME_LIST], md[model.MD_TIME_LIST])
+
+        rthumbs = hdf5.read_thumbnail(FILENAME)
+        self.assertEqual(len(rthumbs), 1)
+        self.assertEqual(rthumbs[0].shape, tshape)
+
+        # Dimensions not in the right order
+        with hdf5.FileWriter(FILENAME) as fw:
+            with self.assertRaises(ValueError):
+                fw.add_acquisition((5, 6, 3), numpy.uint8, {model.MD_DIMS: "YXC"})
+
+    def testChunkShape(self):
+        # spectrum: C, then X, then Y
+        self.assertEqual(hdf5._guess_chunk_shape((1024, 1, 1, 256, 256), 2), (1024, 1, 1, 2, 256))
+        self.assertEqual(hdf5._guess_chunk_shape((1024, 1, 1, 256, 256), 2, max_lines=1), (1024, 1, 1, 1, 256))
+        # large temporal spectrum: only part of the pixel spectrum
+        self.assertEqual(hdf5._guess_chunk_shape((1024, 1024, 1, 8, 8), 4), (1024, 256, 1, 1, 1))
+        # 2D image
+        self.assertEqual(hdf5._guess_chunk_shape((1, 1, 1, 4096, 4096), 2), (1, 1, 1, 128, 4096))
+        # small data: all in one chunk
+        self.assertEqual(hdf5._guess_chunk_shape((1, 1, 5, 10, 10), 8), (1, 1, 5, 10, 10))
+
+    def testExportCompressions(self):
+        """
+        Checks that the data can be written with the different compressions, and
+        read back identical
+        """
+        shape = (100, 1, 1, 30, 40)  # CTZYX, chunks not aligned on the shape
+        md = {model.MD_DESCRIPTION: "spectrum",
+              model.MD_WL_LIST: [500e-9 + i * 1e-9 for i in range(shape[0])],
+             }
+        ldata = [model.DataArray(numpy.random.randint(0, 4000, shape).astype(numpy.uint16), md),
+                 model.DataArray(numpy.random.random((50, 60)).astype(numpy.float32))]
+        tshape = (40, 50, 3)
+        thumbnail = model.DataArray(numpy.zeros(tshape, numpy.uint8))
+        thumbnail[:, :, 1] += 255  # green
+
+        exp_compression = {False: None,
+                           True: "gzip",
+                           "gzip": "gzip",
+                           "gzip:1": "gzip",
+                           "deflate:1": "gzip",  # TIFF name
+                           "lzf": "lzf",
+                           }
+        orig_chunk_size = hdf5.CHUNK_SIZE
+        hdf5.CHUNK_SIZE = 2 * 100 * 7  # To get many chunks (of 7 pixels)
+        try:
+            for compressed, exp_c in exp_compression.items():
+                hdf5.export(FILENAME, ldata, thumbnail, compressed=compressed)
+
+                f = h5py.File(FILENAME, "r")
+                self.assertEqual(f["Acquisition0/ImageData/Image"].compression, exp_c)
+                if exp_c:
+                    self.assertEqual(f["Acquisition0/ImageData/Image"].chunks, (100, 1, 1, 1, 7))
+                f.close()
+
+                rdata = hdf5.read_data(FILENAME)
+                self.assertEqual(len(rdata), len(ldata))
+                for im, orig in zip(rdata, ldata):
+                    self.assertEqual(im.dtype, orig.dtype)
+                    numpy.testing.assert_array_equal(im.reshape(orig.shape), orig)
+
+                rthumbs = hdf5.read_thumbnail(FILENAME)
+                self.assertEqual(len(rthumbs), 1)
+                self.assertEqual(rthumbs[0][0, 0].tolist(), [0, 255, 0])
+        finally:
+            hdf5.CHUNK_SIZE = orig_chunk_size
+
+        with self.assertRaises(ValueError):
+            hdf5.export(FILENAME, ldata, compressed="szip")
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
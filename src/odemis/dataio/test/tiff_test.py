@@ -23,8 +23,10 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division
 
 from PIL import Image
+import gc
 import libtiff
 import logging
+import math
 import numpy
 from numpy.polynomial import polynomial
 from odemis import model
@@ -32,7 +34,9 @@ import odemis
 from odemis.dataio import tiff
 from odemis.util import img
 import os
+import random
 import re
+import threading
 import time
 import unittest
 from unittest.case import skip
@@ -1789,12 +1793,13 @@ class TestTiffIO(unittest.TestCase):
         # read the subimage
         subimage = im.read_image()
         self.assertEqual(subimage.shape, (147, 128))
-        # Checking the values in the corner of the tile. The downsampling uses
-        # the neighbour pixels to calculate a pixel in the resized image.
-        self.assertEqual(subimage[0][0], 130)
-        self.assertEqual(subimage[0][-1], 385)
-        self.assertEqual(subimage[-1][0], 9893)
-        self.assertEqual(subimage[-1][-1], 10148)
+        # Checking the values in the corner of the tile. Each pixel of the
+        # resized image is the average of 2x2 pixels of the full image (and
+        # the last odd row is dropped).
+        self.assertEqual(subimage[0][0], 129)
+        self.assertEqual(subimage[0][-1], 383)
+        self.assertEqual(subimage[-1][0], 9637)
+        self.assertEqual(subimage[-1][-1], 9891)
 
     def testExportThinPyramid(self):           
         """
@@ -1826,6 +1831,156 @@ class TestTiffIO(unittest.TestCase):
         self.assertEqual(full_image[-1][0], 4096)
         self.assertEqual(full_image[-1][-1], 4097)
 
+    def _readPyramid(self, fn):
+        """
+        return (list of numpy.array): the full image and all its zoom levels
+        """
+        im = libtiff.TIFF.open(fn)
+        levels = [im.read_image()]
+        sub_ifds = im.GetField(T.TIFFTAG_SUBIFD) or []
+        for sifd in sub_ifds:
+            im.SetSubDirectory(sifd)
+            levels.append(im.read_image())
+        im.close()
+        return levels
+
+    def testExportPyramidLevels(self):
+        """
+        Checks each zoom level is the 2x2 reduction of the previous one, for
+        all compressions and when the levels are stored on disk
+        """
+        data = model.DataArray(numpy.random.randint(0, 4096, (1100, 700)).astype(numpy.uint16))
+        exp_levels = [data]
+        while exp_levels[-1].shape[0] >= tiff.TILE_SIZE and exp_levels[-1].shape[1] >= tiff.TILE_SIZE:
+            exp_levels.append(tiff._reduceHalf(exp_levels[-1][:, :, numpy.newaxis])[:, :, 0])
+        self.assertEqual(len(exp_levels), 3)
+        self.assertEqual(exp_levels[1].shape, (550, 350))
+
+        orig_spool_size = tiff.PYRAMID_SPOOL_SIZE
+        try:
+            for spool_size in (orig_spool_size, 1024):
+                tiff.PYRAMID_SPOOL_SIZE = spool_size
+                for compressed in (False, "lzw", "deflate"):
+                    tiff.export(FILENAME, data, compressed=compressed, pyramid=True)
+                    levels = self._readPyramid(FILENAME)
+                    self.assertEqual(len(levels), len(exp_levels))
+                    for l, el in zip(levels, exp_levels):
+                        numpy.testing.assert_array_equal(l, el)
+        finally:
+            tiff.PYRAMID_SPOOL_SIZE = orig_spool_size
+
+        # RGB
+        rgb = model.DataArray(numpy.random.randint(0, 255, (600, 520, 3)).astype(numpy.uint8),
+                              {model.MD_DIMS: "YXC"})
+        tiff.export(FILENAME, rgb, compressed="deflate", pyramid=True)
+        levels = self._readPyramid(FILENAME)
+        self.assertEqual(len(levels), 3)
+        numpy.testing.assert_array_equal(levels[0], rgb)
+        numpy.testing.assert_array_equal(levels[1], tiff._reduceHalf(rgb))
+        numpy.testing.assert_array_equal(levels[2], tiff._reduceHalf(levels[1]))
+
+    def testExportPyramidFromTiles(self):
+        """
+        Checks that an image provided tile by tile can be exported as pyramid
+        """
+        md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (1e-3, -30e-3)}
+        data = model.DataArray(numpy.random.randint(0, 4096, (700, 613)).astype(numpy.uint16), md)
+
+        tiles_read = []  # x, y of each tile read
+
+        class TiledShadow(model.DataArrayShadow):
+            def __init__(self, data, tile_shape):
+                model.DataArrayShadow.__init__(self, data.shape, data.dtype, data.metadata,
+                                               maxzoom=0, tile_shape=tile_shape)
+                self._data = data
+
+            def getData(self):
+                return self._data
+
+            def getTile(self, x, y, zoom):
+                assert zoom == 0
+                tiles_read.append((x, y))
+                tw, th = self.tile_shape
+                return self._data[y * th:(y + 1) * th, x * tw:(x + 1) * tw]
+
+        for tile_shape in ((100, 100), (tiff.TILE_SIZE, tiff.TILE_SIZE), (613, 10)):
+            das = TiledShadow(data, tile_shape)
+            del tiles_read[:]
+            tiff.export(FILENAME, das, compressed="deflate", pyramid=True)
+            levels_tiles = self._readPyramid(FILENAME)
+
+            tiff.export(FILENAME, data, compressed="deflate", pyramid=True)
+            levels_array = self._readPyramid(FILENAME)
+            self.assertEqual(len(levels_tiles), 3)
+            for lt, la in zip(levels_tiles, levels_array):
+                numpy.testing.assert_array_equal(lt, la)
+
+            # Each tile is read only once
+            ntiles = (int(numpy.ceil(700 / tile_shape[1])) *
+                      int(numpy.ceil(613 / tile_shape[0])))
+            self.assertEqual(len(tiles_read), ntiles)
+            self.assertEqual(len(set(tiles_read)), ntiles)
+
+        rdata = tiff.read_data(FILENAME)
+        self.assertEqual(rdata[0].metadata[model.MD_POS], md[model.MD_POS])
+
+        # Not pyramidal => the whole data is used
+        tiff.export(FILENAME, das, compressed="deflate")
+        rdata = tiff.read_data(FILENAME)
+        numpy.testing.assert_array_equal(rdata[0], data)
+
+    def testExportCompressions(self):
+        """
+        Checks that the data can be written with the different compressions, and
+        read back identical
+        """
+        size = (1000, 600)
+        ldata = []
+        for dtype in (numpy.uint16, numpy.int16, numpy.float32):
+            arr = numpy.random.randint(-1000, 1000, size[::-1]).astype(dtype)
+            arr[10:20, :] = 12  # Something easy to compress
+            ldata.append(model.DataArray(arr))
+        tshape = (size[1] // 8, size[0] // 8, 3)
+        thumbnail = model.DataArray(numpy.zeros(tshape, numpy.uint8))
+        thumbnail[:, :, 1] += 255  # green
+
+        exp_compression = {False: T.COMPRESSION_NONE,
+                           True: T.COMPRESSION_LZW,
+                           "lzw": T.COMPRESSION_LZW,
+                           "deflate": T.COMPRESSION_ADOBE_DEFLATE,
+                           "deflate:1": T.COMPRESSION_ADOBE_DEFLATE,
+                           "gzip:1": T.COMPRESSION_ADOBE_DEFLATE,  # HDF5 name
+                           }
+        for compressed, exp_c in exp_compression.items():
+            tiff.export(FILENAME, ldata, thumbnail, compressed=compressed)
+
+            f = libtiff.TIFF.open(FILENAME)
+            self.assertEqual(f.GetField("Compression"), exp_c)
+            f.close()
+
+            rdata = tiff.read_data(FILENAME)
+            self.assertEqual(len(rdata), len(ldata))
+            for im, orig in zip(rdata, ldata):
+                self.assertEqual(im.dtype, orig.dtype)
+                numpy.testing.assert_array_equal(im, orig)
+
+            rthumbs = tiff.read_thumbnail(FILENAME)
+            self.assertEqual(len(rthumbs), 1)
+            self.assertEqual(rthumbs[0].shape, tshape)
+            self.assertEqual(rthumbs[0][0, 0].tolist(), [0, 255, 0])
+
+        # Pyramidal, with tiles of the border smaller than the full tile
+        md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (1e-3, -30e-3)}
+        data = model.DataArray(numpy.random.randint(0, 4096, (700, 513)).astype(numpy.uint16), md)
+        tiff.export(FILENAME, data, compressed="deflate:9", pyramid=True)
+        rdata = tiff.open_data(FILENAME)
+        numpy.testing.assert_array_equal(rdata.content[0].getData(), data)
+        tile = rdata.content[0].getTile(2, 2, 0)
+        numpy.testing.assert_array_equal(tile, data[512:700, 512:513])
+
+        with self.assertRaises(ValueError):
+            tiff.export(FILENAME, data, compressed="zstd")
+
     def testExportMultiArrayPyramid(self):
         """
         Checks that we can export and read back the metadata and data of 1 SEM image,
@@ -2063,6 +2218,97 @@ class TestTiffIO(unittest.TestCase):
             # the image is not tiled
             rdata.content[0].getTile(0, 0, 0)
 
+    def testAcquisitionDataTIFFGetTiles(self):
+        """
+        Check reading multiple tiles at once, and from multiple threads
+        """
+        size = (1000, 700)
+        md = {
+            model.MD_DIMS: 'YX',
+            model.MD_POS: (5.0, 7.0),
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        arr = numpy.arange(size[0] * size[1], dtype=numpy.uint16).reshape(size[::-1])
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        rdata = tiff.open_data(FILENAME)
+        das = rdata.content[0]
+        self.assertEqual(das.maxzoom, 2)
+
+        xyzs = [(x, y, z) for z in range(das.maxzoom + 1)
+                          for x in range(int(math.ceil(size[0] / 2 ** z / 256)))
+                          for y in range(int(math.ceil(size[1] / 2 ** z / 256)))]
+        tiles = das.getTiles(xyzs)
+        self.assertEqual(len(tiles), len(xyzs))
+        for (x, y, z), tile in zip(xyzs, tiles):
+            exp = das.getTile(x, y, z)
+            numpy.testing.assert_array_equal(tile, exp)
+            self.assertEqual(tile.metadata[model.MD_POS], exp.metadata[model.MD_POS])
+            self.assertEqual(tile.metadata[model.MD_PIXEL_SIZE], exp.metadata[model.MD_PIXEL_SIZE])
+
+        numpy.testing.assert_array_equal(tiles[0], arr[:256, :256])
+        numpy.testing.assert_array_equal(das.getTile(3, 2, 0), arr[512:, 768:])
+
+        # Read all the tiles from several threads simultaneously, in a different order
+        errors = []
+
+        def read_tiles(order):
+            try:
+                for i in order:
+                    x, y, z = xyzs[i]
+                    numpy.testing.assert_array_equal(das.getTile(x, y, z), tiles[i])
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = []
+        for i in range(4):
+            order = list(range(len(xyzs)))
+            random.shuffle(order)
+            t = threading.Thread(target=read_tiles, args=(order,))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+        # Closing the extra handles doesn't prevent reading afterwards
+        rdata.close()
+        numpy.testing.assert_array_equal(das.getTile(3, 2, 0), arr[512:, 768:])
+        rdata.close()
+
+    def testAcquisitionDataTIFFHandles(self):
+        """
+        Check the extra handles used to read the tiles are closed
+        """
+        arr = numpy.arange(1000 * 700, dtype=numpy.uint16).reshape(700, 1000)
+        md = {
+            model.MD_DIMS: 'YX',
+            model.MD_POS: (5.0, 7.0),
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+        }
+        data = model.DataArray(arr, metadata=md)
+        tiff.export(FILENAME, data, pyramid=True)
+
+        rdata = tiff.open_data(FILENAME)
+        das = rdata.content[0]
+        handles = das.tiff_info['handles']
+
+        # A handle being used is only closed once it's not used anymore
+        with handles.use(0) as h:
+            rdata.close()
+            self.assertFalse(h.closed)
+            h.read_one_tile(0, 0)
+        self.assertTrue(h.closed)
+
+        # The handles are closed when the data is not used anymore
+        numpy.testing.assert_array_equal(das.getTile(3, 2, 0), arr[512:, 768:])
+        with handles.use(0) as h:
+            self.assertFalse(h.closed)
+        del rdata, das, handles
+        gc.collect()
+        self.assertTrue(h.closed)
+
     def testAcquisitionDataTIFFLargerFile(self):
 
         def getSubData(dast, zoom, rect):
@@ -23,17 +23,21 @@ from __future__ import division
 
 from past.builtins import basestring
 import calendar
+from contextlib import contextmanager
+import copy
 from libtiff import TIFF
 import logging
 import math
 import numpy
 from odemis import model, util
 import odemis
+from odemis.dataio import _compress
 from odemis.util import spectrum, img, fluo
 import operator
 import os
 import re
 import sys
+import tempfile
 import time
 import uuid
 import threading
@@ -69,6 +73,15 @@ CAN_SAVE_PYRAMID = True # indicates the support for pyramidal export
 TILE_SIZE = 256 # Tile size of pyramidal images
 LOSSY = False
 
+# Compression codecs which can be passed to export(). LZW is the most widely
+# supported, deflate is compressed in parallel, so it's faster on multi-core
+# computers, and typically gives smaller files.
+COMPRESSIONS = ("lzw", "deflate")
+STRIP_SIZE = 256 * 1024  # bytes, approximate size of a strip when using deflate
+# Above this size (in bytes), the zoom levels of a pyramid are stored on disk
+# until they are written
+PYRAMID_SPOOL_SIZE = 16 * 1024 * 1024
+
 # We try to make it as much as possible looking like a normal (multi-page) TIFF,
 # with as much metadata as possible saved in the known TIFF tags. In addition,
 # we ensure it's compatible with OME-TIFF, which support much more metadata, and
@@ -1603,11 +1616,16 @@ def _mergeCorrectionMetadata(da):
     """
     Create a new DataArray with metadata updated to with the correction metadata
     merged.
-    da (DataArray): the original data
-    return (DataArray): new DataArray (view) with the updated metadata
+    da (DataArray or DataArrayShadow): the original data
+    return (DataArray or DataArrayShadow): new DataArray (view) with the updated
+      metadata, or a (shallow) copy of the DataArrayShadow
     """
     md = da.metadata.copy() # to avoid modifying the original one
     img.mergeMetadata(md)
+    if isinstance(da, model.DataArrayShadow):
+        das = copy.copy(da)
+        das.metadata = md
+        return das
     return model.DataArray(da, md) # create a view
 
 
@@ -1618,7 +1636,8 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
     filename (string): name of the file to save
     ldata (list of DataArray): list of 2D data of int or float. Should have at least one array
     thumbnail (None or DataArray): see export
-    compressed (boolean): whether the file is LZW compressed or not.
+    compressed (boolean or str): whether the file is compressed or not, or the
+      compression codec. See export.
     multiple_files (boolean): whether the data is distributed across multiple
       files or not.
     file_index (int): index of this particular file.
@@ -1639,10 +1658,18 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
     # According to this page: http://www.openmicroscopy.org/site/support/file-formats/ome-tiff/ome-tiff-data
     # LZW is a good trade-off between compatibility and small size (reduces file
     # size by about 2). => that's why we use it by default
-    if compressed:
-        compression = "lzw"
-    else:
-        compression = None
+    compression, level = _compress.parse_compression(compressed, COMPRESSIONS, "lzw")
+
+    # Only pyramidal images can be written tile by tile
+    ldata = list(ldata)  # to not modify the caller's list
+    for i, da in enumerate(ldata):
+        if isinstance(da, model.DataArrayShadow):
+            dims = da.metadata.get(model.MD_DIMS, "CTZYX"[-da.ndim:])
+            if not pyramid:
+                ldata[i] = da.getData()
+            elif dims not in ("YX", "YXC"):
+                raise ValueError("Cannot save tiled image of shape %s (dims %s)" %
+                                 (da.shape, dims))
 
     # merge correction metadata (as we cannot save them separatly in OME-TIFF)
     ldata = [_mergeCorrectionMetadata(da) for da in ldata]
@@ -1684,7 +1711,7 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
         # Our version is fixed
 
         # write_rgb makes it clever to detect RGB vs. Greyscale
-        f.write_image(thumbnail, compression=compression, write_rgb=True)
+        write_image(f, thumbnail, compression=compression, write_rgb=True, level=level)
 
 
         # TODO also save it as thumbnail of the image (in limited size)
@@ -1767,11 +1794,13 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
                     f.SetField(key, val)
                 except Exception:
                     logging.exception("Failed to store tag %s with value '%s'", key, val)
-            if data[i].dtype in [numpy.int64, numpy.uint64]:
+            im = data[i] if i else data  # a DataArrayShadow cannot be indexed
+            if im.dtype in [numpy.int64, numpy.uint64]:
                 c = None # libtiff doesn't support compression on these types
             else:
                 c = compression
-            write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid)
+            write_image(f, im, write_rgb=write_rgb, compression=c, pyramid=pyramid,
+                        level=level)
 
 
 def _genResizedShapes(data):
@@ -1805,40 +1834,395 @@ def _ensure_fs_encoding(filename):
         return filename.encode(sys.getfilesystemencoding())
 
 
-def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
+def _getSampleFormat(dtype):
+    """
+    return (int): the TIFF sample format corresponding to the numpy dtype
+    raise NotImplementedError: if the dtype cannot be saved
+    """
+    if dtype.kind == "f":
+        return T.SAMPLEFORMAT_IEEEFP
+    elif dtype.kind in "ub":
+        return T.SAMPLEFORMAT_UINT
+    elif dtype.kind == "i":
+        return T.SAMPLEFORMAT_INT
+    elif dtype.kind == "c":
+        return T.SAMPLEFORMAT_COMPLEXIEEEFP
+    else:
+        raise NotImplementedError("Cannot save data of type %s" % (dtype,))
+
+
+def _compressBlockDeflate(block, predict, level=None):
+    """
+    Compress a strip or a tile with deflate
+    block (numpy.array of shape YX or YXS): the data
+    predict (bool): if True, the horizontal predictor is applied first
+    level (None or 0<=int<=9): compression level (None for the default)
+    return (bytes): the compressed data
     """
+    if predict:
+        # Note: the integer overflows are expected (and wrap around)
+        pblock = block.copy()
+        pblock[:, 1:] -= block[:, :-1]
+        block = pblock
+    return _compress.compress_deflate(numpy.ascontiguousarray(block), level)
+
+
+def _write_image_deflate(f, arr, write_rgb=False, level=None, tile_size=None):
+    """
+    Write an image compressed with deflate. The image is split in strips (or
+     tiles), which are compressed in parallel.
     f (libtiff file handle): Handle of a TIFF file
-    arr (DataArray): DataArray to be written to the file
-    compression (boolean): Compression type to be used on the TIFF file
+    arr (numpy.array): 2D image, or 3D if write_rgb
     write_rgb (boolean): True if the image is RGB, False if the image is grayscale
-    pyramid (boolean): whether the file should be saved in the pyramid format or not.
-      In this format, each image is saved along with different zoom levels
+    level (None or 0<=int<=9): compression level (None for the default)
+    tile_size (None or int): if not None, the image is tiled, with square tiles
+      of the given size. Otherwise, it's saved in strips.
     """
-    # if not pyramid, just save the image in the TIFF file, and return
-    if not pyramid:
-        f.write_image(arr, compression=compression, write_rgb=write_rgb)
-        return
+    arr = numpy.ascontiguousarray(arr)
+    sample_format = _getSampleFormat(arr.dtype)
+    # The horizontal predictor (= difference with the previous pixel) usually
+    # improves a lot the compression of microscope images
+    predict = arr.dtype.kind in "ui"
+
+    f.SetField(T.TIFFTAG_COMPRESSION, T.COMPRESSION_ADOBE_DEFLATE)
+    f.SetField(T.TIFFTAG_PREDICTOR, T.PREDICTOR_HORIZONTAL if predict else T.PREDICTOR_NONE)
+    f.SetField(T.TIFFTAG_BITSPERSAMPLE, arr.itemsize * 8)
+    f.SetField(T.TIFFTAG_SAMPLEFORMAT, sample_format)
+    f.SetField(T.TIFFTAG_ORIENTATION, T.ORIENTATION_TOPLEFT)
+
+    # Convert the image into a list of planes of shape YXS (S = samples per pixel)
+    if arr.ndim == 2:
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_MINISBLACK)
+        f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_CONTIG)
+        planes = [arr[:, :, numpy.newaxis]]
+        depth = 1
+    elif arr.ndim == 3 and write_rgb:
+        # Same as pylibtiff: guess the planar config, with preference for separate planes
+        if arr.shape[2] in (3, 4):
+            f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_CONTIG)
+            planes = [arr]
+            depth = arr.shape[2]
+        else:
+            f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_SEPARATE)
+            planes = [p[:, :, numpy.newaxis] for p in arr]
+            depth = arr.shape[0]
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_RGB)
+        f.SetField(T.TIFFTAG_SAMPLESPERPIXEL, depth)
+        if depth == 4:  # RGBA
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNASSALPHA])
+        elif depth > 4:  # No idea...
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNSPECIFIED] * (depth - 3))
+    else:
+        raise NotImplementedError("Cannot save image of shape %s" % (arr.shape,))
+
+    height, width, spp = planes[0].shape
+    f.SetField(T.TIFFTAG_IMAGEWIDTH, width)
+    f.SetField(T.TIFFTAG_IMAGELENGTH, height)
+
+    if tile_size:
+        f.SetField(T.TIFFTAG_TILEWIDTH, tile_size)
+        f.SetField(T.TIFFTAG_TILELENGTH, tile_size)
+
+        def get_blocks():
+            for p in planes:
+                for y in range(0, height, tile_size):
+                    for x in range(0, width, tile_size):
+                        tile = p[y:y + tile_size, x:x + tile_size]
+                        if tile.shape[:2] != (tile_size, tile_size):
+                            # Tiles on the border are always full size, filled with 0's
+                            ftile = numpy.zeros((tile_size, tile_size, spp), dtype=p.dtype)
+                            ftile[:tile.shape[0], :tile.shape[1]] = tile
+                            tile = ftile
+                        yield tile
+
+        write_block = T.libtiff.TIFFWriteRawTile
+    else:
+        rows = max(1, STRIP_SIZE // (width * spp * arr.itemsize))
+        f.SetField(T.TIFFTAG_ROWSPERSTRIP, rows)
+
+        def get_blocks():
+            for p in planes:
+                for y in range(0, height, rows):
+                    yield p[y:y + rows]
 
-    # generate the sizes of the zoom levels to be generated and saved
-    resized_shapes = _genResizedShapes(arr)
+        write_block = T.libtiff.TIFFWriteRawStrip
+
+    def compress(block):
+        return _compressBlockDeflate(block, predict, level)
+
+    for i, cdata in enumerate(_compress.imap_ordered(compress, get_blocks())):
+        r = write_block(f, i, cdata, len(cdata))
+        if r.value != len(cdata):
+            raise IOError("Failed to write block %d of the image" % (i,))
+
+    f.WriteDirectory()
+
+
+def _reduceHalf(band):
+    """
+    Reduce by 2 the size of an image, by averaging each block of 2x2 pixels.
+    band (numpy.array of shape YXS): the image (or part of it). If Y or X is odd,
+      the last row or column is dropped.
+    return (numpy.array of shape Y//2, X//2, S): the reduced image, of the same
+      dtype. Integers are rounded to the nearest value.
+    """
+    h, w = (band.shape[0] // 2) * 2, (band.shape[1] // 2) * 2
+    quads = band[0:h:2, 0:w:2], band[1:h:2, 0:w:2], band[0:h:2, 1:w:2], band[1:h:2, 1:w:2]
+    if band.dtype.kind in "fc":
+        acc = numpy.complex128 if band.dtype.kind == "c" else numpy.float64
+        total = quads[0].astype(acc) + quads[1] + quads[2] + quads[3]
+        return (total / 4).astype(band.dtype)
+    else:  # integers and booleans
+        acc = numpy.uint64 if band.dtype.kind == "u" else numpy.int64
+        total = quads[0].astype(acc) + quads[1] + quads[2] + quads[3]
+        return ((total + 2) // 4).astype(band.dtype)
+
+
+def _iterArrayBands(arr, separate):
+    """
+    Yields the bands of TILE_SIZE rows of an image
+    arr (numpy.array of shape YX, YXS, or SYX if separate)
+    separate (bool): True if the samples are the first dimension
+    yields (numpy.array of shape YXS): views on each band
+    """
+    if separate:
+        arr = arr.transpose(1, 2, 0)
+    elif arr.ndim == 2:
+        arr = arr[:, :, numpy.newaxis]
+    for y in range(0, arr.shape[0], TILE_SIZE):
+        yield arr[y:y + TILE_SIZE]
+
+
+def _iterShadowBands(das):
+    """
+    Yields the bands of TILE_SIZE rows of an image which is provided tile by tile
+    das (DataArrayShadow of shape YX or YXS): the image, with getTile() support
+    yields (numpy.array of shape YXS): each band
+    raise ValueError: if the tiles don't fit the shape of the image
+    """
+    tw, th = das.tile_shape[:2]
+    height, width = das.shape[:2]
+    ntx = int(math.ceil(width / tw))
+    pending = None  # rows received but not yet passed
+    for ty in range(int(math.ceil(height / th))):
+        row = numpy.concatenate([das.getTile(tx, ty, 0) for tx in range(ntx)], axis=1)
+        if row.ndim == 2:
+            row = row[:, :, numpy.newaxis]
+        if row.shape[1] != width:
+            raise ValueError("Tiles of row %d have a total width of %d px, while expected %d px"
+                             % (ty, row.shape[1], width))
+        pending = row if pending is None else numpy.concatenate([pending, row])
+        while pending.shape[0] >= TILE_SIZE:
+            yield pending[:TILE_SIZE]
+            pending = pending[TILE_SIZE:]
+
+    if pending is not None and pending.shape[0] > 0:
+        yield pending
+
+
+def _iterSpooledBands(spool, shape, dtype):
+    """
+    Yields the bands of TILE_SIZE rows of an image stored in a file
+    spool (file): the file containing the raw data, from the beginning
+    shape (tuple of 3 ints): shape of the image (YXS)
+    dtype (numpy.dtype): type of the data
+    yields (numpy.array of shape YXS): each band
+    """
+    row_size = shape[1] * shape[2] * dtype.itemsize
+    for y in range(0, shape[0], TILE_SIZE):
+        nrows = min(TILE_SIZE, shape[0] - y)
+        buf = spool.read(nrows * row_size)
+        yield numpy.frombuffer(buf, dtype=dtype).reshape((nrows,) + shape[1:])
+
+
+def _write_tiled_bands(f, bands, shape, dtype, separate, compression=None, level=None,
+                       on_band=None):
+    """
+    Write one tiled image, provided band by band.
+    f (libtiff file handle): Handle of a TIFF file
+    bands (iterable of numpy.array of shape YXS): the bands of TILE_SIZE rows
+      (the last one can be smaller)
+    shape (tuple of 3 ints): shape of the whole image (YXS)
+    dtype (numpy.dtype): type of the data
+    separate (bool): if True, each sample is stored in a separate plane (RGB only)
+    compression (None or str): Compression type (None or one of COMPRESSIONS)
+    level (None or int): compression level (only used for deflate)
+    on_band (None or callable (numpy.array)): called on each band, just after
+      it has been received
+    """
+    height, width, spp = shape
+    if compression == "deflate":
+        tcompression = T.COMPRESSION_ADOBE_DEFLATE
+        predict = dtype.kind in "ui"
+    elif compression == "lzw":
+        tcompression = T.COMPRESSION_LZW
+        predict = dtype.kind in "ui"
+    else:
+        tcompression = T.COMPRESSION_NONE
+        predict = False
+
+    # Same fields as pylibtiff's write_tiles()
+    f.SetField(T.TIFFTAG_COMPRESSION, tcompression)
+    if tcompression != T.COMPRESSION_NONE:
+        f.SetField(T.TIFFTAG_PREDICTOR, T.PREDICTOR_HORIZONTAL if predict else T.PREDICTOR_NONE)
+    f.SetField(T.TIFFTAG_BITSPERSAMPLE, dtype.itemsize * 8)
+    f.SetField(T.TIFFTAG_SAMPLEFORMAT, _getSampleFormat(dtype))
+    f.SetField(T.TIFFTAG_ORIENTATION, T.ORIENTATION_TOPLEFT)
+    f.SetField(T.TIFFTAG_TILEWIDTH, TILE_SIZE)
+    f.SetField(T.TIFFTAG_TILELENGTH, TILE_SIZE)
+    f.SetField(T.TIFFTAG_IMAGEWIDTH, width)
+    f.SetField(T.TIFFTAG_IMAGELENGTH, height)
+    f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_SEPARATE if separate else T.PLANARCONFIG_CONTIG)
+    if spp == 1 and not separate:
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_MINISBLACK)
+    else:
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_RGB)
+        f.SetField(T.TIFFTAG_SAMPLESPERPIXEL, spp)
+        if spp == 4:  # RGBA
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNASSALPHA])
+        elif spp > 4:  # No idea...
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNSPECIFIED] * (spp - 3))
+
+    ntx = int(math.ceil(width / TILE_SIZE))
+    nty = int(math.ceil(height / TILE_SIZE))
+
+    def get_tiles():
+        """
+        yields (int, int, int, numpy.array): index, x, y (in px), and data of each tile
+        """
+        for ty, band in enumerate(bands):
+            if on_band:
+                on_band(band)
+            if separate:
+                planes = [band[:, :, i:i + 1] for i in range(spp)]
+            else:
+                planes = [band]
+            for p, plane in enumerate(planes):
+                for tx in range(ntx):
+                    tile = plane[:, tx * TILE_SIZE:(tx + 1) * TILE_SIZE]
+                    # Tiles on the border are always full size, filled with 0's
+                    ftile = numpy.zeros((TILE_SIZE, TILE_SIZE, plane.shape[2]), dtype=dtype)
+                    ftile[:tile.shape[0], :tile.shape[1]] = tile
+                    yield (p * nty + ty) * ntx + tx, tx * TILE_SIZE, ty * TILE_SIZE, p, ftile
+
+    if tcompression == T.COMPRESSION_ADOBE_DEFLATE:
+        # Compress the tiles in parallel, and write them directly
+        def compress(tinfo):
+            return tinfo[0], _compressBlockDeflate(tinfo[-1], predict, level)
+
+        for i, cdata in _compress.imap_ordered(compress, get_tiles()):
+            r = T.libtiff.TIFFWriteRawTile(f, i, cdata, len(cdata))
+            if r.value != len(cdata):
+                raise IOError("Failed to write tile %d of the image" % (i,))
+    else:
+        # libtiff takes care of the compression
+        for i, x, y, p, tile in get_tiles():
+            r = f.WriteTile(tile.ctypes.data, x, y, 0, p)
+            if r.value < 0:
+                raise IOError("Failed to write tile %d of the image" % (i,))
+
+    f.WriteDirectory()
+
+
+def _write_pyramid(f, arr, compression=None, write_rgb=False, level=None):
+    """
+    Write an image as tiles, followed by all its zoom levels (as sub-IFDs).
+    Each zoom level is computed from the previous one (by averaging 2x2 pixels),
+    band by band, while the previous one is written. It is kept in a temporary
+    file (in memory if it is small) until it is written. So only a few bands of
+    tiles are in memory at the same time, whatever the size of the image.
+    f (libtiff file handle): Handle of a TIFF file
+    arr (DataArray or DataArrayShadow): the image, of shape YX, or YXC or CYX if
+      write_rgb. If it's a DataArrayShadow, it must support getTile(), and only
+      YX or YXC are supported.
+    compression (None or str): Compression type (None or one of COMPRESSIONS)
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    level (None or int): compression level (only used for deflate)
+    """
+    dtype = numpy.dtype(arr.dtype)
+    separate = False
+    if len(arr.shape) == 2:
+        shape = arr.shape + (1,)
+    elif len(arr.shape) == 3 and write_rgb:
+        # Same as pylibtiff: guess the planar config, with preference for separate planes
+        if arr.shape[2] in (3, 4):
+            shape = arr.shape
+        else:
+            separate = True
+            shape = arr.shape[1:] + arr.shape[:1]
+    else:
+        raise NotImplementedError("Cannot save image of shape %s" % (arr.shape,))
+
+    if isinstance(arr, model.DataArrayShadow):
+        if separate:
+            raise NotImplementedError("Cannot save tiled image of shape %s" % (arr.shape,))
+        bands = _iterShadowBands(arr)
+    else:
+        bands = _iterArrayBands(arr, separate)
+
+    # Number of zoom levels: reduce until the image is smaller than a tile
+    nzooms = 0
+    h, w = shape[:2]
+    while h >= TILE_SIZE and w >= TILE_SIZE:
+        nzooms += 1
+        h, w = h // 2, w // 2
 
     # do not write the SUBIFD tag when there are no subimages
-    if len(resized_shapes) > 0:
+    if nzooms > 0:
         # LibTIFF will automatically write the next N directories as subdirectories
         # when this tag is present.
-        f.SetField(T.TIFFTAG_SUBIFD, [0] * len(resized_shapes))
+        f.SetField(T.TIFFTAG_SUBIFD, [0] * nzooms)
 
-    # write the original image
-    f.write_tiles(arr, TILE_SIZE, TILE_SIZE, compression, write_rgb)
-    # generate the rescaled images and write the tiled image
-    for resized_shape in resized_shapes:
-        # rescale the image
-        subim = img.rescale_hq(arr, resized_shape)
+    prev_spool = None
+    for z in range(nzooms + 1):
+        if z > 0:
+            # Before writting the actual data, we set the special metadata
+            f.SetField(T.TIFFTAG_SUBFILETYPE, T.FILETYPE_REDUCEDIMAGE)
 
-        # Before writting the actual data, we set the special metadata
-        f.SetField(T.TIFFTAG_SUBFILETYPE, T.FILETYPE_REDUCEDIMAGE)
-        # write the tiled image to the TIFF file
-        f.write_tiles(subim, TILE_SIZE, TILE_SIZE, compression, write_rgb)
+        if z < nzooms:
+            # Generate the next zoom level while writing this one
+            spool = tempfile.SpooledTemporaryFile(max_size=PYRAMID_SPOOL_SIZE)
+
+            def reduce_band(band, spool=spool):
+                spool.write(numpy.ascontiguousarray(_reduceHalf(band)).tobytes())
+        else:
+            spool = None
+            reduce_band = None
+
+        _write_tiled_bands(f, bands, shape, dtype, separate, compression, level,
+                           on_band=reduce_band)
+
+        if prev_spool is not None:
+            prev_spool.close()
+        if spool is not None:
+            shape = (shape[0] // 2, shape[1] // 2, shape[2])
+            spool.seek(0)
+            bands = _iterSpooledBands(spool, shape, dtype)
+        prev_spool = spool
+
+
+def write_image(f, arr, compression=None, write_rgb=False, pyramid=False, level=None):
+    """
+    f (libtiff file handle): Handle of a TIFF file
+    arr (DataArray or DataArrayShadow): DataArray to be written to the file.
+      If pyramid is True, it can also be a DataArrayShadow with getTile(), in which
+      case the data is only read tile by tile.
+    compression (None or str): Compression type to be used on the TIFF file
+      (None or one of COMPRESSIONS)
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    pyramid (boolean): whether the file should be saved in the pyramid format or not.
+      In this format, each image is saved along with different zoom levels
+    level (None or int): compression level (only used for deflate)
+    """
+    # if not pyramid, just save the image in the TIFF file, and return
+    if not pyramid:
+        if compression == "deflate":
+            _write_image_deflate(f, arr, write_rgb, level)
+        else:
+            f.write_image(arr, compression=compression, write_rgb=write_rgb)
+        return
+
+    _write_pyramid(f, arr, compression, write_rgb, level)
 
 
 def export(filename, data, thumbnail=None, compressed=True, multiple_files=False, pyramid=False):
@@ -1851,15 +2235,25 @@ def export(filename, data, thumbnail=None, compressed=True, multiple_files=False
        Time, Z, Y, X. However, all the first dimensions of size 1 can be omitted
        (ex: an array of 111YX can be given just as YX, but RGB images are 311YX,
        so must always be 5 dimensions).
+       A DataArrayShadow supporting getTile() can also be passed. If pyramid is
+       True, its data is read tile by tile (so it doesn't need to fit in memory),
+       in which case it must be YX (or YXC, with MD_DIMS).
     thumbnail (None or numpy.array): Image used as thumbnail
       for the file. Can be of any (reasonable) size. Must be either 2D array
       (greyscale) or 3D with last dimension of length 3 (RGB). If the exporter
       doesn't support it, it will be dropped silently.
-    compressed (boolean): whether the file is compressed or not.
+    compressed (boolean or str): whether the file is compressed or not. It can
+      also be the name of the compression codec (one of COMPRESSIONS), optionally
+      followed by ":" and the compression level (eg, "deflate:9"). "gzip" is
+      also accepted, as a synonym of "deflate" (as in HDF5). True means LZW.
     multiple_files (boolean): whether the data is distributed across multiple
       files or not.
+    pyramid (boolean): whether the file should be saved in the pyramid format or not.
+      In this format, each image is saved along with different zoom levels
+    raise ValueError: if the compression is not supported
     '''
     filename = _ensure_fs_encoding(filename)
+    _compress.parse_compression(compressed, COMPRESSIONS, "lzw")  # Check early
     if isinstance(data, list):
         if multiple_files:
             if thumbnail is not None:
@@ -1878,7 +2272,7 @@ def export(filename, data, thumbnail=None, compressed=True, multiple_files=False
             _saveAsMultiTiffLT(filename, data, thumbnail, compressed, pyramid=pyramid)
     else:
         # TODO should probably not enforce it: respect duck typing
-        assert(isinstance(data, model.DataArray))
+        assert(isinstance(data, (model.DataArray, model.DataArrayShadow)))
         _saveAsMultiTiffLT(filename, [data], thumbnail, compressed, pyramid=pyramid)
 
 
@@ -1926,6 +2320,106 @@ def open_data(filename):
     return AcquisitionDataTIFF(filename)
 
 
+class _TiffHandlePool(object):
+    """
+    Opens the same TIFF file once per thread, so that several threads can read
+    tiles simultaneously. A libtiff handle holds the current directory as a
+    state, so it cannot be shared between threads without a lock.
+    The handles stay open until close() is called, or the pool is deleted (ie,
+    when the AcquisitionDataTIFF and all its DataArrayShadows are not used
+    anymore).
+    """
+
+    def __init__(self, filename):
+        """
+        filename (str): path to the TIFF file
+        """
+        self.filename = filename
+        self._local = threading.local()
+        # The handles are not hashable, so they are referred to by their id
+        self._handles = {}  # id -> TIFF: all the handles opened
+        self._users = {}  # id -> int: number of reads in progress with each handle
+        self._closing = set()  # id: handles to close as soon as they are not used
+        self._lock = threading.Lock()  # to protect ._handles, ._users, ._closing and ._local
+
+    def __del__(self):
+        self.close()
+
+    @contextmanager
+    def use(self, dir_index, subifd=None):
+        """
+        Context manager to use the handle of the current thread, set on the
+        given directory. The handle is not closed while it's being used, even
+        if close() is called.
+        dir_index (int): index of the directory in the TIFF file
+        subifd (None or int): offset of the sub-directory, or None for the
+          directory itself
+        yields (TIFF): the handle, only to be used from the current thread
+        """
+        with self._lock:
+            local = self._local
+            handle = getattr(local, "handle", None)
+        if handle is None:
+            handle = TIFF.open(self.filename, mode='r')
+            with self._lock:
+                self._handles[id(handle)] = handle
+                self._users[id(handle)] = 0
+                local = self._local  # In case close() was just called
+                local.handle = handle
+                local.pos = None
+
+        hid = id(handle)
+        with self._lock:
+            self._users[hid] += 1
+        try:
+            # Changing of directory requires re-reading the IFD, so avoid it
+            # when reading tiles in the same directory
+            pos = (dir_index, subifd)
+            if local.pos != pos:
+                local.pos = None  # In case of failure
+                handle.SetDirectory(dir_index)
+                if subifd is not None:
+                    handle.SetSubDirectory(subifd)
+                local.pos = pos
+            yield handle
+        finally:
+            with self._lock:
+                self._users[hid] -= 1
+                closing = (self._users[hid] == 0 and hid in self._closing)
+                if closing:
+                    del self._handles[hid]
+                    del self._users[hid]
+                    self._closing.discard(hid)
+            if closing:
+                self._close_handle(handle)
+
+    def close(self):
+        """
+        Close all the handles opened. The handles being used are closed as
+        soon as they are not used anymore. The pool can still be used
+        afterwards, in which case new handles will be opened.
+        """
+        with self._lock:
+            # Forget the handles in all the threads
+            self._local = threading.local()
+            handles = []
+            for hid, n in list(self._users.items()):
+                if n == 0:
+                    handles.append(self._handles.pop(hid))
+                    del self._users[hid]
+                else:
+                    self._closing.add(hid)
+
+        for h in handles:
+            self._close_handle(h)
+
+    def _close_handle(self, handle):
+        try:
+            handle.close()
+        except Exception:
+            logging.warning("Failed to close TIFF file %s", self.filename, exc_info=True)
+
+
 class DataArrayShadowTIFF(DataArrayShadow):
     """
     This class implements the read of a TIFF file
@@ -2028,6 +2522,8 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
             'tiff_file' (handle): Handle of the tiff file
             'dir_index' (int): Index of the directory
             'lock' (threading.Lock): The lock that controls the access to the TIFF file
+            'handles' (_TiffHandlePool, optional): per-thread handles of the
+              TIFF file, to read the tiles in parallel
         shape (tuple of int): The shape of the corresponding DataArray
         dtype (numpy.dtype): The data type
         metadata (dict str->val): The metadata
@@ -2051,8 +2547,11 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
         # add the number of subdirectories, and the main image
         if sub_ifds:
             maxzoom = len(sub_ifds)
+            # offset of each subimage, to avoid reading the tag for every tile
+            self._sub_ifds = tuple(sub_ifds)
         else:
             maxzoom = 0
+            self._sub_ifds = ()
 
         tile_shape = (num_tcols, num_trows)
 
@@ -2074,37 +2573,54 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
             # It is the case when the DataArray has multiple pixelData (eg, when data has more than 2D).
             raise NotImplementedError("DataArray has multiple pixelData")
 
-        with tiff_info['lock']:
-            tiff_file = tiff_info['handle']
-            tiff_file.SetDirectory(tiff_info['dir_index'])
+        if zoom != 0:
+            if not self._sub_ifds:
+                raise ValueError("Image does not have zoom levels")
 
-            if zoom != 0:
-                # get an array of offsets, one for each subimage
-                sub_ifds = tiff_file.GetField(T.TIFFTAG_SUBIFD)
-                if not sub_ifds:
-                    raise ValueError("Image does not have zoom levels")
+            if not (0 <= zoom <= len(self._sub_ifds)):
+                raise ValueError("Invalid Z value %d" % (zoom,))
 
-                if not (0 <= zoom <= len(sub_ifds)):
-                    raise ValueError("Invalid Z value %d" % (zoom,))
-
-                # set the offset of the subimage. Z=0 is the main image
-                tiff_file.SetSubDirectory(sub_ifds[zoom - 1])
+            # offset of the subimage. Z=0 is the main image
+            subifd = self._sub_ifds[zoom - 1]
+        else:
+            subifd = None
+
+        xp = x * self.tile_shape[0]
+        yp = y * self.tile_shape[1]
+        handles = tiff_info.get('handles')
+        if handles is None:
+            with tiff_info['lock']:
+                tiff_file = tiff_info['handle']
+                tiff_file.SetDirectory(tiff_info['dir_index'])
+                if subifd is not None:
+                    tiff_file.SetSubDirectory(subifd)
+                tile = tiff_file.read_one_tile(xp, yp)
+        else:
+            # Each thread has its own handle => no need to lock
+            with handles.use(tiff_info['dir_index'], subifd) as tiff_file:
+                tile = tiff_file.read_one_tile(xp, yp)
 
-            orig_pixel_size = self.metadata.get(model.MD_PIXEL_SIZE, (1, 1))
+        orig_pixel_size = self.metadata.get(model.MD_PIXEL_SIZE, (1, 1))
 
-            # calculate the pixel size of the tile for the zoom level
-            tile_pixel_size = tuple(ps * 2 ** zoom for ps in orig_pixel_size)
+        # calculate the pixel size of the tile for the zoom level
+        tile_pixel_size = tuple(ps * 2 ** zoom for ps in orig_pixel_size)
 
-            xp = x * self.tile_shape[0]
-            yp = y * self.tile_shape[1]
-            tile = tiff_file.read_one_tile(xp, yp)
-            tile = model.DataArray(tile, self.metadata.copy())
-            tile.metadata[model.MD_PIXEL_SIZE] = tile_pixel_size
-            # calculate the center of the tile
-            tile.metadata[model.MD_POS] = get_tile_md_pos((x, y), self.tile_shape, tile, self)
+        tile = model.DataArray(tile, self.metadata.copy())
+        tile.metadata[model.MD_PIXEL_SIZE] = tile_pixel_size
+        # calculate the center of the tile
+        tile.metadata[model.MD_POS] = get_tile_md_pos((x, y), self.tile_shape, tile, self)
 
         return tile
 
+    def getTiles(self, tiles):
+        '''
+        Fetches multiple tiles. The tiles are read in parallel.
+        tiles (iterable of (int, int, int)): X index, Y index and zoom level of
+          each tile, as for getTile().
+        return (list of DataArray): the tiles, in the same order as requested
+        '''
+        return list(_compress.imap_ordered(lambda xyz: self.getTile(*xyz), tiles))
+
 
 class AcquisitionDataTIFF(AcquisitionData):
     """
@@ -2118,6 +2634,7 @@ class AcquisitionDataTIFF(AcquisitionData):
         # lock to avoid race conditions when accessing the TIFF file (as libtiff
         # uses multiple calls to access a specific IFD/tile + tag.
         self._lock = threading.Lock()
+        self._handle_pools = []  # _TiffHandlePool of each file opened
         tiff_file = TIFF.open(filename, mode='r')
         try:
             data, thumbnails = self._getAllOMEDataArrayShadows(filename, tiff_file)
@@ -2128,6 +2645,16 @@ class AcquisitionDataTIFF(AcquisitionData):
 
         AcquisitionData.__init__(self, tuple(data), tuple(thumbnails))
 
+    def close(self):
+        """
+        Close the extra handles opened to read the tiles of the file(s).
+        The data can still be read afterwards, but it will reopen the file(s).
+        Note: it's not required to call it, as the handles are also closed when
+        this object and all its DataArrayShadows are deleted.
+        """
+        for handles in self._handle_pools:
+            handles.close()
+
     def _getAllDataArrayShadows(self, tfile, lock):
         """
         Create the all DataArrayShadows for the given TIFF file
@@ -2142,9 +2669,12 @@ class AcquisitionDataTIFF(AcquisitionData):
         """
         data = []
         thumbnails = []
+        # Extra handles on the same file, to read the tiles from multiple threads
+        handles = _TiffHandlePool(os.path.abspath(tfile.FileName()))
+        self._handle_pools.append(handles)
         # iterates all the directories of the TIFF file
         for dir_index in self._iterDirectories(tfile):
-            das, is_thumb = self._createDataArrayShadows(tfile, dir_index, lock)
+            das, is_thumb = self._createDataArrayShadows(tfile, dir_index, lock, handles)
             if is_thumb:
                 data.append(None)
                 thumbnails.append(das)
@@ -2318,12 +2848,14 @@ class AcquisitionDataTIFF(AcquisitionData):
         raise LookupError("No OME XML data found")
 
     @staticmethod
-    def _createDataArrayShadows(tfile, dir_index, lock):
+    def _createDataArrayShadows(tfile, dir_index, lock, handles=None):
         """
         Create the DataArrayShadow from the TIFF metadata for the current directory
         tfile (tiff handle): Handle for the TIFF file
         dir_index (int): Index of the directory in the TIFF file
         lock (threading.Lock): The lock that controls the access to the TIFF file
+        handles (None or _TiffHandlePool): per-thread handles for the TIFF file,
+          used to read the tiles in parallel (if the image is tiled)
         return:
             das (DataArrayShadows): DataArrayShadows representing the image
             is_thumbnail (bool): True if the image is a thumbnail
@@ -2350,8 +2882,10 @@ class AcquisitionDataTIFF(AcquisitionData):
         # and it is not a part of DataArrayShadow class
         # It can also be a a list of tiff_info,
         # in case the DataArray has multiple pixelData (eg, when data has more than 2D).
-        # Add also the lock of the TIFF file
+        # Add also the lock of the TIFF file, and the per-thread handles
         tiff_info = {'handle': tfile, 'dir_index': dir_index, 'lock': lock}
+        if handles is not None:
+            tiff_info['handles'] = handles
         das = DataArrayShadowTIFF(tiff_info, shape, typ, md)
 
         return das, _isThumbnail(tfile)
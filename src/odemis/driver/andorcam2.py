@@ -730,6 +730,8 @@ class AndorCam2(model.DigitalCamera):
 
         self.acquisition_lock = threading.Lock()
         self.acquire_must_stop = threading.Event()
+        # To avoid allocating new memory for each frame
+        self._buffer_pool = model.BufferPool()
         self.acquire_thread = None
 
         # For temporary stopping the acquisition (kludge for the andorshrk
@@ -1833,23 +1835,22 @@ class AndorCam2(model.DigitalCamera):
 
         return im_res
 
-    def _allocate_buffer(self, size):
+    def _allocate_buffer(self, size, metadata=None):
         """
-        returns a cbuffer of the right size for an image
+        Rents a buffer from the pool, to receive an image
+        size (2-tuple of int): width, height
+        metadata (dict): metadata of the DataArray
+        return (DataArray of uint16 of shape H, W): the buffer. It's automatically
+          given back to the pool when not used anymore.
         """
-        cbuffer = (c_uint16 * (size[0] * size[1]))() # empty array
-        return cbuffer
+        return self._buffer_pool.get((size[1], size[0]), numpy.uint16, metadata) # numpy shape is H, W
 
-    def _buffer_as_array(self, cbuffer, size, metadata=None):
+    def _read_most_recent_image(self, array):
         """
-        Converts the buffer allocated for the image as an ndarray. zero-copy
-        size (2-tuple of int): width, height
-        return an ndarray
+        Copies the latest image acquired into the given buffer
+        array (ndarray of uint16): C-contiguous buffer, of the size of the image
         """
-        p = cast(cbuffer, POINTER(c_uint16))
-        ndbuffer = numpy.ctypeslib.as_array(p, (size[1], size[0])) # numpy shape is H, W
-        dataarray = model.DataArray(ndbuffer, metadata)
-        return dataarray
+        self.atcore.GetMostRecentImage16(c_void_p(array.ctypes.data), c_uint32(array.size))
 
     def acquireOne(self):
         """
@@ -1878,9 +1879,8 @@ class AndorCam2(model.DigitalCamera):
             duration = max(kinetic, exposure + readout)
             self.WaitForAcquisition(duration + 1)
 
-            cbuffer = self._allocate_buffer(size)
-            self.atcore.GetMostRecentImage16(cbuffer, c_uint32(size[0] * size[1]))
-            array = self._buffer_as_array(cbuffer, size, metadata)
+            array = self._allocate_buffer(size, metadata)
+            self._read_most_recent_image(array)
 
             self.atcore.FreeInternalMemory() # TODO not sure it's needed
             return self._transposeDAToUser(array)
@@ -1965,8 +1965,7 @@ class AndorCam2(model.DigitalCamera):
                 tstart = time.time()
                 tend = tstart + duration
                 metadata[model.MD_ACQ_DATE] = tstart # time at the beginning
-                cbuffer = self._allocate_buffer(size)
-                array = self._buffer_as_array(cbuffer, size, metadata)
+                array = self._allocate_buffer(size, metadata)
 
                 # we don't know when it started acquiring, so we just keep
                 # poking (to also be able to detect cancellation)
@@ -1990,7 +1989,7 @@ class AndorCam2(model.DigitalCamera):
                             break # new image!
                     # it might have acquired _several_ images in the time to process
                     # one image. In this case we discard all but the last one.
-                    self.atcore.GetMostRecentImage16(cbuffer, c_uint32(size[0] * size[1]))
+                    self._read_most_recent_image(array)
                 except AndorV2Error as ex:
                     # try again up to 5 times
                     failures += 1
@@ -2019,11 +2018,7 @@ class AndorCam2(model.DigitalCamera):
 
                 logging.debug("image acquired successfully after %g s", time.time() - tstart)
                 callback(self._transposeDAToUser(array))
-                del cbuffer, array
-
-                # force the GC to non-used buffers, for some reason, without this
-                # the GC runs only after we've managed to fill up the memory
-                gc.collect()
+                del array  # the buffer goes back to the pool (if not used anymore)
         except CancelledError:
             # received a must-stop event
             pass
@@ -2098,8 +2093,7 @@ class AndorCam2(model.DigitalCamera):
                 tend = tstart + duration
                 metadata = dict(self._metadata) # duplicate
                 metadata[model.MD_ACQ_DATE] = tstart
-                cbuffer = self._allocate_buffer(size)
-                array = self._buffer_as_array(cbuffer, size, metadata)
+                array = self._allocate_buffer(size, metadata)
 
                 # first we wait ourselves the typical time (which might be very long)
                 # while detecting requests for stop
@@ -2128,7 +2122,7 @@ class AndorCam2(model.DigitalCamera):
 
                     # Normally only one image has been produced as it's on a
                     # software trigger, but just in case, discard older images.
-                    self.atcore.GetMostRecentImage16(cbuffer, c_uint32(size[0] * size[1]))
+                    self._read_most_recent_image(array)
                 except AndorV2Error as ex:
                     # try again up to 5 times
                     failures += 1
@@ -2157,11 +2151,7 @@ class AndorCam2(model.DigitalCamera):
 
                 logging.debug("image acquired successfully after %g s", time.time() - tstart)
                 callback(self._transposeDAToUser(array))
-                del cbuffer, array
-
-                # force the GC to non-used buffers, for some reason, without this
-                # the GC runs only after we've managed to fill up the memory
-                gc.collect()
+                del array  # the buffer goes back to the pool (if not used anymore)
         except CancelledError:
             # received a must-stop event
             pass
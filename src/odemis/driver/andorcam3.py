@@ -368,6 +368,8 @@ class AndorCam3(model.DigitalCamera):
 
         self.acquisition_lock = threading.Lock()
         self.acquire_must_stop = threading.Event()
+        # To avoid allocating new memory for each frame
+        self._buffer_pool = model.BufferPool()
         self.acquire_thread = None
         # for synchronized acquisition
         self._got_event = threading.Event()
@@ -616,9 +618,9 @@ class AndorCam3(model.DigitalCamera):
 
     def QueueBuffer(self, cbuffer):
         """
-        cbuffer (ctypes.array): the buffer to queue
+        cbuffer (ndarray of uint8): the buffer to queue (C-contiguous and aligned)
         """
-        self.atcore.AT_QueueBuffer(self.handle, cbuffer, sizeof(cbuffer))
+        self.atcore.AT_QueueBuffer(self.handle, c_void_p(cbuffer.ctypes.data), cbuffer.nbytes)
 
     def WaitBuffer(self, timeout=None):
         """
@@ -1430,19 +1432,16 @@ class AndorCam3(model.DigitalCamera):
     def _allocate_buffer(self, size):
         """
         size (3 ints)
-        returns a cbuffer of the right size for an image
+        returns (ndarray of uint8): a buffer of the right size for an image,
+          rented from the pool (so it's recycled when not used anymore)
         """
         image_size = self.GetInt(u"ImageSizeBytes")
         # The buffer might be bigger than AOIStride * AOIHeight if there is metadata
         assert image_size >= (size[0] * size[1] * size[2])
 
-        # allocating directly a numpy array doesn't work if there is metadata:
-        # ndbuffer = numpy.empty(shape=(stride / 2, size[1]), dtype="uint16")
-        # cbuffer = numpy.ctypeslib.as_ctypes(ndbuffer)
-        cbuffer = (c_byte * image_size)() # empty array
-        assert(addressof(cbuffer) % 8 == 0) # the SDK wants it aligned
-
-        return cbuffer
+        # The buffer is a raw array of bytes, as it also contains the metadata.
+        # It's aligned on a memory page, so it's fine for the SDK (wants 8 bytes).
+        return self._buffer_pool.get((image_size,), numpy.uint8)
 
     def _buffer_as_array(self, cbuffer, size, metadata=None):
         """
@@ -1453,9 +1452,9 @@ class AndorCam3(model.DigitalCamera):
         """
         itemsize = size[2]
         if itemsize == 4:
-            ityp = c_uint32
+            ityp = numpy.uint32
         else:
-            ityp = c_uint16
+            ityp = numpy.uint16
 
         # actual size of a line in pixels
         try:
@@ -1464,8 +1463,8 @@ class AndorCam3(model.DigitalCamera):
             # SimCam doesn't support stride
             stride = self.GetInt(u"AOIWidth")
 
-        p = cast(cbuffer, POINTER(ityp))
-        ndbuffer = numpy.ctypeslib.as_array(p, (size[1], stride))  # numpy shape is H, W
+        ndbuffer = cbuffer[:size[1] * stride * itemsize].view(ityp)
+        ndbuffer.shape = (size[1], stride)  # numpy shape is H, W
         dataarray = model.DataArray(ndbuffer, metadata)
         # crop the array in case of stride (should not cause copy)
         return dataarray[:, :size[0]]
@@ -1483,7 +1482,7 @@ class AndorCam3(model.DigitalCamera):
         # Metadata is read from the end to the beginning of the data
         # ...TAG | CID | LENGTH
         # Length is the length of the tag + CID
-        addl = addressof(cbuffer) + len(cbuffer) - LENGTH_FIELD_SIZE
+        addl = cbuffer.ctypes.data + cbuffer.nbytes - LENGTH_FIELD_SIZE
         while addl > data_size:
             pl = cast(addl, POINTER(c_uint32))
             l = pl.contents.value
@@ -1533,13 +1532,11 @@ class AndorCam3(model.DigitalCamera):
                                                args=(callback,))
         self.acquire_thread.start()
 
-    GC_PERIOD = 10 # how often the garbage collector should run (in number of buffers)
     def _acquire_thread_run(self, callback):
         """
         The core of the acquisition thread. Runs until acquire_must_stop is True.
         """
         nbuffers = 2
-        num_gc = 0
         num_errors = 0
         need_reinit = True
         logging.debug("beginning of acq thread")
@@ -1644,14 +1641,7 @@ class AndorCam3(model.DigitalCamera):
                                       metadata[model.MD_ACQ_DATE] - hw_ts)
 
                 callback(self._transposeDAToUser(array))
-                del cbuffer, array
-
-                # force the GC to free non-used buffers, for some reason, without
-                # this the GC runs only after we've managed to fill up the memory
-                num_gc += 1
-                if num_gc >= self.GC_PERIOD:
-                    gc.collect()
-                    num_gc = 0
+                del cbuffer, array  # the buffer goes back to the pool (if not used anymore)
         except CancelledError:
             # received a must-stop event
             pass
@@ -1712,7 +1702,7 @@ class AndorCam3(model.DigitalCamera):
         # memory allocation... and it'd get free'd at the end of the method
         # So rely on the assumption cbuffer is used as is
         cbuffer = buffers.pop(0)
-        assert(addressof(pbuffer.contents) == addressof(cbuffer))
+        assert(addressof(pbuffer.contents) == cbuffer.ctypes.data)
 
         # Check if there is already a newer image
         discarded = 0
@@ -1736,7 +1726,7 @@ class AndorCam3(model.DigitalCamera):
 
             # get the newer image (and forget about the old one)
             cbuffer = buffers.pop(0)
-            assert(addressof(pbuffer.contents) == addressof(cbuffer))
+            assert(addressof(pbuffer.contents) == cbuffer.ctypes.data)
 
         if discarded > 0:
             if discarded >= max_discard:
@@ -30,7 +30,6 @@ from __future__ import division
 
 import collections
 from ctypes import *
-import gc
 import logging
 import math
 import numpy
@@ -359,6 +358,8 @@ class PVCam(model.DigitalCamera):
                                               unit="s", setter=self._setShutterPeriod)
         self.acquisition_lock = threading.Lock()
         self.acquire_must_stop = threading.Event()
+        # To avoid allocating new memory for each frame
+        self._buffer_pool = model.BufferPool()
         self.acquire_thread = None
         # for synchronized acquisition
         self._cbuffer = None
@@ -1024,19 +1025,19 @@ class PVCam(model.DigitalCamera):
     def _allocate_buffer(self, length):
         """
         length (int): number of bytes requested by pl_exp_setup
-        returns a cbuffer of the right type for an image
+        returns (ndarray of uint16): a buffer of the right type for an image,
+          rented from the pool (so it's recycled when not used anymore)
         """
-        cbuffer = (c_uint16 * (length // 2))() # empty array
-        return cbuffer
+        return self._buffer_pool.get((length // 2,), numpy.uint16)
 
-    def _buffer_as_array(self, cbuffer, size, metadata=None):
+    def _buffer_as_array(self, buf, size, metadata=None):
         """
         Converts the buffer allocated for the image as an ndarray. zero-copy
+        buf (ndarray of uint16): the buffer
         size (2-tuple of int): width, height
         return an ndarray
         """
-        p = cast(cbuffer, POINTER(c_uint16))
-        ndbuffer = numpy.ctypeslib.as_array(p, (size[1], size[0])) # numpy shape is H, W
+        ndbuffer = buf[:size[0] * size[1]].reshape(size[1], size[0]) # numpy shape is H, W
         dataarray = model.DataArray(ndbuffer, metadata)
         return dataarray
 
@@ -1090,7 +1091,6 @@ class PVCam(model.DigitalCamera):
                     self.pvcam.pl_exp_setup_seq(self._handle, 1, 1, byref(region),
                                                 pv.TIMED_MODE, exp_ms, byref(blength))
                     logging.debug("acquisition setup report buffer size of %d", blength.value)
-                    cbuffer = self._allocate_buffer(blength.value) # TODO shall allocate a new buffer every time?
                     assert (blength.value / 2) >= (size[0] * size[1])
 
                     readout_sw = size[0] * size[1] * self._metadata[model.MD_READOUT_TIME] # s
@@ -1101,7 +1101,10 @@ class PVCam(model.DigitalCamera):
                     duration = exposure + readout # seems it actually takes +40ms
                     need_init = False
 
-                # Acquire the image
+                # Acquire the image, in a new buffer, as the previous one might
+                # still be used by the receivers of the previous image.
+                buf = self._allocate_buffer(blength.value)
+                cbuffer = c_void_p(buf.ctypes.data)
                 # Note: might be unlocked slightly too early in case of must_stop,
                 # but should be very rare and not too much of a problem hopefully.
                 with self._online_lock:
@@ -1111,7 +1114,7 @@ class PVCam(model.DigitalCamera):
                     metadata[model.MD_ACQ_DATE] = start
                     expected_end = start + duration
                     timeout = expected_end + 1
-                    array = self._buffer_as_array(cbuffer, size, metadata)
+                    array = self._buffer_as_array(buf, size, metadata)
 
                     # wait a bounded time until the image is acquired
                     try:
@@ -1158,10 +1161,7 @@ class PVCam(model.DigitalCamera):
                 retries = 0
                 logging.debug("image acquired successfully after %g s", time.time() - start)
                 callback(self._transposeDAToUser(array))
-
-                # force the GC to non-used buffers, for some reason, without this
-                # the GC runs only after we've managed to fill up the memory
-                gc.collect()
+                del array  # the buffer goes back to the pool (if not used anymore)
         except CancelledError:
             # received a must-stop event
             pass
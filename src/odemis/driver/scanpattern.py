@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Scan patterns for the scanners which drive the e-beam position point by point
+# (eg, semcomedi). A scan pattern defines in which order the pixels of the
+# region of interest are scanned. It generates the waveform (the X/Y values to
+# write for each point), and converts back the data read (as lines, like the
+# waveform) into the image.
+# The waveform is a 3D array of shape N x (M + margin) x 2: N lines of M points,
+# each line starting with "margin" extra points to let the beam settle after
+# jumping to the beginning of the line. The last dimension contains the Y and X
+# values. All the dimensions follow the numpy convention (ie, Y first).
+
+from __future__ import division
+
+import numpy
+
+
+class ScanPattern(object):
+    """
+    Base class for the scan patterns. It's immutable, and two patterns with the
+    same .key() generate the same waveforms.
+    """
+    name = None
+
+    def key(self):
+        """
+        return (tuple): identifies the pattern (hashable)
+        """
+        return (self.name,)
+
+    def __eq__(self, other):
+        return isinstance(other, ScanPattern) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(repr(k) for k in self.key()[1:]))
+
+    def generate(self, shape, limits, margin):
+        """
+        Generate the waveform to scan the area
+        shape (list of 2 int): H/W of the scanning area (slow, fast axis)
+        limits (2x2 ndarray): the min/max values of H/W
+        margin (0<=int): number of additional points needed at the beginning
+          of each line, for the beam to settle after a fly-back
+        return:
+          scan (3D ndarray of N x (M + margin2) x 2): the Y/X values for each
+            point, with the same type as the limits
+          margin2 (0<=int): number of additional points actually added at the
+            beginning of each line
+        """
+        raise NotImplementedError()
+
+    def toImage(self, shape, data):
+        """
+        Place back the data acquired into the image
+        shape (list of 2 int): H/W of the scanning area
+        data (2D ndarray of N x M): the data acquired with the waveform, with
+          the margin already removed
+        return (2D ndarray of shape): the image, with the same type as data.
+          The pixels not scanned are 0.
+        """
+        raise NotImplementedError()
+
+
+def _linspace(limits, num):
+    """
+    return (ndarray of float): the value of each pixel along one axis
+    """
+    # Force the conversion to full number (e.g., instead of uint16), which
+    # avoids linspace() to go crazy when limits are going down.
+    return numpy.linspace(float(limits[0]), float(limits[1]), num)
+
+
+class RasterPattern(ScanPattern):
+    """
+    Scans each line from left to right, and lines from top to bottom. It's
+    basically a saw-tooth curve on the W dimension and a linear increase on the
+    H dimension.
+    """
+    name = "raster"
+
+    def generate(self, shape, limits, margin):
+        # prepare an array of the right type
+        full_shape = (shape[0], shape[1] + margin, 2)
+        scan = numpy.empty(full_shape, dtype=limits.dtype, order='C')
+
+        # fill the Y dimension
+        scany = scan[:, :, 0].swapaxes(0, 1)  # just a view to have Y as last dim
+        scany[:, :] = _linspace(limits[0], shape[0])
+        # fill the X dimension
+        scan[:, margin:, 1] = _linspace(limits[1], shape[1])
+
+        # fill the margin with the first pixel (Y dimension is already filled)
+        if margin:
+            fp = scan[:, margin, 1]
+            # use the transpose, as the broadcast rule is to extend on the row
+            scan[:, :margin, 1].T[:] = fp
+
+        return scan, margin
+
+    def toImage(self, shape, data):
+        return data
+
+
+class SerpentinePattern(RasterPattern):
+    """
+    Scans the even lines from left to right, and the odd lines from right to
+    left. As the beam only moves by one pixel between two lines, there is no
+    fly-back, so no margin is needed.
+    """
+    name = "serpentine"
+
+    def generate(self, shape, limits, margin):
+        scan, _ = RasterPattern.generate(self, shape, limits, 0)
+        # Copy, as in-place assignment from an overlapping view is unsafe on numpy < 1.13
+        scan[1::2, :, 1] = scan[1::2, ::-1, 1].copy()
+        return scan, 0
+
+    def toImage(self, shape, data):
+        img = data.copy()
+        img[1::2] = data[1::2, ::-1]
+        return img
+
+
+class InterlacedPattern(RasterPattern):
+    """
+    Scans the lines in several passes (fields): first the lines 0, n, 2n...,
+    then the lines 1, n+1, 2n+1... Each line is scanned as in raster.
+    """
+    name = "interlaced"
+
+    def __init__(self, fields=2):
+        """
+        fields (1<=int): number of passes
+        """
+        if fields < 1:
+            raise ValueError("Interlaced pattern needs at least 1 field, but got %s" % (fields,))
+        self._fields = int(fields)
+
+    def key(self):
+        return (self.name, self._fields)
+
+    def _getOrder(self, height):
+        """
+        return (ndarray of int): index of the image line for each line scanned
+        """
+        return numpy.concatenate([numpy.arange(f, height, self._fields)
+                                  for f in range(self._fields)])
+
+    def generate(self, shape, limits, margin):
+        scan, margin = RasterPattern.generate(self, shape, limits, margin)
+        return scan[self._getOrder(shape[0])], margin
+
+    def toImage(self, shape, data):
+        img = numpy.empty_like(data)
+        img[self._getOrder(shape[0])] = data
+        return img
+
+
+class PointListPattern(ScanPattern):
+    """
+    Scans only some pixels, in the given order. Consecutive pixels on the
+    same line, going right, are scanned as one line. For any other move, the
+    beam is given time to settle (margin), as after a fly-back.
+    """
+    name = "points"
+
+    def __init__(self, points):
+        """
+        points (list of (0<=int, 0<=int)): position (X, Y) in px of each pixel
+          to scan, in order.
+        """
+        points = numpy.array(points, dtype=numpy.int64)
+        if points.ndim != 2 or points.shape[1] != 2 or not points.size:
+            raise ValueError("Points should be a list of 2 ints, but got shape %s" %
+                             (points.shape,))
+        if (points < 0).any():
+            raise ValueError("Points should have positive positions")
+        self._points = points[:, ::-1]  # Y/X
+        self._points.flags.writeable = False
+        self._layout = (None, None)  # shape -> layout, of the last shape used
+
+    def key(self):
+        return (self.name, self._points.tobytes())
+
+    def __repr__(self):
+        return "%s(%d points)" % (self.__class__.__name__, len(self._points))
+
+    def _getPoints(self, shape):
+        """
+        shape (list of 2 int): H/W of the scanning area
+        return (2D ndarray of int of N x 2): position (Y, X) of each pixel to scan
+        raise ValueError: if a point is outside of the area
+        """
+        if (self._points >= shape).any():
+            raise ValueError("Points outside of the scanning area %s" % (tuple(shape),))
+        return self._points
+
+    def _getLayout(self, shape):
+        """
+        Cut the points into lines of consecutive pixels
+        return:
+          points (2D ndarray of int of N x 2): position (Y, X) of each pixel
+          line (ndarray of int of N): index of the line of each pixel
+          col (ndarray of int of N): index of each pixel in its line
+          starts (ndarray of int): index of the first pixel of each line
+          length (int): number of points of the longest line
+        """
+        # The same layout is typically needed for generating the waveform, and
+        # then for every image acquired.
+        lshape, layout = self._layout
+        if lshape == tuple(shape):
+            return layout
+
+        points = self._getPoints(shape)
+        ys, xs = points[:, 0], points[:, 1]
+        new = numpy.ones(len(points), dtype=numpy.bool_)
+        new[1:] = (ys[1:] != ys[:-1]) | (xs[1:] <= xs[:-1])
+        starts = numpy.flatnonzero(new)
+        line = numpy.cumsum(new) - 1
+        col = numpy.arange(len(points)) - starts[line]
+        length = int(col.max()) + 1
+        layout = points, line, col, starts, length
+        self._layout = (tuple(shape), layout)
+        return layout
+
+    def generate(self, shape, limits, margin):
+        points, line, col, starts, length = self._getLayout(shape)
+        # The shorter lines are completed by staying on their last pixel
+        lengths = numpy.diff(numpy.append(starts, len(points)))
+        idx = starts[:, None] + numpy.minimum(numpy.arange(length), lengths[:, None] - 1)
+
+        scan = numpy.empty((len(starts), length + margin, 2), dtype=limits.dtype)
+        scan[:, margin:, 0] = _linspace(limits[0], shape[0])[points[idx, 0]]
+        scan[:, margin:, 1] = _linspace(limits[1], shape[1])[points[idx, 1]]
+        # fill the margin with the first pixel of each line
+        scan[:, :margin] = scan[:, margin:margin + 1]
+        return scan, margin
+
+    def toImage(self, shape, data):
+        points, line, col, _, _ = self._getLayout(shape)
+        img = numpy.zeros(shape, dtype=data.dtype)
+        img[points[:, 0], points[:, 1]] = data[line, col]
+        return img
+
+
+class RandomPattern(PointListPattern):
+    """
+    Scans a random subset of the pixels, in raster order. Each pixel has the
+    same probability to be scanned. The subset is always the same for a given
+    area, fraction and seed.
+    """
+    name = "random"
+
+    def __init__(self, fraction, seed=0):
+        """
+        fraction (0<float<=1): ratio of pixels scanned
+        seed (int): seed of the random generator
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError("Fraction should be between 0 and 1, but got %s" % (fraction,))
+        self._fraction = fraction
+        self._seed = seed
+        self._layout = (None, None)
+
+    def key(self):
+        return (self.name, self._fraction, self._seed)
+
+    def __repr__(self):
+        return "%s(%s, seed=%s)" % (self.__class__.__name__, self._fraction, self._seed)
+
+    def _getPoints(self, shape):
+        rng = numpy.random.RandomState(self._seed)
+        idx = numpy.flatnonzero(rng.random_sample(shape[0] * shape[1]) < self._fraction)
+        if not idx.size:  # At least one pixel
+            idx = numpy.array([0])
+        return numpy.column_stack(numpy.unravel_index(idx, shape))
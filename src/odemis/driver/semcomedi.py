@@ -33,8 +33,10 @@ import numpy
 from numpy.core import umath
 from odemis import model
 import odemis
+from odemis.driver.scanpattern import ScanPattern, RasterPattern
 from odemis.model import roattribute, oneway
 from odemis.util import driver
+from odemis.util.cache import LRUCache
 import os
 import re
 import threading
@@ -110,6 +112,9 @@ NI_AO_TRIG_AI_START1 = 19  # Trigger number for AI Start1 (= beginning of a comm
 ACQ_CMD_UPD = 1
 ACQ_CMD_TERM = 2
 
+# Maximum memory used to keep the scan waveforms previously computed
+SCAN_CACHE_SIZE = 256 * 2 ** 20  # B
+
 # helper functions
 def get_best_dtype_for_acc(idtype, count):
     """
@@ -1077,11 +1082,25 @@ class SEMComedi(model.HwComponent):
             acc = umath.add.reduce(tr_rect, axis=2, dtype=adtype)
             umath.true_divide(acc, osr, out=oarray, casting='unsafe', subok=False)
 
+    def _get_max_pixels_per_cmd(self, nrchans, nsamples):
+        """
+        Computes how many pixels can be acquired in one command
+        nrchans (0<=int): number of read channels
+        nsamples (1<=int): number of samples read per pixel and per channel
+        return (1<=int): maximum number of pixels per command
+        """
+        if self._scanner.newPosition.hasListeners():
+            # One command per pixel, so that the newPosition events are sent
+            # as precisely as possible.
+            return 1
+        pixelsz = max(1, nrchans) * nsamples * self._reader.dtype.itemsize
+        return max(1, self._max_bufsz // pixelsz)
+
     def _write_read_2d_pixel(self, wchannels, wranges, rchannels, rranges,
                              period, margin, osr, dpr, data):
         """
-        Implementation of write_read_2d_data_raw by reading the input data one
-          pixel at a time.
+        Implementation of write_read_2d_data_raw by reading the input data a
+          few pixels at a time (as many as fit in the buffer, on the same line).
         """
         rshape = (data.shape[0], data.shape[1] - margin)
 
@@ -1089,29 +1108,33 @@ class SEMComedi(model.HwComponent):
         buf = []
         for c in rchannels:
             buf.append(numpy.empty(rshape, dtype=self._reader.dtype))
-        adtype = get_best_dtype_for_acc(self._reader.dtype, osr)
+        adtype = get_best_dtype_for_acc(self._reader.dtype, osr * dpr)
 
         # TODO: as we do point per point, we could do the margin (=settle time)
         # shorter than a standard point
-        logging.debug(u"Reading one pixel at a time: %d samples/read every %g µs",
-                      dpr * osr * len(rchannels), period * 1e6)
-        wdata = numpy.empty((dpr, data.shape[2]), dtype=data.dtype) # just one pixel
-        # read one pixel at a time
-        for x, y in numpy.ndindex(data.shape[0], data.shape[1]):
-            wdata[:] = data[x, y, :] # copy the same pixel data * dpr
-            if y < margin:
-                ss = dpr
-            else:
-                ss = 0
-            islast = ((x + 1, y + 1) == data.shape)
-            rbuf = self._write_read_raw_one_cmd(wchannels, wranges, rchannels,
-                                    rranges, period / dpr, osr, wdata, ss,
-                                    rest=(islast and self._scanner.fast_park))
+        maxpx = self._get_max_pixels_per_cmd(len(rchannels), osr * dpr)
+        logging.debug(u"Reading up to %d pixels at a time: %d samples/pixel every %g µs",
+                      maxpx, dpr * osr * len(rchannels), period * 1e6)
+        for x in range(data.shape[0]):
+            for y in range(0, data.shape[1], maxpx):
+                ey = min(y + maxpx, data.shape[1])
+                # copy the same pixel data * dpr
+                wdata = numpy.repeat(data[x, y:ey, :], dpr, axis=0)
+                # The margin pixels are always at the beginning of the batch
+                ss = max(0, min(margin, ey) - y) * dpr
+                islast = (x + 1 == data.shape[0] and ey == data.shape[1])
+                rbuf = self._write_read_raw_one_cmd(wchannels, wranges, rchannels,
+                                        rranges, period / dpr, osr, wdata, ss,
+                                        rest=(islast and self._scanner.fast_park))
 
-            # decimate into each buffer
-            for i, b in enumerate(buf):
-                self._scan_raw_to_pixel(rshape, margin, osr, dpr, x, y,
-                                        rbuf[..., i], b, adtype)
+                # decimate into each buffer, skipping the margin
+                sy = max(y, margin)
+                if sy >= ey:
+                    continue
+                rbuf = rbuf[(sy - y) * dpr * osr:]
+                for i, b in enumerate(buf):
+                    self._scan_raw_to_pixels(osr * dpr, rbuf[..., i],
+                                             b[x, sy - margin:ey - margin], adtype)
         return buf
 
     def _write_read_2d_subpixel(self, wchannels, wranges, rchannels, rranges,
@@ -1129,34 +1152,52 @@ class SEMComedi(model.HwComponent):
             buf.append(numpy.empty(rshape, dtype=self._reader.dtype))
         adtype = get_best_dtype_for_acc(self._reader.dtype, osr * dpr)
 
-        # even one pixel at a time is too big => cut in several scans
-        # Note: we could optimize slightly more by grouping dpr up to max_dpr
-        # but would make the code more complex and anyway it's already huge
-        # acquisitions.
-        logging.debug(u"Reading one sub-pixel at a time: %d samples/read every %g µs",
-                      osr * nrchans, (period / dpr) * 1e6)
-        px_rbuf = numpy.empty((dpr, nrchans), dtype=adtype) # intermediary sum for mean
+        # even one pixel at a time is too big => cut in several scans, each
+        # containing as many duplications as fit in the buffer.
+        maxdup = min(dpr, self._get_max_pixels_per_cmd(nrchans, osr))
+        logging.debug(u"Reading %d sub-pixels at a time: %d samples/read every %g µs",
+                      maxdup, osr * nrchans * maxdup, (period / dpr) * 1e6)
+        px_rbuf = numpy.empty((nrchans,), dtype=adtype)  # intermediary sum for mean
         for x, y in numpy.ndindex(data.shape[0], data.shape[1]):
-            if y < margin:
-                ss = 1
-            else:
-                ss = 0
-            wdata = data[x, y].reshape(1, data.shape[2]) # add a "time" dimension == 1
-            for d in range(dpr):
-                islast = ((x + 1, y + 1, d + 1) == data.shape + (dpr,))
+            px_rbuf[:] = 0
+            for d in range(0, dpr, maxdup):
+                ndup = min(maxdup, dpr - d)
+                if y < margin:
+                    ss = ndup
+                else:
+                    ss = 0
+                wdata = numpy.repeat(data[x, y].reshape(1, data.shape[2]), ndup, axis=0)
+                islast = ((x + 1, y + 1) == data.shape[:2] and d + ndup >= dpr)
                 rbuf = self._write_read_raw_one_cmd(wchannels, wranges, rchannels,
                                         rranges, period / dpr, osr, wdata, ss,
                                         rest=(islast and self._scanner.fast_park))
                 # decimate into intermediary buffer
-                px_rbuf[d] = numpy.sum(rbuf, axis=0, dtype=adtype)
+                px_rbuf += numpy.sum(rbuf, axis=0, dtype=adtype)
 
             # decimate into each buffer
             for i, b in enumerate(buf):
                 self._scan_raw_to_pixel(rshape, margin, osr, dpr, x, y,
-                                        px_rbuf[..., i], b, adtype)
+                                        px_rbuf[i], b, adtype)
 
         return buf
 
+    @staticmethod
+    def _scan_raw_to_pixels(nsamples, data, oarray, adtype):
+        """
+        Converts acquired data for several consecutive pixels into the pixels
+        nsamples (int): number of samples per pixel (osr * dpr)
+        data (1D ndarray): the raw data (including oversampling and
+          duplication), of one channel
+        oarray (1D ndarray): the output array, already allocated, of one value
+          per pixel
+        adtype (dtype): intermediary type to use for the accumulator
+        """
+        if nsamples == 1:
+            oarray[...] = data
+        else:
+            acc = umath.add.reduce(data.reshape(-1, nsamples), axis=1, dtype=adtype)
+            umath.true_divide(acc, nsamples, out=oarray, casting='unsafe', subok=False)
+
     @staticmethod
     def _scan_raw_to_pixel(shape, margin, osr, dpr, x, y, data, oarray, adtype):
         """
@@ -1671,17 +1712,28 @@ class SEMComedi(model.HwComponent):
 
                 self._check_cmd_q(block=False)
 
-                # Ensures we don't wait _again_ for synchronised DataFlows on error
+                # Ensures we don't wait _again_ for synchronised DataFlows on error,
+                # and that a retry scans at the same position.
                 if nfailures == 0:
-                    detectors = tuple(self._acq_wait_detectors_ready())  # ordered
+                    if self._scanner.has_spot_list():
+                        # The synchronisation event typically also starts the
+                        # exposure of another detector, so the e-beam must
+                        # already be on the spot when it's received.
+                        translation = self._scanner.get_next_translation()
+                        self._set_to_scan_start(translation)
+                        detectors = tuple(self._acq_wait_detectors_ready())  # ordered
+                    else:
+                        detectors = tuple(self._acq_wait_detectors_ready())  # ordered
+                        # Typically, .translation is updated just before the event
+                        translation = self._scanner.get_next_translation()
                 if detectors:
                     self._scanner.indicate_scan_state(True)
                     # write and read the raw data
                     try:
                         if any(isinstance(d, CountingDetector) for d in detectors):
-                            rdas = self._acquire_counting_detector(detectors)
+                            rdas = self._acquire_counting_detector(detectors, translation)
                         else:
-                            rdas = self._acquire_analog_detectors(detectors)
+                            rdas = self._acquire_analog_detectors(detectors, translation)
                     except CancelledError:
                         # either because must terminate or just need to rest
                         logging.debug("Acquisition was cancelled")
@@ -1701,6 +1753,7 @@ class SEMComedi(model.HwComponent):
                             continue
 
                     nfailures = 0
+                    self._scanner.next_spot()
 
                     for d, da in zip(detectors, rdas):
                         if d.inverted:
@@ -1772,10 +1825,32 @@ class SEMComedi(model.HwComponent):
 
         return detectors
 
-    def _acquire_analog_detectors(self, detectors):
+    def _set_to_scan_start(self, translation):
+        """
+        Move the e-beam to the first position of the next scan, so that it's
+        already settled when the scan starts.
+        translation ((float, float)): the translation of the scan (in px)
+        """
+        with self._acquisition_mng_lock:
+            acquisitions = self._acquisitions.copy()
+        if any(isinstance(d, CountingDetector) for d in acquisitions):
+            nrchans = 0
+        else:
+            nrchans = len(acquisitions)
+        (scan, period, shape, margin,
+         wchannels, wranges, osr, dpr, pattern) = self._scanner.get_scan_data(nrchans, translation)
+
+        with self._acquisition_init_lock:
+            for p, c, r in zip(scan[0, 0], wchannels, wranges):
+                comedi.data_write(self._device, self._ao_subdevice, c, r,
+                                  comedi.AREF_GROUND, int(p))
+        logging.debug("Set to starting position at %s", scan[0, 0])
+
+    def _acquire_analog_detectors(self, detectors, translation):
         """
         Run the acquisition for multiple analog detectors (and no counters)
         detectors (AnalogDetectors)
+        translation ((float, float)): the translation of the scan (in px)
         return (list of DataArrays): acquisition for each detector in order
         """
         rchannels = tuple(d.channel for d in detectors)
@@ -1784,7 +1859,7 @@ class SEMComedi(model.HwComponent):
 
         # get the scan values (automatically updated to the latest needs)
         (scan, period, shape, margin,
-         wchannels, wranges, osr, dpr) = self._scanner.get_scan_data(len(detectors))
+         wchannels, wranges, osr, dpr, pattern) = self._scanner.get_scan_data(len(detectors), translation)
         # Immediately write the first position to give the beam a bit more
         # settling time while we are preparing the whole scan.
         for p, c, r in zip(scan[0, 0], wchannels, wranges):
@@ -1801,7 +1876,7 @@ class SEMComedi(model.HwComponent):
 
         # add scanner translation to the center
         center = self._metadata.get(model.MD_POS, (0, 0))
-        trans = self._scanner.pixelToPhy(self._scanner.translation.value)
+        trans = self._scanner.pixelToPhy(translation)
         metadata[model.MD_POS] = (center[0] + trans[0],
                                   center[1] + trans[1])
 
@@ -1830,15 +1905,17 @@ class SEMComedi(model.HwComponent):
         # Transform raw data + metadata into a 2D DataArray
         rdas = []
         for i, b in enumerate(rbuf):
+            b = pattern.toImage(shape, b)
             rdas.append(model.DataArray(b, md[i]))
 
         return rdas
 
-    def _acquire_counting_detector(self, detectors):
+    def _acquire_counting_detector(self, detectors, translation):
         """
         Run the acquisition for one counting detector (and the other detectors
          are not used!)
         detectors (Detectors)
+        translation ((float, float)): the translation of the scan (in px)
         return (list of DataArrays): acquisition of each detector, only the one
           for the first counting detector is real
         """
@@ -1867,7 +1944,7 @@ class SEMComedi(model.HwComponent):
 
         # get the scan values (automatically updated to the latest needs)
         (scan, period, shape, margin,
-         wchannels, wranges, osr, dpr) = self._scanner.get_scan_data(0)
+         wchannels, wranges, osr, dpr, pattern) = self._scanner.get_scan_data(0, translation)
         if osr != 1:
             logging.warning("osr = %d, while using counting detector", osr)
         # Immediately write the first position to give the beam a bit more
@@ -1886,7 +1963,7 @@ class SEMComedi(model.HwComponent):
 
         # add scanner translation to the center
         center = self._metadata.get(model.MD_POS, (0, 0))
-        trans = self._scanner.pixelToPhy(self._scanner.translation.value)
+        trans = self._scanner.pixelToPhy(translation)
         metadata[model.MD_POS] = (center[0] + trans[0],
                                   center[1] + trans[1])
 
@@ -1903,7 +1980,7 @@ class SEMComedi(model.HwComponent):
         rdas = []
         for i, d in enumerate(detectors):
             if i == ic:
-                b = rbuf[0]
+                b = pattern.toImage(shape, rbuf[0])
             else:
                 b = numpy.empty((0,), dtype=self._reader.dtype)  # empty array
             rdas.append(model.DataArray(b, md[i]))
@@ -2584,7 +2661,7 @@ class FakeWriter(Accesser):
         self._must_stop.set()
 
 
-class Scanner(model.Emitter):
+class Scanner(driver.SpotListMixin, model.Emitter):
     """
     Represents the e-beam scanner
 
@@ -2804,8 +2881,17 @@ class Scanner(model.Emitter):
         # the beam settling time or when put to rest.
         self.newPosition = model.Event()
 
-        self._prev_settings = [None, None, None, None] # resolution, scale, translation, margin
+        # The order in which the pixels are scanned
+        self.scanPattern = model.VigilantAttribute(RasterPattern(), setter=self._setScanPattern)
+
+        self._prev_settings = [None, None, None, None, None] # resolution, scale, translation, margin, pattern
         self._scan_array = None # last scan array computed
+        self._scan_margin = 0  # margin of the last scan array computed
+        # (shape, limits, margin, pattern, ranges) -> (scan array, margin)
+        self._scan_cache = LRUCache(SCAN_CACHE_SIZE)
+
+        # Translations to use for the next scans (see setSpotList())
+        self._init_spot_list()
 
     def terminate(self):
         if self._scanning_mng:
@@ -2930,6 +3016,11 @@ class Scanner(model.Emitter):
                 max(min(value[1], max_tran[1]), -max_tran[1]))
         return tran
 
+    def _setScanPattern(self, pattern):
+        if not isinstance(pattern, ScanPattern):
+            raise ValueError("Scan pattern must be a ScanPattern, but got %s" % (pattern,))
+        return pattern
+
     # we share metadata with our parent
     def getMetadata(self):
         return self.parent.getMetadata()
@@ -3095,16 +3186,18 @@ class Scanner(model.Emitter):
                 except Exception:
                     logging.warning("Failed to change digital output port %d", c, exc_info=True)
 
-    def get_scan_data(self, nrchans):
+    def get_scan_data(self, nrchans, translation=None):
         """
         Returns all the data as it has to be written the device to generate a
           scan.
         nrchans (0 <= int): number of read channels
+        translation (None or (float, float)): translation to use, instead of
+          the value of .translation
         returns: array (3D numpy.ndarray), period (0<=float), shape (2-tuple int),
                  margin (0<=int), channels (list of int), ranges (list of int)
-                 osr (1<=int):
-          array is of shape HxWx2: H,W is the scanning area. dtype is fitting the
-             device raw data. .shape = shape[0], shape[1] + margin, 2
+                 osr (1<=int), dpr (1<=int), pattern (ScanPattern):
+          array is of shape NxMx2: N lines of M points to scan (for a raster
+             pattern, N,M = H,W + margin). dtype is fitting the device raw data.
           period: time between a pixel in s
           shape: H,W dimension of the scanned image (e.g., the resolution in numpy order)
           margin: amount of fake pixels inserted at the beginning of each (Y) line
@@ -3113,6 +3206,8 @@ class Scanner(model.Emitter):
           ranges: the range index of each output channel
           osr: over-sampling rate, how many input samples should be acquired by pixel
           dpr: duplication rate, how many times each pixel should be re-acquired
+          pattern: the scan pattern used to generate the array. Use its
+            .toImage() to convert the data read back to the image.
         Note: it can update the dwell time, if nrchans changed since previous time
         Note: it only recomputes the scanning array if the settings have changed
         Note: it's not thread-safe, you must ensure no simultaneous calls.
@@ -3124,7 +3219,8 @@ class Scanner(model.Emitter):
         dwell_time, osr, dpr = self.dwellTime.value, self._osr, self._dpr
         resolution = self.resolution.value
         scale = self.scale.value
-        translation = self.translation.value
+        if translation is None:
+            translation = self.translation.value
 
         # settle_time is proportional to the size of the ROI (and =0 if only 1 px)
         st = self._settle_time * scale[0] * (resolution[0] - 1) / (self._shape[0] - 1)
@@ -3133,20 +3229,20 @@ class Scanner(model.Emitter):
         # tiny areas (eg, 4x4) scanned without the first pixel of each line
         # being exposed twice more than the others.
         margin = int(math.ceil(st / dwell_time - 0.01))
+        pattern = self.scanPattern.value
 
-        new_settings = [resolution, scale, translation, margin]
+        new_settings = [resolution, scale, translation, margin, pattern]
         if self._prev_settings != new_settings:
-            # TODO: if only margin changes, just duplicate the margin columns
             # need to recompute the scanning array
             self._update_raw_scan_array(resolution[::-1], scale[::-1],
-                                        translation[::-1], margin)
+                                        translation[::-1], margin, pattern)
 
             self._prev_settings = new_settings
 
         return (self._scan_array, dwell_time, resolution[::-1],
-                margin, self._channels, self._ranges, osr, dpr)
+                self._scan_margin, self._channels, self._ranges, osr, dpr, pattern)
 
-    def _update_raw_scan_array(self, shape, scale, translation, margin):
+    def _update_raw_scan_array(self, shape, scale, translation, margin, pattern):
         """
         Update the raw array of values to send to scan the 2D area.
         shape (list of 2 int): H/W=Y/X of the scanning area (slow, fast axis)
@@ -3154,8 +3250,9 @@ class Scanner(model.Emitter):
         translation (tuple of 2 float): shift from the center
         margin (0<=int): number of additional pixels to add at the beginning of
             each scanned line
+        pattern (ScanPattern): order in which the pixels are scanned
         Warning: the dimensions follow the numpy convention, so opposite of user API
-        returns nothing, but update ._scan_array and ._ranges.
+        returns nothing, but update ._scan_array, ._scan_margin and ._ranges.
         """
         area_shape = self._shape[::-1]
         # adapt limits according to the scale and translation so that if scale
@@ -3213,17 +3310,29 @@ class Scanner(model.Emitter):
                 ranges.append(best_range)
             self._ranges = ranges
 
+            # The waveforms only depend on these settings, so reuse the
+            # previous one, if it has already been computed.
+            key = (tuple(shape), tuple(tuple(l) for l in roi_limits), margin,
+                   pattern.key(), tuple(ranges))
+            cached = self._scan_cache.get(key)
+            if cached is not None:
+                self._scan_array, self._scan_margin = cached
+                return
+
             # computes the limits in raw values
             # Note: _array_from_phys expects the channel as last dim
             rlimits = numpy.array(roi_limits, dtype=numpy.double).T
             limits = self.parent._array_from_phys(self.parent._ao_subdevice,
                                                   self._channels, ranges,
                                                   rlimits)
-            scan_raw = self._generate_scan_array(shape, limits.T, margin)
+            scan_raw, self._scan_margin = pattern.generate(shape, limits.T, margin)
             self._scan_array = scan_raw
+            # The array is shared with the cache => make sure it's not modified
+            scan_raw.flags.writeable = False
+            self._scan_cache.put(key, (scan_raw, self._scan_margin))
         else:
             limits = numpy.array(roi_limits, dtype=numpy.double)
-            scan_phys = self._generate_scan_array(shape, limits, margin)
+            scan_phys, self._scan_margin = pattern.generate(shape, limits, margin)
 
             # Compute the best ranges for each channel
             ranges = []
@@ -3245,35 +3354,14 @@ class Scanner(model.Emitter):
         interpolation between the limits. It's basically a saw-tooth curve on
         the W dimension and a linear increase on the H dimension.
         shape (list of 2 int): H/W of the scanning area (slow, fast axis)
-        limits (2x2 ndarray): the min/max limits of W/H
+        limits (2x2 ndarray): the min/max limits of H/W
         margin (0<=int): number of additional pixels to add at the begginning of
             each scanned line
         returns (3D ndarray of shape[0] x (shape[1] + margin) x 2): the H/W
             values for each points of the array, with W scanned fast, and H
             slowly. The type is the same one as the limits.
         """
-        # prepare an array of the right type
-        full_shape = (shape[0], shape[1] + margin, 2)
-        scan = numpy.empty(full_shape, dtype=limits.dtype, order='C')
-
-        # TODO see if meshgrid is faster (it needs to be in C order!)
-
-        # Force the conversion to full number (e.g., instead of uint16), which
-        # avoids linspace() to go crazy when limits are going down.
-        pylimits = limits.tolist()
-        # fill the X dimension
-        scanx = scan[:, :, 0].swapaxes(0, 1) # just a view to have X as last dim
-        scanx[:, :] = numpy.linspace(pylimits[0][0], pylimits[0][1], shape[0])
-        # fill the Y dimension
-        scan[:, margin:, 1] = numpy.linspace(pylimits[1][0], pylimits[1][1], shape[1])
-
-        # fill the margin with the first pixel (X dimension is already filled)
-        if margin:
-            fp = scan[:, margin, 1]
-            # use the transpose, as the broadcast rule is to extend on the row
-            scan[:, :margin, 1].T[:] = fp
-
-        return scan
+        return RasterPattern().generate(shape, limits, margin)[0]
 
 
 class AnalogDetector(model.Detector):
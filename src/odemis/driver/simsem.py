@@ -28,7 +28,7 @@ import math
 import numpy
 from odemis import model, util, dataio
 from odemis.model import isasync, oneway
-from odemis.util import img
+from odemis.util import driver, img
 import os
 import random
 from scipy import ndimage
@@ -109,7 +109,7 @@ class SimSEM(model.HwComponent):
             d.terminate()
 
 
-class Scanner(model.Emitter):
+class Scanner(driver.SpotListMixin, model.Emitter):
     """
     This is an extension of the model.Emitter class. It contains Vigilant
     Attributes and setters for magnification, pixel size, translation, resolution,
@@ -206,6 +206,9 @@ class Scanner(model.Emitter):
                           unit="A")
         self.accelVoltage = model.FloatContinuous(10e3, (1e3, 30e3), unit="V")
 
+        # Translations to use for the next scans (see setSpotList())
+        self._init_spot_list()
+
     def _onHFV(self, hfv):
         self._updatePixelSize()
         self._updateDepthOfField()
@@ -440,7 +443,8 @@ class Detector(model.Detector):
             logging.debug("Simulating an image")
             pxs = scanner.pixelSize.value  # m/px
 
-            pxs_pos = scanner.translation.value
+            pxs_pos = scanner.get_next_translation()
+            scanner.next_spot()
             scale = scanner.scale.value
             res = scanner.resolution.value
             shi = scanner.shift.value
@@ -509,6 +513,8 @@ class Detector(model.Detector):
                 # as in Odemis the convention for SEM is that the ebeam waits
                 # for _all_ the detectors to be ready before scanning.
                 self.data._waitSync()
+                if self._acquisition_must_stop.is_set():
+                    break  # unblocked because the acquisition is stopped
                 callback(self._simulate_image())
         except Exception:
             logging.exception("Unexpected failure during image acquisition")
@@ -546,6 +552,8 @@ class SEMDataFlow(model.DataFlow):
         try:
             self.component().stop_acquire()
             # Note that after that acquisition might still go on for a short time
+            if self._sync_event:
+                self._evtq.put(None)  # in case it was waiting for an event
         except ReferenceError:
             # sem/component has been deleted, it's all fine, we'll be GC'd soon
             pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import numpy
+from odemis.driver.scanpattern import RasterPattern, SerpentinePattern, \
+    InterlacedPattern, PointListPattern, RandomPattern
+import unittest
+
+
+# minY, maxY, minX, maxX
+LIMITS = numpy.array([[30320, 35215], [40943, 24592]], dtype="uint16")
+
+
+def fake_acquire(shape, scan, margin):
+    """
+    Simulates the acquisition of an image whose pixel value is Y * 10000 + X
+    return (2D ndarray): the data, as read with the scan waveform, without margin
+    """
+    ys = numpy.round((scan[:, margin:, 0].astype(numpy.float64) - LIMITS[0, 0]) *
+                     (shape[0] - 1) / (float(LIMITS[0, 1]) - LIMITS[0, 0]))
+    xs = numpy.round((scan[:, margin:, 1].astype(numpy.float64) - LIMITS[1, 0]) *
+                     (shape[1] - 1) / (float(LIMITS[1, 1]) - LIMITS[1, 0]))
+    return (ys * 10000 + xs).astype(numpy.int64)
+
+
+class TestScanPattern(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (51, 64)
+        self.expected = numpy.add.outer(numpy.arange(self.shape[0]) * 10000,
+                                        numpy.arange(self.shape[1]))
+
+    def test_raster(self):
+        pattern = RasterPattern()
+        scan, margin = pattern.generate(self.shape, LIMITS, 3)
+        self.assertEqual(margin, 3)
+        self.assertEqual(scan.shape, (self.shape[0], self.shape[1] + 3, 2))
+        self.assertEqual(scan.dtype, LIMITS.dtype)
+        # The margin is the first pixel of the line
+        numpy.testing.assert_array_equal(scan[:, 0], scan[:, 3])
+
+        img = pattern.toImage(self.shape, fake_acquire(self.shape, scan, margin))
+        numpy.testing.assert_array_equal(img, self.expected)
+
+    def test_serpentine(self):
+        pattern = SerpentinePattern()
+        scan, margin = pattern.generate(self.shape, LIMITS, 3)
+        self.assertEqual(margin, 0)
+        self.assertEqual(scan.shape, self.shape + (2,))
+        # The end of a line is next to the beginning of the next line
+        numpy.testing.assert_array_equal(scan[0, -1, 1], scan[1, 0, 1])
+
+        data = fake_acquire(self.shape, scan, margin)
+        img = pattern.toImage(self.shape, data)
+        numpy.testing.assert_array_equal(img, self.expected)
+
+    def test_interlaced(self):
+        pattern = InterlacedPattern(3)
+        scan, margin = pattern.generate(self.shape, LIMITS, 2)
+        self.assertEqual(scan.shape, (self.shape[0], self.shape[1] + 2, 2))
+        raster, _ = RasterPattern().generate(self.shape, LIMITS, 2)
+        numpy.testing.assert_array_equal(scan[1], raster[3])
+        numpy.testing.assert_array_equal(scan[17], raster[1])
+
+        img = pattern.toImage(self.shape, fake_acquire(self.shape, scan, margin))
+        numpy.testing.assert_array_equal(img, self.expected)
+
+        self.assertRaises(ValueError, InterlacedPattern, 0)
+
+    def test_points(self):
+        # X, Y
+        points = [(3, 0), (4, 0), (5, 0), (1, 2), (7, 2), (6, 2), (63, 50)]
+        pattern = PointListPattern(points)
+        scan, margin = pattern.generate(self.shape, LIMITS, 2)
+        # 4 lines: (3, 4, 5), (1, 7), (6), (63)
+        self.assertEqual(scan.shape, (4, 3 + 2, 2))
+        self.assertEqual(margin, 2)
+
+        img = pattern.toImage(self.shape, fake_acquire(self.shape, scan, margin))
+        for x, y in points:
+            self.assertEqual(img[y, x], self.expected[y, x])
+        self.assertEqual(numpy.count_nonzero(img), len(points))
+
+        # Points outside of the area
+        pattern = PointListPattern([(0, 0), (64, 0)])
+        self.assertRaises(ValueError, pattern.generate, self.shape, LIMITS, 0)
+        self.assertRaises(ValueError, PointListPattern, [(-1, 0)])
+        self.assertRaises(ValueError, PointListPattern, [])
+
+    def test_random(self):
+        pattern = RandomPattern(0.1)
+        scan, margin = pattern.generate(self.shape, LIMITS, 1)
+        img = pattern.toImage(self.shape, fake_acquire(self.shape, scan, margin))
+        n = self.shape[0] * self.shape[1] * 0.1
+        self.assertTrue(0.8 * n < numpy.count_nonzero(img) < 1.2 * n)
+        scanned = img != 0
+        numpy.testing.assert_array_equal(img[scanned], self.expected[scanned])
+
+        # Same settings => same pattern
+        scan2, _ = RandomPattern(0.1).generate(self.shape, LIMITS, 1)
+        numpy.testing.assert_array_equal(scan, scan2)
+        self.assertEqual(RandomPattern(0.1), pattern)
+        self.assertNotEqual(RandomPattern(0.1, seed=1), pattern)
+
+        # All pixels => same as raster (apart from the margin)
+        pattern = RandomPattern(1)
+        scan, margin = pattern.generate(self.shape, LIMITS, 0)
+        raster, _ = RasterPattern().generate(self.shape, LIMITS, 0)
+        numpy.testing.assert_array_equal(scan, raster)
+
+
+if __name__ == "__main__":
+    unittest.main()
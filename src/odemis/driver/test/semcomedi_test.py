@@ -20,7 +20,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 from __future__ import division, print_function
 from odemis import model
-from odemis.driver import semcomedi
+from odemis.driver import semcomedi, scanpattern
 import Pyro4
 import comedi
 import copy
@@ -156,6 +156,24 @@ class TestSEMStatic(unittest.TestCase):
             comp = diffx >= 0 # must be decreasing
         self.assertTrue(comp.all())
 
+    def test_scan_raw_to_pixels(self):
+        """
+        Test the decimation of several pixels at once is the same as pixel per pixel
+        """
+        osr, dpr = 5, 3
+        shape = (1, 20)
+        data = numpy.random.randint(0, 2 ** 16, shape[1] * osr * dpr).astype(numpy.uint16)
+        adtype = semcomedi.get_best_dtype_for_acc(data.dtype, osr * dpr)
+
+        exp = numpy.empty(shape, dtype=data.dtype)
+        for y in range(shape[1]):
+            pxdata = data[y * osr * dpr:(y + 1) * osr * dpr]
+            semcomedi.SEMComedi._scan_raw_to_pixel(shape, 0, osr, dpr, 0, y, pxdata, exp, adtype)
+
+        out = numpy.empty(shape, dtype=data.dtype)
+        semcomedi.SEMComedi._scan_raw_to_pixels(osr * dpr, data, out[0], adtype)
+        numpy.testing.assert_array_equal(out, exp)
+
 #@unittest.skip("simple")
 class TestSEM(unittest.TestCase):
     """
@@ -182,6 +200,7 @@ class TestSEM(unittest.TestCase):
         self.scanner.resolution.value = (512, 256)
         self.size = self.scanner.resolution.value
         self.scanner.dwellTime.value = self.scanner.dwellTime.range[0]
+        self.scanner.scanPattern.value = scanpattern.RasterPattern()
         self.acq_dates = (set(), set()) # 2 sets of dates, one for each receiver
         self.acq_done = threading.Event()
 
@@ -511,6 +530,82 @@ class TestSEM(unittest.TestCase):
 
         self.assertEqual(self.left, 0)
 
+    def test_spot_list(self):
+        """
+        Acquire a synchronised dataflow, going through a list of spots
+        """
+        self.scanner.scale.value = (1, 1)
+        self.scanner.resolution.value = (1, 1)
+        self.scanner.translation.value = (0, 0)
+        self.scanner.dwellTime.value = 10e-6
+        spots = [(-10, -10), (10, 0), (0, 20.5)]
+        center = self.sed.getMetadata().get(model.MD_POS, (0, 0))
+
+        self.sed.data.synchronizedOn(self.sed.softwareTrigger)
+        images = []
+        acq_done = threading.Event()
+
+        def receive_spot(df, data):
+            images.append(data)
+            if len(images) == len(spots) + 1:
+                acq_done.set()
+
+        self.scanner.setSpotList(spots)
+        self.sed.data.subscribe(receive_spot)
+        try:
+            # One more than the spots, to check it's back to the translation
+            for i in range(len(spots) + 1):
+                self.sed.softwareTrigger.notify()
+            self.assertTrue(acq_done.wait(10))
+        finally:
+            self.sed.data.unsubscribe(receive_spot)
+            self.sed.data.synchronizedOn(None)
+
+        for im, spot in zip(images, spots + [(0, 0)]):
+            self.assertEqual(im.shape, (1, 1))
+            trans = self.scanner.pixelToPhy(spot)
+            exp_pos = (center[0] + trans[0], center[1] + trans[1])
+            numpy.testing.assert_allclose(im.metadata[model.MD_POS], exp_pos)
+
+        # Spots out of the translation range are refused
+        rng = self.scanner.translation.range
+        with self.assertRaises(ValueError):
+            self.scanner.setSpotList([(0, 0), (rng[1][0] + 1, 0)])
+
+    def test_scan_pattern(self):
+        """
+        Acquire with the different scan patterns
+        """
+        self.scanner.dwellTime.value = 10e-6
+        expected_duration = self.compute_expected_duration()
+
+        for pattern in (scanpattern.SerpentinePattern(), scanpattern.InterlacedPattern(),
+                        scanpattern.RandomPattern(0.1)):
+            self.scanner.scanPattern.value = pattern
+            im = self.sed.data.get()
+            self.assertEqual(im.shape, self.size[::-1])
+
+        # Only the points are scanned => faster than the whole image
+        points = [(0, 0), (10, 5), (100, 200)]
+        self.scanner.scanPattern.value = scanpattern.PointListPattern(points)
+        start = time.time()
+        im = self.sed.data.get()
+        duration = time.time() - start
+        self.assertEqual(im.shape, self.size[::-1])
+        self.assertLess(duration, expected_duration)
+
+        # The waveforms are cached => same array if the settings are the same
+        self.scanner.scanPattern.value = scanpattern.SerpentinePattern()
+        scan1 = self.scanner.get_scan_data(1)[0]
+        self.scanner.scanPattern.value = scanpattern.RasterPattern()
+        self.scanner.get_scan_data(1)
+        self.scanner.scanPattern.value = scanpattern.SerpentinePattern()
+        scan2 = self.scanner.get_scan_data(1)[0]
+        self.assertIs(scan1, scan2)
+
+        with self.assertRaises(ValueError):
+            self.scanner.scanPattern.value = "raster"
+
 #     @unittest.skip("simple")
     def test_new_position_event(self):
         """
@@ -23,6 +23,7 @@ from __future__ import division
 import Pyro4
 import copy
 import logging
+import numpy
 from odemis import model
 from odemis.driver import simsem
 import os
@@ -404,6 +405,48 @@ class TestSEM(unittest.TestCase):
         # if it has acquired a least 5 pictures we are already happy
         self.assertLessEqual(self.left, 10000)
 
+    def test_spot_list(self):
+        """
+        Acquire a synchronised dataflow, going through a list of spots
+        """
+        self.scanner.scale.value = (1, 1)
+        self.scanner.resolution.value = (1, 1)
+        self.scanner.translation.value = (0, 0)
+        self.scanner.dwellTime.value = 10e-6
+        spots = [(-10, -10), (10, 0), (0, 20.5)]
+        center = self.sed.getMetadata().get(model.MD_POS, (0, 0))
+
+        self.sed.data.synchronizedOn(self.sed.softwareTrigger)
+        images = []
+        acq_done = threading.Event()
+
+        def receive_spot(df, data):
+            images.append(data)
+            if len(images) == len(spots) + 1:
+                acq_done.set()
+
+        self.scanner.setSpotList(spots)
+        self.sed.data.subscribe(receive_spot)
+        try:
+            # One more than the spots, to check it's back to the translation
+            for i in range(len(spots) + 1):
+                self.sed.softwareTrigger.notify()
+            self.assertTrue(acq_done.wait(10))
+        finally:
+            self.sed.data.unsubscribe(receive_spot)
+            self.sed.data.synchronizedOn(None)
+
+        for im, spot in zip(images, spots + [(0, 0)]):
+            self.assertEqual(im.shape, (1, 1))
+            trans = self.scanner.pixelToPhy(spot)
+            exp_pos = (center[0] + trans[0], center[1] + trans[1])
+            numpy.testing.assert_allclose(im.metadata[model.MD_POS], exp_pos)
+
+        # Spots out of the translation range are refused
+        rng = self.scanner.translation.range
+        with self.assertRaises(ValueError):
+            self.scanner.setSpotList([(0, 0), (rng[1][0] + 1, 0)])
+
     def receive_image(self, dataflow, image):
         """
         callback for df of test_acquire_flow()
@@ -19,7 +19,6 @@ from __future__ import division
 import queue
 from ctypes import *
 import ctypes
-import gc
 import logging
 import numpy
 from odemis import model
@@ -659,6 +658,8 @@ class Camera(model.DigitalCamera):
         super(Camera, self).__init__(name, role, **kwargs)
         self._dll = UEyeDLL()
         self._hcam = self._openDevice(device)
+        # To avoid allocating new memory for each frame
+        self._buffer_pool = model.BufferPool()
 
         try:
             # Read camera properties and set metadata to be included in dataflow
@@ -1023,7 +1024,7 @@ class Camera(model.DigitalCamera):
         return (DataArray): a numpy array corresponding to the data pointed to
         """
         res, dtype = self._buffers_props
-        na = numpy.empty((res[1], res[0]), dtype=dtype)
+        na = self._buffer_pool.get((res[1], res[0]), dtype, md)
         # TODO use GetImageMemPitch() if needed: if width is not multiple of 4
         # => create a na height x stride, and then return na[:, :size[0]]
         assert(res[0] % 4 == 0)
@@ -1032,7 +1033,7 @@ class Camera(model.DigitalCamera):
         # release the buffer
         self._dll.is_UnlockSeqBuf(self._hcam, IGNORE_PARAMETER, mem)
 
-        return model.DataArray(na, md)
+        return na
 
     # Acquisition methods
     def start_generate(self):
@@ -1122,14 +1123,12 @@ class Camera(model.DigitalCamera):
             self._commander = None
             logging.debug("Commander thread closed")
 
-    GC_PERIOD = 10  # how often the garbage collector should run (in number of buffers)
     def _acquire(self):
         """
         Acquisition thread
         Managed via the .genmsg Queue
         """
         try:
-            num_gc = 0
             while not self._must_stop:
                 try:
                     # Timeout to regularly check if needs to end
@@ -1149,13 +1148,7 @@ class Camera(model.DigitalCamera):
                 array = self._buffer_as_array(mem, metadata)
 
                 self.data.notify(self._transposeDAToUser(array))
-
-                # force the GC to free non-used buffers, for some reason, without
-                # this the GC runs only after we've managed to fill up the memory
-                num_gc += 1
-                if num_gc >= self.GC_PERIOD:
-                    gc.collect()
-                    num_gc = 0
+                del array  # the buffer goes back to the pool (if not used anymore)
         except Exception:
             logging.exception("Failure in acquisition thread")
             try:
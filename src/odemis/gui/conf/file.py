@@ -170,6 +170,19 @@ class GeneralConfig(Config):
         # Section for Odemis/Delphi viewer config
         self.default.add_section("viewer")
         self.default.set("viewer", "update", "yes")
+        # Memory used to cache the tiles of the large (pyramidal) images, in MB
+        self.default.set("viewer", "tile_cache_size", "512")
+
+    @property
+    def tile_cache_size(self):
+        """
+        (int): maximum memory used to cache the tiles of the large images, in MB
+        """
+        try:
+            return int(self.get("viewer", "tile_cache_size"))
+        except ValueError:
+            logging.warning("Invalid tile_cache_size, will use the default value")
+            return int(self.default.get("viewer", "tile_cache_size"))
 
     def get_manual(self, role=None):
         """ This method returns the path to the user manual
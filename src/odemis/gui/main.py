@@ -28,7 +28,8 @@ import argparse
 import logging
 from odemis import model, gui
 import odemis
-from odemis.gui import main_xrc, log, img, plugin
+from odemis.acq import stream
+from odemis.gui import main_xrc, log, img, plugin, conf
 from odemis.gui.cont import acquisition
 from odemis.gui.cont.menu import MenuController
 from odemis.gui.util import call_in_wx_main
@@ -140,6 +141,9 @@ class OdemisGUIApp(wx.App):
         logging.info("Odemis GUI v%s (from %s)", odemis.__version__, __file__)
         logging.info("wxPython v%s", wx.version())
 
+        # Memory used to cache the tiles of the large (pyramidal) images
+        stream.TILE_CACHE.max_size = conf.get_general_conf().tile_cache_size * 2 ** 20
+
         # TODO: if microscope.ghost is not empty => wait and/or display a special
         # "hardware status" tab.
 
@@ -33,6 +33,7 @@ from ._dataflow import *
 from ._core import *
 from ._metadata import *
 from ._dataio import *
+from ._bufpool import *
 
 
 #__all__ = []
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Pool of memory buffers for the drivers which acquire a stream of frames of
+# the same size (typically, cameras). Instead of allocating a new buffer for
+# each frame, a buffer is "rented" from the pool, and the DataArray returned
+# uses it directly. The buffer automatically goes back to the pool when the
+# last view on the DataArray is deleted (ie, when reference count drops to 0,
+# without needing the garbage collector).
+
+from __future__ import division
+
+import logging
+import mmap
+import numpy
+import threading
+
+from ._dataflow import DataArray
+
+
+BUFFER_ALIGNMENT = mmap.PAGESIZE  # bytes
+
+
+def _alloc_aligned(nbytes, alignment=BUFFER_ALIGNMENT):
+    """
+    return (numpy.array of uint8 of shape nbytes): a (non-initialised) buffer
+      whose address is a multiple of alignment.
+    """
+    raw = numpy.empty(nbytes + alignment, dtype=numpy.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    return raw[offset:offset + nbytes]
+
+
+class _BufferLease(object):
+    """
+    Owns a buffer while it's rented. It's used as the base of the numpy array,
+    so that it is deleted when the last view on the data is gone. At that
+    moment, the buffer is given back to the pool.
+    """
+
+    def __init__(self, pool, buf, shape, dtype):
+        self._pool = pool
+        self._buf = buf  # keep the memory alive
+        self.__array_interface__ = {
+            "shape": tuple(shape),
+            "typestr": dtype.str,
+            "data": (buf.ctypes.data, False),  # writable
+            "version": 3,
+        }
+
+    def __del__(self):
+        try:
+            self._pool._release(self._buf)
+        except Exception:
+            pass
+
+
+class BufferPool(object):
+    """
+    Provides memory buffers, and recycles them once they are not used anymore.
+    Only the buffers of the latest size requested are kept, so it's optimised
+    for a sequence of frames of the same size (with rare changes of size).
+    Thread-safe.
+    """
+
+    def __init__(self, max_free=4):
+        """
+        max_free (0<=int): maximum number of unused buffers kept for later use.
+          The number of buffers in use is not limited.
+        """
+        self._max_free = max_free
+        self._lock = threading.Lock()
+        self._free = []  # numpy arrays of uint8, all of _nbytes
+        self._nbytes = None
+        # Statistics
+        self.allocated = 0  # number of buffers newly allocated
+        self.reused = 0  # number of buffers which were recycled
+
+    def get(self, shape, dtype, metadata=None):
+        """
+        Rent a buffer. Its content is undefined.
+        shape (tuple of int): shape of the array
+        dtype (numpy.dtype): type of the array
+        metadata (None or dict str -> value): metadata of the DataArray
+        return (DataArray): C-contiguous, writable array, whose data is aligned
+          on a memory page. The buffer is given back to the pool when this
+          array, and all the views on it, are deleted.
+        """
+        dtype = numpy.dtype(dtype)
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        buf = None
+        with self._lock:
+            if nbytes != self._nbytes:
+                # Sizes changed => the previous buffers are not useful anymore
+                self._free = []
+                self._nbytes = nbytes
+            elif self._free:
+                buf = self._free.pop()
+
+            if buf is None:
+                self.allocated += 1
+            else:
+                self.reused += 1
+
+        if buf is None:
+            buf = _alloc_aligned(nbytes)
+
+        lease = _BufferLease(self, buf, shape, dtype)
+        return DataArray(numpy.asarray(lease), metadata)
+
+    def _release(self, buf):
+        """
+        Called when a buffer is not used anymore
+        """
+        with self._lock:
+            if buf.nbytes == self._nbytes and len(self._free) < self._max_free:
+                self._free.append(buf)
+
+    def clear(self):
+        """
+        Forget all the unused buffers, to free the memory
+        """
+        with self._lock:
+            logging.debug("Dropping %d unused buffers", len(self._free))
+            self._free = []
@@ -248,6 +248,43 @@ class ComponentProxy(ComponentBase, Pyro4.Proxy):
         _vattributes.load_vigilant_attributes(self, vas)
         _dataflow.load_events(self, events)
 
+    def getVAValues(self, names=None):
+        """
+        Same as HwComponent.getVAValues(), but the VAs which are subscribed to
+        are read locally, and the other ones are read all in one remote call.
+        """
+        vas = getVAs(self)
+        if names is None:
+            names = vas.keys()
+
+        values = {}
+        remote_names = []
+        for n in names:
+            try:
+                cached = vas[n]._get_cached_value()
+            except (KeyError, AttributeError):
+                cached = None
+            if cached is None:
+                remote_names.append(n)
+            else:
+                values[n] = cached[0]
+
+        if remote_names:
+            values.update(Pyro4.Proxy.__getattr__(self, "getVAValues")(remote_names))
+        return values
+
+    def setVAValues(self, values):
+        """
+        Same as HwComponent.setVAValues()
+        """
+        # The values might be different from the requested ones, so just
+        # forget about the cached ones until the notifications arrive.
+        for n in values.keys():
+            va = getattr(self, n, None)
+            if isinstance(va, _vattributes.VigilantAttributeProxy):
+                va._invalidate_cache()
+        return Pyro4.Proxy.__getattr__(self, "setVAValues")(values)
+
     def __str__(self):
         try:
             return "Proxy of Component '%s'" % (self.name,)
@@ -362,6 +399,75 @@ class HwComponent(Component):
         """
         return self._metadata
 
+    def _getVAsByName(self, names):
+        """
+        names (None or iterable of str): names of VAs. If None, all the VAs.
+        return (dict str -> VigilantAttribute)
+        raise AttributeError: if one of the names is not a VA of the component
+        """
+        if names is None:
+            return getVAs(self)
+
+        vas = {}
+        for n in names:
+            va = getattr(self, n, None)
+            if not isinstance(va, _vattributes.VigilantAttributeBase):
+                raise AttributeError("Component %s has no VA %s" % (self.name, n))
+            vas[n] = va
+        return vas
+
+    def getVAValues(self, names=None):
+        """
+        Read the value of several VAs at once. Remotely, it's much faster than
+        reading each VA separately, as it only needs one call.
+        names (None or iterable of str): names of the VAs to read. If None, all
+          the VAs of the component are read.
+        return (dict str -> value): VA name -> value
+        raise AttributeError: if one of the names is not a VA of the component
+        """
+        return {n: va.value for n, va in self._getVAsByName(names).items()}
+
+    def getVAInfo(self, names=None):
+        """
+        Read the value and the range or choices of several VAs at once.
+        names (None or iterable of str): names of the VAs to read. If None, all
+          the VAs of the component are read.
+        return (dict str -> dict str -> value): VA name -> information.
+          The information always contains "value", and "range" and "choices" if
+          the VA has such property.
+        raise AttributeError: if one of the names is not a VA of the component
+        """
+        infos = {}
+        for n, va in self._getVAsByName(names).items():
+            info = {"value": va.value}
+            for p in ("range", "choices"):
+                try:
+                    info[p] = getattr(va, p)
+                except (AttributeError, _vattributes.NotApplicableError):
+                    pass
+            infos[n] = info
+        return infos
+
+    def setVAValues(self, values):
+        """
+        Change the value of several VAs at once. The VAs are set in the order
+         of the dict, so pass an OrderedDict if some VAs depend on others
+         (eg, binning before resolution).
+        values (dict str -> value): VA name -> new value
+        return (dict str -> value): VA name -> actual value after being set
+          (which might be different from the requested one)
+        raise: AttributeError if one of the names is not a VA of the component,
+          or any exception raised when setting a value. In such case, the VAs
+          before this one in the dict are already changed.
+        """
+        vas = self._getVAsByName(values.keys())
+        actual = {}
+        for n, v in values.items():
+            va = vas[n]
+            va.value = v
+            actual[n] = va.value
+        return actual
+
     def _onSupplied(self, sup):
         # keep up to date with supplied changes
         self.powerSupply._value = sup[self.name]
@@ -558,10 +664,13 @@ class Microscope(HwComponent):
         if kwargs:
             raise ValueError("Microscope component cannot have initialisation arguments.")
 
-        # These 2 VAs should not modified, but by the backend
+        # These VAs should not modified, but by the backend
         self.alive = _vattributes.VigilantAttribute(set())  # set of components
         # dict str -> int or Exception: name of component -> State
         self.ghosts = _vattributes.VigilantAttribute(dict())
+        # dict str -> (float, float): name of component -> time it started to
+        # be instantiated (s since epoch), duration of the instantiation (s)
+        self.startTimes = _vattributes.VigilantAttribute(dict())
 
     @roattribute
     def model(self):
@@ -65,6 +65,8 @@ BACKEND_FILE = BASE_DIRECTORY + "/backend.ipc" # the official ipc file for backe
 BACKEND_NAME = "backend" # the official name for the backend container
 
 _microscope = None
+# To create only one container process at a time
+_process_creation_lock = threading.Lock()
 
 def getMicroscope():
     """
@@ -261,6 +263,14 @@ class ContainerObject(Pyro4.core.DaemonObject):
         """
         return self.getObject(self.daemon.rootId)
 
+    def getCPUTime(self):
+        """
+        returns (float): CPU time (user + system) used so far by the process
+          of the container, in s.
+        """
+        t = os.times()
+        return t[0] + t[1]
+
 # Basically a wrapper around the Pyro Daemon
 class Container(Pyro4.core.Daemon):
     def __init__(self, name):
@@ -396,13 +406,26 @@ def createNewContainer(name, validate=True, in_own_process=True):
     # create a container separately
     if in_own_process:
         isready = multiprocessing.Event()
-        p = multiprocessing.Process(name="Container " + name, target=_manageContainer,
+        p = multiprocessing.Process(name="Container " + name, target=_manageContainerProcess,
                                     args=(name, isready))
+        # The process can be created from any thread, while other threads are
+        # running (eg, in the back-end, containers are created by a pool of
+        # threads). This is safe, because the new process only has a single
+        # thread, which doesn't use any state of the other threads:
+        #  * the locks of the logging module are recreated (see _manageContainerProcess())
+        #  * the import lock and the threading module are reset by Python after fork
+        #  * the daemon and the zmq sockets are all created anew in the container
+        #  * the other objects (components, proxies...) and their locks, which
+        #    might be held by another thread during the fork, are not used.
+        # However, multiprocessing updates its (global) list of children
+        # processes without lock, so only create one process at a time.
+        with _process_creation_lock:
+            p.start()
     else:
         isready = threading.Event()
         p = threading.Thread(name="Container " + name, target=_manageContainer,
                              args=(name, isready))
-    p.start()
+        p.start()
     if not isready.wait(5):  # wait maximum 5s
         logging.error("Container %s is taking too long to get ready", name)
         raise IOError("Container creation timeout")
@@ -462,6 +485,28 @@ def createInContainer(container, klass, kwargs):
         container._pyroTimeout = CALL_TIMEOUT
 
 
+def _reinitLoggingLocks():
+    """
+    Recreate all the locks of the logging module. To be called in a new process
+    just after fork, as another thread might have been holding such a lock
+    when the process was created, in which case it would never be released.
+    See http://bugs.python.org/issue6721
+    """
+    logging._lock = threading.RLock()
+    for wh in logging._handlerList:
+        h = wh()  # It's a weakref
+        if h is not None:
+            h.createLock()
+
+
+def _manageContainerProcess(name, isready=None):
+    """
+    Same as _manageContainer(), but to be run in a new process
+    """
+    _reinitLoggingLocks()
+    _manageContainer(name, isready)
+
+
 def _manageContainer(name, isready=None):
     """
     manages the whole life of a container, from birth till death
@@ -27,18 +27,43 @@ from __future__ import division, print_function
 
 from past.builtins import basestring
 import Pyro4
+from Pyro4.core import oneway
+import bisect
+import collections
 import inspect
 import logging
 import numpy
-from odemis.model import _metadata
-from odemis.util.weak import WeakMethod, WeakRefLostError
+from odemis.model import _metadata, _mdcodec, _shm
+from odemis.util.weak import WeakMethod, WeakMethodBound, WeakMethodFree, \
+    WeakRefLostError
 import os
 import threading
 import time
+import weakref
 import zmq
 
 from . import _core
 
+# First part of each 0MQ message sent by a DataFlow. The subscribers only
+# receive the messages of the transport they use.
+TOPIC_INLINE = b"D"  # data is sent in the message
+TOPIC_SHM = b"S"  # data is (typically) in shared memory, only its location is sent
+
+# Delivery policies of the listeners of a DataFlow (cf DataFlowBase.subscribe())
+# Called directly from the thread which notifies the data (so a slow listener
+# delays all the other ones).
+DELIVERY_DIRECT = "direct"
+# Called from its own thread, and if the listener is slower than the data
+# generation, only the latest data is passed.
+DELIVERY_LATEST = "latest"
+# Called from its own thread, and all the data is passed, whatever the delay.
+DELIVERY_LOSSLESS = "lossless"
+# Any int N > 0: called from its own thread, with a queue of maximum N data,
+# and the oldest data dropped when the queue is full.
+
+# Upper bounds (in s) of the bins of the callback latency histogram
+LATENCY_BINS = (0.001, 0.01, 0.1, 1, float("inf"))
+
 
 class DataArray(numpy.ndarray):
     """
@@ -95,6 +120,163 @@ class DataArray(numpy.ndarray):
     #     out_arr.metadata = self.metadata
     #     return numpy.ndarray.__array_wrap__(self, out_arr, context)
 
+def _get_view_recipe(data):
+    """
+    Find how to reconstruct an array which is a view (eg, transposed, flipped,
+    or sliced) of a C-contiguous buffer.
+    data (numpy.ndarray): a non C-contiguous array
+    return (None or tuple of (numpy.ndarray, int, tuple of int)): None if it is
+      not worthy to send the buffer (because the data is only a small part of
+      it, or because no underlying contiguous buffer is found). Otherwise:
+      * 1D array of uint8 contiguous, covering exactly the memory used by the data
+      * offset (in bytes) of the first element of the data in this array
+      * strides of the data
+    """
+    if data.size == 0:
+        return None
+
+    # Memory range used by the data, relative to its first element
+    lo = sum(min(0, (n - 1) * s) for n, s in zip(data.shape, data.strides))
+    hi = sum(max(0, (n - 1) * s) for n, s in zip(data.shape, data.strides)) + data.itemsize
+    if hi - lo > 2 * data.nbytes:
+        return None  # Sending the whole buffer would cost more than a copy
+
+    # Look for the array owning the memory
+    base = data
+    while isinstance(base.base, numpy.ndarray):
+        base = base.base
+        if base.flags["C_CONTIGUOUS"]:
+            break
+    else:
+        return None
+
+    start = data.__array_interface__["data"][0] + lo - base.__array_interface__["data"][0]
+    end = start + (hi - lo)
+    if start < 0 or end > base.nbytes:
+        return None  # Should never happen
+    buf = base.reshape(-1).view(numpy.uint8)[start:end]
+    return buf, -lo, data.strides
+
+
+class _ListenerStatistics(object):
+    """
+    Counters about the delivery of the data to one listener
+    """
+
+    def __init__(self, name, policy):
+        self.name = name
+        self.policy = policy
+        self.delivered = 0
+        self.dropped = 0
+        self.latency = [0] * len(LATENCY_BINS)  # number of calls per latency bin
+
+    def add_call(self, duration):
+        """
+        duration (float): time (in s) the listener took to process the data
+        """
+        self.delivered += 1
+        self.latency[bisect.bisect_left(LATENCY_BINS, duration)] += 1
+
+
+class _ListenerDelivery(object):
+    """
+    Calls a listener from a dedicated thread, with the data queued according to
+    the delivery policy.
+    """
+
+    def __init__(self, dataflow, listener, policy, stats):
+        """
+        dataflow (DataFlowBase): the dataflow passed to the listener
+        listener (WeakMethod): the callable to call
+        policy (DELIVERY_LATEST, DELIVERY_LOSSLESS, or int > 0)
+        stats (_ListenerStatistics): counters to update
+        """
+        if policy == DELIVERY_LATEST:
+            maxlen = 1
+        elif policy == DELIVERY_LOSSLESS:
+            maxlen = None
+        else:
+            maxlen = policy
+        self._queue = collections.deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._must_stop = False
+        # Don't keep a strong reference, so that the dataflow can be garbage
+        # collected (and unsubscribe everything).
+        self._w_dataflow = weakref.ref(dataflow)
+        self._listener = listener
+        self._stats = stats
+
+        self._thread = threading.Thread(target=self._run,
+                                        name="Data delivery to %s" % (stats.name,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """
+        (int): number of data waiting to be passed to the listener
+        """
+        return len(self._queue)
+
+    def put(self, data):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self._stats.dropped += 1
+            self._queue.append(data)  # drops the oldest data if full
+            self._cond.notify()
+
+    def stop(self):
+        """
+        Stop delivering the data, as soon as possible (the queued data is dropped)
+        """
+        with self._cond:
+            self._must_stop = True
+            self._queue.clear()
+            self._cond.notify()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._must_stop:
+                        self._cond.wait()
+                    if self._must_stop:
+                        return
+                    data = self._queue.popleft()
+
+                dataflow = self._w_dataflow()
+                if dataflow is None:
+                    return
+                try:
+                    start = time.time()
+                    self._listener(dataflow, data)
+                    self._stats.add_call(time.time() - start)
+                except WeakRefLostError:
+                    dataflow.unsubscribe(self._listener)
+                    return
+                except Exception:
+                    # we cannot abort just because one data failed
+                    logging.exception("Exception when notifying a data_flow")
+                del dataflow, data  # Don't keep them while waiting
+        except Exception:
+            if logging:  # Can be None when ending
+                logging.exception("Delivery thread of %s ended unexpectedly", self._stats.name)
+
+
+def _get_listener_name(listener):
+    """
+    return (str): a (more or less) readable name for a callable
+    """
+    try:
+        if hasattr(listener, "__self__"):
+            name = "%s.%s" % (listener.__self__.__class__.__name__, listener.__name__)
+        else:
+            name = listener.__name__
+    except AttributeError:
+        name = repr(listener)
+    return "%s@%x" % (name, id(listener))
+
+
 class DataFlowBase(object):
     """
     This is an abstract class that must be extended by each detector which
@@ -106,6 +288,9 @@ class DataFlowBase(object):
     def __init__(self):
         self._listeners = set()
         self._lock = threading.RLock()  # need to be acquired to modify the set
+        self._deliveries = {}  # WeakMethod -> _ListenerDelivery (if not direct)
+        self._listener_stats = {}  # WeakMethod -> _ListenerStatistics
+        self._received = 0  # number of data notified
 
     # to be overridden
     # not defined at all so that the proxy version automatically does a remote call
@@ -113,18 +298,22 @@ class DataFlowBase(object):
 #        # TODO timeout argument?
 #        pass
 
-    def subscribe(self, listener):
+    def subscribe(self, listener, policy=DELIVERY_DIRECT):
         """
         Register a callback function to be called when the ActiveValue is
         listener (function): callback function which takes as arguments
            dataflow (this object) and data (the new data array)
+        policy (DELIVERY_* or int > 0): how to pass the data to the listener if
+          it is slower than the data generation. See the definition of the
+          DELIVERY_* constants. If the listener is already subscribed, the
+          policy is updated.
         """
         # TODO update rate argument to indicate how often we need an update?
         assert callable(listener)
 
         with self._lock:
             count_before = len(self._listeners)
-            self._listeners.add(WeakMethod(listener))
+            self._add_listener(listener, policy)
             logging.debug("Listener %r subscribed, now %d subscribers", listener, len(self._listeners))
             if count_before == 0:
                 self.start_generate()
@@ -132,12 +321,69 @@ class DataFlowBase(object):
     def unsubscribe(self, listener):
         with self._lock:
             count_before = len(self._listeners)
-            self._listeners.discard(WeakMethod(listener))
-            count_after = len(self._listeners)
-            logging.debug("Listener %r unsubscribed, now %d subscribers", listener, count_after)
-            if count_before > 0 and count_after == 0:
+            self._remove_listener(listener)
+            logging.debug("Listener %r unsubscribed, now %d subscribers", listener, len(self._listeners))
+            if count_before > 0 and len(self._listeners) == 0:
                 self.stop_generate()
 
+    def _add_listener(self, listener, policy):
+        """
+        Add a (local) listener to the set of listeners. Must be called with the
+        lock taken.
+        """
+        if not (policy in (DELIVERY_DIRECT, DELIVERY_LATEST, DELIVERY_LOSSLESS) or
+                (isinstance(policy, int) and policy > 0)):
+            raise ValueError("Delivery policy %r is not valid" % (policy,))
+
+        wlistener = WeakMethod(listener)
+        prev_delivery = self._deliveries.pop(wlistener, None)
+        if prev_delivery:
+            prev_delivery.stop()
+
+        stats = _ListenerStatistics(_get_listener_name(listener), policy)
+        if policy != DELIVERY_DIRECT:
+            self._deliveries[wlistener] = _ListenerDelivery(self, wlistener, policy, stats)
+        self._listener_stats[wlistener] = stats
+        self._listeners.add(wlistener)
+
+    def _remove_listener(self, listener):
+        """
+        Remove a (local) listener from the set of listeners. Must be called with
+        the lock taken.
+        listener (callable or WeakMethod)
+        """
+        if not isinstance(listener, (WeakMethodBound, WeakMethodFree)):
+            listener = WeakMethod(listener)
+        self._listeners.discard(listener)
+        self._listener_stats.pop(listener, None)
+        delivery = self._deliveries.pop(listener, None)
+        if delivery:
+            delivery.stop()
+
+    def getStatistics(self):
+        """
+        Provides counters about the data passed to the listeners.
+        return (dict str -> value):
+          "received" (int): number of data notified (or received from the
+            remote DataFlow, in case of a proxy)
+          "listeners" (dict str -> dict): for each (local) listener name:
+            "policy" (str or int): the delivery policy
+            "delivered" (int): number of data passed
+            "dropped" (int): number of data dropped because the listener was slow
+            "queue" (int): number of data currently waiting to be passed
+            "latency" (list of int): number of calls for each bin of LATENCY_BINS
+        """
+        listeners = {}
+        for l, stats in list(self._listener_stats.items()):
+            delivery = self._deliveries.get(l)
+            listeners[stats.name] = {"policy": stats.policy,
+                                     "delivered": stats.delivered,
+                                     "dropped": stats.dropped,
+                                     "queue": delivery.depth if delivery else 0,
+                                     "latency": list(stats.latency),
+                                     }
+        return {"received": self._received, "listeners": listeners}
+
 #    # to be overridden
 #    def synchronizedOn(self, event):
 #        raise NotImplementedError("This DataFlow doesn't support Event synchronization")
@@ -170,6 +416,7 @@ class DataFlowBase(object):
         data (DataArray): the data to be sent to listeners
         """
         assert(isinstance(data, numpy.ndarray))
+        self._received += 1
 
         # Never take the lock here, to avoid the case where stop_generate() waits
         # for one last notify
@@ -177,8 +424,17 @@ class DataFlowBase(object):
         # to allow modify the set while calling
         snapshot_listeners = frozenset(self._listeners)
         for l in snapshot_listeners:
+            delivery = self._deliveries.get(l)
+            if delivery:
+                delivery.put(data)
+                continue
+
             try:
+                start = time.time()
                 l(self, data)
+                stats = self._listener_stats.get(l)
+                if stats:
+                    stats.add_call(time.time() - start)
             except WeakRefLostError:
                 self.unsubscribe(l)
             except:
@@ -204,6 +460,17 @@ class DataFlow(DataFlowBase):
         self.pipe = None
         self._max_discard = max_discard
 
+        # for the remote listeners on the same computer
+        self._shm_subscribers = {}  # str (listener) -> int (subscriber index)
+        # str (listener) -> int: index last given to each listener, to give it
+        # back on the next subscription, as the slots might still be in use.
+        self._shm_indices = {}
+        self._shm_ring = None  # SharedMemoryRing, created on first use
+
+        # topic -> MetadataEncoder
+        self._md_encoders = {TOPIC_INLINE: _mdcodec.MetadataEncoder(),
+                             TOPIC_SHM: _mdcodec.MetadataEncoder()}
+
     def _getproxystate(self):
         """
         Equivalent to __getstate__() of the proxy version
@@ -217,41 +484,28 @@ class DataFlow(DataFlowBase):
 
     @max_discard.setter
     def max_discard(self, value):
+        # Only used by the DataFlowProxies created afterwards (the 0MQ pipe
+        # never discards, see _set_pipe_hwm())
         self._max_discard = value
-        # TODO: for now it doesn't make sense to update the HWM, as 0MQ needs to
-        # unbind/bind, but that looses current subscriptions.
-        # self._update_pipe_hwm()
 
-    def _update_pipe_hwm(self):
+    def _set_pipe_hwm(self):
         """
-        updates the high water mark option of OMQ pipe according to max_discard
+        sets the high water mark option of OMQ pipe
         """
-        if self.pipe is None:
-            return
-
-        # When discarding, allow a bit of delay, but nothing more: if more than
-        # 2 (=2x3) msg already queued, the _newest_ one will be dropped.
-        # TODO: in ZMQ v4, ZMQ_CONFLATE allows to have a queue of 1 message
-        # containing only the newest message. That sounds closer to what we
-        # need (though, currently multi-part messages are not supported).
-        # The best would be to drop the _oldest_ messages.
-        hwm = 6 if self._max_discard else 10000
+        # The HWM is not used to discard data: 0MQ would drop the data for
+        # every remote subscriber, including the ones with a listener using
+        # DELIVERY_LOSSLESS or an int policy, and it drops the _newest_
+        # messages. In addition, it is only taken into account when binding,
+        # so it cannot follow the remote subscriptions. So the HWM is high, and
+        # the data is discarded on reception, by each SubscribeProxyThread,
+        # according to max_discard and the policy of its listeners (see
+        # DataFlowProxy._get_thread_discard()).
+        hwm = 10000
         if hasattr(self.pipe, "sndhwm"):  # zmq v3+
             self.pipe.sndhwm = hwm
         else:  # zmq v2
             self.pipe.hwm = hwm
 
-#         # HWM is only updated after rebinding, but 0MQ v2 doesn't allow rebinding
-#         # and with v3+ rebinding losses the current subscriptions.
-#         if self._global_name:
-#             if zmq.zmq_version_info()[0] <= 2:
-#                 logging.info("Cannot update HWM on 0MQ v2")
-#             else:
-#                 logging.debug("Rebinding connection due to HWM change to %d on %s",
-#                               hwm, self._global_name)
-#                 self.pipe.unbind("ipc://" + self._global_name)
-#                 self.pipe.bind("ipc://" + self._global_name)
-
     def _register(self, daemon):
         """
         Get the dataflow ready to be shared. It gets registered to the Pyro
@@ -269,7 +523,7 @@ class DataFlow(DataFlowBase):
         self._ctx = zmq.Context(1)
         self.pipe = self._ctx.socket(zmq.PUB)
         self.pipe.linger = 1 # don't keep messages more than 1s after close
-        self._update_pipe_hwm()
+        self._set_pipe_hwm()
 
         uri = daemon.uriFor(self)
         # uri.sockname is the file name of the pyro daemon (with full path)
@@ -284,6 +538,9 @@ class DataFlow(DataFlowBase):
         daemon = getattr(self, "_pyroDaemon", None)
         if daemon:
             daemon.unregister(self)
+        if self._shm_ring:
+            self._shm_ring.close()
+            self._shm_ring = None
         if self._ctx:
             self.pipe.close()
             self.pipe = None
@@ -324,29 +581,95 @@ class DataFlow(DataFlowBase):
     # speed up a bit calls to them), but as Pyro doesn't ensure the order, it's
     # not possible because it could lead to wrong behaviour in case of quick
     # subscribe/unsubscribe.
-    def subscribe(self, listener):
+    def subscribe(self, listener, policy=DELIVERY_DIRECT):
+        """
+        listener (str or callable): a callable for local listeners, or the name
+          of the remote listener (ie, DataFlowProxy).
+        policy (DELIVERY_* or int > 0): delivery policy, only for local listeners
+        """
         with self._lock:
             count_before = self._count_listeners()
 
             # add string to listeners if listener is string
             if isinstance(listener, basestring):
                 self._remote_listeners.add(listener)
+                # The new listener needs the full metadata to decode the next ones
+                for encoder in self._md_encoders.values():
+                    encoder.reset()
             else:
                 assert callable(listener)
-                self._listeners.add(WeakMethod(listener))
+                self._add_listener(listener, policy)
 
             logging.debug("Listener %r subscribed, now %d subscribers on %s", listener, self._count_listeners(), self._global_name)
             if count_before == 0:
                 self.start_generate()
 
+    @oneway
+    def requestKeyMetadata(self):
+        """
+        Force the next data sent to the remote listeners to contain the full
+        metadata. Called by a remote listener which has missed it, and so cannot
+        decode the metadata anymore.
+        """
+        for encoder in self._md_encoders.values():
+            encoder.reset()
+
+    def negotiateShm(self, listener, hostid):
+        """
+        Reserve a shared-memory subscriber index for a remote listener, so that
+        it receives the data via shared memory instead of inside the 0MQ
+        messages. To be called just before subscribe(). The reservation is
+        dropped at unsubscribe().
+        listener (str): name of the remote listener, as passed to subscribe()
+        hostid (str): identifier of the computer of the listener (cf _shm.get_host_id())
+        return (None or (str, int)): path of the shared-memory segment, and index
+          of the subscriber. None if shared memory cannot be used.
+        """
+        if hostid != _shm.get_host_id() or not self.pipe:
+            return None
+
+        with self._lock:
+            if self._shm_ring is None:
+                if not _shm.is_shm_supported():
+                    return None
+                try:
+                    self._shm_ring = _shm.SharedMemoryRing(self._global_name)
+                except (IOError, OSError):
+                    logging.exception("Failed to create shared-memory for %s", self._global_name)
+                    return None
+
+            if listener not in self._shm_subscribers:
+                used = set(self._shm_subscribers.values())
+                index = self._shm_indices.get(listener)
+                if index is None or index in used:
+                    # Pick an index not used by any subscriber, and whose slots
+                    # have all been released by its previous subscriber (which
+                    # might still hold some arrays)
+                    for index in range(_shm.MAX_SHM_SUBSCRIBERS):
+                        if index not in used and self._shm_ring.is_subscriber_free(index):
+                            break
+                    else:
+                        logging.info("Too many shared-memory subscribers on %s", self._global_name)
+                        return None
+                for l, i in list(self._shm_indices.items()):
+                    if i == index:
+                        del self._shm_indices[l]
+                self._shm_indices[listener] = index
+                self._shm_subscribers[listener] = index
+
+            return self._shm_ring.path, self._shm_subscribers[listener]
+
     def unsubscribe(self, listener):
         with self._lock:
             count_before = self._count_listeners()
             if isinstance(listener, basestring):
                 # remove string from listeners
                 self._remote_listeners.discard(listener)
+                # The slots still used by the listener are released by the
+                # listener itself (cf SharedMemoryReader)
+                self._shm_subscribers.pop(listener, None)
             else:
-                self._listeners.discard(WeakMethod(listener))
+                self._remove_listener(listener)
 
             count_after = self._count_listeners()
             logging.debug("Listener %r unsubscribed, now %d subscribers on %s", listener, count_after, self._global_name)
@@ -365,25 +688,66 @@ class DataFlow(DataFlowBase):
 
             # TODO thread-safe for self.pipe ?
             dformat = {"dtype": str(data.dtype), "shape": data.shape}
-            self.pipe.send_pyobj(dformat, zmq.SNDMORE)
-            self.pipe.send_pyobj(data.metadata, zmq.SNDMORE)
-            try:
-                if not data.flags["C_CONTIGUOUS"]:
-                    # if not in C order, it will be received incorrectly
-                    # TODO: if it's just rotated, send the info to reconstruct it
-                    # and avoid the memory copy
-                    raise TypeError("Need C ordered array")
-                self.pipe.send(numpy.getbuffer(data), copy=False)
-            except TypeError:
-                # not all buffers can be sent zero-copy (e.g., has strides)
-                # try harder by copying (which removes the strides)
-                logging.debug("Failed to send data with zero-copy")
-                data = numpy.require(data, requirements=["C_CONTIGUOUS"])
-                self.pipe.send(numpy.getbuffer(data), copy=False)
+            remote_listeners = frozenset(self._remote_listeners)
+            shm_subs = [i for l, i in list(self._shm_subscribers.items())
+                        if l in remote_listeners]
+            if len(shm_subs) < len(remote_listeners):
+                self._send_inline(TOPIC_INLINE, dformat, data)
+            if shm_subs:
+                self._send_shm(dformat, data, shm_subs)
 
         # publish locally
         DataFlowBase.notify(self, data)
 
+    def _send_inline(self, topic, dformat, data):
+        """
+        Send the data over 0MQ, including the array buffer
+        """
+        self.pipe.send(topic, zmq.SNDMORE)
+        if not data.flags["C_CONTIGUOUS"]:
+            # If it's a view (eg, transposed) on a C ordered buffer, send the
+            # buffer and the info to reconstruct the view on the receiver side
+            recipe = _get_view_recipe(data)
+            if recipe is not None:
+                buf, offset, strides = recipe
+                self.pipe.send_pyobj(dict(dformat, offset=offset, strides=strides), zmq.SNDMORE)
+                self.pipe.send(self._md_encoders[topic].encode(data.metadata), zmq.SNDMORE)
+                self.pipe.send(numpy.getbuffer(buf), copy=False)
+                return
+
+        self.pipe.send_pyobj(dformat, zmq.SNDMORE)
+        self.pipe.send(self._md_encoders[topic].encode(data.metadata), zmq.SNDMORE)
+        try:
+            if not data.flags["C_CONTIGUOUS"]:
+                # if not in C order, it will be received incorrectly
+                raise TypeError("Need C ordered array")
+            self.pipe.send(numpy.getbuffer(data), copy=False)
+        except TypeError:
+            # not all buffers can be sent zero-copy (e.g., has strides)
+            # try harder by copying (which removes the strides)
+            logging.debug("Failed to send data with zero-copy")
+            data = numpy.require(data, requirements=["C_CONTIGUOUS"])
+            self.pipe.send(numpy.getbuffer(data), copy=False)
+
+    def _send_shm(self, dformat, data, subscribers):
+        """
+        Copy the data to the shared memory, and send its location over 0MQ.
+        If the data is small, or no slot is available, it's sent inline.
+        subscribers (list of int): indices of the shared-memory subscribers
+        """
+        shm_info = None
+        ring = self._shm_ring
+        if ring and data.nbytes >= _shm.SHM_MIN_SIZE:
+            # Non C-contiguous data is reordered while copied
+            shm_info = ring.write(data, subscribers)
+
+        if shm_info is None:
+            self._send_inline(TOPIC_SHM, dict(dformat, shm=None), data)
+        else:
+            self.pipe.send(TOPIC_SHM, zmq.SNDMORE)
+            self.pipe.send_pyobj(dict(dformat, shm=shm_info), zmq.SNDMORE)
+            self.pipe.send(self._md_encoders[TOPIC_SHM].encode(data.metadata))
+
     def __del__(self):
         if self._count_listeners() > 0:
             self.stop_generate()
@@ -412,6 +776,7 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
         self._ctx = None
         self._commands = None
         self._thread = None
+        self._shm_supported = True  # False once known it cannot be used
 
     def __getstate__(self):
         # must permit to recreate a proxy to a data-flow in a different container
@@ -430,25 +795,93 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
         self._ctx = None
         self._commands = None
         self._thread = None
+        self._shm_supported = True  # False once known it cannot be used
 
     # .get() is a direct remote call
 
-    # next three methods are directly from DataFlowBase
-    #.subscribe()
-    #.unsubscribe()
-    #.notify()
+    # .notify() is directly from DataFlowBase
+
+    def subscribe(self, listener, policy=DELIVERY_DIRECT):
+        with self._lock:
+            DataFlowBase.subscribe(self, listener, policy)
+            self._update_thread_discard()
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            DataFlowBase.unsubscribe(self, listener)
+            self._update_thread_discard()
+
+    def _get_thread_discard(self):
+        """
+        return (int): the maximum number of data that can be discarded in a row
+          when receiving the data, taking into account the policy of the listeners
+        """
+        # The data can only be discarded if every listener accepts to skip data
+        for stats in list(self._listener_stats.values()):
+            if stats.policy not in (DELIVERY_DIRECT, DELIVERY_LATEST):
+                return 0
+        return self.max_discard
+
+    def _update_thread_discard(self):
+        if self._thread:
+            self._thread.max_discard = self._get_thread_discard()
+
+    def getStatistics(self):
+        """
+        See DataFlowBase.getStatistics(). In addition, it contains:
+          "discarded" (int): number of data received, but dropped before being
+            passed to any listener, because a newer one was already available.
+        """
+        stats = DataFlowBase.getStatistics(self)
+        stats["discarded"] = self._thread.discarded if self._thread else 0
+        stats["received"] += stats["discarded"]
+        return stats
 
     def _create_thread(self):
         self._ctx = zmq.Context(1) # apparently 0MQ reuse contexts
         self._commands = self._ctx.socket(zmq.PAIR)
         self._commands.bind("inproc://" + self._global_name)
-        self._thread = SubscribeProxyThread(self.notify, self._global_name, self.max_discard, self._ctx)
+        self._thread = SubscribeProxyThread(self.notify, self._global_name,
+                                            self._get_thread_discard(), self._ctx,
+                                            self._pyroUri)
         self._thread.start()
 
+    def _negotiate_shm(self):
+        """
+        Try to set up the shared-memory transport with the remote dataflow
+        return (None or SharedMemoryReader): reader to use, or None if the data
+          has to be received inline in the 0MQ messages.
+        """
+        if not self._shm_supported:
+            return None
+
+        try:
+            ret = Pyro4.Proxy.__getattr__(self, "negotiateShm")(self._proxy_name, _shm.get_host_id())
+        except Exception:
+            # Typically, because the remote DataFlow is too old
+            logging.debug("Failed to negotiate shared-memory with dataflow %s",
+                          self._global_name, exc_info=True)
+            self._shm_supported = False
+            return None
+        if ret is None:
+            return None
+
+        path, index = ret
+        if not _shm.SharedMemoryReader.can_access(path):
+            logging.info("Cannot access shared-memory %s, will receive data of %s inline",
+                         path, self._global_name)
+            self._shm_supported = False
+            # Drop the reservation
+            Pyro4.Proxy.__getattr__(self, "unsubscribe")(self._proxy_name)
+            return None
+
+        return _shm.SharedMemoryReader(index, path=path)
+
     def start_generate(self):
         # start the remote subscription
         if not self._thread:
             self._create_thread()
+        self._thread.shm_reader = self._negotiate_shm()
         self._commands.send("SUB")
         self._commands.recv() # synchronise
 
@@ -488,18 +921,28 @@ class DataFlowProxy(DataFlowBase, Pyro4.Proxy):
 
 
 class SubscribeProxyThread(threading.Thread):
-    def __init__(self, notifier, uri, max_discard, zmq_ctx):
+    def __init__(self, notifier, uri, max_discard, zmq_ctx, pyro_uri=None):
         """
         notifier (callable): method to call when a new array arrives
         uri (string): unique string to identify the connection
         max_discard (int)
         zmq_ctx (0MQ context): available 0MQ context to use
+        pyro_uri (None or Pyro4.URI): URI of the remote DataFlow, used to request
+          the full metadata when it was missed. If None, the data is dropped
+          until the full metadata is sent anyway.
         """
         threading.Thread.__init__(self, name="zmq for dataflow " + uri)
         self.daemon = True
         self.uri = uri
         self.max_discard = max_discard
         self._ctx = zmq_ctx
+        # SharedMemoryReader to use for the next subscription, or None to receive
+        # the data inline.
+        self.shm_reader = None
+        self._topic = TOPIC_INLINE
+        self.discarded = 0  # total number of data discarded
+        self._pyro_uri = pyro_uri
+        self._remote = None  # Pyro4.Proxy, own proxy to the DataFlow, for this thread
         # don't keep strong reference to notifier so that it can be garbage
         # collected normally and it will let us know then that we can stop
         self.w_notifier = WeakMethod(notifier)
@@ -517,12 +960,8 @@ class SubscribeProxyThread(threading.Thread):
         else:  # zmq v2
             self._data.hwm = 0
         self._data.connect("ipc://" + uri)
-
-        # TODO: we need a more advance support for max_discards to be able to
-        # ensure all the data is received when the client needs it.
-        # API should be either:
-        #  *  .max_discard = XXX (= per dataflow)
-        #  * .subscribe(callback, discard=True) (per subscriber)
+        # Note: .max_discard is updated by the DataFlowProxy according to the
+        # delivery policy of its listeners.
 
     def run(self):
         """
@@ -536,6 +975,8 @@ class SubscribeProxyThread(threading.Thread):
             poller.register(self._commands, zmq.POLLIN)
             poller.register(self._data, zmq.POLLIN)
             discarded = 0
+            shm_reader = None
+            md_decoder = _mdcodec.MetadataDecoder(self._request_key_metadata)
             while True:
                 socks = dict(poller.poll())
 
@@ -543,11 +984,20 @@ class SubscribeProxyThread(threading.Thread):
                 if self._commands in socks:
                     message = self._commands.recv()
                     if message == "SUB":
-                        self._data.setsockopt(zmq.SUBSCRIBE, '')
-                        logging.debug("Subscribed to remote dataflow %s", self.uri)
+                        shm_reader = self.shm_reader
+                        if shm_reader is not None:
+                            # Frames of a previous subscription, never received
+                            shm_reader.release_unused()
+                        md_decoder.reset()
+                        self._topic = TOPIC_INLINE if shm_reader is None else TOPIC_SHM
+                        self._data.setsockopt(zmq.SUBSCRIBE, self._topic)
+                        logging.debug("Subscribed to remote dataflow %s (%s)", self.uri,
+                                      "inline" if shm_reader is None else "shared memory")
                         self._commands.send("SUBD")
                     elif message == "UNSUB":
-                        self._data.setsockopt(zmq.UNSUBSCRIBE, '')
+                        self._data.setsockopt(zmq.UNSUBSCRIBE, self._topic)
+                        if shm_reader is not None:
+                            shm_reader.release_unused()
                         if logging:
                             logging.debug("Unsubscribed from remote dataflow %s", self.uri)
                         # no confirmation (async)
@@ -560,26 +1010,54 @@ class SubscribeProxyThread(threading.Thread):
                 if self._data in socks:
                     # TODO: be more resilient if wrong data is received (can
                     # block forever)
+                    self._data.recv()  # topic
                     array_format = self._data.recv_pyobj()
-                    array_md = self._data.recv_pyobj()
-                    array_buf = self._data.recv(copy=False)
+                    # Always decode the metadata, even if the data is discarded,
+                    # as it might be needed to decode the next metadata.
+                    array_md = md_decoder.decode(self._data.recv())
+                    shm_info = array_format.get("shm")
+                    if shm_info is None:
+                        array_buf = self._data.recv(copy=False)
+                    elif shm_reader is None:
+                        # Left-over from a previous subscription, with a different transport
+                        continue
+                    if array_md is None:
+                        # Just subscribed, and the full metadata has not arrived yet
+                        if shm_info is not None:
+                            shm_reader.release(shm_info)
+                        continue
                     # logging.debug("Received new DataArray over ZMQ for %s", self.uri)
                     # more fresh data already?
                     if (self._data.getsockopt(zmq.EVENTS) & zmq.POLLIN and
                         discarded < self.max_discard):
                         discarded += 1
+                        self.discarded += 1
                         # logging.debug("Discarding object received as a newer one is available")
+                        if shm_info is not None:
+                            shm_reader.release(shm_info)
                         continue
                     # TODO: only log the accumulated number every second, to avoid log flooding
 #                     if discarded:
 #                         logging.debug("Dataflow %s dropped %d arrays", self.uri, discarded)
                     discarded = 0
+                    if shm_info is not None:
+                        array = shm_reader.read(shm_info, array_format["dtype"], array_format["shape"])
+                        if array is None:
+                            logging.debug("Skipping data in shared-memory not valid anymore for %s", self.uri)
+                            continue
                     # TODO: any need to use zmq.utils.rebuffer.array_from_buffer()?
-                    if len(array_buf):
+                    elif "strides" in array_format:
+                        # View on the buffer (eg, transposed)
+                        array = numpy.ndarray(array_format["shape"], dtype=array_format["dtype"],
+                                              buffer=numpy.frombuffer(array_buf, dtype=numpy.uint8),
+                                              offset=array_format["offset"],
+                                              strides=array_format["strides"])
+                    elif len(array_buf):
                         array = numpy.frombuffer(array_buf, dtype=array_format["dtype"])
+                        array.shape = array_format["shape"]
                     else: # frombuffer doesn't support zero length array
                         array = numpy.empty((0,), dtype=array_format["dtype"])
-                    array.shape = array_format["shape"]
+                        array.shape = array_format["shape"]
                     darray = DataArray(array, metadata=array_md)
 
                     try:
@@ -598,6 +1076,30 @@ class SubscribeProxyThread(threading.Thread):
                 self._data.close()
             except Exception:
                 print("Exception closing ZMQ data connection")
+            if self._remote is not None:
+                try:
+                    self._remote._pyroRelease()
+                except Exception:
+                    pass
+
+    def _request_key_metadata(self):
+        """
+        Ask the remote DataFlow to send the full metadata with the next data.
+        Called (from this thread) when the full metadata was missed.
+        """
+        if self._pyro_uri is None:
+            return
+        logging.debug("Requesting full metadata of remote dataflow %s", self.uri)
+        try:
+            # Pyro proxies cannot be shared between threads, so use our own one
+            if self._remote is None:
+                self._remote = Pyro4.Proxy(self._pyro_uri)
+                self._remote._pyroOneway.add("requestKeyMetadata")
+            self._remote.requestKeyMetadata()
+        except Exception:
+            # Not a big deal, the full metadata is sent periodically anyway
+            logging.info("Failed to request full metadata of remote dataflow %s",
+                         self.uri, exc_info=True)
 
 
 def unregister_dataflows(self):
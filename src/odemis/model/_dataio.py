@@ -75,6 +75,15 @@ class DataArrayShadow(object):
 #         return (DataArray): the shape of the DataArray is typically of shape
 #         """
 
+    # Optionally defined if the object supports per tile access, and can read
+    # multiple tiles more efficiently than one at a time (eg, in parallel).
+#     def getTiles(self, tiles):
+#         """
+#         tiles (iterable of (int, int, int)): X index, Y index and zoom level
+#             of each tile, as for getTile()
+#         return (list of DataArray): the tiles, in the same order as requested
+#         """
+
 
 class AcquisitionData(object):
     """
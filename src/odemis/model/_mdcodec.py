@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Encoding of the metadata of the DataArrays sent by a DataFlow over 0MQ.
+# Most of the metadata is identical from one frame to the next one, so instead
+# of sending (and pickling) the whole dict at every frame, only the difference
+# compared to the last "key" metadata is sent.
+#
+# Each message is a fixed header followed by a pickled body:
+#  * version (uint8): CODEC_VERSION
+#  * kind (uint8): KIND_KEY or KIND_DELTA
+#  * key number (uint32): identifier of the key metadata
+# For a KIND_KEY, the body is the full metadata (dict).
+# For a KIND_DELTA, the body is a tuple (changed, removed):
+#  * changed (dict (int or str) -> value): the new values of the keys which
+#    are different from the key metadata. The key is replaced by its index in
+#    the (sorted) list of keys of the key metadata, or is the key itself if it's
+#    a new key.
+#  * removed (tuple of int): indices of the keys not present anymore
+# A key metadata is sent when explicitly requested (ie, when a new subscriber
+# arrives, or when a subscriber missed it), at least every KEY_PERIOD, and
+# whenever the delta would be large.
+# As the delta are always relative to the key metadata, any intermediary message
+# can be lost (eg, discarded by 0MQ) without consequence. If a key metadata is
+# lost, the decoder asks for a new one, instead of waiting for the periodic one.
+
+from __future__ import division
+
+import copy
+import numbers
+import numpy
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import struct
+import time
+
+
+CODEC_VERSION = 1
+KIND_KEY = 0
+KIND_DELTA = 1
+KEY_PERIOD = 1  # s, maximum time between two key metadata
+
+_HEADER = struct.Struct("<BBI")
+
+# Types of the values which can be shared between the decoded metadata, as they
+# cannot be modified.
+_IMMUTABLE_TYPES = (type(None), numbers.Number, bytes, type(u""))
+
+
+def _is_same(a, b):
+    """
+    return (bool): True if both values are identical (and of the same type)
+    """
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    try:
+        return bool(a == b)
+    except Exception:  # eg, numpy arrays with more than one element
+        return False
+
+
+def _is_immutable(v):
+    """
+    return (bool): True if the value (and everything it contains) cannot be
+      modified
+    """
+    if isinstance(v, _IMMUTABLE_TYPES):
+        return True
+    if type(v) is tuple:
+        return all(_is_immutable(i) for i in v)
+    return False
+
+
+def _get_copier(v):
+    """
+    v (mutable value): a value of the metadata
+    return (callable value -> value): the fastest function to copy such value,
+      without sharing anything mutable with the original
+    """
+    if type(v) is list and all(_is_immutable(i) for i in v):
+        return list
+    elif type(v) is numpy.ndarray and not v.dtype.hasobject:
+        return numpy.copy
+    return copy.deepcopy
+
+
+class MetadataEncoder(object):
+    """
+    Encodes the successive metadata of one stream of DataArrays.
+    Not thread-safe.
+    """
+
+    def __init__(self):
+        self._key_md = None
+        self._key_index = {}  # str -> int: index of each key of the key metadata
+        self._key_num = 0
+        self._key_time = 0
+        self._force_key = True
+
+    def reset(self):
+        """
+        Force the next metadata to be encoded fully. Can be called from any thread.
+        """
+        self._force_key = True
+
+    def encode(self, md):
+        """
+        md (dict str -> value): the metadata
+        return (bytes): the encoded metadata
+        """
+        if not self._force_key and time.time() < self._key_time + KEY_PERIOD:
+            changed = {}
+            key_index = self._key_index
+            key_md = self._key_md
+            for k, v in md.items():
+                try:
+                    prev_v = key_md[k]
+                except KeyError:
+                    changed[k] = v
+                    continue
+                # Quick check for the most common case (identical float, str...)
+                if v is prev_v or (type(v) is float and type(prev_v) is float and v == prev_v):
+                    continue
+                if not _is_same(v, prev_v):
+                    changed[key_index[k]] = v
+
+            if len(md) == len(self._key_md) and all(isinstance(i, int) for i in changed):
+                removed = ()
+            else:
+                removed = tuple(i for k, i in key_index.items() if k not in md)
+
+            # Only worthy if there is less than half of the keys to send
+            if len(changed) + len(removed) <= len(md) // 2:
+                return (_HEADER.pack(CODEC_VERSION, KIND_DELTA, self._key_num) +
+                        pickle.dumps((changed, removed), pickle.HIGHEST_PROTOCOL))
+
+        # Encode as a new key metadata
+        self._force_key = False
+        self._key_num = (self._key_num + 1) % (2 ** 32)
+        self._key_md = dict(md)
+        self._key_index = {k: i for i, k in enumerate(sorted(md.keys()))}
+        self._key_time = time.time()
+        return (_HEADER.pack(CODEC_VERSION, KIND_KEY, self._key_num) +
+                pickle.dumps(self._key_md, pickle.HIGHEST_PROTOCOL))
+
+
+class MetadataDecoder(object):
+    """
+    Decodes the successive metadata of one stream of DataArrays.
+    Not thread-safe.
+    """
+
+    def __init__(self, request_key=None):
+        """
+        request_key (None or callable): called (without argument) when a
+          metadata cannot be decoded because its key metadata was not received.
+          It should cause a new key metadata to be sent (eg, by calling
+          MetadataEncoder.reset()). It's called only once per missing key.
+        """
+        self._key_md = None
+        self._key_keys = []  # str: all the keys of the key metadata, sorted
+        # str -> callable: the keys of the key metadata with a mutable value,
+        # and the function to copy it
+        self._key_mutable = {}
+        self._key_num = None
+        self._request_key = request_key
+        self._requested_num = None  # key number of the last missing key requested
+
+    def reset(self):
+        """
+        Forget the current key metadata (eg, because of a new subscription)
+        """
+        self._key_md = None
+        self._key_num = None
+
+    def decode(self, buf):
+        """
+        buf (bytes): the encoded metadata
+        return (None or dict str -> value): the metadata. None if it cannot be
+          decoded (yet), because the corresponding key metadata was not received.
+        raise ValueError: if the encoding is not supported
+        """
+        version, kind, key_num = _HEADER.unpack_from(buf)
+        if version != CODEC_VERSION:
+            raise ValueError("Metadata encoding version %d not supported" % (version,))
+        body = pickle.loads(buf[_HEADER.size:])
+
+        if kind == KIND_KEY:
+            self._key_md = body
+            self._key_keys = sorted(body.keys())
+            self._key_mutable = {k: _get_copier(v) for k, v in body.items()
+                                 if not _is_immutable(v)}
+            self._key_num = key_num
+            return self._copy_key_md()
+        elif kind == KIND_DELTA:
+            if key_num != self._key_num:
+                if self._request_key and key_num != self._requested_num:
+                    self._requested_num = key_num
+                    self._request_key()
+                return None
+            changed, removed = body
+            md = self._copy_key_md()
+            keys = self._key_keys
+            for i in removed:
+                del md[keys[i]]
+            for k, v in changed.items():
+                if isinstance(k, int):
+                    k = keys[k]
+                md[k] = v
+            return md
+        else:
+            raise ValueError("Unknown metadata encoding kind %d" % (kind,))
+
+    def _copy_key_md(self):
+        """
+        return (dict str -> value): a copy of the key metadata, which doesn't
+          share any mutable value (eg, list, array) with it, so that the
+          metadata returned can be modified independently.
+        """
+        md = dict(self._key_md)
+        for k, copier in self._key_mutable.items():
+            md[k] = copier(md[k])
+        return md
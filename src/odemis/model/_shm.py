@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Shared-memory transport for the DataFlows, when the publisher and the
+# subscriber run on the same computer. The data is written once in a "slot" of a
+# ring of buffers in a POSIX shared-memory segment (ie, a file in /dev/shm), and
+# only a small descriptor is sent over 0MQ.
+#
+# Layout of a segment:
+#  * header: for each slot, a sequence number (uint64) and one byte per
+#    subscriber. The byte is set to 1 by the writer when the slot is filled for
+#    this subscriber and set back to 0 by the subscriber when all the
+#    DataArrays using it are released. Each byte has only one writer at a time,
+#    so no lock is needed between the processes.
+#  * data: the slots, each of the same size, aligned on memory pages.
+# A slot can only be reused by the writer once all its subscriber bytes are 0.
+# The writer never clears the bytes itself: when a subscriber stops listening,
+# the arrays it still holds keep their slots. The subscriber releases the slots
+# it received but never read when it (un)subscribes.
+
+from __future__ import division
+
+import collections
+import itertools
+import logging
+import mmap
+import numpy
+import os
+import socket
+import threading
+
+
+SHM_DIRECTORY = "/dev/shm"
+SHM_PREFIX = "odemis-df-"
+SHM_SLOTS = 8  # number of frames which can be shared simultaneously
+MAX_SHM_SUBSCRIBERS = 32  # maximum number of proxies using the same segment
+# Below this size (in bytes), the data is sent inline, as it's not worthy
+SHM_MIN_SIZE = 64 * 1024
+
+_PAGE_SIZE = mmap.PAGESIZE
+_segment_counter = itertools.count()
+
+# Slots currently used by arrays in this process: (path, slot, index) -> number of leases
+_held_slots = collections.Counter()
+_held_lock = threading.Lock()
+
+
+def _round_up_page(size):
+    return ((size + _PAGE_SIZE - 1) // _PAGE_SIZE) * _PAGE_SIZE
+
+
+def _header_size(nslots):
+    return _round_up_page(nslots * (8 + MAX_SHM_SUBSCRIBERS))
+
+
+def _map_header(mm, nslots):
+    """
+    return (numpy.array of uint64 of shape nslots, numpy.array of uint8 of shape
+      nslots x MAX_SHM_SUBSCRIBERS): sequence numbers and subscriber flags
+    """
+    seqs = numpy.ndarray((nslots,), dtype=numpy.uint64, buffer=mm, offset=0)
+    flags = numpy.ndarray((nslots, MAX_SHM_SUBSCRIBERS), dtype=numpy.uint8,
+                          buffer=mm, offset=nslots * 8)
+    return seqs, flags
+
+
+_host_id = None
+
+
+def get_host_id():
+    """
+    return (str): a string which is identical for all the processes which can
+      share memory together (ie, running on the same computer, since the same boot)
+    """
+    global _host_id
+    if _host_id is None:
+        try:
+            with open("/proc/sys/kernel/random/boot_id") as f:
+                boot_id = f.read().strip()
+        except IOError:
+            boot_id = ""
+        _host_id = "%s/%s" % (socket.gethostname(), boot_id)
+    return _host_id
+
+
+def is_shm_supported():
+    """
+    return (bool): True if shared-memory segments can be created on this computer
+    """
+    return os.path.isdir(SHM_DIRECTORY) and os.access(SHM_DIRECTORY, os.W_OK)
+
+
+class SharedMemoryRing(object):
+    """
+    Writer side: a ring of slots in a shared-memory segment. It's used by one
+    DataFlow. The segment is recreated (with a new name) when a frame is bigger
+    than the slots.
+    """
+
+    def __init__(self, name, nslots=SHM_SLOTS):
+        """
+        name (str): some string to identify the segment (will be part of the
+          file name), typically the name of the DataFlow.
+        nslots (int): number of slots in the ring
+        """
+        self._name = "".join(c if c.isalnum() else "_" for c in name)[-64:]
+        self._nslots = nslots
+        self._lock = threading.Lock()
+        self._path = None
+        self._mm = None
+        self._seqs = None
+        self._flags = None
+        self._data = None  # numpy array of uint8 on all the data part
+        self._slot_size = 0
+        self._next_slot = 0
+        self._seq = 0
+        # Create a (data-less) segment immediately, so that the subscribers
+        # can check they have access to it.
+        self._create_segment(0)
+
+    @property
+    def path(self):
+        return self._path
+
+    def _create_segment(self, slot_size):
+        """
+        Create a new segment, and drop the previous one (which is still kept
+         alive by the subscribers mapping it).
+        slot_size (int): size in bytes of each slot
+        """
+        slot_size = _round_up_page(slot_size)
+        hdr_size = _header_size(self._nslots)
+        path = os.path.join(SHM_DIRECTORY, "%s%d-%d-%s" % (SHM_PREFIX, os.getpid(),
+                                                           next(_segment_counter), self._name))
+        # Same permissions as the other files (ie, taking into account umask),
+        # so that the subscribers from other users of the same group can write
+        # their flag.
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            os.ftruncate(fd, hdr_size + slot_size * self._nslots)
+            mm = mmap.mmap(fd, hdr_size + slot_size * self._nslots)
+        except Exception:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+
+        self._unlink()
+        self._path = path
+        self._mm = mm
+        self._seqs, self._flags = _map_header(mm, self._nslots)
+        self._data = numpy.ndarray((slot_size * self._nslots,), dtype=numpy.uint8,
+                                   buffer=mm, offset=hdr_size)
+        self._slot_size = slot_size
+        self._next_slot = 0
+        logging.debug("Created shared-memory segment %s with %d slots of %d bytes",
+                      path, self._nslots, slot_size)
+
+    def _unlink(self):
+        if self._path is None:
+            return
+        try:
+            os.unlink(self._path)
+        except OSError:
+            logging.warning("Failed to delete shared-memory segment %s", self._path)
+        # The mmap itself will be closed automatically when garbage collected.
+        # Don't do it explicitly, as some numpy arrays might still be using it.
+        self._path = None
+        self._mm = None
+        self._seqs = self._flags = self._data = None
+
+    def close(self):
+        with self._lock:
+            self._unlink()
+
+    def is_subscriber_free(self, index):
+        """
+        Check whether a subscriber index can be given to a new subscriber, ie,
+        no slot is still used with this index.
+        index (0<=int<MAX_SHM_SUBSCRIBERS)
+        return (bool): True if no slot is reserved for this index
+        """
+        with self._lock:
+            return self._flags is None or not self._flags[:, index].any()
+
+    def write(self, data, subscribers):
+        """
+        Copy the data into a free slot
+        data (numpy.ndarray): the array to copy (if not C-contiguous, it will
+          be reordered during the copy)
+        subscribers (list of int): index of all the subscribers which will
+          receive the slot
+        return (None or tuple (str, int, int, int)): path of the segment, slot
+          number, offset of the data in the segment, sequence number.
+          None if no slot is available (then the data should be sent inline).
+        """
+        nbytes = data.nbytes
+        with self._lock:
+            if self._path is None:
+                return None
+            if nbytes > self._slot_size:
+                try:
+                    self._create_segment(nbytes)
+                except (IOError, OSError):
+                    logging.exception("Failed to create shared-memory segment of %d bytes", nbytes)
+                    return None
+
+            # Look for the next slot fully released by every subscriber
+            for i in range(self._nslots):
+                slot = (self._next_slot + i) % self._nslots
+                if not self._flags[slot].any():
+                    break
+            else:
+                return None
+            self._next_slot = (slot + 1) % self._nslots
+
+            self._seq += 1
+            self._seqs[slot] = self._seq
+            for s in subscribers:
+                self._flags[slot, s] = 1
+
+            start = slot * self._slot_size
+            dest = self._data[start:start + nbytes].view(data.dtype).reshape(data.shape)
+            dest[...] = data
+            return self._path, slot, _header_size(self._nslots) + start, self._seq
+
+    def __del__(self):
+        try:
+            self._unlink()
+        except Exception:
+            pass
+
+
+class _ShmLease(object):
+    """
+    Owns the reference to a slot on the subscriber side. It's used as the base
+    of the numpy array, so that it is deleted when the last view on the data is
+    gone. At that moment, the slot is released for the writer.
+    """
+
+    def __init__(self, segment, slot, index, seq, offset, dtype, shape):
+        self._segment = segment  # keep the memory alive
+        self._slot = slot
+        self._index = index
+        self._seq = seq  # to check the slot has not been given to another frame
+        self._key = (segment.path, slot, index)
+        with _held_lock:
+            _held_slots[self._key] += 1
+        self.__array_interface__ = {
+            "shape": tuple(shape),
+            "typestr": numpy.dtype(dtype).str,
+            "data": (segment.address + offset, True),  # read-only
+            "version": 3,
+        }
+
+    def __del__(self):
+        try:
+            with _held_lock:
+                _held_slots[self._key] -= 1
+                if _held_slots[self._key] > 0:
+                    return
+                del _held_slots[self._key]
+                # Only release if the slot still contains our frame
+                if self._segment.seqs[self._slot] == self._seq:
+                    self._segment.flags[self._slot, self._index] = 0
+        except Exception:
+            pass
+
+
+class _SegmentMap(object):
+    """
+    A mapping of a segment on the subscriber side
+    """
+
+    def __init__(self, path, nslots):
+        self.path = path
+        fd = os.open(path, os.O_RDWR)
+        try:
+            size = os.fstat(fd).st_size
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.seqs, self.flags = _map_header(self.mm, nslots)
+        self.address = numpy.frombuffer(self.mm, dtype=numpy.uint8).ctypes.data
+
+
+class SharedMemoryReader(object):
+    """
+    Subscriber side of a SharedMemoryRing. Not thread-safe: to be used only by
+    one thread (the one receiving the descriptors).
+    """
+
+    def __init__(self, index, nslots=SHM_SLOTS, path=None):
+        """
+        index (0<=int<MAX_SHM_SUBSCRIBERS): index of the subscriber, as provided
+          by the writer
+        path (None or str): path of the current segment of the writer, if known
+        """
+        self.index = index
+        self._nslots = nslots
+        self._segments = {}  # path -> _SegmentMap
+        self._path = path  # latest segment path known
+
+    @staticmethod
+    def can_access(path):
+        """
+        return (bool): True if the segment can be opened
+        """
+        return os.access(path, os.R_OK | os.W_OK)
+
+    def _get_segment(self, path):
+        try:
+            return self._segments[path]
+        except KeyError:
+            pass
+        seg = _SegmentMap(path, self._nslots)
+        self._path = path
+        # A new segment means the previous ones are not used anymore by the writer.
+        # The leases keep a reference to their segment anyway.
+        self._segments = {path: seg}
+        return seg
+
+    def read(self, shm_info, dtype, shape):
+        """
+        Get the data from a slot
+        shm_info (tuple): as returned by SharedMemoryRing.write()
+        dtype (numpy.dtype)
+        shape (tuple of int)
+        return (None or numpy.ndarray): read-only array backed by the shared
+          memory, or None if the slot is not (anymore) valid for this subscriber.
+        """
+        path, slot, offset, seq = shm_info
+        try:
+            seg = self._get_segment(path)
+        except (IOError, OSError):
+            # The writer has already moved to a newer segment
+            logging.debug("Failed to open shared-memory segment %s", path)
+            return None
+
+        # It's only safe to read if the slot was reserved for us, and it has not
+        # been rewritten since then.
+        if not seg.flags[slot, self.index]:
+            return None
+        if seg.seqs[slot] != seq:
+            # Don't release: the flag corresponds to a newer frame
+            return None
+
+        return numpy.asarray(_ShmLease(seg, slot, self.index, seq, offset, dtype, shape))
+
+    def release_unused(self):
+        """
+        Release all the slots reserved for this subscriber in the latest
+        segment, but not used by any array. To be called when not subscribed,
+        to release the slots of the frames sent but never received.
+        """
+        if self._path is None:
+            return
+        try:
+            seg = self._get_segment(self._path)
+        except (IOError, OSError):
+            return  # The writer doesn't use it anymore anyway
+        with _held_lock:
+            for slot in numpy.flatnonzero(seg.flags[:, self.index]):
+                slot = int(slot)
+                if (seg.path, slot, self.index) not in _held_slots:
+                    seg.flags[slot, self.index] = 0
+
+    def release(self, shm_info):
+        """
+        Release a slot without reading it (eg, because the data is discarded)
+        shm_info (tuple): as returned by SharedMemoryRing.write()
+        """
+        path, slot, offset, seq = shm_info
+        try:
+            seg = self._get_segment(path)
+        except (IOError, OSError):
+            return  # The writer doesn't use it anymore anyway
+        if seg.seqs[slot] == seq:
+            seg.flags[slot, self.index] = 0
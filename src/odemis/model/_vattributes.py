@@ -25,6 +25,7 @@ from past.builtins import basestring
 import Pyro4
 from Pyro4.core import oneway
 import collections
+import copy
 import inspect
 import logging
 import numbers
@@ -108,6 +109,20 @@ class VigilantAttributeBase(object):
                                   "receiving value %s", l, v)
 
 
+class _CacheInvalidation(object):
+    """
+    Message sent to the remote subscribers instead of a value, to indicate that
+    the value has changed without notification, so that any cached value is
+    out of date.
+    """
+
+    def __reduce__(self):
+        # Always unpickled as the same object, to be easily recognised
+        return "_CACHE_INVALIDATION"
+
+_CACHE_INVALIDATION = _CacheInvalidation()
+
+
 # noinspection PyBroadException
 class VigilantAttribute(VigilantAttributeBase):
     """
@@ -160,8 +175,11 @@ class VigilantAttribute(VigilantAttributeBase):
         Equivalent to __getstate__() of the proxy version
         """
         proxy_state = Pyro4.core.pyroObjectSerializer(self)[2]
+        # The value can only be cached by the proxy if every change is notified,
+        # which is not the case when the value is computed by a getter.
+        cacheable = self._getter is None
         return (proxy_state, _core.dump_roattributes(self), self.unit,
-                self.readonly, self.max_discard)
+                self.readonly, self.max_discard, cacheable)
 
     def _check(self, value):
         """
@@ -176,7 +194,7 @@ class VigilantAttribute(VigilantAttributeBase):
             try:
                 # Store the value for the setter to know if the value has changed
                 # TODO: any way to not avoid calling the getter during serialization?
-                self._value = self._getter()
+                self._raw_value = self._getter()
             except WeakRefLostError:
                 logging.warning("Getter for VA %s is gone", self)
                 self._getter = None
@@ -200,9 +218,9 @@ class VigilantAttribute(VigilantAttributeBase):
 
         self._check(value) # we allow the setter to even put illegal value, it's the master
         try:
-            self._value = self._setter(value)
+            self._raw_value = self._setter(value)
         except WeakRefLostError:
-            self._value = self.__default_setter(value)
+            self._raw_value = self.__default_setter(value)
 
         # only notify if the value has changed (or is different from requested)
         try:
@@ -244,6 +262,26 @@ class VigilantAttribute(VigilantAttributeBase):
 
     value = property(_get_value, _set_value, _del_value, "The actual value")
 
+    def _get_raw_value(self):
+        return self._raw_value
+
+    def _set_raw_value(self, value):
+        """
+        Called when ._value is written directly, typically by the owner of the
+        VA, to change the value without going through the setter, and without
+        notifying the listeners (at least, not immediately).
+        """
+        self._raw_value = value
+        # The proxies cache the value while subscribed, and would never know
+        # about the change => ask them to read the value again.
+        if getattr(self, "_remote_listeners", None) and self.pipe:
+            self.pipe.send_pyobj(_CACHE_INVALIDATION)
+
+    def _del_raw_value(self):
+        del self._raw_value
+
+    _value = property(_get_raw_value, _set_raw_value, _del_raw_value)
+
     def _register(self, daemon):
         """ Get the VigilantAttributeBase ready to be shared.
 
@@ -331,6 +369,16 @@ class VigilantAttribute(VigilantAttributeBase):
         self._unregister()
 
 
+def _copy_value(v):
+    """
+    return (value): a copy of the value if it's a mutable container, otherwise
+      the value itself
+    """
+    if isinstance(v, (dict, list, set, numpy.ndarray)):
+        return copy.copy(v)
+    return v
+
+
 # noinspection PyBroadException
 class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
     # init is as light as possible to reduce creation overhead in case the
@@ -350,16 +398,85 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         self._ctx = None
         self._commands = None
         self._thread = None
+        self._init_cache(False)
+
+    def _init_cache(self, cacheable):
+        """
+        Prepare the local cache of the value. While the proxy is subscribed to
+        the remote VA, every change of value is received, so the value doesn't
+        need to be read remotely.
+        cacheable (bool): if False, the value is always read remotely
+        """
+        self._cacheable = cacheable
+        self._cache_lock = threading.Lock()
+        self._listening = False
+        self._cache = None  # None or tuple of 1 value, when the cache is valid
+        self._cache_gen = 0  # incremented at every change of the cache
+
+    def _get_cached_value(self):
+        """
+        return (None or tuple of 1 value): the latest value of the VA, if it is
+          known locally, otherwise None.
+        """
+        c = self._cache
+        if c is not None:
+            return (_copy_value(c[0]),)
+        return None
+
+    def _set_cached_value(self, v, gen=None):
+        """
+        Update the cache with a value just received
+        v (value): the latest value of the remote VA
+        gen (None or int): if not None, the cache is only updated if it hasn't
+          changed since this generation.
+        """
+        with self._cache_lock:
+            if not self._listening:
+                return
+            if gen is not None and gen != self._cache_gen:
+                return  # A more recent value was received in the mean time
+            self._cache = (v,)
+            self._cache_gen += 1
+
+    def _invalidate_cache(self):
+        """
+        Forget the cached value (eg, because it has been changed by this process)
+        """
+        with self._cache_lock:
+            self._cache = None
+            self._cache_gen += 1
+
+    def _read_value(self):
+        """
+        return (value): the value of the VA, from the cache if possible
+        """
+        c = self._cache
+        if c is not None:
+            # Each caller gets its own copy, as before, so that the cache cannot
+            # be modified by mistake.
+            return _copy_value(c[0])
+
+        gen = self._cache_gen
+        v = self.__getattr__("_get_value")()
+        if self._listening:
+            self._set_cached_value(v, gen)
+        return v
+
+    def _write_value(self, v):
+        if self.readonly:
+            raise NotSettableError("Value is read-only")
+        # The actual value might be different from v, so only the notification
+        # (or the next read) will refill the cache.
+        self._invalidate_cache()
+        self.__getattr__("_set_value")(v)
 
     @property
     def value(self):
-        return self.__getattr__("_get_value")()
+        return self._read_value()
 
     @value.setter
     def value(self, v):
-        if self.readonly:
-            raise NotSettableError("Value is read-only")
-        return self.__getattr__("_set_value")(v)
+        self._write_value(v)
     # no delete remotely
 
     # for enumerated VA
@@ -388,7 +505,7 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         proxy_state = Pyro4.Proxy.__getstate__(self)
         # we don't need value, it's always remotely accessed
         return (proxy_state, _core.dump_roattributes(self), self.unit,
-                self.readonly, self.max_discard)
+                self.readonly, self.max_discard, self._cacheable)
 
     def __setstate__(self, state):
         """
@@ -397,8 +514,9 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
                             a new one is already available. 0 to keep (notify)
                             all the messages (dangerous if callback is slower
                             than the generator).
+        cacheable (bool): True if the value can be cached while subscribed
         """
-        proxy_state, roattributes, unit, self.readonly, self.max_discard = state
+        proxy_state, roattributes, unit, self.readonly, self.max_discard, cacheable = state
         Pyro4.Proxy.__setstate__(self, proxy_state)
         VigilantAttributeBase.__init__(self, unit=unit)
         _core.load_roattributes(self, roattributes)
@@ -409,15 +527,25 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         self._ctx = None
         self._commands = None
         self._thread = None
+        self._init_cache(cacheable)
 
     def _create_thread(self):
         logging.debug("Creating thread for VA %s", self._global_name)
         self._ctx = zmq.Context(1) # apparently 0MQ reuse contexts
         self._commands = self._ctx.socket(zmq.PAIR)
         self._commands.bind("inproc://" + self._global_name)
-        self._thread = SubscribeProxyThread(self.notify, self._global_name, self.max_discard, self._ctx)
+        self._thread = SubscribeProxyThread(self._on_remote_value, self._global_name, self.max_discard, self._ctx,
+                                            invalidator=self._invalidate_cache)
         self._thread.start()
 
+    def _on_remote_value(self, v):
+        """
+        Called by the subscription thread when a new value is received
+        """
+        if self._cacheable:
+            self._set_cached_value(v)
+        self.notify(v)
+
     def subscribe(self, listener, init=False):
         count_before = len(self._listeners)
 
@@ -439,6 +567,9 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         # send subscription to the actual VA
         # a bit tricky because the underlying method gets created on the fly
         Pyro4.Proxy.__getattr__(self, "subscribe")(self._proxy_name)
+        # From now on, every change will be received, so the cache can be used
+        # (as soon as the value is known)
+        self._listening = self._cacheable
 
     def unsubscribe(self, listener):
         VigilantAttributeBase.unsubscribe(self, listener)
@@ -449,6 +580,9 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
         """
         stop the remote subscription
         """
+        with self._cache_lock:
+            self._listening = False
+        self._invalidate_cache()
         Pyro4.Proxy.__getattr__(self, "unsubscribe")(self._proxy_name)
         if self._commands:
             self._commands.send("UNSUB")
@@ -477,12 +611,14 @@ class VigilantAttributeProxy(VigilantAttributeBase, Pyro4.Proxy):
 
 
 class SubscribeProxyThread(threading.Thread):
-    def __init__(self, notifier, uri, max_discard, zmq_ctx):
+    def __init__(self, notifier, uri, max_discard, zmq_ctx, invalidator=None):
         """
         notifier (callable): method to call when a new value arrives
         uri (string): unique string to identify the connection
         max_discard (int)
         zmq_ctx (0MQ context): available 0MQ context to use
+        invalidator (None or callable): method to call (without argument) when
+          the value has changed without notification
         """
         threading.Thread.__init__(self, name="zmq for VA " + uri)
         self.daemon = True
@@ -492,6 +628,7 @@ class SubscribeProxyThread(threading.Thread):
         # don't keep strong reference to notifier so that it can be garbage
         # collected normally and it will let us know then that we can stop
         self.w_notifier = WeakMethod(notifier)
+        self.w_invalidator = WeakMethod(invalidator) if invalidator else None
 
         # create a zmq synchronised channel to receive commands
         self._commands = zmq_ctx.socket(zmq.PAIR)
@@ -507,6 +644,10 @@ class SubscribeProxyThread(threading.Thread):
         poller.register(self._commands, zmq.POLLIN)
         poller.register(self.data, zmq.POLLIN)
         discarded = 0
+        # Latest value not yet notified, and whether the value changed after it
+        # without notification
+        pending = None  # None or tuple of 1 value
+        invalidate = False
         while True:
             socks = dict(poller.poll())
 
@@ -527,6 +668,11 @@ class SubscribeProxyThread(threading.Thread):
             # receive data
             if socks.get(self.data) == zmq.POLLIN:
                 value = self.data.recv_pyobj()
+                if value is _CACHE_INVALIDATION:
+                    invalidate = True
+                else:
+                    pending = (value,)
+                    invalidate = False  # This value is more recent
                 # more fresh data already?
                 if (
                         self.data.getsockopt(zmq.EVENTS) & zmq.POLLIN and
@@ -539,11 +685,16 @@ class SubscribeProxyThread(threading.Thread):
                 discarded = 0
 
                 try:
-                    self.w_notifier(value)
+                    if pending is not None:
+                        self.w_notifier(pending[0])
+                    if invalidate and self.w_invalidator:
+                        self.w_invalidator()
                 except WeakRefLostError:
                     self._commands.close()
                     self.data.close()
                     return
+                pending = None
+                invalidate = False
 
 
 def unregister_vigilant_attributes(self):
@@ -731,7 +882,7 @@ class ListVA(VigilantAttribute):
         VigilantAttribute._set_value(self, value, **kwargs)
         # TODO: this means that .notify will be called with a simple list,
         # should it be overridden to change to a notifying list? Same for the proxy.
-        self._value = _NotifyingList(self._value, notifier=self._internal_set_value)
+        self._raw_value = _NotifyingList(self._value, notifier=self._internal_set_value)
 
     value = property(VigilantAttribute._get_value,
                      _set_value,
@@ -745,7 +896,7 @@ class ListVAProxy(VigilantAttributeProxy):
     @property
     def value(self):
         # Transform a normal list into a notifying one
-        raw_list = self.__getattr__("_get_value")()
+        raw_list = self._read_value()
         # When value change, same as setting the value
         val = _NotifyingList(raw_list, notifier=self.__value_setter)
         return val
@@ -756,9 +907,7 @@ class ListVAProxy(VigilantAttributeProxy):
 
     # needs to be an explicit method to be able to reference it from the list
     def __value_setter(self, v):
-        if self.readonly:
-            raise NotSettableError("Value is read-only")
-        self.__getattr__("_set_value")(v)
+        self._write_value(v)
 
 
 class BooleanVA(VigilantAttribute):
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import gc
+import logging
+import numpy
+from odemis import model
+import threading
+import unittest
+
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def setUp(self):
+        # Make sure the buffers are only recycled thanks to the reference counting
+        gc.disable()
+
+    def tearDown(self):
+        gc.enable()
+
+    def test_get(self):
+        pool = model.BufferPool()
+        md = {model.MD_EXP_TIME: 0.1}
+        da = pool.get((200, 300), numpy.uint16, md)
+        self.assertIsInstance(da, model.DataArray)
+        self.assertEqual(da.shape, (200, 300))
+        self.assertEqual(da.dtype, numpy.uint16)
+        self.assertEqual(da.metadata, md)
+        self.assertTrue(da.flags.c_contiguous)
+        self.assertTrue(da.flags.writeable)
+        self.assertEqual(da.ctypes.data % model.BUFFER_ALIGNMENT, 0)
+
+        da[...] = 12
+        numpy.testing.assert_array_equal(da, 12)
+
+    def test_reuse(self):
+        """
+        A buffer is reused only once all the views on it are gone
+        """
+        pool = model.BufferPool(max_free=2)
+        da = pool.get((100, 100), numpy.uint16)
+        addr = da.ctypes.data
+        view = da.T[::2]
+        del da
+        da2 = pool.get((100, 100), numpy.uint16)
+        self.assertNotEqual(da2.ctypes.data, addr)
+        self.assertEqual(pool.allocated, 2)
+
+        del view
+        da3 = pool.get((100, 100), numpy.uint16)
+        self.assertEqual(da3.ctypes.data, addr)
+        self.assertEqual((pool.allocated, pool.reused), (2, 1))
+
+        # Different dtype but same size => also reused
+        del da3
+        da4 = pool.get((50, 100), numpy.uint32)
+        self.assertEqual(da4.ctypes.data, addr)
+
+    def test_max_free(self):
+        pool = model.BufferPool(max_free=2)
+        das = [pool.get((10, 10), numpy.uint8) for i in range(5)]
+        del das
+        self.assertEqual(len(pool._free), 2)
+
+        pool.clear()
+        self.assertEqual(len(pool._free), 0)
+
+    def test_size_change(self):
+        """
+        The buffers of the previous size are dropped
+        """
+        pool = model.BufferPool()
+        small = pool.get((10, 10), numpy.uint16)
+        big = pool.get((100, 100), numpy.uint16)
+        del small
+        self.assertEqual(len(pool._free), 0)
+        del big
+        self.assertEqual(len(pool._free), 1)
+
+    def test_threads(self):
+        pool = model.BufferPool()
+
+        def rent():
+            for i in range(200):
+                da = pool.get((64, 64), numpy.uint16)
+                da[...] = i
+                self.assertTrue((da == i).all())
+
+        threads = [threading.Thread(target=rent) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(pool.allocated + pool.reused, 4 * 200)
+        self.assertLessEqual(pool.allocated, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -227,6 +227,48 @@ class TestActuator(unittest.TestCase):
 #             self.assertAlmostEqual(val, abs_mov_back[axis])
 
 
+class TestHwComponent(unittest.TestCase):
+
+    def setUp(self):
+        self.comp = model.HwComponent("testcomp", "test")
+        self.comp.prop = model.IntVA(42)
+        self.comp.cont = model.FloatContinuous(2.0, (-1, 3.4))
+        self.comp.enum = model.StringEnumerated("a", {"a", "c", "bfds"})
+
+    def test_get_va_values(self):
+        vals = self.comp.getVAValues(["prop", "cont"])
+        self.assertEqual(vals, {"prop": 42, "cont": 2.0})
+
+        # All the VAs
+        vals = self.comp.getVAValues()
+        for n in ("prop", "cont", "enum", "state", "affects"):
+            self.assertIn(n, vals)
+        self.assertEqual(vals["enum"], "a")
+
+        with self.assertRaises(AttributeError):
+            self.comp.getVAValues(["prop", "role"])  # role is a roattribute
+
+    def test_get_va_info(self):
+        infos = self.comp.getVAInfo(["prop", "cont", "enum"])
+        self.assertEqual(infos["prop"], {"value": 42})
+        self.assertEqual(infos["cont"], {"value": 2.0, "range": (-1, 3.4)})
+        self.assertEqual(infos["enum"], {"value": "a", "choices": {"a", "c", "bfds"}})
+
+    def test_set_va_values(self):
+        actual = self.comp.setVAValues({"prop": 3, "enum": "c"})
+        self.assertEqual(actual, {"prop": 3, "enum": "c"})
+        self.assertEqual(self.comp.prop.value, 3)
+        self.assertEqual(self.comp.enum.value, "c")
+
+        # Invalid value => exception
+        with self.assertRaises(IndexError):
+            self.comp.setVAValues({"cont": 10.0})
+        self.assertEqual(self.comp.cont.value, 2.0)
+
+        with self.assertRaises(AttributeError):
+            self.comp.setVAValues({"foo": 1})
+
+
 class FakeActuator(Actuator):
     @isasync
     def moveRel(self, shift):
@@ -23,7 +23,9 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division, print_function
 from Pyro4.core import oneway
 from odemis import model
+from odemis.model import _dataflow
 import logging
+import numpy
 import pickle
 import threading
 import time
@@ -171,6 +173,27 @@ class TestDataFlow(unittest.TestCase):
         self.assertEqual(darray.metadata, up_darray.metadata, "metadata is different after pickling")
         self.assertEqual(up_darray.metadata["a"], 1)
 
+#    @unittest.skip("simple")
+    def test_view_recipe(self):
+        """
+        Check views of arrays can be reconstructed from their base buffer
+        """
+        base = numpy.arange(200 * 300, dtype=numpy.uint16).reshape(200, 300)
+        views = (base.T, base[::-1], base[:, ::-1], base.T[::-1, ::-1],
+                 base[:, 3:], base[2:-3, 1:].T[::-1])
+        for v in views:
+            recipe = _dataflow._get_view_recipe(v)
+            self.assertIsNotNone(recipe)
+            buf, offset, strides = recipe
+            self.assertLessEqual(buf.nbytes, 2 * v.nbytes)
+            # Simulate the transfer
+            rbuf = numpy.frombuffer(bytes(numpy.getbuffer(buf)), dtype=numpy.uint8)
+            rv = numpy.ndarray(v.shape, v.dtype, buffer=rbuf, offset=offset, strides=strides)
+            numpy.testing.assert_array_equal(rv, v)
+
+        # A small part of a big array is not worthy to send as a view
+        self.assertIsNone(_dataflow._get_view_recipe(base[10:20:2, ::3]))
+
 #    @unittest.skip("simple")
     def test_df_subscribe_get(self):
         self.df = SimpleDataFlow()
@@ -243,6 +266,81 @@ class TestDataFlow(unittest.TestCase):
             dataflow.unsubscribe(self.receive_data2)
 
 
+    def test_delivery_policy(self):
+        """
+        Check a slow listener doesn't delay the other ones, and receives the
+        data according to its policy
+        """
+        self.df = SimpleDataFlow()
+        self.fast_received = []
+        self.latest_received = []
+        self.lossless_received = []
+        self.df.subscribe(self.receive_fast)
+        self.df.subscribe(self.receive_slow_latest, policy=model.DELIVERY_LATEST)
+        self.df.subscribe(self.receive_slow_lossless, policy=model.DELIVERY_LOSSLESS)
+
+        time.sleep(1.5)  # ~15 data
+        stats = self.df.getStatistics()
+        self.df.unsubscribe(self.receive_fast)
+        self.df.unsubscribe(self.receive_slow_latest)
+        self.df.unsubscribe(self.receive_slow_lossless)
+
+        # The fast listener is not slowed down by the slow ones
+        self.assertGreaterEqual(len(self.fast_received), 10)
+        nums = [d.metadata["num"] for d in self.fast_received]
+        self.assertEqual(nums, list(range(len(nums))))
+
+        # The latest listener only gets the newest data, so some are skipped
+        self.assertLess(len(self.latest_received), len(self.fast_received))
+        nums = [d.metadata["num"] for d in self.latest_received]
+        self.assertEqual(nums, sorted(nums))
+        self.assertGreater(max(nums), len(nums))
+
+        # The lossless listener receives every data, in order
+        nums = [d.metadata["num"] for d in self.lossless_received]
+        self.assertEqual(nums, list(range(len(nums))))
+
+        self.assertEqual(len(stats["listeners"]), 3)
+        for name, lstats in stats["listeners"].items():
+            if "receive_slow_lossless" in name:
+                self.assertEqual(lstats["policy"], model.DELIVERY_LOSSLESS)
+                self.assertEqual(lstats["dropped"], 0)
+                self.assertGreater(lstats["queue"], 0)
+            elif "receive_slow_latest" in name:
+                self.assertGreater(lstats["dropped"], 0)
+                self.assertLessEqual(lstats["queue"], 1)
+                # All the calls take > 0.1s
+                self.assertEqual(sum(lstats["latency"][:3]), 0)
+        self.assertGreaterEqual(stats["received"], len(self.fast_received))
+
+    def test_delivery_bounded_queue(self):
+        self.df = SimpleDataFlow()
+        self.lossless_received = []
+        self.df.subscribe(self.receive_slow_lossless, policy=3)
+        time.sleep(1.5)  # ~15 data
+        stats = self.df.getStatistics()
+        self.df.unsubscribe(self.receive_slow_lossless)
+
+        lstats = list(stats["listeners"].values())[0]
+        self.assertGreater(lstats["dropped"], 0)
+        self.assertLessEqual(lstats["queue"], 3)
+        nums = [d.metadata["num"] for d in self.lossless_received]
+        self.assertEqual(nums, sorted(nums))
+
+        with self.assertRaises(ValueError):
+            self.df.subscribe(self.receive_slow_lossless, policy=0)
+
+    def receive_fast(self, dataflow, data):
+        self.fast_received.append(data)
+
+    def receive_slow_latest(self, dataflow, data):
+        self.latest_received.append(data)
+        time.sleep(0.35)
+
+    def receive_slow_lossless(self, dataflow, data):
+        self.lossless_received.append(data)
+        time.sleep(0.35)
+
     def test_synchronized_df(self):
         self.dfe = SimpleDataFlow()
         self.dfs = SynchronizableDataFlow()
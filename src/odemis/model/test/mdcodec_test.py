@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division, print_function
+
+import logging
+import numpy
+from odemis import model
+from odemis.model import _mdcodec
+import time
+import unittest
+
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+def _create_md(i):
+    """
+    Create a typical metadata of a camera
+    """
+    md = {model.MD_ACQ_DATE: time.time(),
+          model.MD_EXP_TIME: 0.01,
+          model.MD_POS: (1e-3, -2e-3 + i * 1e-9),
+          model.MD_PIXEL_SIZE: (1e-7, 1e-7),
+          model.MD_SENSOR_PIXEL_SIZE: (6.5e-6, 6.5e-6),
+          model.MD_BINNING: (1, 1),
+          model.MD_BPP: 16,
+          model.MD_GAIN: 1.0,
+          model.MD_READOUT_TIME: 1e-8,
+          model.MD_SENSOR_TEMP: -60.0,
+          model.MD_HW_NAME: "Andor Clara (s/n: 1234)",
+          model.MD_HW_VERSION: "Andor SDK v2.100",
+          model.MD_SW_VERSION: "2.9.0",
+          model.MD_DESCRIPTION: "Camera",
+          model.MD_ROTATION: 0.0,
+          model.MD_SHEAR: 0.0,
+          model.MD_LENS_MAG: 40.0,
+          model.MD_LENS_NA: 0.95,
+          model.MD_IN_WL: (500e-9, 520e-9),
+          model.MD_OUT_WL: (600e-9, 650e-9),
+          model.MD_LIGHT_POWER: 0.1,
+          model.MD_DWELL_TIME: 1e-6,
+          model.MD_EBEAM_VOLTAGE: 10000.0,
+          model.MD_EBEAM_CURRENT: 1e-9,
+          model.MD_WL_POLYNOMIAL: [500e-9, 1e-10, 1e-15],
+          model.MD_BASELINE: 100,
+          model.MD_INTEGRATION_COUNT: 1,
+          model.MD_FLIP: 0,
+          model.MD_DIMS: "YX",
+          model.MD_SENSOR_SIZE: (2048, 2048),
+          }
+    return md
+
+
+class TestMetadataCodec(unittest.TestCase):
+
+    def test_delta(self):
+        enc = _mdcodec.MetadataEncoder()
+        dec = _mdcodec.MetadataDecoder()
+
+        md = _create_md(0)
+        buf_key = enc.encode(md)
+        self.assertEqual(dec.decode(buf_key), md)
+
+        # Only a few keys change => small message
+        md = _create_md(1)
+        buf_delta = enc.encode(md)
+        self.assertLess(len(buf_delta), len(buf_key) / 4)
+        self.assertEqual(dec.decode(buf_delta), md)
+
+        # New key and removed key
+        md[model.MD_USER_NOTE] = "blah"
+        del md[model.MD_GAIN]
+        self.assertEqual(dec.decode(enc.encode(md)), md)
+
+        # Numpy arrays (cannot be compared with ==)
+        md[model.MD_AR_POLE] = numpy.array([1.2, 4.5])
+        rmd = dec.decode(enc.encode(md))
+        numpy.testing.assert_array_equal(rmd[model.MD_AR_POLE], md[model.MD_AR_POLE])
+
+        # Very different => key
+        md = {"a": 1}
+        self.assertEqual(dec.decode(enc.encode(md)), md)
+
+    def test_resync(self):
+        """
+        A decoder without the key metadata cannot decode the delta, until the
+        next key
+        """
+        enc = _mdcodec.MetadataEncoder()
+        enc.encode(_create_md(0))
+        enc.encode(_create_md(1))
+
+        dec = _mdcodec.MetadataDecoder()
+        self.assertIsNone(dec.decode(enc.encode(_create_md(2))))
+
+        # Lost messages are not a problem
+        enc.reset()
+        buf_key = enc.encode(_create_md(3))
+        enc.encode(_create_md(4))
+        md = _create_md(5)
+        buf_delta = enc.encode(md)
+        dec.decode(buf_key)
+        self.assertEqual(dec.decode(buf_delta), md)
+
+        # Old key and delta are ignored
+        enc.reset()
+        enc.encode(_create_md(6))
+        self.assertIsNone(dec.decode(enc.encode(_create_md(7))))
+
+    def test_request_key(self):
+        """
+        A decoder which lost the key metadata asks for a new one, only once
+        """
+        requests = []
+        enc = _mdcodec.MetadataEncoder()
+        dec = _mdcodec.MetadataDecoder(request_key=lambda: requests.append(True))
+        self.assertIsNotNone(dec.decode(enc.encode(_create_md(0))))
+
+        enc.reset()
+        enc.encode(_create_md(1))  # Key lost
+
+        self.assertIsNone(dec.decode(enc.encode(_create_md(2))))
+        self.assertIsNone(dec.decode(enc.encode(_create_md(3))))
+        self.assertEqual(len(requests), 1)
+
+        # The requested key arrives, and the next delta can be decoded
+        enc.reset()
+        md = _create_md(4)
+        self.assertEqual(dec.decode(enc.encode(md)), md)
+        md = _create_md(5)
+        self.assertEqual(dec.decode(enc.encode(md)), md)
+        self.assertEqual(len(requests), 1)
+
+    def test_version(self):
+        enc = _mdcodec.MetadataEncoder()
+        buf = enc.encode(_create_md(0))
+        dec = _mdcodec.MetadataDecoder()
+        with self.assertRaises(ValueError):
+            dec.decode(b"\xff" + buf[1:])
+
+    def test_independent_copies(self):
+        """
+        The metadata decoded don't share mutable values, so modifying one
+        doesn't affect the others
+        """
+        enc = _mdcodec.MetadataEncoder()
+        dec = _mdcodec.MetadataDecoder()
+
+        md = _create_md(0)
+        md[model.MD_AR_POLE] = numpy.array([1.2, 4.5])
+        md["Settings"] = {"ccd": {"gain": [1, 2]}}
+        rmd0 = dec.decode(enc.encode(md))
+        rmd1 = dec.decode(enc.encode(_create_md(1)))
+        md[model.MD_POS] = (1, 2)
+        rmd2 = dec.decode(enc.encode(md))
+
+        rmd0[model.MD_WL_POLYNOMIAL].append(1e-20)
+        rmd0[model.MD_AR_POLE][0] = 10
+        rmd0["Settings"]["ccd"]["gain"].append(3)
+        self.assertEqual(rmd1[model.MD_WL_POLYNOMIAL], [500e-9, 1e-10, 1e-15])
+        self.assertEqual(rmd2[model.MD_WL_POLYNOMIAL], [500e-9, 1e-10, 1e-15])
+        numpy.testing.assert_array_equal(rmd2[model.MD_AR_POLE], [1.2, 4.5])
+        self.assertEqual(rmd2["Settings"], {"ccd": {"gain": [1, 2]}})
+
+        # Immutable values can be shared
+        self.assertIs(rmd1[model.MD_HW_NAME], rmd2[model.MD_HW_NAME])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -597,6 +597,79 @@ class RemoteTest(unittest.TestCase):
         self.assertEqual(count_end, self.count)
         self.assertGreaterEqual(count_end, 1)
 
+    def test_dataflow_keep_data(self):
+        """
+        test keeping a reference to many DataArrays received (which prevents
+        the shared memory to be reused)
+        """
+        self.kept = []
+        self.comp.data.reset()
+
+        self.comp.data.subscribe(self.receive_and_keep_data)
+        time.sleep(1)
+        self.comp.data.unsubscribe(self.receive_and_keep_data)
+        time.sleep(0.1)
+
+        self.assertGreater(len(self.kept), model._shm.SHM_SLOTS)
+        prev_count = 0
+        for d in self.kept:
+            count = d[0][0]
+            self.assertGreater(count, prev_count)
+            prev_count = count
+            # Check the data has not been overwritten
+            self.assertTrue((d[count % d.shape[0], 1:] == 255).all())
+
+    def test_dataflow_resubscribe_keep_data(self):
+        """
+        test the DataArrays still referenced are not overwritten when
+        unsubscribing and subscribing again
+        """
+        self.kept = []
+        self.comp.data.reset()
+
+        self.comp.data.subscribe(self.receive_and_keep_data)
+        time.sleep(0.3)
+        self.comp.data.unsubscribe(self.receive_and_keep_data)
+        time.sleep(0.1)
+        self.assertGreater(len(self.kept), 0)
+        held = self.kept[:]
+        held_copy = [numpy.array(d) for d in held]
+
+        self.kept = []
+        self.comp.data.subscribe(self.receive_and_keep_data)
+        time.sleep(0.3)
+        self.kept = []  # Only keep the held data from the first subscription
+        time.sleep(0.5)
+        self.comp.data.unsubscribe(self.receive_and_keep_data)
+        time.sleep(0.1)
+
+        for d, c in zip(held, held_copy):
+            numpy.testing.assert_array_equal(d, c)
+
+    def receive_and_keep_data(self, dataflow, data):
+        self.kept.append(data)
+
+    def test_dataflow_transposed(self):
+        # test that a transposed array is received correctly
+        self.count = 0
+        self.data_arrays_sent = 0
+        self.expected_shape = (2045, 2048)
+        self.comp.cut.value = 3
+        self.comp.flip.value = True
+        self.comp.data.reset()
+
+        self.comp.data.subscribe(self.receive_data)
+        time.sleep(0.5)
+        self.comp.data.unsubscribe(self.receive_data)
+        self.comp.cut.value = 0 # put it back
+        self.comp.flip.value = False
+        count_end = self.count
+        print("received %d transposed arrays over %d" % (self.count, self.data_arrays_sent))
+
+        time.sleep(0.1)
+        self.assertEqual(count_end, self.count)
+        self.assertGreaterEqual(count_end, 1)
+
     def test_dataflow_empty(self):
         """
         test passing empty DataArray
@@ -764,6 +837,68 @@ class RemoteTest(unittest.TestCase):
         self.assertEqual(self.called, 3)
         l.unsubscribe(self.receive_listva_update)
 
+    def test_va_batch(self):
+        hwcomp = self.rdaemon.getObject("hwcomp")
+        vals = hwcomp.getVAValues(["prop", "cont", "enum"])
+        self.assertEqual(vals, {"prop": 42, "cont": 2.0, "enum": "a"})
+
+        infos = hwcomp.getVAInfo(["cont", "enum"])
+        self.assertEqual(infos["cont"], {"value": 2.0, "range": (-1, 3.4)})
+        self.assertEqual(infos["enum"], {"value": "a", "choices": {"a", "c", "bfds"}})
+
+        actual = hwcomp.setVAValues({"prop": 3, "enum": "c"})
+        self.assertEqual(actual, {"prop": 3, "enum": "c"})
+        self.assertEqual(hwcomp.prop.value, 3)
+        self.assertEqual(hwcomp.enum.value, "c")
+
+        with self.assertRaises(IndexError):
+            hwcomp.setVAValues({"cont": 10.0})
+
+    def test_va_cache(self):
+        hwcomp = self.rdaemon.getObject("hwcomp")
+        prop = hwcomp.prop
+        self.assertIsNone(prop._get_cached_value())
+
+        self.called = 0
+        prop.subscribe(self.receive_va_update)
+        self.assertEqual(prop.value, 42)
+        self.assertEqual(prop._get_cached_value(), (42,))
+
+        # Changed by another process
+        hwcomp2 = self.rdaemon.getObject("hwcomp")
+        hwcomp2.prop.value = 5
+        time.sleep(0.1)  # give time to receive notifications
+        self.assertEqual(self.called, 1)
+        self.assertEqual(prop._get_cached_value(), (5,))
+        self.assertEqual(prop.value, 5)
+        self.assertEqual(hwcomp.getVAValues(["prop", "enum"]), {"prop": 5, "enum": "a"})
+
+        # Changed locally: the new value is immediately visible
+        prop.value = 6
+        self.assertEqual(prop.value, 6)
+        hwcomp.setVAValues({"prop": 7})
+        self.assertEqual(prop.value, 7)
+
+        # Changed by the owner, without notification => not cached anymore
+        ncalled = self.called
+        hwcomp.set_prop_silently(9)
+        time.sleep(0.1)
+        self.assertEqual(self.called, ncalled)
+        self.assertIsNone(prop._get_cached_value())
+        self.assertEqual(prop.value, 9)
+        # ... and cached again when notified
+        hwcomp.set_prop_silently(10, notify=True)
+        time.sleep(0.1)
+        self.assertEqual(self.called, ncalled + 1)
+        self.assertEqual(prop._get_cached_value(), (10,))
+        self.assertEqual(prop.value, 10)
+
+        # No more subscription => the cache cannot be trusted anymore
+        prop.unsubscribe(self.receive_va_update)
+        self.assertIsNone(prop._get_cached_value())
+        hwcomp2.prop.value = 8
+        self.assertEqual(prop.value, 8)
+
     def receive_listva_update(self, value):
         self.called += 1
         self.last_value = value
@@ -781,8 +916,10 @@ def ServerLoop(socket_name):
     childc = FamilyValueComponent("child", 43, daemon=daemon)
     parentc = FamilyValueComponent("parent", 42, parent=None, children={"one": childc}, daemon=daemon)
     childc.parent = parentc
+    hwcomp = SimpleHwComponent("hwcomp", "test", daemon=daemon)
     daemon.requestLoop()
     component.terminate()
+    hwcomp.terminate()
     parentc.terminate()
     daemon.close()
 
@@ -816,6 +953,14 @@ class SimpleHwComponent(model.HwComponent):
     def my_value(self):
         return "ro"
 
+    def set_prop_silently(self, value, notify=False):
+        """
+        Change the value of .prop directly, as some drivers do
+        """
+        self.prop._value = value
+        if notify:
+            self.prop.notify(value)
+
 
 class MyComponent(model.Component):
     """
@@ -837,12 +982,17 @@ class MyComponent(model.Component):
         self.cont = model.FloatContinuous(2.0, [-1, 3.4], unit="C")
         self.enum = model.StringEnumerated("a", {"a", "c", "bfds"})
         self.cut = model.IntVA(0, setter=self._setCut)
+        self.flip = model.BooleanVA(False, setter=self._setFlip)
         self.listval = model.ListVA([2, 65])
 
     def _setCut(self, value):
         self.data.cut = value
         return self.data.cut
 
+    def _setFlip(self, value):
+        self.data.flip = value
+        return self.data.flip
+
     @roattribute
     def my_value(self):
         return "ro"
@@ -981,6 +1131,7 @@ class FakeDataFlow(model.DataFlow):
         self._thread = None
         self.count = 0
         self.cut = 0 # to test non stride arrays
+        self.flip = False  # to test transposed arrays
         self._startAcquire = sae
 
     def _create_one(self, shape, bpp, index):
@@ -992,9 +1143,10 @@ class FakeDataFlow(model.DataFlow):
         if shape[0] > 0:
             array[index % shape[0], :] = 255
         if self.cut:
-            return array[:, self.cut:]
-        else:
-            return array
+            array = array[:, self.cut:]
+        if self.flip:
+            array = array.T[::-1, :]
+        return array
 
     def reset(self):
         self.count = 0
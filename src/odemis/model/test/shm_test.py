@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import logging
+import numpy
+from odemis.model import _shm
+import os
+import unittest
+
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+@unittest.skipUnless(_shm.is_shm_supported(), "No shared memory available")
+class TestSharedMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = _shm.SharedMemoryRing("test", nslots=3)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_write_read(self):
+        reader = _shm.SharedMemoryReader(1, nslots=3)
+        self.assertTrue(reader.can_access(self.ring.path))
+        data = numpy.arange(200 * 300, dtype=numpy.uint16).reshape(200, 300)
+        info = self.ring.write(data, [1])
+        self.assertIsNotNone(info)
+
+        rdata = reader.read(info, data.dtype, data.shape)
+        numpy.testing.assert_array_equal(rdata, data)
+        self.assertFalse(rdata.flags.writeable)
+
+        # Once released, it cannot be read anymore
+        del rdata
+        self.assertIsNone(reader.read(info, data.dtype, data.shape))
+
+    def test_write_transposed(self):
+        reader = _shm.SharedMemoryReader(0, nslots=3)
+        data = numpy.arange(200 * 300, dtype=numpy.uint16).reshape(200, 300).T[::-1]
+        info = self.ring.write(data, [0])
+        rdata = reader.read(info, data.dtype, data.shape)
+        numpy.testing.assert_array_equal(rdata, data)
+
+    def test_slot_reuse(self):
+        """
+        Slots are only reused once all the arrays are released
+        """
+        reader = _shm.SharedMemoryReader(0, nslots=3)
+        data = numpy.ones((100, 100), dtype=numpy.uint32)
+        arrays = []
+        for i in range(3):
+            info = self.ring.write(data * i, [0])
+            self.assertIsNotNone(info)
+            arrays.append(reader.read(info, data.dtype, data.shape))
+
+        # All slots in use
+        self.assertIsNone(self.ring.write(data, [0]))
+
+        # Views keep the slot in use
+        view = arrays[1][10:20, ::2]
+        del arrays[1]
+        self.assertIsNone(self.ring.write(data, [0]))
+        del view
+        info = self.ring.write(data * 5, [0])
+        self.assertIsNotNone(info)
+        numpy.testing.assert_array_equal(arrays[0], data * 0)
+        numpy.testing.assert_array_equal(arrays[1], data * 2)
+        rdata = reader.read(info, data.dtype, data.shape)
+        numpy.testing.assert_array_equal(rdata, data * 5)
+
+        # Release without reading
+        del rdata
+        info = self.ring.write(data, [0])
+        reader.release(info)
+        self.assertIsNotNone(self.ring.write(data, [0]))
+
+    def test_subscriber_free(self):
+        data = numpy.ones((100, 100), dtype=numpy.uint8)
+        self.assertTrue(self.ring.is_subscriber_free(2))
+        for i in range(3):
+            self.assertIsNotNone(self.ring.write(data, [2, 3]))
+        reader2 = _shm.SharedMemoryReader(2, nslots=3, path=self.ring.path)
+        reader3 = _shm.SharedMemoryReader(3, nslots=3, path=self.ring.path)
+        self.assertIsNone(self.ring.write(data, [2, 3]))
+        self.assertFalse(self.ring.is_subscriber_free(2))
+
+        # None of the frames were read => all released
+        reader2.release_unused()
+        self.assertTrue(self.ring.is_subscriber_free(2))
+        self.assertIsNone(self.ring.write(data, [2, 3]))
+        reader3.release_unused()
+        self.assertIsNotNone(self.ring.write(data, [2, 3]))
+
+    def test_resubscribe(self):
+        """
+        The arrays still held after unsubscribing are not overwritten by the
+        next subscription
+        """
+        data = numpy.ones((100, 100), dtype=numpy.uint16)
+        info = self.ring.write(data, [0])
+        reader = _shm.SharedMemoryReader(0, nslots=3, path=self.ring.path)
+        held = reader.read(info, data.dtype, data.shape)
+        info_lost = self.ring.write(data * 2, [0])  # never received
+
+        # Unsubscribe: only the frame not received is released
+        reader.release_unused()
+        self.assertFalse(self.ring.is_subscriber_free(0))
+
+        # Subscribe again, with the same index
+        reader = _shm.SharedMemoryReader(0, nslots=3, path=self.ring.path)
+        reader.release_unused()
+        self.assertIsNone(reader.read(info_lost, data.dtype, data.shape))
+        for i in range(10):
+            info = self.ring.write(data * 3, [0])
+            self.assertIsNotNone(info)
+            self.assertNotEqual(info[1], 0)  # The slot of the held frame
+            rdata = reader.read(info, data.dtype, data.shape)
+            numpy.testing.assert_array_equal(rdata, data * 3)
+            del rdata
+
+        numpy.testing.assert_array_equal(held, data)
+        del held
+        self.assertTrue(self.ring.is_subscriber_free(0))
+
+    def test_bigger_data(self):
+        """
+        When the data doesn't fit the slots anymore, a new segment is used
+        """
+        reader = _shm.SharedMemoryReader(0, nslots=3)
+        small = numpy.zeros((10, 10), dtype=numpy.uint8)
+        info = self.ring.write(small, [0])
+        rsmall = reader.read(info, small.dtype, small.shape)
+        prev_path = self.ring.path
+
+        big = numpy.ones((1000, 1000), dtype=numpy.uint16)
+        info = self.ring.write(big, [0])
+        self.assertNotEqual(self.ring.path, prev_path)
+        self.assertFalse(os.path.exists(prev_path))
+        rbig = reader.read(info, big.dtype, big.shape)
+        numpy.testing.assert_array_equal(rbig, big)
+        # The previous data is still accessible
+        numpy.testing.assert_array_equal(rsmall, small)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,11 +25,16 @@ from __future__ import division
 import logging
 import numpy
 from odemis import model
+from odemis.model import _vattributes
+import os
 import pickle
+import tempfile
+import threading
 import time
 import unittest
 from unittest.case import skip
 import weakref
+import zmq
 
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -486,6 +491,75 @@ class VigilantAttributeTest(unittest.TestCase):
         propt.unsubscribe(self.callback_test_notify)
 
 
+class RemoteNotificationTest(unittest.TestCase):
+    """
+    Test the messages sent to the remote subscribers (without Pyro)
+    """
+
+    def setUp(self):
+        self.events = []
+        self.received = threading.Event()
+
+        # Same as VigilantAttribute._register(), without daemon
+        self.va = model.IntVA(1)
+        fd, self.uri = tempfile.mkstemp(prefix="va-test-")
+        os.close(fd)
+        self.va._ctx = zmq.Context(1)
+        self.va.pipe = self.va._ctx.socket(zmq.PUB)
+        self.va.pipe.bind("ipc://" + self.uri)
+        self.va._remote_listeners.add("test")
+
+        # Same as VigilantAttributeProxy, with a fake cache
+        self.ctx = zmq.Context(1)
+        self.commands = self.ctx.socket(zmq.PAIR)
+        self.commands.bind("inproc://" + self.uri)
+        self.thread = _vattributes.SubscribeProxyThread(self.on_value, self.uri, 100, self.ctx,
+                                                        invalidator=self.on_invalidate)
+        self.thread.start()
+        self.commands.send(b"SUB")
+        self.commands.recv()
+        time.sleep(0.2)  # Let the subscription reach the publisher
+
+    def tearDown(self):
+        self.commands.send(b"STOP")
+        self.thread.join(5)
+        self.commands.close()
+        self.ctx.term()
+        self.va._unregister()
+        os.remove(self.uri)
+
+    def on_value(self, v):
+        self.events.append(("value", v))
+        self.received.set()
+
+    def on_invalidate(self):
+        self.events.append(("invalidate",))
+        self.received.set()
+
+    def wait_events(self):
+        self.assertTrue(self.received.wait(5))
+        time.sleep(0.1)  # in case of more events
+        self.received.clear()
+        events = self.events
+        self.events = []
+        return events
+
+    def test_invalidate(self):
+        # Normal change => only the new value
+        self.va.value = 2
+        self.assertEqual(self.wait_events(), [("value", 2)])
+
+        # Direct change, without notification => the value is out of date
+        self.va._value = 3
+        self.assertEqual(self.wait_events(), [("invalidate",)])
+        self.assertEqual(self.va.value, 3)
+
+        # Direct change, followed by notification => the last event is the value
+        self.va._value = 4
+        self.va.notify(4)
+        self.assertEqual(self.wait_events()[-1], ("value", 4))
+
+
 class LittleObject(object):
     def __init__(self):
         self.called = 0
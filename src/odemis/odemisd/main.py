@@ -24,6 +24,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division, print_function
 
 import argparse
+from concurrent import futures
 import grp
 from logging import FileHandler
 import logging
@@ -31,7 +32,7 @@ from logging.handlers import WatchedFileHandler
 from odemis import model
 import odemis
 from odemis.model import ST_UNLOADED, ST_STARTING
-from odemis.odemisd import modelgen
+from odemis.odemisd import modelgen, startprof
 from odemis.odemisd.mdupdater import MetadataUpdater
 from odemis.util.driver import BACKEND_RUNNING, BACKEND_DEAD, BACKEND_STOPPED, \
     get_backend_status, BACKEND_STARTING
@@ -44,6 +45,8 @@ import time
 import yaml
 
 DEFAULT_SETTINGS_FILE = "/etc/odemis-settings.yaml"
+# Maximum number of components being instantiated simultaneously
+MAX_PARALLEL_INSTANTIATIONS = 8
 
 status_to_xtcode = {BACKEND_RUNNING: 0,
                     BACKEND_DEAD: 1,
@@ -58,7 +61,7 @@ class BackendContainer(model.Container):
     """
 
     def __init__(self, model_file, settings_file, create_sub_containers=False,
-                 dry_run=False, name=model.BACKEND_NAME):
+                 dry_run=False, name=model.BACKEND_NAME, profile_file=None):
         """
         inst_file (file): opened file that contains the yaml
         settings_file (file): opened file that contains the persistent data
@@ -67,6 +70,9 @@ class BackendContainer(model.Container):
            have no children created separately) are running in isolated containers
         dry_run (bool): if True, it will check the semantic and try to instantiate the
           model without actually any driver contacting the hardware.
+        profile_file (None or str): if not None, the timeline of the start-up
+          is recorded, and saved in this file (in Chrome trace format), with
+          a text summary next to it, once all the components are instantiated.
         """
         model.Container.__init__(self, name)
 
@@ -77,12 +83,25 @@ class BackendContainer(model.Container):
         self._must_stop = threading.Event()
         self._dry_run = dry_run
         # TODO: have an argument to ask for disabling parallel start? same as create_sub_containers?
+        # To ensure .ghosts, .alive and .startTimes of the microscope are
+        # updated atomically, as they are modified by several threads
+        self._comps_lock = threading.Lock()
+        # To ensure the persistent data is written by only one thread at a time
+        self._persistent_lock = threading.RLock()
+
+        self._profile_file = profile_file
+        self._profile_count = 0  # number of events in the profile last saved
+        if profile_file:
+            self._profiler = startprof.StartupProfiler()
+        else:
+            self._profiler = None
 
         # parse the instantiation file
         logging.debug("model instantiation file is: %s", self._model.name)
         try:
             self._instantiator = modelgen.Instantiator(model_file, settings_file, self,
-                                                       create_sub_containers, dry_run)
+                                                       create_sub_containers, dry_run,
+                                                       self._profiler)
             # save the model
             logging.info("model has been successfully parsed")
         except modelgen.ParseError as exp:
@@ -107,13 +126,15 @@ class BackendContainer(model.Container):
         """
 
         def on_va_change(value, comp_name=comp.name, prop_name=prop_name):
-            self._persistent_data[comp_name]['properties'][prop_name] = value
-            self._write_persistent_data()
+            with self._persistent_lock:
+                self._persistent_data[comp_name]['properties'][prop_name] = value
+                self._write_persistent_data()
 
-        self._persistent_data.setdefault(comp.name, {}).setdefault('properties', {})
         try:
             va = getattr(comp, prop_name)
-            self._persistent_data[comp.name]['properties'][prop_name] = va.value
+            with self._persistent_lock:
+                self._persistent_data.setdefault(comp.name, {}).setdefault('properties', {})
+                self._persistent_data[comp.name]['properties'][prop_name] = va.value
         except AttributeError:
             logging.warning("Persistent property %s not found for component %s." % (prop_name, comp.name))
         else:     
@@ -124,17 +145,20 @@ class BackendContainer(model.Container):
         """
         Update all metadata in ._persistent_data and write values to settings file.
         """
-        for comp in self._instantiator.components:
-            _, md_names = self._instantiator.get_persistent(comp.name)
-            md_values = comp.getMetadata()
-            for md in md_names:
-                self._persistent_data.setdefault(comp.name, {}).setdefault('metadata', {})
-                fullname = "MD_" + md
-                try:
-                    self._persistent_data[comp.name]['metadata'][md] = md_values[getattr(model, fullname)]
-                except KeyError:
-                    logging.warning("Persistent metadata %s not found on component %s" % (md, comp.name))
-        self._write_persistent_data()
+        with self._persistent_lock:
+            for comp in self._instantiator.components:
+                _, md_names = self._instantiator.get_persistent(comp.name)
+                if not md_names:
+                    continue
+                md_values = comp.getMetadata()
+                for md in md_names:
+                    self._persistent_data.setdefault(comp.name, {}).setdefault('metadata', {})
+                    fullname = "MD_" + md
+                    try:
+                        self._persistent_data[comp.name]['metadata'][md] = md_values[getattr(model, fullname)]
+                    except KeyError:
+                        logging.warning("Persistent metadata %s not found on component %s" % (md, comp.name))
+            self._write_persistent_data()
 
     def _write_persistent_data(self):
         """
@@ -143,9 +167,10 @@ class BackendContainer(model.Container):
         if not self._settings or self._dry_run:
             return
 
-        self._settings.truncate(0)  # delete previous file contents
-        self._settings.seek(0)  # go back to position 0
-        yaml.safe_dump(self._persistent_data, self._settings)
+        with self._persistent_lock:
+            self._settings.truncate(0)  # delete previous file contents
+            self._settings.seek(0)  # go back to position 0
+            yaml.safe_dump(self._persistent_data, self._settings)
 
     def run(self):
         # Create the root
@@ -185,7 +210,12 @@ class BackendContainer(model.Container):
     def _instantiate_all(self):
         """
         Thread continuously monitoring the components that need to be instantiated
+        All the components which are independent from each other are
+        instantiated simultaneously, and as soon as a component is instantiated,
+        the components which depend on it are started.
         """
+        executor = futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL_INSTANTIATIONS)
+        running = {}  # future -> str: the components being instantiated
         try:
             # Hack warning: there is a bug in python when using lock (eg, logging)
             # and simultaneously using threads and process: is a thread acquires
@@ -193,51 +223,43 @@ class BackendContainer(model.Container):
             # See http://bugs.python.org/issue6721
             # To ensure this is not happening, we wait long enough that all (2)
             # threads have started (and logging nothing) before creating new processes.
+            # Note: the containers are created by the threads of the pool, while
+            # other threads are running. See model.createNewContainer() for why
+            # it is safe.
             time.sleep(1)
 
             mic = self._instantiator.microscope
             failed = set() # set of str: name of components that failed recently
             while not self._must_stop.is_set():
-                # Try to start simultaneously all the components that are
-                # independent from each other
-                nexts = set()
-                while not nexts:
-                    instantiated = set(c.name for c in mic.alive.value) | {mic.name}
-                    nexts = self._instantiator.get_instantiables(instantiated)
-                    # If still some non-failed component, immediately try again,
-                    # otherwise give some time for things to get fixed or broken
-                    nexts -= failed
-                    if not nexts:
-                        if self._dry_run:
-                            return # everything instantiated, good enough
-
-                        if self._must_stop.wait(10):
-                            return
-                        failed = set() # not recent anymore
+                # Start all the components which are now instantiable
+                instantiated = set(c.name for c in mic.alive.value) | {mic.name}
+                nexts = self._instantiator.get_instantiables(instantiated)
+                nexts -= failed | set(running.values())
+                if nexts:
+                    logging.debug("Trying to instantiate comps: %s", ", ".join(nexts))
+                for n in nexts:
+                    f = executor.submit(self._start_component, n)
+                    running[f] = n
 
-                logging.debug("Trying to instantiate comps: %s", ", ".join(nexts))
+                if not running:
+                    # Nothing left to do immediately. Give some time for things
+                    # to get fixed or broken, and try again the failed ones.
+                    self._write_profile()
+                    if self._dry_run:
+                        return # everything instantiated, good enough
 
-                for n in nexts:
-                    ghosts = mic.ghosts.value.copy()
-                    if n not in ghosts:
-                        logging.warning("going to instantiate %s but not a ghost", n)
-                    # TODO: run each of them in a future, so that they start
-                    # in parallel, and (bonus) when the future is done, check
-                    # immediately which component can be started. The only
-                    # difficulty is to ensure non-concurrent access to .ghosts
-                    # and .alive .
+                    if self._must_stop.wait(10):
+                        return
+                    failed = set() # not recent anymore
+                    continue
+
+                # Wait for at least one component to be done
+                done, _ = futures.wait(list(running.keys()), timeout=1,
+                                       return_when=futures.FIRST_COMPLETED)
+                for f in done:
+                    n = running.pop(f)
                     try:
-                        ghosts[n] = ST_STARTING
-                        mic.ghosts.value = ghosts
-                        newcmps = self._instantiate_component(n)
-                        if self._must_stop.is_set():
-                            # in case the termination was too late to stop these new component
-                            for c in newcmps:
-                                try:
-                                    c.terminate()
-                                except Exception:
-                                    logging.warning("Failed to terminate component '%s'", c.name, exc_info=True)
-                            break
+                        newcmps = f.result()
                     except ValueError:
                         if self._dry_run:
                             raise
@@ -246,15 +268,77 @@ class BackendContainer(model.Container):
                         logging.debug("Stopping instantiation due to unrecoverable error")
                         threading.Thread(target=self.terminate).start()
                         return
-                    if not newcmps:
+
+                    if self._must_stop.is_set():
+                        # in case the termination was too late to stop these new component
+                        self._terminate_components(newcmps)
+                    elif not newcmps:
                         failed.add(n)
 
         except Exception:
             logging.exception("Instantiator thread failed")
             raise
         finally:
+            # Don't start the components which are still waiting in the queue
+            started = [f for f in running if not f.cancel()]
+            # Wait for the components still being instantiated, and stop them,
+            # as no one will take care of them otherwise.
+            if started:
+                logging.debug("Waiting for the instantiation of %s to end",
+                              ", ".join(running[f] for f in started))
+            for f in started:
+                try:
+                    self._terminate_components(f.result())
+                except Exception:
+                    pass  # Already reported
+            executor.shutdown(wait=False)
             logging.debug("Instantiator thread finished")
 
+    def _write_profile(self):
+        """
+        Save the start-up profile, if it was requested, and it has changed since
+        the last time it was saved. Called every time the instantiation is
+        paused, so that the retries of the failed components are also recorded.
+        """
+        if self._profiler is None:
+            return
+        nevents = self._profiler.count
+        if nevents == self._profile_count:
+            return
+        try:
+            self._profiler.write_report(self._profile_file)
+        except Exception:
+            logging.exception("Failed to save the start-up profile")
+        self._profile_count = nevents
+
+    def _terminate_components(self, comps):
+        """
+        comps (set of Components): the components to stop
+        """
+        for c in comps:
+            try:
+                c.terminate()
+            except Exception:
+                logging.warning("Failed to terminate component '%s'", c.name, exc_info=True)
+
+    def _start_component(self, name):
+        """
+        Instantiate a component, and report it as starting meanwhile.
+        Runs in a separate thread.
+        name (str): name of the component
+        return (set of HwComponent): see _instantiate_component()
+        raise ValueError: see _instantiate_component()
+        """
+        mic = self._instantiator.microscope
+        with self._comps_lock:
+            ghosts = mic.ghosts.value.copy()
+            if name not in ghosts:
+                logging.warning("going to instantiate %s but not a ghost", name)
+            ghosts[name] = ST_STARTING
+            mic.ghosts.value = ghosts
+
+        return self._instantiate_component(name)
+
     def _instantiate_component(self, name):
         """
         Instantiate a component and handle the outcome
@@ -266,15 +350,18 @@ class BackendContainer(model.Container):
         # TODO: use the AST from the microscope (instead of the original one
         # in _instantiator) to allow modifying it online?
         mic = self._instantiator.microscope
-        ghosts = mic.ghosts.value.copy()
+        tstart = time.time()
         try:
-            comp = self._instantiator.instantiate_component(name)
+            with self._instantiator.profiler.record(startprof.PH_INSTANTIATE, name):
+                comp = self._instantiator.instantiate_component(name)
         except model.HwError as exp:
             # HwError means: hardware problem, try again later
             logging.warning("Failed to start component %s due to device error: %s",
                             name, exp)
-            ghosts[name] = exp
-            mic.ghosts.value = ghosts
+            with self._comps_lock:
+                ghosts = mic.ghosts.value.copy()
+                ghosts[name] = exp
+                mic.ghosts.value = ghosts
             return set()
         except Exception as exp:
             # Anything else means: microscope file or driver is borked => give up
@@ -301,19 +388,29 @@ class BackendContainer(model.Container):
                 logging.warning("Component %s instantiated extra unexpected components %s",
                                 name, new_names - exp_names)
 
-            mic.alive.value = mic.alive.value | new_cmps
-            # update ghosts by removing all the new components
-            dchildren = self._instantiator.get_children_names(name)
-            for n in dchildren:
-                del ghosts[n]
-
-            mic.ghosts.value = ghosts
+            dur = time.time() - tstart
+            logging.info("Component %s started in %.3f s", name, dur)
 
-            for c in new_cmps:
-                prop_names, _ = self._instantiator.get_persistent(c.name)
-                for prop_name in prop_names:
-                    self._observe_persistent_va(c, prop_name)
-            self._update_persistent_metadata()
+            dchildren = self._instantiator.get_children_names(name)
+            with self._comps_lock:
+                mic.alive.value = mic.alive.value | new_cmps
+                # update ghosts by removing all the new components
+                ghosts = mic.ghosts.value.copy()
+                for n in dchildren:
+                    del ghosts[n]
+                mic.ghosts.value = ghosts
+
+                start_times = mic.startTimes.value.copy()
+                for n in dchildren:
+                    start_times[n] = (tstart, dur)
+                mic.startTimes.value = start_times
+
+            with self._instantiator.profiler.record(startprof.PH_PERSISTENT, name):
+                for c in new_cmps:
+                    prop_names, _ = self._instantiator.get_persistent(c.name)
+                    for prop_name in prop_names:
+                        self._observe_persistent_va(c, prop_name)
+                self._update_persistent_metadata()
 
             return new_cmps
 
@@ -445,15 +542,17 @@ class BackendRunner(object):
     CONTAINER_SEPARATED = "+" # each component is started in a separate container
 
     def __init__(self, model_file, settings_file, daemon=False, dry_run=False,
-                 containement=CONTAINER_SEPARATED):
+                 containement=CONTAINER_SEPARATED, profile_file=None):
         """
         containement (CONTAINER_*): the type of container policy to use
+        profile_file (None or str): file where to save the start-up profile
         """
         self.model = model_file
         self.settings = settings_file
         self.daemon = daemon
         self.dry_run = dry_run
         self.containement = containement
+        self.profile_file = profile_file
 
         self._container = None
 
@@ -554,7 +653,7 @@ class BackendRunner(object):
             create_sub_containers = False
 
         self._container = BackendContainer(self.model, self.settings, create_sub_containers,
-                                        dry_run=self.dry_run)
+                                        dry_run=self.dry_run, profile_file=self.profile_file)
 
         try:
             self._container.run()
@@ -628,6 +727,10 @@ def main(args):
                          type=argparse.FileType('a+'), help="Path to the settings file "
                          "(stores values of persistent properties and metadata). "
                          "Default is %s, if writable." % DEFAULT_SETTINGS_FILE)
+    opt_grp.add_argument("--profile-startup", dest="profile", metavar="trace.json",
+                         help="Record the time spent in each phase of the start-up, "
+                         "and save it in Chrome trace format (JSON), with a text "
+                         "summary (.txt) next to it.")
     parser.add_argument("model", metavar="file.odm.yaml", nargs='?', type=open,
                         help="Microscope model instantiation file (*.odm.yaml)")
 
@@ -720,7 +823,8 @@ def main(args):
 
         # let's become the back-end for real
         runner = BackendRunner(options.model, options.settings, options.daemon,
-                               dry_run=options.validate, containement=cont_pol)
+                               dry_run=options.validate, containement=cont_pol,
+                               profile_file=options.profile)
         runner.run()
     except ValueError as exp:
         logging.error("%s", exp)
@@ -29,8 +29,10 @@ import collections
 import itertools
 import logging
 from odemis import model
+from odemis.odemisd import startprof
 from odemis.util import mock
 import re
+import threading
 import yaml
 
 
@@ -142,7 +144,7 @@ class Instantiator(object):
     """
 
     def __init__(self, inst_file, settings_file=None, container=None, create_sub_containers=False,
-                 dry_run=False):
+                 dry_run=False, profiler=None):
         """
         inst_file (file): opened file that contains the YAML
         settings_file (file or None): opened settings file in YAML format.
@@ -154,8 +156,12 @@ class Instantiator(object):
           model without actually any driver contacting the hardware. It will also
           be stricter, and some issues which are normally just warnings will be
           considered errors.
+        profiler (None or StartupProfiler): if not None, the time spent in each
+          phase of the instantiation will be recorded in it.
         """
-        self.ast = self._parse_instantiation_model(inst_file)  # AST of the model to instantiate
+        self.profiler = profiler or startprof.NullProfiler()
+        with self.profiler.record(startprof.PH_PARSE):
+            self.ast = self._parse_instantiation_model(inst_file)  # AST of the model to instantiate
         self._can_persist = settings_file is not None
         self._persistent_props, self._persistent_mds = self._parse_settings(settings_file)
         self.root_container = container # the container for non-leaf components
@@ -163,7 +169,13 @@ class Instantiator(object):
         self.microscope = None # the root of the model (Microscope component)
         self._microscope_name = None  # the name of the microscope
         self._microscope_ast = None # the definition of the Microscope
-        self.components = set() # all the components created
+        # all the components created. The set is never modified, but replaced,
+        # so that it can be safely read from any thread.
+        self.components = frozenset()
+        # To protect the modifications of the model, when several components
+        # are instantiated simultaneously
+        self._lock = threading.RLock()
+        self._instantiating = set()  # names of the components being instantiated
         self.sub_containers = {}  # container's name -> container: all the sub-containers created for the components
         self._comp_container = {}  # comp name -> container: the container that runs the given component
         self.create_sub_containers = create_sub_containers # flag for creating sub-containers
@@ -567,7 +579,9 @@ class Instantiator(object):
         """
         attr = self.ast[name]
         class_name = attr["class"]
-        class_comp = get_class(class_name)
+        with self.profiler.record(startprof.PH_IMPORT, name) as pargs:
+            pargs["class"] = class_name
+            class_comp = get_class(class_name)
 
         # create the arguments:
         # name (str)
@@ -596,20 +610,42 @@ class Instantiator(object):
             cont = self._get_container(name)
             if cont is None:
                 # new container has the same name as the component
-                cont, comp = model.createInNewContainer(name, class_comp, args)
+                with self.profiler.record(startprof.PH_CONTAINER, name):
+                    cont = model.createNewContainer(name, validate=False)
+                try:
+                    with self.profiler.record(startprof.PH_INIT, name) as pargs:
+                        comp = model.createInContainer(cont, class_comp, args)
+                        if self.profiler.enabled:
+                            # The work is done in the container process
+                            pargs["cpu"] = cont.getCPUTime()
+                except Exception:
+                    # Same as model.createInNewContainer()
+                    try:
+                        cont.terminate()  # Non blocking
+                    except Exception:
+                        logging.exception("Failed to stop the container %s after component failure",
+                                          name)
+                    raise
                 self.sub_containers[name] = cont
             else:
                 logging.debug("Creating %s in container %s", name, cont)
-                comp = model.createInContainer(cont, class_comp, args)
+                with self.profiler.record(startprof.PH_INIT, name) as pargs:
+                    # If it's another container, the work is done in its process
+                    remote = self.profiler.enabled and cont is not self.root_container
+                    if remote:
+                        cpu_start = cont.getCPUTime()
+                    comp = model.createInContainer(cont, class_comp, args)
+                    if remote:
+                        pargs["cpu"] = cont.getCPUTime() - cpu_start
             self._comp_container[name] = cont
         except Exception:
             logging.error("Error while instantiating component %s.", name)
             raise
 
-        self.components.add(comp)
         # Add all the children to our list of components. Useful only if child
         # created by delegation, but can't hurt to add them all.
-        self.components |= comp.children.value
+        with self._lock:
+            self.components = self.components | {comp} | comp.children.value
 
         return comp
 
@@ -842,22 +878,32 @@ class Instantiator(object):
             ValueError: if the component has already been instantiated
             KeyError: if component should be created by delegation
         """
-        for c in self.components:
-            if c.name == name:
-                raise ValueError("Trying to instantiate again component %s" % name)
+        with self._lock:
+            if name in self._instantiating:
+                raise ValueError("Component %s is already being instantiated" % name)
+            for c in self.components:
+                if c.name == name:
+                    raise ValueError("Trying to instantiate again component %s" % name)
+            self._instantiating.add(name)
 
-        comp = self._instantiate_comp(name)
+        try:
+            comp = self._instantiate_comp(name)
+        finally:
+            with self._lock:
+                self._instantiating.discard(name)
 
         # Add to the microscope all the new components that should be child
         mchildren = self._microscope_ast["children"].values()
         # we only care about children created by delegation, but all is fine
         newcmps = self.get_children(comp) # that includes comp itself
         for c in newcmps:
-            self._update_properties(c.name)
-            self._update_metadata(c.name)
-            self._update_affects(c.name)
+            with self.profiler.record(startprof.PH_PROPERTIES, c.name):
+                self._update_properties(c.name)
+                self._update_metadata(c.name)
+                self._update_affects(c.name)
         newchildren = set(c for c in newcmps if c.name in mchildren)
-        self.microscope.children.value = self.microscope.children.value | newchildren
+        with self._lock:
+            self.microscope.children.value = self.microscope.children.value | newchildren
 
         return comp
 
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Records the timeline of the back-end start-up, to find out which phases take
+# time (for each component). The timeline can be saved in the Chrome trace
+# format (which can be opened with chrome://tracing or https://ui.perfetto.dev),
+# and summarised as text.
+
+from __future__ import division
+
+import collections
+from contextlib import contextmanager
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import threading
+import time
+
+# Phases recorded
+PH_PARSE = "parse"  # YAML parsing of the microscope file
+PH_IMPORT = "import"  # import of the module of the driver
+PH_CONTAINER = "container"  # creation of the container (process)
+PH_INIT = "init"  # __init__() of the component
+PH_PROPERTIES = "properties"  # setting the properties/metadata/affects
+PH_PERSISTENT = "persistent"  # storing the persistent settings
+PH_INSTANTIATE = "instantiate"  # the whole instantiation of the component
+
+# Order of the columns in the summary
+SUMMARY_PHASES = (PH_IMPORT, PH_CONTAINER, PH_INIT, PH_PROPERTIES, PH_PERSISTENT)
+
+
+def _get_process_cpu_time():
+    """
+    return (float): CPU time (user + system) used by the current process, in s
+    """
+    t = os.times()
+    return t[0] + t[1]
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+_CLOCK_THREAD_CPUTIME_ID = 3  # From linux/time.h
+
+
+def _load_clock_gettime():
+    """
+    return (None or callable): the clock_gettime() function of the C library,
+      or None if not available
+    """
+    for libname in (None, ctypes.util.find_library("rt")):
+        try:
+            f = ctypes.CDLL(libname, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        f.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        return f
+    return None
+
+
+if hasattr(time, "clock_gettime") and hasattr(time, "CLOCK_THREAD_CPUTIME_ID"):  # Python 3.3+
+    def _get_cpu_time():
+        """
+        return (float): CPU time (user + system) used by the current thread, in s
+        """
+        return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+else:
+    _clock_gettime = _load_clock_gettime()
+    if _clock_gettime is not None:
+        def _get_cpu_time():
+            """
+            return (float): CPU time (user + system) used by the current thread, in s
+            """
+            ts = _Timespec()
+            if _clock_gettime(_CLOCK_THREAD_CPUTIME_ID, ctypes.byref(ts)) != 0:
+                return _get_process_cpu_time()
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    else:
+        # Less precise, as the components are started in parallel
+        logging.debug("Per-thread CPU time not available, will use the process CPU time")
+        _get_cpu_time = _get_process_cpu_time
+
+
+class StartupProfiler(object):
+    """
+    Records the phases of the start-up. Thread-safe.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._events = []  # list of dict: name, comp, start, dur, cpu, tid, args
+        self._thread_names = {}  # int -> str
+
+    @contextmanager
+    def record(self, phase, comp=None):
+        """
+        Context manager to record the time spent in the block.
+        phase (PH_*): the phase
+        comp (None or str): the name of the component concerned
+        yields (dict str -> value): extra information to attach to the event.
+          If "cpu" is set, it will be used instead of the CPU time of the
+          current thread (eg, when the work is done in another process).
+        """
+        args = {}
+        tstart = time.time()
+        cstart = _get_cpu_time()
+        try:
+            yield args
+        finally:
+            dur = time.time() - tstart
+            cpu = args.pop("cpu", None)
+            if cpu is None:
+                cpu = _get_cpu_time() - cstart
+            self.add(phase, comp, tstart, dur, cpu, **args)
+
+    def add(self, phase, comp, start, dur, cpu=None, **kwargs):
+        """
+        Add an event to the timeline
+        phase (PH_*): the phase
+        comp (None or str): the name of the component concerned
+        start (float): time of the beginning of the event (s, since epoch)
+        dur (float): duration of the event (s)
+        cpu (None or float): CPU time used during the event (s)
+        kwargs: any extra information to attach to the event
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            self._events.append({"name": phase, "comp": comp, "start": start,
+                                 "dur": dur, "cpu": cpu, "tid": thread.ident,
+                                 "args": kwargs})
+
+    @property
+    def count(self):
+        """
+        (int): number of events recorded so far
+        """
+        return len(self._events)
+
+    def get_trace(self):
+        """
+        return (dict): the timeline in the Chrome trace format
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+
+        trace = []
+        for tid, tname in thread_names.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                          "args": {"name": tname}})
+        for ev in events:
+            args = dict(ev["args"])
+            if ev["cpu"] is not None:
+                args["cpu"] = ev["cpu"]
+            if ev["comp"] is None:
+                name = ev["name"]
+            else:
+                name = "%s %s" % (ev["name"], ev["comp"])
+                args["component"] = ev["comp"]
+            trace.append({"name": name, "cat": ev["name"], "ph": "X",
+                          "ts": (ev["start"] - self._start) * 1e6,  # µs
+                          "dur": ev["dur"] * 1e6,
+                          "pid": pid, "tid": ev["tid"], "args": args})
+
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_trace(self, filename):
+        """
+        Save the timeline in the Chrome trace format (JSON)
+        filename (str): path to the file
+        """
+        with open(filename, "w") as f:
+            json.dump(self.get_trace(), f)
+
+    def get_summary(self):
+        """
+        return (str): a (multi-line) text describing the time spent in each
+          phase, for each component, from the slowest component to the fastest.
+        """
+        with self._lock:
+            events = list(self._events)
+
+        # comp -> phase -> [wall, cpu]
+        comps = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+        glob = collections.defaultdict(lambda: [0, 0])  # phase -> [wall, cpu]
+        tend = self._start
+        for ev in events:
+            tend = max(tend, ev["start"] + ev["dur"])
+            if ev["comp"] is None:
+                times = glob[ev["name"]]
+            else:
+                times = comps[ev["comp"]][ev["name"]]
+            times[0] += ev["dur"]
+            times[1] += ev["cpu"] or 0
+
+        lines = ["Start-up took %.3f s" % (tend - self._start,)]
+        for phase, (wall, cpu) in sorted(glob.items()):
+            lines.append("%s: %.3f s (CPU %.3f s)" % (phase, wall, cpu))
+
+        if comps:
+            # Sort by total time (or the sum of the phases, if not available)
+            def get_total(ct):
+                if PH_INSTANTIATE in ct:
+                    return ct[PH_INSTANTIATE][0]
+                return sum(wall for wall, cpu in ct.values())
+
+            name_len = max(max(len(c) for c in comps), len("Component"))
+            lines.append("")
+            lines.append("%-*s %9s %9s" % (name_len, "Component", "total", "CPU") +
+                         "".join(" %10s" % (p,) for p in SUMMARY_PHASES))
+            for c, ct in sorted(comps.items(), key=lambda i: get_total(i[1]), reverse=True):
+                cpu = sum(ct[p][1] for p in SUMMARY_PHASES if p in ct)
+                line = "%-*s %8.3fs %8.3fs" % (name_len, c, get_total(ct), cpu)
+                for p in SUMMARY_PHASES:
+                    if p in ct:
+                        line += " %9.3fs" % (ct[p][0],)
+                    else:
+                        line += " %10s" % ("-",)
+                lines.append(line)
+
+        return "\n".join(lines)
+
+    def write_report(self, filename):
+        """
+        Save the timeline in the Chrome trace format, and the summary in a text
+         file with the same name, but the extension .txt .
+        filename (str): path to the trace file (eg, "startup.json")
+        """
+        self.write_trace(filename)
+        summary = self.get_summary()
+        sum_fn = os.path.splitext(filename)[0] + ".txt"
+        with open(sum_fn, "w") as f:
+            f.write(summary + "\n")
+        logging.info("Start-up profile saved to %s and %s:\n%s", filename, sum_fn, summary)
+
+
+class NullProfiler(object):
+    """
+    Same interface as StartupProfiler, but doesn't record anything.
+    Used when no profiling is requested.
+    """
+    enabled = False
+
+    @contextmanager
+    def record(self, phase, comp=None):
+        yield {}
+
+    def add(self, phase, comp, start, dur, cpu=None, **kwargs):
+        pass
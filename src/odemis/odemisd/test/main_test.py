@@ -297,6 +297,37 @@ class TestCommandLine(unittest.TestCase):
         os.remove("test.log")
         os.remove("testdaemon.log")
 
+    @timeout(20)
+    def test_start_times(self):
+        """Test the start time of each component is reported"""
+        filename = "example-secom.odm.yaml"
+        cmdline = "--log-level=2 --log-target=testdaemon.log --daemonize %s" % filename
+        ret = subprocess.call(ODEMISD_CMD + cmdline.split())
+        self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+
+        # eventually it should say it's running
+        ret = self._wait_backend_starts(10)
+        self.assertEqual(ret, 0, "backend status check returned %d" % (ret,))
+
+        # All the components which are alive should have a start time
+        mic = model.getMicroscope()
+        start_times = mic.startTimes.value
+        for c in mic.alive.value:
+            self.assertIn(c.name, start_times)
+            t, d = start_times[c.name]
+            self.assertGreater(t, 0)
+            self.assertGreaterEqual(d, 0)
+
+        # stop the backend
+        cmdline = "odemisd --log-level=2 --log-target=test.log --kill"
+        ret = main.main(cmdline.split())
+        self.assertEqual(ret, 0, "trying to run '%s'" % cmdline)
+
+        time.sleep(5) # give some time to stop
+        ret = main.main(cmdline.split())
+        os.remove("test.log")
+        os.remove("testdaemon.log")
+
     @timeout(40)
     def test_persistent_data(self):
         """Test initialization with persistent data"""
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import json
+import logging
+from odemis.odemisd import startprof
+import os
+import threading
+import time
+import unittest
+
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+TRACE_FILE = "test-startup.json"
+SUMMARY_FILE = "test-startup.txt"
+
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def tearDown(self):
+        for fn in (TRACE_FILE, SUMMARY_FILE):
+            if os.path.exists(fn):
+                os.remove(fn)
+
+    def _instantiate(self, prof, name, dur):
+        with prof.record(startprof.PH_INSTANTIATE, name):
+            with prof.record(startprof.PH_IMPORT, name) as args:
+                args["class"] = "simulated.Light"
+            with prof.record(startprof.PH_INIT, name) as args:
+                time.sleep(dur)
+                args["cpu"] = 0.001
+
+    def test_record(self):
+        prof = startprof.StartupProfiler()
+        with prof.record(startprof.PH_PARSE):
+            pass
+
+        # Simultaneous instantiations
+        ts = [threading.Thread(target=self._instantiate, args=(prof, n, d))
+              for n, d in (("Light", 0.2), ("Camera", 0.1))]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+
+        trace = prof.get_trace()
+        evts = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual(len(evts), 1 + 2 * 3)
+        init_light = [e for e in evts if e["name"] == "init Light"][0]
+        self.assertGreaterEqual(init_light["dur"], 0.2e6)
+        self.assertEqual(init_light["args"]["cpu"], 0.001)
+        self.assertEqual(init_light["args"]["component"], "Light")
+        # One metadata event per thread
+        self.assertEqual(len([e for e in trace["traceEvents"] if e["ph"] == "M"]), 3)
+
+        # The slowest component first
+        summary = prof.get_summary()
+        self.assertIn("parse", summary)
+        self.assertLess(summary.index("Light"), summary.index("Camera"))
+
+    def test_thread_cpu(self):
+        """
+        The CPU time is only the one of the thread recording, not of the other
+        components starting simultaneously
+        """
+        prof = startprof.StartupProfiler()
+        must_stop = threading.Event()
+
+        def busy():
+            while not must_stop.is_set():
+                pass
+
+        t = threading.Thread(target=busy)
+        t.start()
+        try:
+            with prof.record(startprof.PH_INIT, "Light"):
+                time.sleep(0.5)
+        finally:
+            must_stop.set()
+            t.join()
+
+        evts = [e for e in prof.get_trace()["traceEvents"] if e["ph"] == "X"]
+        self.assertLess(evts[0]["args"]["cpu"], 0.1)
+        self.assertEqual(prof.count, 1)
+
+    def test_write_report(self):
+        prof = startprof.StartupProfiler()
+        self._instantiate(prof, "Light", 0)
+        prof.write_report(TRACE_FILE)
+
+        with open(TRACE_FILE) as f:
+            trace = json.load(f)
+        self.assertIn("traceEvents", trace)
+        with open(SUMMARY_FILE) as f:
+            self.assertIn("Light", f.read())
+
+    def test_null(self):
+        prof = startprof.NullProfiler()
+        self.assertFalse(prof.enabled)
+        with prof.record(startprof.PH_INIT, "Light") as args:
+            args["cpu"] = 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,11 +21,14 @@ If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+import collections
+import logging
 import math
 from scipy.spatial import Delaunay as DelaunayTriangulation
-from scipy.interpolate import LinearNDInterpolator
+import scipy.sparse
 import numpy
 from odemis import model
+from odemis.util.cache import LRUCache
 # import matplotlib.pyplot as plt
 
 # Functions to convert/manipulate Angle resolved image to polar projection
@@ -42,6 +45,24 @@ AR_HOLE_DIAMETER = 0.6e-3  # m, diameter of the hole in the mirror
 AR_FOCUS_DISTANCE = 0.5e-3  # m, the vertical mirror cutoff, iow the min distance between the mirror and the sample
 AR_PARABOLA_F = 2.5e-3  # m, parabola_parameter=1/(4f): f: focal point of mirror (place of sample)
 
+# Maximum memory used by the cached projection maps (in bytes)
+PROJECTION_MAPS_CACHE_SIZE = 256 * 2 ** 20
+# Maximum memory used by the raw data of the images projected together (in bytes)
+BATCH_MAX_BYTES = 64 * 2 ** 20
+
+
+def _get_sparse_nbytes(m):
+    """
+    return (int): the memory used by a scipy.sparse matrix (in CSR or CSC format)
+    """
+    return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+
+
+# The maps from the raw data to the projections, which only depend on the
+# geometry of the mirror and the output size.
+# (str, tuple, int or tuple of int, bool) -> scipy.sparse.csr_matrix
+_projection_maps = LRUCache(PROJECTION_MAPS_CACHE_SIZE, get_size=_get_sparse_nbytes)
+
 
 def _ExtractAngleInformation(data, hole):
     """
@@ -161,31 +182,108 @@ def _FindAngle(x_array, y_array, pixel_size, parabola_f):
     return theta, phi, omega
 
 
-def AngleResolved2Polar(data, output_size, hole=True):
+def _GetMirrorGeometry(data):
     """
-    Converts an angle resolved image to polar (aka azimuthal) projection
+    Returns all the parameters which define the position of the pixels of the
+      image on the mirror. Two images with the same geometry have the same
+      theta/phi angles for each pixel.
     :parameter data: (model.DataArray) The image that was projected on the detector after being
-      reflected on the parabolic mirror. The flat line of the D shape is
-      expected to be horizontal, at the top. It needs PIXEL_SIZE and AR_POLE
-      metadata. Pixel size is the sensor pixel size * binning / magnification.
-    :parameter output_size: (int) The size of the output DataArray (assumed to be square)
-    :parameter hole: (boolean) Crop the pole if True
-    :returns: (model.DataArray) converted image in polar view
+      reflected on the parabolic mirror.
+    :returns: (tuple) shape, pixel size, pole position, parabola_f, xmax,
+      hole diameter and focus distance
     """
+    md = data.metadata
+    try:
+        pixel_size = tuple(md[model.MD_PIXEL_SIZE])
+        pole_pos = tuple(md[model.MD_AR_POLE])
+    except KeyError:
+        raise ValueError("Metadata required: MD_PIXEL_SIZE, MD_AR_POLE.")
+
+    return (data.shape, pixel_size, pole_pos,
+            md.get(model.MD_AR_PARABOLA_F, AR_PARABOLA_F),
+            md.get(model.MD_AR_XMAX, AR_XMAX),
+            md.get(model.MD_AR_HOLE_DIAMETER, AR_HOLE_DIAMETER),
+            md.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE))
+
 
+def _ExtractAngleWeights(data, hole):
+    """
+    Same as _ExtractAngleInformation(), but instead of the intensity, returns the factor
+      to apply to each pixel of the raw data to get the intensity.
+    :parameter data (model.DataArray): The image that was projected on the detector after being
+      reflected on the parabolic mirror. Only its shape and metadata are used.
+    :returns:
+        theta_data, phi_data, circle_mask_dilated: same as _ExtractAngleInformation()
+        weight_data: array containing for each px the factor to convert the raw data
+          to intensity (ie, 0 outside of the mirror, and 1/omega inside)
+    """
+    ones = model.DataArray(numpy.ones(data.shape), data.metadata)
+    theta_data, phi_data, weight_data, circle_mask_dilated = _ExtractAngleInformation(ones, hole)
+    return theta_data, phi_data, weight_data, circle_mask_dilated
+
+
+def _ComputeInterpolationMap(points, src_indices, src_weights, src_size, grid):
+    """
+    Computes the linear interpolation of scattered points onto a grid, as a
+      (sparse) matrix. It gives the same result as LinearNDInterpolator, but the
+      weights are independent of the values, so they can be reused for any
+      data with the same points.
+    :parameter points: (ndarray of shape N, 2) position of each source point
+    :parameter src_indices: (ndarray of int of shape N) index of the raw data
+      pixel (in the flattened data) corresponding to each source point
+    :parameter src_weights: (ndarray of shape N) factor to apply to the raw data
+      to get the value of each source point
+    :parameter src_size: (int) number of pixels in the raw data
+    :parameter grid: (ndarray of shape M, 2) position of each output point
+    :returns: (scipy.sparse.csr_matrix of shape M, src_size) the interpolation
+      weights. The output points which are outside of the triangulation have no
+      weight (so their value will be 0).
+    """
+    triang = DelaunayTriangulation(points)
+    # Same as LinearNDInterpolator: find the triangle containing each grid
+    # position, and use its barycentric coordinates as the weights of the 3 vertices.
+    simplices = triang.find_simplex(grid)
+    inside = numpy.flatnonzero(simplices >= 0)  # -1 if outside of the triangulation
+    simplices = simplices[inside]
+    transform = triang.transform[simplices]  # affine transform to the barycentric coordinates
+    delta = grid[inside] - transform[:, 2]
+    bary = numpy.empty((len(inside), 3))
+    bary[:, :2] = numpy.einsum("ijk,ik->ij", transform[:, :2], delta)
+    bary[:, 2] = 1 - bary[:, 0] - bary[:, 1]
+
+    vertices = triang.simplices[simplices]
+    weights = bary * src_weights[vertices]
+    rows = numpy.repeat(inside, 3)
+    cols = src_indices[vertices].ravel()
+    # Note: if multiple vertices correspond to the same pixel, their weights are summed
+    interp_map = scipy.sparse.coo_matrix((weights.ravel(), (rows, cols)),
+                                         shape=(len(grid), src_size)).tocsr()
+    interp_map.eliminate_zeros()  # pixels out of the mirror (in the dilated mask)
+    return interp_map
+
+
+def _ComputePolarMap(data, output_size, hole):
+    """
+    Computes the map to convert an angle resolved image to polar projection.
+    :parameter data: (model.DataArray) The image that was projected on the detector after being
+      reflected on the parabolic mirror. Only its shape and metadata are used.
+    :parameter output_size: (int) The size of the output (assumed to be square)
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (scipy.sparse.csr_matrix of shape output_size², data.size)
+    """
     # calculate the corresponding theta and phi angles based on the geometrical properties
     # of the mirror for each px on the raw data
-    # TODO the angles are all the same for a given mirror shape
     # TODO runtime could be improved by calc mirror shape with pole pos at center and always move data to center
-    # TODO implement: if not theta, phi, intensity -> calc angles
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    theta_data, phi_data, weight_data, circle_mask_dilated = _ExtractAngleWeights(data, hole)
+    indices = numpy.arange(data.size).reshape(data.shape)
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
     # We use a dilated mask for cropping to avoid edge effects during triangulation and interpolation.
-    # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
+    # The additional data points (due to dilation) have a weight of zero (see weight_data).
     theta_data_masked = theta_data[circle_mask_dilated]  # list of values for theta within mask
     phi_data_masked = phi_data[circle_mask_dilated]  # list of values for phi within mask
-    intensity_data_masked = intensity_data[circle_mask_dilated]  # list of values for intensity within mask
+    weight_data_masked = weight_data[circle_mask_dilated]  # list of values for weight within mask
+    indices_masked = indices[circle_mask_dilated]
 
     # Convert the spherical coordinates theta and phi into polar coordinates for display in GUI
     # theta equals radial distance r to center of whole (0 - 90 degree)
@@ -200,69 +298,39 @@ def AngleResolved2Polar(data, output_size, hole=True):
     # Therefore, not all px in the output image are populated.
     # Moreover, the data is masked with the mirror shape (mask_circle).
     # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
-    # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
+    # The input data points (theta and phi) are mapped on a meshgrid of the size specified for the output image.
+    # As the meshgrid contains much more positions compared to the input data points, the empty grid positions
+    # are filled up with intensity values interpolated from the intensity values of the positions spanning the
+    # triangle they are contained in (triangle from delaunay triangulation).
+    # Grid positions located outside of any delaunay triangle are set to 0.
 
     # Note: delaunay triangulation input points: ndarray of floats, shape (npoints, ndim) -> transpose data for input
     data_transposed = numpy.array([x_data_polar, y_data_polar]).T  # transpose moves angle orientation from CCW to CW
-    triang = DelaunayTriangulation(data_transposed)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation: neg to pos as x/y data polar
     # contain now values from -output_size/2 to +output_size/2
     xi, yi = numpy.meshgrid(numpy.linspace(-output_size/2, output_size/2, output_size),
                             numpy.linspace(-output_size/2, output_size/2, output_size))
-
-    # interpolate
-    qz = interp(xi, yi)
     # polar coordinate transformation starts with 0 at horizontal axis by definition
-    qz = numpy.rot90(qz)  # rotate by 90 degrees CCW so we start 0 at top (angles will be CW orientated)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation
-    assert numpy.all(qz > -1)  # there should be no negative values, some very small due to interpolation are possible
-    qz[qz < 0] = 0  # all negative values (due to interpolation or wrong background subtraction) set to zero
-
-    # plot the data
-    # plt.figure()
-    # plt.plot(theta_data_polar, phi_data_polar)
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1])
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1], 'o')
-    # plt.triplot(triang.points[:, 0], triang.points[:, 1], triang.simplices.copy())
-    # plt.title("delaunay tesselation (triangulation)")
+    # rotate by 90 degrees CCW so we start 0 at top (angles will be CW orientated)
+    xi, yi = numpy.rot90(xi), numpy.rot90(yi)
+    grid = numpy.array([xi.ravel(), yi.ravel()]).T
 
-    result = model.DataArray(qz, data.metadata)
+    return _ComputeInterpolationMap(data_transposed, indices_masked, weight_data_masked, data.size, grid)
 
-    return result
 
-
-def AngleResolved2Rectangular(data, output_size, hole=True):
+def _ComputeRectangularMap(data, output_size, hole):
     """
-    Converts an angle resolved image to equirectangular (aka cylindrical)
-      projection (ie, phi/theta axes)
-      Note: Even if the input contains only positive values, there might be some small negative
-      values in the output due to interpolation. Also note, that NaNs occurring in the
-      interpolation step are set to 0.
+    Computes the map to convert an angle resolved image to equirectangular projection.
     :parameter data: (model.DataArray) The image that was projected on the detector after being
-      reflected on the parabolic mirror. The flat line of the D shape is
-      expected to be horizontal, at the top. It needs PIXEL_SIZE and AR_POLE
-      metadata. Pixel size is the sensor pixel size * binning / magnification.
-    :parameter output_size: (int, int) The size of the output DataArray (theta, phi),
-      not including the theta/phi angles at the first row/column
+      reflected on the parabolic mirror. Only its shape and metadata are used.
+    :parameter output_size: (int, int) The size of the output (theta, phi)
     :parameter hole: (boolean) Crop the pole if True
-    :returns: (model.DataArray) converted image in equirectangular view
+    :returns: (scipy.sparse.csr_matrix of shape theta * phi, data.size)
     """
-
     # calculate the corresponding theta and phi angles based on the geometrical properties
     # of the mirror for each px on the raw data
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    theta_data, phi_data, weight_data, circle_mask_dilated = _ExtractAngleWeights(data, hole)
+    indices = numpy.arange(data.size).reshape(data.shape)
 
     # extend the data range to take care of edge effects during interpolation step
     # extend the range of phi from 0 - 2pi to -2pi to 2pi to take care of periodicity of phi
@@ -278,8 +346,9 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
     # circle_mask_dilated_2 = numpy.append(numpy.append(circle_mask_dilated[:, -num:], circle_mask_dilated, axis=1),
     #                                      circle_mask_dilated[:, :num], axis=1)
 
-    # So triple the data for theta, intensity and mask, and extend phi to cover the range from -2pi to +2pi
+    # So triple the data for theta, weight, indices and mask, and extend phi to cover the range from -2pi to +2pi
     # for interpolation only use the data from -pi to +3pi, which is sufficient to take care of most edge effects
+    # Note: the indices are tripled too, so that each repetition of a pixel refers to the same raw data.
     low_border = int(phi_data.shape[1] - phi_data.shape[1]/2 + 1)
     high_border = int(phi_data.shape[1]*2 + phi_data.shape[1]/2 - 1)
 
@@ -287,41 +356,149 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
                        numpy.append(phi_data - 2 * math.pi, phi_data, axis=1),
                        phi_data + 2 * math.pi, axis=1)[:, low_border: high_border]  # -pi to +3pi
     theta_data_doubled = numpy.tile(theta_data, (1, 3))[:, low_border: high_border]
-    intensity_data_doubled = numpy.tile(intensity_data, (1, 3))[:, low_border: high_border]
+    weight_data_doubled = numpy.tile(weight_data, (1, 3))[:, low_border: high_border]
+    indices_doubled = numpy.tile(indices, (1, 3))[:, low_border: high_border]
     circle_mask_dilated_doubled = numpy.tile(circle_mask_dilated, (1, 3))[:, low_border: high_border]
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
     # We use a dilated mask for cropping to avoid edge effects during triangulation.
-    # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
+    # The additional data points (due to dilation) have a weight of zero (see weight_data).
     theta_data_masked = theta_data_doubled[circle_mask_dilated_doubled]  # list containing values from 0 to +pi/2
     phi_data_masked = phi_data_doubled[circle_mask_dilated_doubled]  # list containing values from -pi to + 3pi
-    intensity_data_masked = intensity_data_doubled[circle_mask_dilated_doubled]
+    weight_data_masked = weight_data_doubled[circle_mask_dilated_doubled]
+    indices_masked = indices_doubled[circle_mask_dilated_doubled]
 
     # Multiple theta-phi combinations will be mapped to the same px in the output image after polar-transformation.
     # Therefore, not all px in the output image are populated.
     # Moreover, the data is masked with the mirror shape (mask_circle).
     # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
-    # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
+    # The input data points (theta and phi) are mapped on a meshgrid of the size specified for the output image.
+    # As the meshgrid contains much more positions compared to the input data points, the empty grid positions
+    # are filled up with intensity values interpolated from the intensity values of the positions spanning the
+    # triangle they are contained in (triangle from delaunay triangulation).
+    # Grid positions located outside of any delaunay triangle are set to 0.
 
     # Note: delaunay triangulation input points: ndarray of floats, shape (npoints, ndim) -> transpose data for input
     data_transposed = numpy.array([phi_data_masked, theta_data_masked]).T
-    triang = DelaunayTriangulation(data_transposed)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation
     xi, yi = numpy.meshgrid(numpy.linspace(0, 2 * numpy.pi, output_size[1]),
                             numpy.linspace(0, numpy.pi / 2, output_size[0]))
+    grid = numpy.array([xi.ravel(), yi.ravel()]).T
+
+    return _ComputeInterpolationMap(data_transposed, indices_masked, weight_data_masked, data.size, grid)
+
+
+def _GetProjectionMap(compute_map, data, output_size, hole):
+    """
+    Returns the map to convert an angle resolved image to a projection. The maps
+      only depend on the geometry of the mirror, so they are cached.
+    :parameter compute_map: (callable) function computing the map
+      (_ComputePolarMap or _ComputeRectangularMap)
+    :parameter data: (model.DataArray) The image that was projected on the detector after being
+      reflected on the parabolic mirror.
+    :parameter output_size: (int or tuple of int) The size of the output
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (scipy.sparse.csr_matrix) the interpolation weights, from the
+      flattened data to the flattened output
+    """
+    key = (compute_map.__name__, _GetMirrorGeometry(data), output_size, hole)
+    proj_map = _projection_maps.get(key)
+    if proj_map is None:
+        logging.debug("Computing AR projection map for %s", key)
+        proj_map = compute_map(data, output_size, hole)
+        _projection_maps.put(key, proj_map)
+    return proj_map
+
+
+def _ProjectBatch(compute_map, data, output_size, hole):
+    """
+    Projects multiple angle resolved images. The images with the same geometry
+      are projected together, by a sparse matrix-matrix product.
+    :parameter compute_map: (callable) function computing the map
+    :parameter data: (list of model.DataArray) The images that were projected on the detector
+    :parameter output_size: (int or tuple of int) The size of the output
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (list of ndarray of float) flattened projection of each image, in
+      the same order as data
+    """
+    # Group the images by geometry, to use the same map
+    groups = collections.OrderedDict()  # geometry -> list of indices
+    for i, d in enumerate(data):
+        groups.setdefault(_GetMirrorGeometry(d), []).append(i)
+
+    results = [None] * len(data)
+    for indices in groups.values():
+        proj_map = _GetProjectionMap(compute_map, data[indices[0]], output_size, hole)
+        # Limit the memory used by the (float) copy of the raw data
+        batch_size = max(1, BATCH_MAX_BYTES // (proj_map.shape[1] * 8))
+        for s in range(0, len(indices), batch_size):
+            batch = indices[s:s + batch_size]
+            raw = numpy.empty((proj_map.shape[1], len(batch)), dtype=numpy.float64)
+            for j, i in enumerate(batch):
+                raw[:, j] = numpy.asarray(data[i]).ravel()
+            projd = proj_map.dot(raw).T  # one row per image
+            for j, i in enumerate(batch):
+                results[i] = projd[j].copy()
+
+    return results
 
-    # interpolate
-    qz = interp(xi, yi)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation but keep negative values 
 
+def AngleResolved2Polar(data, output_size, hole=True):
+    """
+    Converts an angle resolved image to polar (aka azimuthal) projection
+    :parameter data: (model.DataArray) The image that was projected on the detector after being
+      reflected on the parabolic mirror. The flat line of the D shape is
+      expected to be horizontal, at the top. It needs PIXEL_SIZE and AR_POLE
+      metadata. Pixel size is the sensor pixel size * binning / magnification.
+    :parameter output_size: (int) The size of the output DataArray (assumed to be square)
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (model.DataArray) converted image in polar view
+    """
+    return AngleResolvedBatch2Polar([data], output_size, hole)[0]
+
+
+def AngleResolvedBatch2Polar(data, output_size, hole=True):
+    """
+    Converts multiple angle resolved images to polar (aka azimuthal) projection.
+      It gives the same result as calling AngleResolved2Polar() on each image,
+      but it's faster, as all the images with the same geometry (shape and
+      metadata) are converted together.
+    :parameter data: (list of model.DataArray) The images that were projected on the detector,
+      with the same requirements as for AngleResolved2Polar().
+    :parameter output_size: (int) The size of the output DataArrays (assumed to be square)
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (list of model.DataArray) converted images in polar view, in the
+      same order as the input
+    """
+    results = []
+    for d, qz in zip(data, _ProjectBatch(_ComputePolarMap, data, output_size, hole)):
+        qz.shape = output_size, output_size
+        assert numpy.all(qz > -1)  # there should be no negative values, some very small due to interpolation are possible
+        qz[qz < 0] = 0  # all negative values (due to interpolation or wrong background subtraction) set to zero
+        results.append(model.DataArray(qz, d.metadata))
+
+    return results
+
+
+def AngleResolved2Rectangular(data, output_size, hole=True):
+    """
+    Converts an angle resolved image to equirectangular (aka cylindrical)
+      projection (ie, phi/theta axes)
+      Note: Even if the input contains only positive values, there might be some small negative
+      values in the output due to interpolation. Also note, that the positions
+      which cannot be interpolated are set to 0.
+    :parameter data: (model.DataArray) The image that was projected on the detector after being
+      reflected on the parabolic mirror. The flat line of the D shape is
+      expected to be horizontal, at the top. It needs PIXEL_SIZE and AR_POLE
+      metadata. Pixel size is the sensor pixel size * binning / magnification.
+    :parameter output_size: (int, int) The size of the output DataArray (theta, phi),
+      not including the theta/phi angles at the first row/column
+    :parameter hole: (boolean) Crop the pole if True
+    :returns: (model.DataArray) converted image in equirectangular view
+    """
+    output_size = tuple(output_size)
+    qz = _ProjectBatch(_ComputeRectangularMap, [data], output_size, hole)[0]
+    qz.shape = output_size
     result = model.DataArray(qz, data.metadata)
 
     return result
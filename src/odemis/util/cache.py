@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Cache of (large) values, typically arrays, limited by the total memory they use.
+
+from __future__ import division
+
+import collections
+import logging
+import threading
+
+
+def get_nbytes(value):
+    """
+    return (int): the memory used by the value, if it's an array (or has a .nbytes).
+      Otherwise, it's counted as 0.
+    """
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache(object):
+    """
+    Dictionary-like cache, which keeps the values up to a maximum total size.
+    When full, the least recently used values are removed first.
+    Thread-safe.
+    """
+
+    def __init__(self, max_size, get_size=get_nbytes):
+        """
+        max_size (0<=int): maximum total size of the values (in bytes)
+        get_size (callable): function taking a value and returning its size
+          (in bytes)
+        """
+        self._get_size = get_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (value, size), oldest first
+        self._size = 0
+        self._max_size = max_size
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        """
+        (int): total size of the values currently cached (in bytes)
+        """
+        return self._size
+
+    @property
+    def max_size(self):
+        """
+        (0<=int): maximum total size of the values (in bytes). If it's reduced,
+          the least recently used values are immediately removed.
+        """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        if value < 0:
+            raise ValueError("Cache size must be positive, but got %s" % (value,))
+        with self._lock:
+            self._max_size = value
+            self._evict(0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Note: it doesn't count as a "use" of the value
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Return the value, and mark it as the most recently used.
+        key (hashable): the key of the value
+        default (object): value returned if the key is not in the cache
+        return (object): the value, or default if not present
+        """
+        with self._lock:
+            try:
+                entry = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Store a value, as the most recently used. If the key is already present,
+          the previous value is replaced. If the value is larger than the whole
+          cache, it's not stored.
+        key (hashable): the key of the value
+        value (object): the value to store
+        """
+        size = self._get_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+            if size > self._max_size:
+                logging.debug("Not caching value of %d bytes, larger than the cache", size)
+                return
+
+            self._evict(size)
+            self._entries[key] = (value, size)
+            self._size += size
+
+    def _evict(self, size):
+        """
+        Remove the least recently used values, until there is enough space.
+        Must be called with the lock taken.
+        size (int): space needed (in bytes)
+        """
+        while self._entries and self._size + size > self._max_size:
+            _, (_, osize) = self._entries.popitem(last=False)
+            self._size -= osize
+
+    def pop(self, key, default=None):
+        """
+        Remove a value from the cache
+        key (hashable): the key of the value
+        default (object): value returned if the key is not in the cache
+        return (object): the value, or default if not present
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._size -= entry[1]
+            return entry[0]
+
+    def discard(self, match):
+        """
+        Remove all the values whose key matches
+        match (callable): function taking a key and returning True if the
+          value should be removed
+        return (int): the number of values removed
+        """
+        with self._lock:
+            keys = [k for k in self._entries if match(k)]
+            for k in keys:
+                _, size = self._entries.pop(k)
+                self._size -= size
+        return len(keys)
+
+    def clear(self):
+        """
+        Remove all the values
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -25,6 +25,7 @@ from Pyro4.errors import CommunicationError
 import collections
 import logging
 import math
+import numpy
 from odemis import model
 import os
 import re
@@ -178,6 +179,91 @@ def checkLightBand(band):
 
     # no error found
 
+class SpotListMixin(object):
+    """
+    Adds a "spot list" mode to an e-beam scanner: a list of translations, used
+    one after another, for each scan.
+    The class must have a .translation VA and a _setTranslation() method, which
+    returns the translation (possibly adjusted) to use for a requested one.
+    _init_spot_list() must be called during the initialisation.
+    """
+
+    def _init_spot_list(self):
+        # Translations to use for the next scans, instead of .translation
+        self._spot_list = None  # None or numpy array of shape (N, 2)
+        self._spot_index = 0
+        self._spot_peeked = None  # the spot list of the last get_next_translation()
+        self._spot_lock = threading.Lock()
+
+    def setSpotList(self, positions):
+        """
+        Set a list of positions to scan, one after another. While a list is
+        set, each scan (ie, each image acquired, or each synchronisation event
+        received, if the DataFlow is synchronised) is centred on the next
+        position of the list, instead of .translation. Once all the positions
+        have been scanned, the list is automatically cleared.
+        This allows to move the e-beam at every trigger of another detector
+        (eg, a CCD) without having to change the settings between each scan.
+        positions (None or list of (float, float)): the translation (in px, as
+          .translation) of each scan. None to clear the list.
+        raise ValueError: if a position is not within the range of .translation
+        """
+        if positions is None:
+            with self._spot_lock:
+                self._spot_list = None
+            return
+
+        pos = numpy.array(positions, dtype=numpy.float64)
+        if pos.ndim != 2 or pos.shape[1] != 2 or not pos.size:
+            raise ValueError("Spot list should be a list of 2 floats, but got shape %s" %
+                             (pos.shape,))
+        rng = self.translation.range
+        if (pos < rng[0]).any() or (pos > rng[1]).any():
+            raise ValueError("Spot list goes outside of the translation range %s" % (rng,))
+        logging.debug("Setting a list of %d spots to scan", len(pos))
+        with self._spot_lock:
+            self._spot_list = pos
+            self._spot_index = 0
+
+    def has_spot_list(self):
+        """
+        return (bool): True if the scans currently use a spot list
+        """
+        return self._spot_list is not None
+
+    def get_next_translation(self):
+        """
+        Pick the translation of the next scan: the current position of the spot
+        list, if there is one, or .translation.
+        It doesn't go to the next position of the list: call next_spot() once
+        the scan is done, so that if the scan fails, it can be retried at the
+        same position.
+        return (float, float): the translation in px
+        """
+        with self._spot_lock:
+            self._spot_peeked = self._spot_list
+            if self._spot_list is None:
+                return self.translation.value
+            pos = self._spot_list[self._spot_index]
+        # Ensure the scanned area fits, as when setting the translation
+        return self._setTranslation(tuple(float(p) for p in pos))
+
+    def next_spot(self):
+        """
+        Go to the next position of the spot list, if the last translation
+        returned by get_next_translation() came from the current spot list (and
+        the list hasn't been advanced since then).
+        Once all the positions are done, the spot list is cleared.
+        """
+        with self._spot_lock:
+            if self._spot_list is None or self._spot_list is not self._spot_peeked:
+                return
+            self._spot_peeked = None
+            self._spot_index += 1
+            if self._spot_index >= len(self._spot_list):
+                self._spot_list = None
+
+
 # Special trick functions for speeding up Pyro start-up
 def _speedUpPyroVAConnect(comp):
     """
@@ -168,16 +168,13 @@ def compactHistogram(hist, length):
     chist = hist.reshape(length, hist.size // length)
     return numpy.sum(chist, 1)
 
-# TODO: compute histogram faster. There are several ways:
+# Note: for the most common types, the histogram is computed by img_fast (in
+# parallel). Otherwise, it falls back to numpy:
 # * x=numpy.bincount(a.flat, minlength=depth) => fast (~0.03s for
 #   a 2048x2048 array) but only works on flat array with uint8 and uint16 and
 #   creates 2**16 bins if uint16 (so need to do a reshape and sum on top of it)
 # * numpy.histogram(a, bins=256, range=(0,depth)) => slow (~0.09s for a
 #   2048x2048 array) but works exactly as needed directly in every case.
-# * see weave? (~ 0.01s for 2048x2048 array of uint16) eg:
-#  timeit.timeit("counts=numpy.zeros((2**16), dtype=numpy.uint32);
-#  weave.inline( code, ['counts', 'idxa'])", "import numpy;from scipy import weave; code=r\"for (int i=0; i<Nidxa[0]; i++) { COUNTS1( IDXA1(i)>>8)++; }\"; idxa=numpy.ones((2048*2048), dtype=numpy.uint16)+15", number=100)
-# * see cython?
 # for comparison, a.min() + a.max() are 0.01s for 2048x2048 array
 
 def histogram(data, irange=None):
@@ -214,7 +211,14 @@ def histogram(data, irange=None):
         # TODO: for 32 or 64 bits with full range, convert to a view looking
         # only at the 2 high bytes.
         length = irange[1] - irange[0] + 1
-        hist = numpy.bincount(data.flat, minlength=length)
+        hist = None
+        if img_fast and data.dtype.kind == "u":
+            try:
+                hist = img_fast.bincount(data, minlength=length)
+            except ValueError as exp:
+                logging.debug("Fast histogram cannot run: %s", exp)
+        if hist is None:
+            hist = numpy.bincount(data.flat, minlength=length)
         edges = (0, hist.size - 1)
         if edges[1] > irange[1]:
             logging.warning("Unexpected value %d outside of range %s", edges[1], irange)
@@ -224,7 +228,14 @@ def histogram(data, irange=None):
         else:
             # For floats, it will automatically find the minimum and maximum
             length = 256
-        hist, all_edges = numpy.histogram(data, bins=length, range=irange)
+        hist = None
+        if img_fast:
+            try:
+                hist, all_edges = img_fast.histogram(data, irange, length)
+            except ValueError as exp:
+                logging.debug("Fast histogram cannot run: %s", exp)
+        if hist is None:
+            hist, all_edges = numpy.histogram(data, bins=length, range=irange)
         edges = (max(irange[0], all_edges[0]),
                  min(irange[1], all_edges[-1]))
 
@@ -330,7 +341,6 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
 
             if img_fast:
                 try:
-                    # only (currently) supports uint16
                     return img_fast.DataArray2RGB(data, irange, tint)
                 except ValueError as exp:
                     logging.info("Fast conversion cannot run: %s", exp)
@@ -343,6 +353,15 @@ def DataArray2RGB(data, irange=None, tint=(255, 255, 255)):
             # Ensure B&W if there is just one value allowed
             if irange[0] >= irange[1]:
                 irange = (irange[0] - 1e-9, irange[0])
+
+            if img_fast and data.dtype == numpy.float32:
+                try:
+                    return img_fast.DataArray2RGB(data, irange, tint)
+                except ValueError as exp:
+                    logging.info("Fast conversion cannot run: %s", exp)
+                except Exception:
+                    logging.exception("Failed to use the fast conversion")
+
             data = data.clip(*irange)
 
         dshift = data - irange[0]
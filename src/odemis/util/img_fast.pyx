@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+# distutils: extra_compile_args = -fopenmp
+# distutils: extra_link_args = -fopenmp
 '''
 Created on 10 Mar 2014
 
 @author: Éric Piel
 
-Copyright © 2014 Éric Piel, Delmic
+Copyright © 2014-2026 Éric Piel, Delmic
 
 This file is part of Odemis.
 
@@ -15,101 +17,569 @@ Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRAN
 You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 # Optimised versions of the functions of odemis.util.img
+# The heavy loops run without the GIL, and are parallelised over the rows of
+# the image (with OpenMP).
 
 from __future__ import division
+
 import cython
+from cython.parallel cimport prange
+from libc.stdint cimport int64_t
+import multiprocessing
+import numbers
 
 # import both numpy and the Cython declarations for numpy
 import numpy
 cimport numpy
 
-# TODO: use fused types to support multiple types (but needs Cython >= 0.20)
+numpy.import_array()
+
+ctypedef numpy.uint8_t uint8_t
 ctypedef numpy.uint16_t uint16_t
+ctypedef numpy.int16_t int16_t
+ctypedef numpy.uint32_t uint32_t
+ctypedef numpy.float32_t float32_t
+
+# All the functions support these types of data
+ctypedef fused img_t:
+    uint8_t
+    uint16_t
+    int16_t
+    uint32_t
+    float32_t
+
+SUPPORTED_DTYPES = (numpy.uint8, numpy.uint16, numpy.int16, numpy.uint32, numpy.float32)
+
+# Below this number of pixels, the image is processed in a single thread, as
+# starting the threads would take longer than the processing itself.
+PARALLEL_MIN_PIXELS = 256 * 256
+
+_NTHREADS = multiprocessing.cpu_count()
+
+# How the histogram is computed
+DEF HIST_NONE = 0
+DEF HIST_DIRECT = 1  # one bin per possible value (only for 8 and 16 bits)
+DEF HIST_BINNED = 2  # as numpy.histogram(), with bins of equal width
+
+cdef struct RGBParams:
+    bint enabled
+    double lo, hi  # irange
+    double b  # scale factor from data to 0->255
+    double br, bg, bb  # same, including the tint
+    bint notint  # True if the tint is white
+    uint8_t tint[3]
+
+cdef struct HistParams:
+    int mode  # HIST_*
+    Py_ssize_t offset  # for HIST_DIRECT: index of the value 0
+    # for HIST_BINNED, same values as numpy.histogram()
+    double first, last  # range of the histogram
+    double norm  # number of bins / width of the range
+    Py_ssize_t nbins
 
-# nogil allows multi-threading but prevents use of any Python objects or call
+
+@cython.cdivision(True)
+cdef inline Py_ssize_t _binIndex(img_t v, HistParams* hp, double* edges) nogil:
+    """
+    Compute the index of the bin, exactly as numpy.histogram() does
+    edges (double*): edges of the bins (nbins + 1)
+    return (-1<=int): index of the bin, or -1 if outside of the range
+    """
+    cdef double dv = <double>v
+    cdef Py_ssize_t idx
+    # Note: also rejects NaN
+    if not (dv >= hp.first and dv <= hp.last):
+        return -1
+
+    if img_t is float32_t:
+        # numpy does the computation in the type of the data (float32)
+        idx = <Py_ssize_t>((v - <float>hp.first) * <float>hp.norm)
+    else:
+        idx = <Py_ssize_t>((dv - hp.first) * hp.norm)
+
+    if idx == hp.nbins:
+        idx -= 1
+    # The index computation is not guaranteed to give exactly consistent
+    # results within ~1 ULP of the bin edges.
+    if dv < edges[idx]:
+        idx -= 1
+    elif idx != hp.nbins - 1 and dv >= edges[idx + 1]:
+        idx += 1
+    return idx
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 @cython.cdivision(True)
-cdef void cDataArray2RGB(uint16_t* data, int datalen, uint16_t irange0, uint16_t irange1,
-                         int* tint, numpy.uint8_t* ret) nogil:
-    cdef double b = 255. / <double>(irange1 - irange0)
-    cdef double br = (b * <double>tint[0]) / 255.
-    cdef double bg = (b * <double>tint[1]) / 255.
-    cdef double bb = (b * <double>tint[2]) / 255.
-
-    cdef numpy.uint8_t di
-    cdef double df
-    cdef int retpos = 0
-
-    if tint[0] == tint[1] == tint[2] == 255:
+cdef void _rgbRows(img_t* data, Py_ssize_t start, Py_ssize_t end,
+                   RGBParams rp, uint8_t* rgb) nogil:
+    """
+    Convert part of the image to RGB
+    data (img_t*): image (C-contiguous)
+    start, end (int): first and last (excluded) pixel to process
+    rp (RGBParams): how to convert to RGB
+    rgb (uint8_t*): RGB image (C-contiguous), updated
+    """
+    # Local copies, as the compiler cannot know they are not modified when
+    # writing to rgb
+    cdef double lo = rp.lo, hi = rp.hi, b = rp.b
+    cdef double br = rp.br, bg = rp.bg, bb = rp.bb
+    cdef uint8_t tr = rp.tint[0], tg = rp.tint[1], tb = rp.tint[2]
+    cdef Py_ssize_t i
+    cdef Py_ssize_t retpos = start * 3
+    cdef double dv, df
+    cdef uint8_t di
+
+    if rp.notint:
         # optimised version, without tinting (about 2x faster)
-        for i in range(datalen):
+        for i in range(start, end):
+            dv = <double>data[i]
             # clip
-            if data[i] <= irange0:
+            if dv <= lo:
                 di = 0
-            elif data[i] >= irange1:
+            elif dv >= hi:
                 di = 255
+            elif img_t is float32_t and dv != dv:  # NaN
+                di = 0
             else:
-                di = <numpy.uint8_t> ((data[i] - irange0) * b + 0.5)
-            ret[retpos] = di
-            retpos += 1
-            ret[retpos] = di
-            retpos += 1
-            ret[retpos] = di
-            retpos += 1
+                di = <uint8_t>((dv - lo) * b + 0.5)
+            rgb[retpos] = di
+            rgb[retpos + 1] = di
+            rgb[retpos + 2] = di
+            retpos += 3
     else:
-        for i in range(datalen):
+        for i in range(start, end):
+            dv = <double>data[i]
             # clip
-            if data[i] <= irange0:
-                ret[retpos] = 0
-                retpos += 1
-                ret[retpos] = 0
-                retpos += 1
-                ret[retpos] = 0
-                retpos += 1
-            elif data[i] >= irange1:
-                ret[retpos] = tint[0]
-                retpos += 1
-                ret[retpos] = tint[1]
-                retpos += 1
-                ret[retpos] = tint[2]
-                retpos += 1
+            if dv <= lo:
+                rgb[retpos] = 0
+                rgb[retpos + 1] = 0
+                rgb[retpos + 2] = 0
+            elif dv >= hi:
+                rgb[retpos] = tr
+                rgb[retpos + 1] = tg
+                rgb[retpos + 2] = tb
+            elif img_t is float32_t and dv != dv:  # NaN
+                rgb[retpos] = 0
+                rgb[retpos + 1] = 0
+                rgb[retpos + 2] = 0
             else:
-                df = (data[i] - irange0)
-                ret[retpos] = <numpy.uint8_t> (df * br + 0.5)
-                retpos += 1
-                ret[retpos] = <numpy.uint8_t> (df * bg + 0.5)
-                retpos += 1
-                ret[retpos] = <numpy.uint8_t> (df * bb + 0.5)
-                retpos += 1
-
-# This function is probably not needed, but I have no idea how to instantiate
-# a numpy array which can be passed as a pointer
+                df = dv - lo
+                rgb[retpos] = <uint8_t>(df * br + 0.5)
+                rgb[retpos + 1] = <uint8_t>(df * bg + 0.5)
+                rgb[retpos + 2] = <uint8_t>(df * bb + 0.5)
+            retpos += 3
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def wrapDataArray2RGB(numpy.ndarray[uint16_t, ndim=2] data not None,
-                  irange,
-                  tint,
-                  numpy.ndarray[numpy.uint8_t, ndim=3] ret not None):
-    cdef int ctint[3]
-    ctint[0] = tint[0]
-    ctint[1] = tint[1]
-    ctint[2] = tint[2]
-    cDataArray2RGB(&data[0,0], data.size, irange[0], irange[1], ctint, &ret[0,0,0])
+cdef void _histRows(img_t* data, Py_ssize_t start, Py_ssize_t end,
+                    HistParams hp, double* edges, int64_t* counts) nogil:
+    """
+    Count the values of part of the image in the histogram
+    data (img_t*): image (C-contiguous)
+    start, end (int): first and last (excluded) pixel to process
+    hp (HistParams): how to compute the histogram
+    edges (double*): edges of the bins, for HIST_BINNED
+    counts (int64_t*): histogram, updated
+    """
+    cdef Py_ssize_t i, idx
+    cdef Py_ssize_t offset = hp.offset
 
+    if hp.mode == HIST_DIRECT:
+        if img_t is uint8_t or img_t is uint16_t or img_t is int16_t:
+            for i in range(start, end):
+                counts[<Py_ssize_t>data[i] + offset] += 1
+    elif hp.mode == HIST_BINNED:
+        for i in range(start, end):
+            idx = _binIndex(data[i], &hp, edges)
+            if idx >= 0:
+                counts[idx] += 1
 
-def DataArray2RGB(data, irange, tint=(255, 255, 255)):
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _allRows(img_t* data, Py_ssize_t start, Py_ssize_t end,
+                   RGBParams rp, uint8_t* rgb,
+                   HistParams hp, double* edges, int64_t* counts,
+                   double* vmin, double* vmax) nogil:
+    """
+    Convert part of the image to RGB, count the values in the histogram, and
+    find the minimum and maximum, in one pass.
+    data (img_t*): image (C-contiguous)
+    start, end (int): first and last (excluded) pixel to process
+    rp (RGBParams): how to convert to RGB
+    rgb (uint8_t*): RGB image (C-contiguous), updated
+    hp (HistParams): how to compute the histogram
+    edges (double*): edges of the bins, for HIST_BINNED
+    counts (int64_t*): histogram, updated
+    vmin, vmax (double*): minimum and maximum, excluding NaN, updated
+    """
+    cdef double lo = rp.lo, hi = rp.hi, b = rp.b
+    cdef double br = rp.br, bg = rp.bg, bb = rp.bb
+    cdef uint8_t tr = rp.tint[0], tg = rp.tint[1], tb = rp.tint[2]
+    cdef bint notint = rp.notint
+    cdef int mode = hp.mode
+    cdef Py_ssize_t offset = hp.offset
+    cdef double mn = vmin[0], mx = vmax[0]
+    cdef Py_ssize_t i, idx
+    cdef Py_ssize_t retpos = start * 3
+    cdef img_t v
+    cdef double dv, df
+
+    for i in range(start, end):
+        v = data[i]
+        dv = <double>v
+
+        # RGB
+        if dv <= lo:
+            rgb[retpos] = 0
+            rgb[retpos + 1] = 0
+            rgb[retpos + 2] = 0
+        elif dv >= hi:
+            rgb[retpos] = tr
+            rgb[retpos + 1] = tg
+            rgb[retpos + 2] = tb
+        elif img_t is float32_t and dv != dv:  # NaN
+            rgb[retpos] = 0
+            rgb[retpos + 1] = 0
+            rgb[retpos + 2] = 0
+        elif notint:
+            rgb[retpos] = <uint8_t>((dv - lo) * b + 0.5)
+            rgb[retpos + 1] = rgb[retpos]
+            rgb[retpos + 2] = rgb[retpos]
+        else:
+            df = dv - lo
+            rgb[retpos] = <uint8_t>(df * br + 0.5)
+            rgb[retpos + 1] = <uint8_t>(df * bg + 0.5)
+            rgb[retpos + 2] = <uint8_t>(df * bb + 0.5)
+        retpos += 3
+
+        # Histogram
+        if mode == HIST_DIRECT:
+            if img_t is uint8_t or img_t is uint16_t or img_t is int16_t:
+                counts[<Py_ssize_t>v + offset] += 1
+        elif mode == HIST_BINNED:
+            idx = _binIndex(v, &hp, edges)
+            if idx >= 0:
+                counts[idx] += 1
+
+        # Min/max
+        if dv < mn:
+            mn = dv
+        if dv > mx:
+            mx = dv
+
+    vmin[0] = mn
+    vmax[0] = mx
+
+
+@cython.cdivision(True)
+cdef void _process(img_t* data, Py_ssize_t height, Py_ssize_t width,
+                   RGBParams rp, uint8_t* rgb,
+                   HistParams hp, double* edges, int64_t* counts, Py_ssize_t ncounts,
+                   double* vmins, double* vmaxs, Py_ssize_t nparts) nogil:
+    """
+    Process the whole image, in parallel. The image is split in nparts parts,
+    each having its own histogram, minimum and maximum.
+    If the RGB conversion and the histogram are both requested, the minimum
+    and maximum are also computed, all in one pass.
+    data (img_t*): the image (C-contiguous, not empty)
+    height, width (int): shape of the image
+    rp (RGBParams): how to convert to RGB
+    rgb (uint8_t*): RGB image, updated if rp.enabled
+    hp (HistParams): how to compute the histogram
+    edges (double*): edges of the bins, for HIST_BINNED
+    counts (int64_t*): histogram of each part (nparts x ncounts), updated
+    vmins, vmaxs (double*): minimum and maximum of each part (nparts), updated
+    nparts (int): number of parts, and of threads to use
+    """
+    cdef Py_ssize_t c, y, start, end
+
+    if hp.mode == HIST_NONE:
+        # Just RGB => no need to split in parts
+        for y in prange(height, schedule="static", num_threads=nparts):
+            _rgbRows(data, y * width, (y + 1) * width, rp, rgb)
+    elif not rp.enabled:
+        for c in prange(nparts, schedule="static", num_threads=nparts):
+            start = ((c * height) // nparts) * width
+            end = (((c + 1) * height) // nparts) * width
+            _histRows(data, start, end, hp, edges, counts + c * ncounts)
+    else:
+        for c in prange(nparts, schedule="static", num_threads=nparts):
+            start = ((c * height) // nparts) * width
+            end = (((c + 1) * height) // nparts) * width
+            _allRows(data, start, end, rp, rgb, hp, edges, counts + c * ncounts,
+                     vmins + c, vmaxs + c)
+
+
+def _checkData(data):
+    """
+    Check the data can be processed by the optimised functions
+    raise ValueError: if it cannot be
+    """
+    if data.ndim != 2:
+        raise ValueError("Optimised version only works on 2D arrays (got %dD)" % (data.ndim,))
     if not data.flags.c_contiguous:
         raise ValueError("Optimised version only works with C-contiguous arrays")
-    if data.dtype != numpy.uint16:
+    if data.dtype not in SUPPORTED_DTYPES:
         # Note: cython automatically detects such errors, but it seems that with
         # ctyhon 0.23, it can leak memory.
-        raise ValueError("Optimised version only works on uint16 (got %s)" % (data.dtype,))
+        raise ValueError("Optimised version only works on %s (got %s)" %
+                         (", ".join(numpy.dtype(d).name for d in SUPPORTED_DTYPES), data.dtype))
+    if data.size == 0:
+        raise ValueError("Optimised version doesn't work on empty arrays")
+
+
+# Parameters when not converting to RGB/computing the histogram
+_NO_RGB = dict(enabled=False, lo=0, hi=0, b=0, br=0, bg=0, bb=0, notint=True, tint=(0, 0, 0))
+_NO_HIST = dict(mode=HIST_NONE, offset=0, first=0, last=0, norm=0, nbins=0)
+_NO_EDGES = numpy.zeros(1)  # edges when not HIST_BINNED
+
+
+def _getRGBParams(irange, tint):
+    """
+    return (dict -> RGBParams): the parameters to convert the data to RGB
+    """
     # Note: we could also make an optimised version for F-contiguous arrays,
     # but it's not clear when it'd be useful. For more complex arrays, it's also
     # probably possible to generate a faster version than numpy, but I don't
     # know how.
     if irange[0] >= irange[1]:
         raise ValueError("irange needs to be a tuple of low/high values")
-    ret = numpy.empty(data.shape + (3,), dtype=numpy.uint8)
-    wrapDataArray2RGB(data, irange, tint, ret)
-    return ret
 
+    lo, hi = float(irange[0]), float(irange[1])
+    b = 255. / (hi - lo)
+    return dict(enabled=True, lo=lo, hi=hi, b=b,
+                br=(b * tint[0]) / 255., bg=(b * tint[1]) / 255., bb=(b * tint[2]) / 255.,
+                notint=(tint[0] == tint[1] == tint[2] == 255),
+                tint=tuple(tint))
+
+
+def _getHistParams(data, irange, length):
+    """
+    Computes the parameters of the histogram, the same way as numpy.histogram().
+    data (2D array): the image
+    irange (2 numbers): the range of the histogram
+    length (int): number of bins
+    return:
+       hp (dict -> HistParams): the parameters
+       edges (numpy.array of float64): the edges of the bins, for HIST_BINNED
+       bin_edges (numpy.array): the edges of the bins, as numpy.histogram() returns
+       tlength (int): the length of the (temporary) histogram to compute
+    """
+    # Same as numpy.histogram_bin_edges(), which is only available since numpy 1.15
+    first, last = irange
+    if first > last:
+        raise ValueError("max must be larger than min in range parameter.")
+    if first == last:
+        first, last = first - 0.5, last + 0.5
+    bin_type = numpy.result_type(first, last, data)
+    if numpy.issubdtype(bin_type, numpy.integer):
+        bin_type = numpy.result_type(bin_type, float)
+    bin_edges = numpy.linspace(first, last, length + 1, endpoint=True, dtype=bin_type)
+
+    if data.dtype.itemsize <= 2 and data.size >= 2 ** (data.dtype.itemsize * 8):
+        # Count each possible value, and compute the actual histogram at the end
+        # (only worthy if there are more values than possible values)
+        idt = numpy.iinfo(data.dtype)
+        hp = dict(_NO_HIST, mode=HIST_DIRECT, offset=-idt.min)
+        tlength = idt.max - idt.min + 1
+        edges = _NO_EDGES
+    else:
+        first, last = irange
+        if isinstance(first, numbers.Integral):
+            first, last = int(first), int(last)
+        if first == last:
+            first, last = first - 0.5, last + 0.5
+        # The comparisons are done in the type of the edges, which is the same
+        # as the data for floats.
+        hp = dict(mode=HIST_BINNED, offset=0, first=bin_edges[0], last=bin_edges[-1],
+                  norm=length / (last - first), nbins=length)
+        tlength = length
+        edges = bin_edges.astype(numpy.float64)
+
+    return hp, edges, bin_edges, tlength
+
+
+def _run(data, rp, hp, numpy.ndarray[double, ndim=1] edges, Py_ssize_t tlength):
+    """
+    Runs the processing on the whole image
+    data (2D numpy.array of SUPPORTED_DTYPES): C-contiguous image
+    rp (dict -> RGBParams): how to convert to RGB
+    hp (dict -> HistParams): how to compute the histogram
+    edges (numpy.array of float64): edges of the bins, for HIST_BINNED
+    tlength (int): length of the histogram to compute
+    return:
+      rgb (numpy.array of uint8): the RGB image, if rp.enabled
+      counts (numpy.array of int64): the histogram (of length tlength), if
+        hp.mode is not HIST_NONE
+      vmin, vmax (float): the minimum and maximum, if both RGB and histogram
+        are computed
+    """
+    cdef RGBParams crp = rp
+    cdef HistParams chp = hp
+    cdef Py_ssize_t height = data.shape[0], width = data.shape[1]
+    cdef numpy.ndarray rgb = None, counts = None, vmins = None, vmaxs = None
+    cdef uint8_t* prgb = NULL
+    cdef int64_t* pcounts = NULL
+    cdef double* pvmins = NULL
+    cdef double* pvmaxs = NULL
+    cdef double* pedges = &edges[0]
+
+    # The histogram (and min/max) are computed separately by each part, so that
+    # there is no need for synchronisation between the threads
+    cdef Py_ssize_t nparts = 1
+    if height * width >= PARALLEL_MIN_PIXELS:
+        nparts = min(height, _NTHREADS)
+
+    if crp.enabled:
+        rgb = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        prgb = <uint8_t*>numpy.PyArray_DATA(rgb)
+    if chp.mode != HIST_NONE:
+        counts = numpy.zeros((nparts, tlength), dtype=numpy.int64)
+        pcounts = <int64_t*>numpy.PyArray_DATA(counts)
+        if crp.enabled:
+            vmins = numpy.empty(nparts, dtype=numpy.float64)
+            vmins.fill(numpy.inf)
+            vmaxs = numpy.empty(nparts, dtype=numpy.float64)
+            vmaxs.fill(-numpy.inf)
+            pvmins = <double*>numpy.PyArray_DATA(vmins)
+            pvmaxs = <double*>numpy.PyArray_DATA(vmaxs)
+
+    cdef void* pdata = numpy.PyArray_DATA(data)
+    cdef int dtnum = data.dtype.num
+    with nogil:
+        if dtnum == numpy.NPY_UINT8:
+            _process(<uint8_t*>pdata, height, width, crp, prgb, chp, pedges,
+                     pcounts, tlength, pvmins, pvmaxs, nparts)
+        elif dtnum == numpy.NPY_UINT16:
+            _process(<uint16_t*>pdata, height, width, crp, prgb, chp, pedges,
+                     pcounts, tlength, pvmins, pvmaxs, nparts)
+        elif dtnum == numpy.NPY_INT16:
+            _process(<int16_t*>pdata, height, width, crp, prgb, chp, pedges,
+                     pcounts, tlength, pvmins, pvmaxs, nparts)
+        elif dtnum == numpy.NPY_UINT32:
+            _process(<uint32_t*>pdata, height, width, crp, prgb, chp, pedges,
+                     pcounts, tlength, pvmins, pvmaxs, nparts)
+        elif dtnum == numpy.NPY_FLOAT32:
+            _process(<float32_t*>pdata, height, width, crp, prgb, chp, pedges,
+                     pcounts, tlength, pvmins, pvmaxs, nparts)
+        else:
+            with gil:
+                raise ValueError("Unsupported data type %s" % (data.dtype,))
+
+    vmin = vmax = None
+    if counts is not None:
+        if nparts > 1:
+            counts = counts.sum(axis=0)
+        else:
+            counts = counts[0]
+        if vmins is not None:
+            vmin, vmax = vmins.min(), vmaxs.max()
+    return rgb, counts, vmin, vmax
+
+
+def _finishHistogram(data, counts, irange, length, hp, bin_edges):
+    """
+    return (numpy.array of intp): the histogram, as numpy.histogram()
+    """
+    if hp["mode"] == HIST_DIRECT:
+        # Bin the counts of each value, exactly as numpy would bin the values
+        idt = numpy.iinfo(data.dtype)
+        values = numpy.arange(idt.min, idt.max + 1, dtype=data.dtype)
+        hist, _ = numpy.histogram(values, bins=length, range=irange, weights=counts)
+        return hist.astype(numpy.intp)
+    else:
+        return counts.astype(numpy.intp, copy=False)
+
+
+def DataArray2RGB(data, irange, tint=(255, 255, 255)):
+    """
+    Same as img.DataArray2RGB(), but the irange must be given.
+    data (2D numpy.array of SUPPORTED_DTYPES): C-contiguous image
+    irange (2 numbers): min/max intensities mapped to black/white
+    tint (3-tuple of 0 < int <256): RGB colour of the final image
+    return (numpy.ndarray of 3*shape of uint8): converted image in RGB
+    raise ValueError: if the data or the arguments are not supported
+    """
+    _checkData(data)
+    rp = _getRGBParams(irange, tint)
+    rgb, _, _, _ = _run(data, rp, _NO_HIST, _NO_EDGES, 1)
+    return rgb
+
+
+def histogram(data, irange, length):
+    """
+    Same as numpy.histogram(data, bins=length, range=irange), but faster.
+    data (2D numpy.array of SUPPORTED_DTYPES): C-contiguous image
+    irange (2 numbers): min/max values of the histogram
+    length (0<int): number of bins
+    return:
+      hist (numpy.array of intp): number of values in each bin
+      bin_edges (numpy.array): edges of the bins (length + 1)
+    raise ValueError: if the data or the arguments are not supported
+    """
+    _checkData(data)
+    hp, edges, bin_edges, tlength = _getHistParams(data, irange, length)
+    _, counts, _, _ = _run(data, _NO_RGB, hp, edges, tlength)
+    hist = _finishHistogram(data, counts, irange, length, hp, bin_edges)
+    return hist, bin_edges
+
+
+def bincount(data, minlength=0):
+    """
+    Same as numpy.bincount(data.flat, minlength=minlength), but faster.
+    data (2D numpy.array of uint8 or uint16): C-contiguous image
+    minlength (0<=int): minimum number of bins
+    return (numpy.array of intp): number of occurrences of each value
+    raise ValueError: if the data is not supported
+    """
+    _checkData(data)
+    if data.dtype not in (numpy.uint8, numpy.uint16):
+        raise ValueError("Optimised bincount only works on uint8 and uint16 (got %s)" % (data.dtype,))
+    hp = dict(_NO_HIST, mode=HIST_DIRECT)
+    tlength = numpy.iinfo(data.dtype).max + 1
+    _, counts, _, _ = _run(data, _NO_RGB, hp, _NO_EDGES, tlength)
+
+    nz = numpy.flatnonzero(counts)
+    length = max(minlength, nz[-1] + 1 if nz.size else 0)
+    if length <= tlength:
+        return counts[:length].astype(numpy.intp)
+    else:
+        hist = numpy.zeros(length, dtype=numpy.intp)
+        hist[:tlength] = counts
+        return hist
+
+
+def DataArray2RGBHistogram(data, irange, hrange, length, tint=(255, 255, 255)):
+    """
+    Converts the image to RGB, computes its histogram and its minimum and
+    maximum, all in a single pass over the data.
+    data (2D numpy.array of SUPPORTED_DTYPES): C-contiguous image
+    irange (2 numbers): min/max intensities mapped to black/white
+    hrange (2 numbers): min/max values of the histogram
+    length (0<int): number of bins of the histogram
+    tint (3-tuple of 0 < int <256): RGB colour of the final image
+    return:
+      rgb (numpy.ndarray of 3*shape of uint8): same as DataArray2RGB()
+      hist, bin_edges: same as histogram()
+      vmin, vmax (numbers): minimum and maximum values of the data (NaN are
+        ignored), in the same type as the data
+    raise ValueError: if the data or the arguments are not supported
+    """
+    _checkData(data)
+    rp = _getRGBParams(irange, tint)
+    hp, edges, bin_edges, tlength = _getHistParams(data, hrange, length)
+    rgb, counts, vmin, vmax = _run(data, rp, hp, edges, tlength)
+
+    if hp["mode"] == HIST_DIRECT:
+        # Faster to find the min/max from the count of each value
+        nz = numpy.flatnonzero(counts)
+        vmin, vmax = nz[0] - hp["offset"], nz[-1] - hp["offset"]
+    elif vmin > vmax:  # Only NaNs
+        vmin = vmax = numpy.nan
+
+    hist = _finishHistogram(data, counts, hrange, length, hp, bin_edges)
+    return rgb, hist, bin_edges, (data.dtype.type(vmin), data.dtype.type(vmax))
@@ -16,11 +16,14 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from concurrent.futures._base import CancelledError, CANCELLED, FINISHED, RUNNING
 import logging
+import multiprocessing
 import numpy
 from odemis import model
-from scipy.optimize import curve_fit, OptimizeWarning
+from odemis.util import executeAsyncTask, spectrum as spectrum_util
+from scipy.optimize import curve_fit, leastsq, OptimizeWarning
 import threading
 import time
 import warnings
@@ -347,6 +350,337 @@ def Curve(wavelength, peak_parameters, offset, type='gaussian'):
     return curve
 
 
+# Single peak models used to fit a whole map, with their analytic Jacobian.
+# They take the same parameters as GaussianFit() and LorentzianFit() (for one
+# peak), but the peak is not normalized by the maximum over the data points. So
+# they are the same as long as the peak is within the wavelength range.
+
+def _GaussianPeak(p, x):
+    """
+    p (4 floats): pos, width, amplitude, offset
+    x (ndarray of floats): wavelength
+    return (ndarray of floats): the value of the peak at each wavelength
+    """
+    pos, width, amplitude, offset = p
+    s = pos * abs(width)
+    return offset + abs(amplitude) * numpy.exp(-(x - pos) ** 2 / s ** 2)
+
+
+def _GaussianPeakJac(p, x):
+    """
+    return (ndarray of floats of shape len(x), 4): derivative of _GaussianPeak()
+      for each parameter
+    """
+    pos, width, amplitude, offset = p
+    s = pos * abs(width)
+    d = x - pos
+    g = numpy.exp(-d ** 2 / s ** 2)
+    ag = abs(amplitude) * g
+    dds = 2 * d ** 2 / s ** 3  # derivative of the exponent wrt s
+    jac = numpy.empty((len(x), 4))
+    jac[:, 0] = ag * (2 * d / s ** 2 + dds * abs(width))
+    jac[:, 1] = ag * dds * pos * numpy.sign(width)
+    jac[:, 2] = numpy.sign(amplitude) * g
+    jac[:, 3] = 1
+    return jac
+
+
+def _LorentzianPeak(p, x):
+    """
+    p (4 floats): pos, width, amplitude, offset
+    x (ndarray of floats): wavelength
+    return (ndarray of floats): the value of the peak at each wavelength
+    """
+    pos, width, amplitude, offset = p
+    s2 = (pos * width) ** 2
+    return offset + abs(amplitude) * s2 / ((x - pos) ** 2 + s2)
+
+
+def _LorentzianPeakJac(p, x):
+    """
+    return (ndarray of floats of shape len(x), 4): derivative of _LorentzianPeak()
+      for each parameter
+    """
+    pos, width, amplitude, offset = p
+    s = pos * abs(width)
+    d2 = (x - pos) ** 2
+    den = d2 + s ** 2
+    a = abs(amplitude)
+    dls = 2 * s * d2 / den ** 2  # derivative of the peak wrt s
+    jac = numpy.empty((len(x), 4))
+    jac[:, 0] = a * (2 * (x - pos) * s ** 2 / den ** 2 + dls * abs(width))
+    jac[:, 1] = a * dls * pos * numpy.sign(width)
+    jac[:, 2] = numpy.sign(amplitude) * s ** 2 / den
+    jac[:, 3] = 1
+    return jac
+
+
+# type -> (function, jacobian)
+PEAK_MODELS = {'gaussian': (_GaussianPeak, _GaussianPeakJac),
+               'lorentzian': (_LorentzianPeak, _LorentzianPeakJac)}
+
+# Ratio between the full width at half maximum and the width parameter (in
+# wavelength, so before dividing by the position)
+_FWHM_TO_WIDTH = {'gaussian': 1 / (2 * numpy.sqrt(numpy.log(2))), 'lorentzian': 0.5}
+
+
+def _GuessPeak(spectrum, wavelength, type):
+    """
+    Estimate the parameters of the main peak of a spectrum
+    return (list of 4 floats): pos, width, amplitude, offset
+    """
+    window_size = max(3, len(wavelength) // 30)
+    if len(spectrum) > window_size:
+        smoothed = Smooth(spectrum, window_len=window_size)
+    else:
+        smoothed = spectrum
+    i = numpy.argmax(smoothed)
+    offset = smoothed.min()
+    amplitude = smoothed[i] - offset
+    pos = wavelength[i]
+
+    # Width from the points above half of the maximum, around the peak
+    below = numpy.flatnonzero(smoothed - offset < amplitude / 2)
+    lo = below[below < i]
+    lo = lo[-1] + 1 if lo.size else 0
+    hi = below[below > i]
+    hi = hi[0] - 1 if hi.size else len(smoothed) - 1
+    fwhm = abs(wavelength[hi] - wavelength[lo])
+    if fwhm > 0 and pos != 0:
+        width = fwhm * _FWHM_TO_WIDTH[type] / pos
+    else:
+        width = PEAK_WIDTHS[type]
+
+    return [pos, width, amplitude, offset]
+
+
+def _FitPeak(spectrum, wavelength, type, p0):
+    """
+    Fit one peak on the spectrum
+    p0 (list of 4 floats): initial parameters
+    return (ndarray of 4 floats or None): the parameters, or None if the fit failed
+    """
+    FitFunction, FitJacobian = PEAK_MODELS[type]
+
+    def residuals(p):
+        return FitFunction(p, wavelength) - spectrum
+
+    def jacobian(p):
+        return FitJacobian(p, wavelength)
+
+    try:
+        params, ier = leastsq(residuals, p0, Dfun=jacobian)
+    except Exception as ex:
+        logging.debug("Failed to fit peak: %s", ex)
+        return None
+
+    if ier not in (1, 2, 3, 4) or not numpy.all(numpy.isfinite(params)):
+        return None
+    # The peak must be within the spectrum
+    if not min(wavelength[0], wavelength[-1]) <= params[0] <= max(wavelength[0], wavelength[-1]):
+        return None
+
+    params[1:3] = numpy.abs(params[1:3])
+    return params
+
+
+def _FitMapChunk(spectra, wavelength, type):
+    """
+    Fit the main peak of a series of spectra. Each spectrum is expected to be
+    a neighbour of the previous one, so the fitting starts from the parameters
+    found for the previous spectrum. Runs in a separate process.
+    spectra (2D ndarray of floats of shape N, C)
+    wavelength (ndarray of floats of shape C)
+    type (str): 'gaussian' or 'lorentzian'
+    return (2D ndarray of floats of shape N, 4): pos, width, amplitude, offset
+      of each spectrum. All NaN if the fitting failed.
+    """
+    results = numpy.full((len(spectra), 4), numpy.nan)
+    prev = None
+    with numpy.errstate(all="ignore"), warnings.catch_warnings():
+        # Hide the warnings of leastsq() when the fit fails, it's reported as NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for i, spec in enumerate(spectra):
+            params = None
+            if prev is not None:
+                params = _FitPeak(spec, wavelength, type, prev)
+            if params is None:  # No previous fit, or it's too different
+                params = _FitPeak(spec, wavelength, type, _GuessPeak(spec, wavelength, type))
+            if params is not None:
+                results[i] = params
+            prev = params
+    return results
+
+
+def FitMap(data, wavelength=None, type='gaussian', max_workers=None):
+    """
+    Fit the main peak of every spectrum of a spectrum cube. The spectra are
+    distributed over several processes.
+    data (DataArray of shape CYX or C11YX): the spectrum cube
+    wavelength (None or 1d array of floats): The wavelength values corresponding
+      to the C dimension. If None, it's read from the metadata of the data.
+    type (str): Type of fitting to be applied (for now only ‘gaussian’ and
+      ‘lorentzian’ are available).
+    max_workers (None or 1<=int): number of processes to use. If None, it's
+      the number of CPUs. The processes are kept between calls, and only
+      restarted if a different number is requested.
+    returns (model.ProgressiveFuture): future whose result() is
+       4 DataArrays of shape YX: the pos, width, amplitude and offset of the
+       peak of each spectrum, as returned by PeakFitter.Fit(). If the fitting
+       failed, the pixel is NaN in all of them.
+    raises:
+        KeyError if given type not available
+    """
+    if type not in PEAK_MODELS:
+        raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_MODELS.keys())))
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+
+    if data.ndim == 3:
+        # force 5D for CYX, so that the dimensions are correctly guessed
+        data = data[:, numpy.newaxis, numpy.newaxis]
+    elif data.ndim != 5 or data.shape[1:3] != (1, 1):
+        raise ValueError("Data should have shape CYX or C11YX, but got %s" % (data.shape,))
+
+    if wavelength is None:
+        wavelength = spectrum_util.get_wavelength_per_pixel(data)
+    data = data[:, 0, 0]
+    wavelength = numpy.asarray(wavelength, dtype=numpy.float64)
+    if len(wavelength) != data.shape[0]:
+        raise ValueError("Wavelength should have the same length as the data, but got %d != %d" %
+                         (len(wavelength), data.shape[0]))
+
+    est_start = time.time() + 0.1
+    f = model.ProgressiveFuture(start=est_start,
+                                end=est_start + estimateFitMapTime(data, max_workers))
+    f._fit_state = RUNNING
+    f._fit_lock = threading.Lock()
+    f.task_canceller = _CancelFitMap
+
+    executeAsyncTask(f, _DoFitMap, args=(f, data, wavelength, type, max_workers))
+    return f
+
+
+def _DoFitMap(future, data, wavelength, type, max_workers):
+    """
+    Cuts the map into chunks of neighbouring pixels, and fits them in a pool of
+    processes.
+    returns (4 DataArrays of shape YX): pos, width, amplitude, offset
+    raises:
+        CancelledError if cancelled
+    """
+    shape = data.shape[1:]
+    npix = shape[0] * shape[1]
+    # Go through the pixels in "zigzag" order, so that each pixel is a
+    # neighbour of the previous one.
+    order = numpy.arange(npix).reshape(shape)
+    order[1::2] = order[1::2, ::-1]
+    order = order.ravel()
+
+    # Enough chunks to spread the load evenly between the processes, and to
+    # report the progress regularly, but not so small that the warm-start
+    # rarely helps.
+    chunk_size = max(16, -(-npix // (8 * max_workers)))
+    chunks = [order[i:i + chunk_size] for i in range(0, npix, chunk_size)]
+
+    # spectra as rows
+    spectra = numpy.asarray(data, dtype=numpy.float64).reshape(data.shape[0], npix).T
+
+    results = numpy.empty((npix, 4))
+    tstart = time.time()
+    logging.debug("Starting fitting %d spectra in %d chunks, with %d processes",
+                  npix, len(chunks), max_workers)
+    executor = _get_fit_executor(max_workers)
+    fs = {}
+    try:
+        for i, spec_idx in enumerate(chunks):
+            f = executor.submit(_FitMapChunk, spectra[spec_idx], wavelength, type)
+            fs[f] = i
+
+        pending = set(fs)
+        while pending:
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for f in done:
+                results[chunks[fs[f]]] = f.result()
+            if done:
+                n = len(fs) - len(pending)
+                dur = time.time() - tstart
+                future.set_progress(end=time.time() + dur * len(pending) / n)
+    except CancelledError:
+        logging.debug("Fitting of map of type %s was cancelled.", type)
+        raise
+    finally:
+        # Don't leave the (shared) processes busy with chunks not needed anymore
+        for f in fs:
+            f.cancel()
+
+    with future._fit_lock:
+        if future._fit_state == CANCELLED:
+            raise CancelledError()
+        future._fit_state = FINISHED
+
+    nfailed = numpy.count_nonzero(numpy.isnan(results[:, 0]))
+    logging.debug("Fitted %d spectra in %g s (%d failed)", npix, time.time() - tstart, nfailed)
+
+    # Same metadata as the data, apart from the spectrum info
+    md = dict(getattr(data, "metadata", {}))
+    for k in (model.MD_WL_LIST, model.MD_WL_POLYNOMIAL, model.MD_DIMS):
+        md.pop(k, None)
+    return tuple(model.DataArray(results[:, i].reshape(shape).copy(), md.copy())
+                 for i in range(4))
+
+
+# The processes used to fit the maps. They are started only once, and reused
+# for every map, instead of forking the whole (GUI) process at each fitting.
+_fit_executor = None
+_fit_executor_workers = 0
+_fit_executor_lock = threading.Lock()
+
+
+def _get_fit_executor(max_workers):
+    """
+    Get the executor to run the fitting of the maps
+    max_workers (1<=int): number of processes
+    return (ProcessPoolExecutor): the shared executor, with max_workers processes
+    """
+    global _fit_executor, _fit_executor_workers
+    with _fit_executor_lock:
+        if _fit_executor is None or _fit_executor_workers != max_workers:
+            if _fit_executor is not None:
+                _fit_executor.shutdown(wait=False)
+            _fit_executor = ProcessPoolExecutor(max_workers=max_workers)
+            _fit_executor_workers = max_workers
+        return _fit_executor
+
+
+def _CancelFitMap(future):
+    """
+    Canceller of _DoFitMap task.
+    """
+    logging.debug("Cancelling fitting of map...")
+
+    with future._fit_lock:
+        if future._fit_state == FINISHED:
+            return False
+        future._fit_state = CANCELLED
+        logging.debug("Fitting of map cancelled.")
+
+    return True
+
+
+def estimateFitMapTime(data, max_workers=1):
+    """
+    Estimates fitting duration of a whole map
+    data (ndarray of shape C...): the spectrum cube
+    max_workers (1<=int): number of processes used
+    return (float): the duration (s)
+    """
+    # really rough estimation
+    return data.size * 1e-6 / max_workers  # s
+
+
 def _Grouped(iterable, n):
     """
     Iterate over the iterable, n elements at a time
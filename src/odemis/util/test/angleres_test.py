@@ -114,6 +114,34 @@ class TestAngleResolvedDataConversion(unittest.TestCase):
 
         numpy.testing.assert_allclose(result, desired_output[0], atol=1e-07)
 
+    def test_batch(self):
+        """
+        Tests that converting multiple images at once gives the same result as
+        converting them one by one, including with different geometries.
+        """
+        data = self.data
+        C, T, Z, Y, X = data[0].shape
+        data[0].shape = Y, X
+        data2 = model.DataArray(data[0] * 2, data[0].metadata.copy())
+        data3 = model.DataArray(data[0].copy(), data[0].metadata.copy())
+        pole = data3.metadata[model.MD_AR_POLE]
+        data3.metadata[model.MD_AR_POLE] = (pole[0] + 10, pole[1] - 5)
+        images = [data[0], data3, data2, self.white_data_512]
+        results = angleres.AngleResolvedBatch2Polar(images, 201)
+        self.assertEqual(len(results), len(images))
+        for d, r in zip(images, results):
+            self.assertEqual(r.shape, (201, 201))
+            numpy.testing.assert_allclose(r, angleres.AngleResolved2Polar(d, 201), rtol=1e-10)
+
+        numpy.testing.assert_allclose(results[2], results[0] * 2, rtol=1e-10)
+        # Different pole position => different projection
+        self.assertFalse(numpy.allclose(results[1], results[0]))
+
+        desired_output = hdf5.read_data("desired201x201image.h5")
+        C, T, Z, Y, X = desired_output[0].shape
+        desired_output[0].shape = Y, X
+        numpy.testing.assert_allclose(results[0], desired_output[0], rtol=1e-04)
+
     def test_uint16_input(self):
         """
         Tests for input of DataArray with uint16 ndarray.
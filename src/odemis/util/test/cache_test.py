@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Created on 18 Oct 2026
+
+@author: Iheb Zaabouti
+
+Copyright © 2026 Iheb Zaabouti, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import numpy
+from odemis.util.cache import LRUCache
+import threading
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_simple(self):
+        cache = LRUCache(1000)
+        a = numpy.zeros(100, dtype=numpy.uint8)
+        cache.put("a", a)
+        self.assertIn("a", cache)
+        self.assertIs(cache.get("a"), a)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", 3), 3)
+        self.assertEqual(cache.size, 100)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # Replace
+        b = numpy.zeros(50, dtype=numpy.uint16)
+        cache.put("a", b)
+        self.assertIs(cache.get("a"), b)
+        self.assertEqual(cache.size, 100)
+        self.assertEqual(len(cache), 1)
+
+        self.assertIs(cache.pop("a"), b)
+        self.assertIsNone(cache.pop("a"))
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        cache = LRUCache(1000)
+        for i in range(10):
+            cache.put(i, numpy.zeros(100, dtype=numpy.uint8))
+        self.assertEqual(cache.size, 1000)
+
+        # Use the oldest one => it's now the most recent
+        cache.get(0)
+        cache.put(10, numpy.zeros(250, dtype=numpy.uint8))
+        self.assertEqual(cache.size, 950)
+        self.assertIn(0, cache)
+        for i in (1, 2, 3):
+            self.assertNotIn(i, cache)
+        for i in range(4, 11):
+            self.assertIn(i, cache)
+
+        # Too big => not stored
+        cache.put(11, numpy.zeros(1001, dtype=numpy.uint8))
+        self.assertNotIn(11, cache)
+        self.assertEqual(cache.size, 950)
+
+        # Reducing the size evicts immediately
+        cache.max_size = 300
+        self.assertEqual(cache.size, 250)
+        self.assertEqual(list(cache._entries.keys()), [10])
+
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_discard(self):
+        cache = LRUCache(10000)
+        for i in range(10):
+            cache.put(("even" if i % 2 else "odd", i), numpy.zeros(10, dtype=numpy.uint8))
+
+        n = cache.discard(lambda k: k[0] == "odd")
+        self.assertEqual(n, 5)
+        self.assertEqual(cache.size, 50)
+        self.assertEqual(len(cache), 5)
+
+    def test_threads(self):
+        cache = LRUCache(5000)
+
+        def use_cache(offset):
+            for i in range(2000):
+                k = (offset + i) % 100
+                if cache.get(k) is None:
+                    cache.put(k, numpy.zeros(k, dtype=numpy.uint8))
+
+        threads = [threading.Thread(target=use_cache, args=(i * 13,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLessEqual(cache.size, 5000)
+        self.assertEqual(cache.size, sum(v.nbytes for v, s in cache._entries.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
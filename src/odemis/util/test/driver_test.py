@@ -26,7 +26,7 @@ from odemis import model
 import odemis
 from odemis.util import test
 from odemis.util.driver import getSerialDriver, speedUpPyroConnect, readMemoryUsage,\
-    get_linux_version
+    get_linux_version, SpotListMixin
 import os
 import time
 import unittest
@@ -82,6 +82,57 @@ class TestDriver(unittest.TestCase):
                 v = get_linux_version()
 
 
+class FakeScanner(SpotListMixin):
+    """
+    Minimal scanner, with just what SpotListMixin needs
+    """
+
+    def __init__(self):
+        self.translation = model.TupleContinuous((0, 0), ((-10, -10), (10, 10)),
+                                                 cls=(int, float))
+        self._init_spot_list()
+
+    def _setTranslation(self, value):
+        return value
+
+
+class TestSpotListMixin(unittest.TestCase):
+
+    def test_next_spot(self):
+        scanner = FakeScanner()
+        self.assertFalse(scanner.has_spot_list())
+        self.assertEqual(scanner.get_next_translation(), (0, 0))
+
+        scanner.setSpotList([(1, 1), (2, 2)])
+        self.assertTrue(scanner.has_spot_list())
+        # Not advanced until the scan is done (eg, retried after a failure)
+        self.assertEqual(scanner.get_next_translation(), (1, 1))
+        self.assertEqual(scanner.get_next_translation(), (1, 1))
+        scanner.next_spot()
+        # Only advanced once per translation picked
+        scanner.next_spot()
+        self.assertEqual(scanner.get_next_translation(), (2, 2))
+        scanner.next_spot()
+
+        # All done => back to .translation
+        self.assertFalse(scanner.has_spot_list())
+        self.assertEqual(scanner.get_next_translation(), (0, 0))
+
+        with self.assertRaises(ValueError):
+            scanner.setSpotList([(0, 0), (11, 0)])
+
+    def test_new_list(self):
+        """
+        A scan finishing after the spot list was replaced doesn't advance the new list
+        """
+        scanner = FakeScanner()
+        scanner.setSpotList([(1, 1), (2, 2)])
+        self.assertEqual(scanner.get_next_translation(), (1, 1))
+        scanner.setSpotList([(3, 3), (4, 4)])
+        scanner.next_spot()
+        self.assertEqual(scanner.get_next_translation(), (3, 3))
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -580,6 +580,87 @@ class TestDataArray2RGB(unittest.TestCase):
         self.assertEqual(hist[-2], 0)
 
 
+class TestImgFast(unittest.TestCase):
+    """
+    Test the optimised functions against the numpy versions
+    """
+
+    def setUp(self):
+        if img.img_fast is None:
+            self.skipTest("img_fast not available")
+        numpy.random.seed(0)
+
+    def _getImages(self, shape):
+        """
+        return (list of numpy.array): image of each supported type
+        """
+        imgs = []
+        for dtype in (numpy.uint8, numpy.uint16, numpy.int16, numpy.uint32):
+            idt = numpy.iinfo(dtype)
+            imgs.append(numpy.random.randint(idt.min, min(idt.max, 2 ** 20) + 1,
+                                             shape).astype(dtype))
+        fimg = numpy.random.normal(0, 100, shape).astype(numpy.float32)
+        if fimg.size > 1:
+            fimg[0, 0] = numpy.nan
+        imgs.append(fimg)
+        return imgs
+
+    def test_histogram(self):
+        for shape in ((1, 1), (51, 20), (600, 512)):
+            for data in self._getImages(shape):
+                for irange in ((0, 255), (-100.5, 1000), (5, 5)):
+                    for length in (1, 10, 256):
+                        hist, edges = img.img_fast.histogram(data, irange, length)
+                        exp_hist, exp_edges = numpy.histogram(data, bins=length, range=irange)
+                        numpy.testing.assert_array_equal(hist, exp_hist)
+                        numpy.testing.assert_array_equal(edges, exp_edges)
+
+        # Not supported
+        data = numpy.zeros((10, 10), dtype=numpy.float64)
+        self.assertRaises(ValueError, img.img_fast.histogram, data, (0, 1), 10)
+        data = numpy.zeros((10, 10), dtype=numpy.uint16).T[::2]
+        self.assertRaises(ValueError, img.img_fast.histogram, data, (0, 1), 10)
+
+    def test_bincount(self):
+        for shape in ((1, 1), (600, 512)):
+            for dtype in (numpy.uint8, numpy.uint16):
+                data = numpy.random.randint(0, 200, shape).astype(dtype)
+                for minlength in (0, 10, 300):
+                    hist = img.img_fast.bincount(data, minlength)
+                    numpy.testing.assert_array_equal(hist, numpy.bincount(data.flat, minlength=minlength))
+
+    def test_rgb(self):
+        for shape in ((1, 1), (51, 20), (600, 512)):
+            for data in self._getImages(shape):
+                for tint in ((255, 255, 255), (0, 73, 255)):
+                    irange = (5.5, 200)
+                    rgb = img.img_fast.DataArray2RGB(data, irange, tint)
+                    self.assertEqual(rgb.shape, shape + (3,))
+                    self.assertEqual(rgb.dtype, numpy.uint8)
+
+                    # Compare with the generic implementation (±1, due to rounding)
+                    data_nc = data.T.copy().T  # F-contiguous => not optimised
+                    exp_rgb = img.DataArray2RGB(data_nc, irange, tint)
+                    numpy.testing.assert_allclose(rgb, exp_rgb, atol=1)
+
+    def test_rgb_histogram(self):
+        """
+        The combined version should give the same result as the separate functions
+        """
+        for shape in ((1, 1), (600, 512)):
+            for data in self._getImages(shape):
+                irange = (10, 100)
+                hrange = (-1000, 1000)
+                rgb, hist, edges, (vmin, vmax) = img.img_fast.DataArray2RGBHistogram(data, irange, hrange, 256, (0, 73, 255))
+                numpy.testing.assert_array_equal(rgb, img.img_fast.DataArray2RGB(data, irange, (0, 73, 255)))
+                exp_hist, exp_edges = numpy.histogram(data, bins=256, range=hrange)
+                numpy.testing.assert_array_equal(hist, exp_hist)
+                numpy.testing.assert_array_equal(edges, exp_edges)
+                self.assertEqual(vmin, numpy.nanmin(data))
+                self.assertEqual(vmax, numpy.nanmax(data))
+                self.assertEqual(type(vmin), data.dtype.type)
+
+
 class TestMergeMetadata(unittest.TestCase):
 
     def test_simple(self):
@@ -16,11 +16,15 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures._base import CancelledError, RUNNING
 import logging
 import numpy
+from odemis import model
 from odemis.dataio import hdf5
 from odemis.util import peak
 import os
+from scipy.optimize import approx_fprime
+import threading
 import unittest
 import matplotlib.pyplot as plt
 
@@ -86,6 +90,102 @@ class TestPeak(unittest.TestCase):
         self.assertRaises(KeyError, peak.Curve, wl, params, offset, type='wrongType')
 
 
+class TestFitMap(unittest.TestCase):
+    """
+    Test peak fitting of a whole spectrum cube
+    """
+    def setUp(self):
+        self.wl = numpy.linspace(400e-9, 800e-9, 256)
+
+    def _create_cube(self, type, shape):
+        """
+        Create a spectrum cube with one peak per pixel, whose position depends
+        on the pixel position.
+        return (DataArray of shape CYX, ndarray of shape YX): cube, peak positions
+        """
+        ys, xs = numpy.mgrid[0:shape[0], 0:shape[1]]
+        pos = 500e-9 + xs * 5e-9 + ys * 2e-9
+        FitFunction = peak.PEAK_MODELS[type][0]
+        rng = numpy.random.RandomState(0)
+        cube = numpy.empty((len(self.wl),) + shape)
+        for y in range(shape[0]):
+            for x in range(shape[1]):
+                cube[:, y, x] = FitFunction([pos[y, x], 0.04, 1000, 50], self.wl)
+        cube += rng.normal(0, 10, cube.shape)
+        md = {model.MD_WL_LIST: list(self.wl), model.MD_POS: (1e-3, 2e-3)}
+        return model.DataArray(cube, md), pos
+
+    def test_jacobian(self):
+        """The analytic Jacobians should match the numerical derivatives"""
+        p = numpy.array([550e-9, 0.03, 100., 5.])
+        for type, (FitFunction, FitJacobian) in peak.PEAK_MODELS.items():
+            jac = FitJacobian(p, self.wl)
+            self.assertEqual(jac.shape, (len(self.wl), 4))
+            for i in range(0, len(self.wl), 16):
+                num = approx_fprime(p, lambda q: FitFunction(q, self.wl)[i], p * 1e-7)
+                numpy.testing.assert_allclose(jac[i], num, rtol=1e-3,
+                                              atol=1e-4 * abs(jac).max())
+
+    def test_fit_map(self):
+        for type in ("gaussian", "lorentzian"):
+            cube, pos = self._create_cube(type, (7, 9))
+            f = peak.FitMap(cube, type=type, max_workers=2)
+            maps = f.result()
+            self.assertEqual(len(maps), 4)
+            for m in maps:
+                self.assertIsInstance(m, model.DataArray)
+                self.assertEqual(m.shape, (7, 9))
+                self.assertEqual(m.metadata[model.MD_POS], (1e-3, 2e-3))
+                self.assertNotIn(model.MD_WL_LIST, m.metadata)
+
+            ppos, width, amplitude, offset = maps
+            self.assertFalse(numpy.isnan(ppos).any())
+            numpy.testing.assert_allclose(ppos, pos, atol=1e-9)
+            numpy.testing.assert_allclose(width, 0.04, rtol=0.05)
+            numpy.testing.assert_allclose(amplitude, 1000, rtol=0.05)
+            numpy.testing.assert_allclose(offset, 50, atol=10)
+
+    def test_fit_map_5d(self):
+        """Data of shape C11YX, with the wavelength passed explicitly"""
+        cube, pos = self._create_cube("gaussian", (1, 20))
+        data = numpy.asarray(cube)[:, numpy.newaxis, numpy.newaxis]
+        ppos, width, amplitude, offset = peak.FitMap(data, self.wl).result()
+        self.assertEqual(ppos.shape, (1, 20))
+        numpy.testing.assert_allclose(ppos, pos, atol=1e-9)
+
+        self.assertRaises(ValueError, peak.FitMap, data[:, :, 0], self.wl)
+        self.assertRaises(ValueError, peak.FitMap, data, self.wl[1:])
+        self.assertRaises(KeyError, peak.FitMap, data, self.wl, type='wrongType')
+
+    def test_cancel(self):
+        cube, pos = self._create_cube("gaussian", (100, 100))
+        f = peak.FitMap(cube, max_workers=1)
+        start, end = f.get_progress()
+        self.assertGreater(end, start)
+        self.assertTrue(f.cancel())
+        self.assertTrue(f.cancelled())
+        self.assertRaises(CancelledError, f.result, 1)
+
+    def test_executor_reuse(self):
+        """The processes are kept between the fittings"""
+        cube, pos = self._create_cube("gaussian", (2, 10))
+        peak.FitMap(cube, max_workers=2).result()
+        executor = peak._fit_executor
+        ppos, width, amplitude, offset = peak.FitMap(cube, max_workers=2).result()
+        self.assertIs(peak._fit_executor, executor)
+        numpy.testing.assert_allclose(ppos, pos, atol=1e-9)
+
+    def test_error(self):
+        """An error in the fitting processes is passed to the caller"""
+        cube, pos = self._create_cube("gaussian", (2, 10))
+        f = model.ProgressiveFuture()
+        f._fit_state = RUNNING
+        f._fit_lock = threading.Lock()
+        # Bypass the check of FitMap(), so that the processes fail
+        with self.assertRaises(KeyError):
+            peak._DoFitMap(f, cube, self.wl, "wrongType", 1)
+
+
 if __name__ == "__main__":
     unittest.main()
 